@@ -0,0 +1,69 @@
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from config import AI_CACHE_MAX_ENTRIES
+
+class ResponseCache:
+    """AI 응답 캐시 (메모리 LRU + 선택적 SQLite 영구 계층, 항목별 TTL)"""
+
+    def __init__(self, db=None, max_entries: int = AI_CACHE_MAX_ENTRIES):
+        self.db = db  # AsyncDatabase (None이면 메모리 계층만 사용)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (응답, 만료 시각)
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+
+    @staticmethod
+    def make_key(model: str, messages: Any, **params) -> str:
+        """(모델, 프롬프트, 파라미터) 내용 기반 캐시 키"""
+        payload = json.dumps({'model': model, 'messages': messages, 'params': params},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        """캐시 조회 (만료된 항목은 없는 것으로 처리)"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._entries[key]
+        if self.db:
+            stored = await self.db.get_ai_cache(key, now)
+            if stored is not None:
+                value, expires_at = stored
+                self._remember(key, value, expires_at)
+                self.hits += 1
+                self.db_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str, ttl: float):
+        """캐시 저장"""
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+        if self.db:
+            await self.db.set_ai_cache(key, value, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        """적중/미적중 지표"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'db_hits': self.db_hits,
+            'entries': len(self._entries),
+            'hit_rate': (self.hits / total) * 100 if total > 0 else 0.0,
+        }
@@ -0,0 +1,217 @@
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import openai
+from config import (AI_MAX_CONCURRENCY, AI_REQUESTS_PER_MINUTE, AI_TOKENS_PER_MINUTE, AI_MAX_RETRIES,
+                    AI_RETRY_BASE_DELAY, AI_RETRY_MAX_DELAY, AI_BREAKER_FAILURES, AI_BREAKER_RESET)
+
+class CircuitOpenError(Exception):
+    """회로 차단기가 열려 있어 요청을 보내지 않음"""
+
+class TokenBucket:
+    """분당 한도 기반 토큰 버킷 (기본 버스트 = 분당 한도)"""
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """amount만큼 쌓일 때까지 대기 후 차감 (버킷보다 큰 요청은 버킷 크기로 제한)"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+def is_billing_error(e: Exception) -> bool:
+    """결제 미설정/한도 소진 (재시도해도 소용없는 오류)"""
+    return "billing_not_active" in str(e) or "insufficient_quota" in str(e)
+
+def is_retryable(e: Exception) -> bool:
+    """429/5xx/연결 오류만 재시도"""
+    if is_billing_error(e):
+        return False
+    if isinstance(e, openai.APIConnectionError):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """요청이 소비할 토큰 수 대략 추정 (프롬프트 글자 수 / 2 + 최대 응답 토큰)"""
+    chars = 0
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get('text', '')) for part in content if isinstance(part, dict))
+    return chars // 2 + max_tokens
+
+class AIRequestExecutor:
+    """OpenAI 요청 공용 실행기 (동시 요청 제한, 분당 요청/토큰 제한, 지터 지수 재시도, 회로 차단기)"""
+
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 requests_per_minute: float = AI_REQUESTS_PER_MINUTE, tokens_per_minute: float = AI_TOKENS_PER_MINUTE,
+                 max_retries: int = AI_MAX_RETRIES, base_delay: float = AI_RETRY_BASE_DELAY,
+                 max_delay: float = AI_RETRY_MAX_DELAY, failure_threshold: int = AI_BREAKER_FAILURES,
+                 reset_timeout: float = AI_BREAKER_RESET):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        # 회로 차단기 상태: closed -> (연속 실패) -> open -> (reset_timeout 후) half_open -> closed/open
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+
+        # 지표
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuits = 0
+        self.wait_times: deque = deque(maxlen=1000)  # 최근 대기 시간(초)
+
+    def _before_request(self):
+        """회로가 열려 있으면 즉시 실패 (reset_timeout이 지나면 시험 요청 하나만 허용)"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.short_circuits += 1
+                raise CircuitOpenError("AI 요청 회로 차단 중")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._trial_running:
+                self.short_circuits += 1
+                raise CircuitOpenError("AI 요청 회로 시험 중")
+            self._trial_running = True
+
+    def _record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._trial_running = False
+
+    def _record_failure(self, e: Exception):
+        self.failures += 1
+        self._trial_running = False
+        # 요청 자체가 잘못된 4xx는 서비스 장애로 보지 않음
+        if isinstance(e, openai.APIStatusError) and e.status_code < 500 and not is_retryable(e) and not is_billing_error(e):
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            return
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def _retry_delay(self, attempt: int, e: Exception) -> float:
+        """지터를 준 지수 백오프 (서버가 retry-after를 주면 그 이상 대기)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        response = getattr(e, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(self.max_delay, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+    def finish_stream(self, error: Optional[BaseException] = None):
+        """run(settle=False)로 연 스트림을 끝까지 읽은 뒤 결과를 회로 차단기에 기록
+
+        error가 None이면 성공, Exception이면 실패로 기록하고, 취소 등은 시험 요청 표시만 해제
+        """
+        if error is None:
+            self._record_success()
+        elif isinstance(error, Exception):
+            self._record_failure(error)
+        else:
+            self._trial_running = False
+
+    async def run(self, call: Callable[[], Awaitable[Any]], estimated_tokens: int = 0, settle: bool = True) -> Any:
+        """call()을 제한/재시도/회로 차단 규칙에 따라 실행
+
+        settle=False면 성공을 기록하지 않음 (스트리밍: 중간에 끊길 수 있으므로 finish_stream으로 기록)
+        """
+        self._before_request()
+        self.requests += 1
+        attempt = 0
+        while True:
+            try:
+                result = await self._attempt(call, estimated_tokens)
+            except asyncio.CancelledError:
+                self._trial_running = False
+                raise
+            except Exception as e:
+                if attempt < self.max_retries and is_retryable(e):
+                    self.retries += 1
+                    await asyncio.sleep(self._retry_delay(attempt, e))
+                    attempt += 1
+                    continue
+                self._record_failure(e)
+                raise
+            if settle:
+                self._record_success()
+            return result
+
+    async def _attempt(self, call: Callable[[], Awaitable[Any]], estimated_tokens: int) -> Any:
+        """동시 요청 슬롯과 분당 한도를 확보한 뒤 한 번 호출"""
+        queued = time.monotonic()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        waiting = True
+        try:
+            async with self._semaphore:
+                await self.request_bucket.acquire(1)
+                if estimated_tokens:
+                    await self.token_bucket.acquire(estimated_tokens)
+                self.queue_depth -= 1
+                waiting = False
+                self.wait_times.append(time.monotonic() - queued)
+                self.in_flight += 1
+                try:
+                    return await call()
+                finally:
+                    self.in_flight -= 1
+        finally:
+            if waiting:
+                self.queue_depth -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """대기열/대기 시간/재시도/차단 지표"""
+        waits = sorted(self.wait_times)
+        def pct(p: float) -> float:
+            return waits[min(len(waits) - 1, int(round(p / 100 * (len(waits) - 1))))] * 1000 if waits else 0.0
+        return {
+            'state': self.state,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'short_circuits': self.short_circuits,
+            'wait_p50_ms': pct(50),
+            'wait_p99_ms': pct(99),
+        }
@@ -1,24 +1,199 @@
+import base64
+import hashlib
 import openai
-import aiofiles
-from typing import Optional, Dict, List, Any
-from config import OPENAI_API_KEY, GPT_MODEL, MAX_TOKENS, TEMPERATURE
+from typing import Optional, Dict, List, Any, AsyncIterator, Tuple
+from config import OPENAI_API_KEY, GPT_MODEL, MAX_TOKENS, TEMPERATURE, AI_CACHE_TTLS, IMAGE_DETAIL
+from ai_cache import ResponseCache
+from ai_executor import AIRequestExecutor, estimate_tokens, is_billing_error
+from embedding_index import format_reflection_line
+from prompt_builder import PromptBuilder
 from openai.types.chat import ChatCompletionMessageParam
 from telegram import Update
 from telegram.ext import ContextTypes
 
+# 메서드별 대체 문구: (결제 미설정 시, 그 밖의 오류/회로 차단 시)
+FALLBACK_MESSAGES: Dict[str, Tuple[str, str]] = {
+    'get_reflection_feedback': (
+        "AI 회고 피드백 생성 중 오류가 발생했습니다. 잠시 후 다시 시도해 주세요.",
+        "AI 회고 피드백 생성 중 오류가 발생했습니다. 잠시 후 다시 시도해 주세요.",
+    ),
+    'get_ai_reflection_guidance': (
+        "💡 AI 묵상을 사용하려면 OpenAI 계정의 결제 정보를 설정해주세요.\n\n📝 대신 기본 묵상 가이드를 제공해드릴게요:\n\n당신의 이야기를 들려주셔서 감사합니다. 자기 성찰은 정말 중요한 시간이에요. 더 깊이 있는 대화를 원하시면 OpenAI 계정 설정 후 다시 시도해보세요! 🙏",
+        "💡 AI 묵상 생성 중 일시적인 오류가 발생했습니다.\n\n📝 대신 기본 묵상 가이드를 제공해드릴게요:\n\n당신의 이야기를 들려주셔서 감사합니다. 자기 성찰은 정말 중요한 시간이에요. 잠시 후 다시 시도해보시거나, 다른 방법으로 자기 성찰을 이어가보세요! 🙏",
+    ),
+    'analyze_reflection_patterns': (
+        "💡 회고 패턴 분석을 사용하려면 OpenAI 계정의 결제 정보를 설정해주세요.\n\n📝 대신 기본 분석을 제공해드릴게요:\n\n회고를 꾸준히 작성하고 계시는 모습이 정말 인상적입니다! 패턴 분석을 원하시면 OpenAI 계정 설정 후 다시 시도해보세요. 지금도 충분히 의미있는 회고를 작성하고 계세요! 📊",
+        "💡 회고 패턴 분석 중 일시적인 오류가 발생했습니다.\n\n📝 대신 기본 분석을 제공해드릴게요:\n\n회고를 꾸준히 작성하고 계시는 모습이 정말 인상적입니다! 잠시 후 다시 시도해보시거나, 지금도 충분히 의미있는 회고를 작성하고 계세요! 📊",
+    ),
+    'get_motivational_message': (
+        "💡 AI 동기부여 메시지를 사용하려면 OpenAI 계정의 결제 정보를 설정해주세요.\n\n📝 대신 기본 메시지를 제공해드릴게요:\n\n당신은 정말 대단한 사람입니다! 매일 조금씩이라도 성장하려는 모습이 정말 멋져요. 오늘도 힘내세요! 💪✨",
+        "💡 AI 동기부여 메시지 생성 중 일시적인 오류가 발생했습니다.\n\n📝 대신 기본 메시지를 제공해드릴게요:\n\n당신은 정말 대단한 사람입니다! 매일 조금씩이라도 성장하려는 모습이 정말 멋져요. 오늘도 힘내세요! 💪✨",
+    ),
+    'chat_with_gpt': (
+        "💡 ChatGPT와 대화하려면 OpenAI 계정의 결제 정보를 설정해주세요.\n\n📝 대신 기본 응답을 제공해드릴게요:\n\n안녕하세요! ChatGPT와 대화를 원하시는군요. OpenAI 계정 설정 후 다시 시도해보세요! 🤖",
+        "💡 ChatGPT 대화 중 일시적인 오류가 발생했습니다.\n\n📝 잠시 후 다시 시도해보시거나, 다른 기능을 이용해보세요! 🤖",
+    ),
+    'get_completion_motivation': ("", ""),
+    'get_schedule_summary': ("❌ AI 분석 중 오류가 발생했습니다.", "❌ AI 분석 중 오류가 발생했습니다."),
+    'transcribe_voice': ("", ""),
+    'analyze_voice_reflection': ("❌ 음성 분석 중 오류가 발생했습니다.", "❌ 음성 분석 중 오류가 발생했습니다."),
+    'analyze_image_reflection': ("❌ 이미지 분석 중 오류가 발생했습니다.", "❌ 이미지 분석 중 오류가 발생했습니다."),
+}
+
+def fallback_message(method: str, e: Exception) -> str:
+    """오류 종류에 맞는 대체 문구"""
+    billing, error = FALLBACK_MESSAGES[method]
+    return billing if is_billing_error(e) else error
+
+def reflection_pattern_messages(reflections: List[Dict], related: Optional[List[Dict]] = None) -> List[ChatCompletionMessageParam]:
+    """회고 패턴 분석 요청 메시지 (최근 10개 회고 기준, 배치 리포트와 공용), related는 주제가 비슷한 과거 회고"""
+    # 회고 데이터 정리
+    reflection_texts = []
+    for reflection in reflections[:10]:  # 최근 10개만 분석
+        reflection_texts.append(f"[{reflection['date']}] {reflection['type']}: {reflection['content'][:200]}...")
+    
+    analysis_text = "\n".join(reflection_texts)
+    if related:
+        analysis_text += "\n\n관련 있는 과거 회고 (최근 회고와 주제가 비슷한 예전 기록):\n"
+        analysis_text += "\n".join(format_reflection_line(reflection) for reflection in related)
+    
+    prompt = f"""
+사용자의 회고 기록을 분석하여 다음과 같은 인사이트를 제공해주세요:
+
+1. **주요 패턴**: 자주 언급되는 주제나 감정 패턴
+2. **성장 영역**: 발전하고 있는 부분이나 개선점
+3. **일관성**: 회고의 일관성과 깊이
+4. **추천사항**: 더 나은 회고를 위한 구체적 제안
+
+회고 기록:
+{analysis_text}
+
+위 내용을 바탕으로 300-400자 내외의 분석 결과를 한국어로 제공해주세요.
+"""
+    
+    return [
+        {"role": "system", "content": "당신은 회고 분석 전문가입니다. 사용자의 회고 패턴을 분석하여 의미있는 인사이트를 제공합니다."},
+        {"role": "user", "content": prompt}
+    ]
+
 class AIHelper:
-    def __init__(self):
-        """AI 헬퍼 초기화"""
-        if OPENAI_API_KEY:
-            self.client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+    def __init__(self, client=None, cache: Optional[ResponseCache] = None, executor: Optional[AIRequestExecutor] = None,
+                 prompts: Optional[PromptBuilder] = None):
+        """AI 헬퍼 초기화 (client/cache/executor/prompts를 넘기면 그대로 사용)"""
+        if client is not None:
+            self.client = client
+        elif OPENAI_API_KEY:
+            # 재시도는 AIRequestExecutor가 담당하므로 SDK 자체 재시도는 끔
+            self.client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
         else:
             self.client = None
             print("⚠️ OpenAI API 키가 설정되지 않았습니다.")
+        self.cache = cache if cache is not None else ResponseCache()
+        self.executor = executor if executor is not None else AIRequestExecutor()
+        self.prompts = prompts if prompts is not None else PromptBuilder()
+        self.prompt_metrics: Dict[str, Dict[str, int]] = {}  # 메서드별 프롬프트 토큰 지표
     
     def is_available(self) -> bool:
         """AI 기능 사용 가능 여부 확인"""
         return self.client is not None
     
+    def _metrics(self, method: str) -> Dict[str, int]:
+        return self.prompt_metrics.setdefault(method, {
+            'calls': 0, 'prompt_tokens': 0, 'max_prompt_tokens': 0, 'last_prompt_tokens': 0,
+            'history_turns': 0, 'evicted_turns': 0, 'usage_calls': 0, 'usage_prompt_tokens': 0,
+        })
+    
+    def _build_prompt(self, method: str, system: str, user_message: str,
+                      conversation_history: Optional[List[Dict[str, Any]]] = None,
+                      context: Optional[List[str]] = None, summary: str = "") -> List[ChatCompletionMessageParam]:
+        """토큰 예산 안에서 메시지를 구성하고 프롬프트 토큰 수를 지표에 기록"""
+        built = self.prompts.build(method, system, user_message, conversation_history, context, summary)
+        metrics = self._metrics(method)
+        metrics['calls'] += 1
+        metrics['prompt_tokens'] += built['prompt_tokens']
+        metrics['max_prompt_tokens'] = max(metrics['max_prompt_tokens'], built['prompt_tokens'])
+        metrics['last_prompt_tokens'] = built['prompt_tokens']
+        metrics['history_turns'] += built['history_turns']
+        metrics['evicted_turns'] += built['evicted_turns']
+        return built['messages']
+    
+    def prompt_stats(self) -> Dict[str, Dict[str, Any]]:
+        """메서드별 프롬프트 토큰 지표 (usage_*는 API 응답이 알려준 실제 토큰, 스트리밍 응답은 제외)"""
+        stats = {}
+        for method, metrics in self.prompt_metrics.items():
+            calls = metrics['calls']
+            stats[method] = dict(metrics,
+                                 avg_prompt_tokens=round(metrics['prompt_tokens'] / calls, 1) if calls else 0.0,
+                                 avg_history_turns=round(metrics['history_turns'] / calls, 1) if calls else 0.0)
+        return stats
+    
+    async def _complete(self, method: str, messages: List[ChatCompletionMessageParam],
+                        max_tokens: int, temperature: float, cache_key: Optional[str] = None) -> str:
+        """공용 실행기를 거쳐 응답 생성 (AI_CACHE_TTLS에 있는 메서드는 같은 요청의 응답을 캐시에서 반환)"""
+        ttl = AI_CACHE_TTLS.get(method)
+        key = cache_key or self.cache.make_key(GPT_MODEL, messages, max_tokens=max_tokens, temperature=temperature)
+        if ttl:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+        
+        response = await self.executor.run(
+            lambda: self.client.chat.completions.create(
+                model=GPT_MODEL,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            ),
+            estimate_tokens(messages, max_tokens)
+        )
+        usage = getattr(response, 'usage', None)
+        if usage is not None and usage.prompt_tokens:
+            metrics = self._metrics(method)
+            metrics['usage_calls'] += 1
+            metrics['usage_prompt_tokens'] += usage.prompt_tokens
+        content = response.choices[0].message.content
+        result = content.strip() if content else ""
+        if ttl and result:
+            await self.cache.set(key, result, ttl)
+        return result
+    
+    async def _stream_completion(self, method: str, messages: List[ChatCompletionMessageParam], max_tokens: int,
+                                 temperature: float, error_label: str) -> AsyncIterator[str]:
+        """스트리밍 응답의 텍스트 조각을 순서대로 반환 (아무것도 못 받고 실패하면 대체 문구 반환)
+
+        스트림을 연 뒤 중간에 실패해도 회로 차단기에 실패로 기록
+        """
+        received = False
+        stream = None
+        try:
+            stream = await self.executor.run(
+                lambda: self.client.chat.completions.create(
+                    model=GPT_MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True
+                ),
+                estimate_tokens(messages, max_tokens),
+                settle=False
+            )
+            async for chunk in stream:
+                piece = chunk.choices[0].delta.content if chunk.choices else None
+                if piece:
+                    received = True
+                    yield piece
+            self.executor.finish_stream()
+        except Exception as e:
+            if stream is not None:
+                self.executor.finish_stream(e)
+            print(f"{error_label}: {e}")
+            if not received:
+                yield fallback_message(method, e)
+        except BaseException as e:
+            if stream is not None:  # 취소되거나 읽는 쪽이 중간에 닫음
+                self.executor.finish_stream(e)
+            raise
+    
     async def get_reflection_feedback(self, content: str, reflection_type: str = "daily") -> str:
         """
         T형 회고를 F형(Feeling/Feedback/Forward) 회고로 변환해주는 AI 피드백 생성
@@ -49,60 +224,47 @@ class AIHelper:
                 {"role": "system", "content": "당신은 따뜻하고 실용적인 자기성찰 코치입니다. 사용자의 회고를 F형 구조로 안내하고, 실현 가능한 목표와 동기부여를 제시합니다."},
                 {"role": "user", "content": prompt}
             ]
-            response = await self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=messages,
-                max_tokens=400,
-                temperature=0.7
-            )
-            content = response.choices[0].message.content
-            return content.strip() if content else ""
+            return await self._complete("get_reflection_feedback", messages, 400, 0.7)
         except Exception as e:
             print(f"AI 회고 피드백 생성 오류: {e}")
-            return "AI 회고 피드백 생성 중 오류가 발생했습니다. 잠시 후 다시 시도해 주세요."
+            return fallback_message("get_reflection_feedback", e)
     
-    async def get_ai_reflection_guidance(self, user_input: str, conversation_history: Optional[List[Dict[str, Any]]] = None) -> str:
+    def _reflection_guidance_messages(self, user_input: str, conversation_history: Optional[List[Dict[str, Any]]] = None,
+                                      context: Optional[List[str]] = None) -> List[ChatCompletionMessageParam]:
+        """묵상 가이드 요청 메시지 구성 (대화 기록과 관련 회고는 토큰 예산 안에서 최근/관련도 순으로)"""
+        system = """당신은 따뜻하고 지혜로운 묵상 동반자입니다. 
+사용자의 이야기를 경청하고, 깊이 있는 질문을 통해 자기 성찰을 돕습니다.
+항상 공감적이고 따뜻한 톤을 유지하며, 사용자가 자신의 생각과 감정을 더 깊이 탐색할 수 있도록 도와주세요.
+답변은 200-300자 내외로 간결하면서도 의미있게 작성해주세요."""
+        return self._build_prompt("get_ai_reflection_guidance", system, user_input, conversation_history, context)
+    
+    async def get_ai_reflection_guidance(self, user_input: str, conversation_history: Optional[List[Dict[str, Any]]] = None,
+                                         context: Optional[List[str]] = None) -> str:
         """AI와 함께하는 묵상 가이드"""
         if not self.is_available() or not self.client:
             return "❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요."
         
         try:
-            # 대화 히스토리 구성
-            messages: List[ChatCompletionMessageParam] = [
-                {"role": "system", "content": """당신은 따뜻하고 지혜로운 묵상 동반자입니다. 
-사용자의 이야기를 경청하고, 깊이 있는 질문을 통해 자기 성찰을 돕습니다.
-항상 공감적이고 따뜻한 톤을 유지하며, 사용자가 자신의 생각과 감정을 더 깊이 탐색할 수 있도록 도와주세요.
-답변은 200-300자 내외로 간결하면서도 의미있게 작성해주세요."""}
-            ]
-            
-            # 대화 히스토리 추가
-            if conversation_history:
-                for msg in conversation_history[-6:]:  # 최근 6개 메시지만 사용
-                    if isinstance(msg, dict) and "role" in msg and "content" in msg:
-                        messages.append({"role": msg["role"], "content": msg["content"]})
-            
-            # 현재 사용자 입력 추가
-            messages.append({"role": "user", "content": user_input})
-            
-            response = await self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=messages,
-                max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE
-            )
-            
-            content = response.choices[0].message.content
-            return content.strip() if content else ""
+            messages = self._reflection_guidance_messages(user_input, conversation_history, context)
+            return await self._complete("get_ai_reflection_guidance", messages, MAX_TOKENS, TEMPERATURE)
             
         except Exception as e:
             print(f"AI 묵상 가이드 생성 중 오류: {e}")
-            if "billing_not_active" in str(e):
-                return "💡 AI 묵상을 사용하려면 OpenAI 계정의 결제 정보를 설정해주세요.\n\n📝 대신 기본 묵상 가이드를 제공해드릴게요:\n\n당신의 이야기를 들려주셔서 감사합니다. 자기 성찰은 정말 중요한 시간이에요. 더 깊이 있는 대화를 원하시면 OpenAI 계정 설정 후 다시 시도해보세요! 🙏"
-            else:
-                return "💡 AI 묵상 생성 중 일시적인 오류가 발생했습니다.\n\n📝 대신 기본 묵상 가이드를 제공해드릴게요:\n\n당신의 이야기를 들려주셔서 감사합니다. 자기 성찰은 정말 중요한 시간이에요. 잠시 후 다시 시도해보시거나, 다른 방법으로 자기 성찰을 이어가보세요! 🙏"
+            return fallback_message("get_ai_reflection_guidance", e)
+    
+    async def stream_ai_reflection_guidance(self, user_input: str, conversation_history: Optional[List[Dict[str, Any]]] = None,
+                                            context: Optional[List[str]] = None) -> AsyncIterator[str]:
+        """묵상 가이드를 생성되는 대로 조각 단위로 반환"""
+        if not self.is_available() or not self.client:
+            yield "❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요."
+            return
+        messages = self._reflection_guidance_messages(user_input, conversation_history, context)
+        async for piece in self._stream_completion("get_ai_reflection_guidance", messages, MAX_TOKENS, TEMPERATURE,
+                                                   "AI 묵상 가이드 생성 중 오류"):
+            yield piece
     
-    async def analyze_reflection_patterns(self, reflections: List[Dict]) -> str:
-        """회고 패턴 분석 및 인사이트 제공"""
+    async def analyze_reflection_patterns(self, reflections: List[Dict], related: Optional[List[Dict]] = None) -> str:
+        """회고 패턴 분석 및 인사이트 제공 (related: 함께 참고할 관련 과거 회고)"""
         if not self.is_available() or not self.client:
             return "❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요."
         
@@ -110,48 +272,12 @@ class AIHelper:
             return "분석할 회고가 없습니다."
         
         try:
-            # 회고 데이터 정리
-            reflection_texts = []
-            for reflection in reflections[:10]:  # 최근 10개만 분석
-                reflection_texts.append(f"[{reflection['date']}] {reflection['type']}: {reflection['content'][:200]}...")
-            
-            analysis_text = "\n".join(reflection_texts)
-            
-            prompt = f"""
-사용자의 회고 기록을 분석하여 다음과 같은 인사이트를 제공해주세요:
-
-1. **주요 패턴**: 자주 언급되는 주제나 감정 패턴
-2. **성장 영역**: 발전하고 있는 부분이나 개선점
-3. **일관성**: 회고의 일관성과 깊이
-4. **추천사항**: 더 나은 회고를 위한 구체적 제안
-
-회고 기록:
-{analysis_text}
-
-위 내용을 바탕으로 300-400자 내외의 분석 결과를 한국어로 제공해주세요.
-"""
-            
-            messages: List[ChatCompletionMessageParam] = [
-                {"role": "system", "content": "당신은 회고 분석 전문가입니다. 사용자의 회고 패턴을 분석하여 의미있는 인사이트를 제공합니다."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = await self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=messages,
-                max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE
-            )
-            
-            content = response.choices[0].message.content
-            return content.strip() if content else ""
+            messages = reflection_pattern_messages(reflections, related)
+            return await self._complete("analyze_reflection_patterns", messages, MAX_TOKENS, TEMPERATURE)
             
         except Exception as e:
             print(f"회고 패턴 분석 중 오류: {e}")
-            if "billing_not_active" in str(e):
-                return "💡 회고 패턴 분석을 사용하려면 OpenAI 계정의 결제 정보를 설정해주세요.\n\n📝 대신 기본 분석을 제공해드릴게요:\n\n회고를 꾸준히 작성하고 계시는 모습이 정말 인상적입니다! 패턴 분석을 원하시면 OpenAI 계정 설정 후 다시 시도해보세요. 지금도 충분히 의미있는 회고를 작성하고 계세요! 📊"
-            else:
-                return "💡 회고 패턴 분석 중 일시적인 오류가 발생했습니다.\n\n📝 대신 기본 분석을 제공해드릴게요:\n\n회고를 꾸준히 작성하고 계시는 모습이 정말 인상적입니다! 잠시 후 다시 시도해보시거나, 지금도 충분히 의미있는 회고를 작성하고 계세요! 📊"
+            return fallback_message("analyze_reflection_patterns", e)
     
     async def get_motivational_message(self, user_context: str = "") -> str:
         """동기부여 메시지 생성"""
@@ -178,62 +304,45 @@ class AIHelper:
                 {"role": "user", "content": prompt}
             ]
             
-            response = await self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=messages,
-                max_tokens=300,
-                temperature=0.8
-            )
-            
-            content = response.choices[0].message.content
-            return content.strip() if content else ""
+            return await self._complete("get_motivational_message", messages, 300, 0.8)
             
         except Exception as e:
             print(f"동기부여 메시지 생성 중 오류: {e}")
-            if "billing_not_active" in str(e):
-                return "💡 AI 동기부여 메시지를 사용하려면 OpenAI 계정의 결제 정보를 설정해주세요.\n\n📝 대신 기본 메시지를 제공해드릴게요:\n\n당신은 정말 대단한 사람입니다! 매일 조금씩이라도 성장하려는 모습이 정말 멋져요. 오늘도 힘내세요! 💪✨"
-            else:
-                return "💡 AI 동기부여 메시지 생성 중 일시적인 오류가 발생했습니다.\n\n📝 대신 기본 메시지를 제공해드릴게요:\n\n당신은 정말 대단한 사람입니다! 매일 조금씩이라도 성장하려는 모습이 정말 멋져요. 오늘도 힘내세요! 💪✨"
+            return fallback_message("get_motivational_message", e)
     
-    async def chat_with_gpt(self, user_message: str, conversation_history: Optional[List[Dict[str, Any]]] = None) -> str:
+    def _chat_messages(self, user_message: str, conversation_history: Optional[List[Dict[str, Any]]] = None,
+                       summary: str = "") -> List[ChatCompletionMessageParam]:
+        """일반 대화 요청 메시지 구성 (대화 기록은 토큰 예산 안에서 최근 순으로, 넘치는 기록은 요약)"""
+        system = """당신은 친근하고 도움이 되는 AI 어시스턴트입니다.
+사용자의 질문이나 대화에 대해 정확하고 유용한 답변을 제공합니다.
+한국어로 대화하며, 필요시 영어로도 답변할 수 있습니다.
+답변은 명확하고 이해하기 쉽게 작성해주세요."""
+        return self._build_prompt("chat_with_gpt", system, user_message, conversation_history, summary=summary)
+    
+    async def chat_with_gpt(self, user_message: str, conversation_history: Optional[List[Dict[str, Any]]] = None,
+                            summary: str = "") -> str:
         """ChatGPT와 일반 대화"""
         if not self.is_available() or not self.client:
             return "❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요."
         
         try:
-            # 대화 히스토리 구성
-            messages: List[ChatCompletionMessageParam] = [
-                {"role": "system", "content": """당신은 친근하고 도움이 되는 AI 어시스턴트입니다.
-사용자의 질문이나 대화에 대해 정확하고 유용한 답변을 제공합니다.
-한국어로 대화하며, 필요시 영어로도 답변할 수 있습니다.
-답변은 명확하고 이해하기 쉽게 작성해주세요."""}
-            ]
-            
-            # 대화 히스토리 추가 (최근 10개 메시지만 사용)
-            if conversation_history:
-                for msg in conversation_history[-10:]:
-                    if isinstance(msg, dict) and "role" in msg and "content" in msg:
-                        messages.append({"role": msg["role"], "content": msg["content"]})
-            
-            # 현재 사용자 메시지 추가
-            messages.append({"role": "user", "content": user_message})
-            
-            response = await self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=messages,
-                max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE
-            )
-            
-            content = response.choices[0].message.content
-            return content.strip() if content else ""
+            messages = self._chat_messages(user_message, conversation_history, summary)
+            return await self._complete("chat_with_gpt", messages, MAX_TOKENS, TEMPERATURE)
             
         except Exception as e:
             print(f"ChatGPT 대화 중 오류: {e}")
-            if "billing_not_active" in str(e):
-                return "💡 ChatGPT와 대화하려면 OpenAI 계정의 결제 정보를 설정해주세요.\n\n📝 대신 기본 응답을 제공해드릴게요:\n\n안녕하세요! ChatGPT와 대화를 원하시는군요. OpenAI 계정 설정 후 다시 시도해보세요! 🤖"
-            else:
-                return "💡 ChatGPT 대화 중 일시적인 오류가 발생했습니다.\n\n📝 잠시 후 다시 시도해보시거나, 다른 기능을 이용해보세요! 🤖"
+            return fallback_message("chat_with_gpt", e)
+    
+    async def stream_chat_with_gpt(self, user_message: str, conversation_history: Optional[List[Dict[str, Any]]] = None,
+                                   summary: str = "") -> AsyncIterator[str]:
+        """ChatGPT 응답을 생성되는 대로 조각 단위로 반환"""
+        if not self.is_available() or not self.client:
+            yield "❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요."
+            return
+        messages = self._chat_messages(user_message, conversation_history, summary)
+        async for piece in self._stream_completion("chat_with_gpt", messages, MAX_TOKENS, TEMPERATURE,
+                                                   "ChatGPT 대화 중 오류"):
+            yield piece
     
     async def get_completion_motivation(self, schedule_title: str) -> str:
         """일정 완료 시 AI 동기부여 메시지 생성"""
@@ -259,19 +368,11 @@ class AIHelper:
                 {"role": "user", "content": prompt}
             ]
             
-            response = await self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=messages,
-                max_tokens=100,
-                temperature=0.8
-            )
-            
-            content = response.choices[0].message.content
-            return content.strip() if content else ""
+            return await self._complete("get_completion_motivation", messages, 100, 0.8)
         
         except Exception as e:
             print(f"AI 완료 동기부여 생성 오류: {e}")
-            return ""
+            return fallback_message("get_completion_motivation", e)
     
     async def get_schedule_summary(self, schedules: List[Dict]) -> str:
         """일정 데이터 기반 AI 요약/분석"""
@@ -309,41 +410,32 @@ class AIHelper:
                 {"role": "user", "content": prompt}
             ]
             
-            response = await self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=messages,
-                max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE
-            )
-            
-            content = response.choices[0].message.content
-            return content.strip() if content else ""
+            return await self._complete("get_schedule_summary", messages, MAX_TOKENS, TEMPERATURE)
         
         except Exception as e:
             print(f"AI 일정 요약 분석 오류: {e}")
-            return "❌ AI 분석 중 오류가 발생했습니다."
+            return fallback_message("get_schedule_summary", e)
     
-    async def transcribe_voice(self, voice_file_path: str) -> str:
-        """음성을 텍스트로 변환 (OpenAI Whisper)"""
+    async def transcribe_voice(self, audio: bytes, filename: str = "voice.ogg") -> str:
+        """메모리에 있는 음성을 텍스트로 변환 (OpenAI Whisper)"""
         if not self.is_available() or not self.client:
             return ""
         
         try:
-            async with aiofiles.open(voice_file_path, "rb") as audio_file:
-                audio_bytes = await audio_file.read()
-            import io
-            audio_stream = io.BytesIO(audio_bytes)
             if hasattr(self.client, "audio") and hasattr(self.client.audio, "transcriptions"):
-                transcript = await self.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_stream
+                # 파일 이름으로 형식을 판단하므로 (이름, 내용) 형태로 전달
+                transcript = await self.executor.run(
+                    lambda: self.client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=(filename, audio)
+                    )
                 )
                 return transcript.text if transcript and hasattr(transcript, 'text') else ""
             else:
                 return ""
         except Exception as e:
             print(f"음성 변환 오류: {e}")
-            return ""
+            return fallback_message("transcribe_voice", e)
     
     async def analyze_voice_reflection(self, transcription: str) -> str:
         """음성 회고 분석"""
@@ -370,32 +462,20 @@ class AIHelper:
                 {"role": "user", "content": prompt}
             ]
             
-            response = await self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=messages,
-                max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE
-            )
-            
-            content = response.choices[0].message.content
-            return content.strip() if content else ""
+            return await self._complete("analyze_voice_reflection", messages, MAX_TOKENS, TEMPERATURE)
         
         except Exception as e:
             print(f"음성 회고 분석 오류: {e}")
-            return "❌ 음성 분석 중 오류가 발생했습니다."
+            return fallback_message("analyze_voice_reflection", e)
     
-    async def analyze_image_reflection(self, image_file_path: str) -> str:
-        """이미지 회고 분석 (OpenAI Vision)"""
+    async def analyze_image_reflection(self, image: bytes, mime_type: str = "image/jpeg") -> str:
+        """이미지 회고 분석 (OpenAI Vision), 같은 이미지는 캐시된 분석 재사용"""
         if not self.is_available() or not self.client:
             return "❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요."
         
         try:
-            import base64
-            
-            # 이미지 파일을 base64로 인코딩
-            async with aiofiles.open(image_file_path, "rb") as image_file:
-                image_bytes = await image_file.read()
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
+            # 이미지를 base64로 인코딩
+            base64_image = base64.b64encode(image).decode('utf-8')
             
             prompt = """
 이 이미지를 회고 관점에서 분석해주세요:
@@ -408,31 +488,31 @@ class AIHelper:
 회고적이고 성찰적인 관점에서 분석해주세요.
 """
             
-            response = await self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
+            messages: List[ChatCompletionMessageParam] = [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{base64_image}",
+                                "detail": IMAGE_DETAIL
                             }
-                        ]
-                    }
-                ],
-                max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE
-            )
+                        }
+                    ]
+                }
+            ]
             
-            return response.choices[0].message.content.strip()
+            # 캐시 키는 base64 본문 대신 이미지 해시로 계산
+            cache_key = self.cache.make_key(GPT_MODEL, {'image_sha256': hashlib.sha256(image).hexdigest(),
+                                                        'prompt': prompt, 'detail': IMAGE_DETAIL},
+                                            max_tokens=MAX_TOKENS, temperature=TEMPERATURE)
+            return await self._complete("analyze_image_reflection", messages, MAX_TOKENS, TEMPERATURE, cache_key)
         
         except Exception as e:
             print(f"이미지 분석 오류: {e}")
-            return "❌ 이미지 분석 중 오류가 발생했습니다."
+            return fallback_message("analyze_image_reflection", e)
     
     async def feedback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """최근 회고에 대한 AI 피드백 제공"""
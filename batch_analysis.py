@@ -0,0 +1,205 @@
+"""
+주간 회고 패턴 리포트 배치 작업
+기간 내 회고를 쓴 사용자를 묶음 단위로 읽어 OpenAI Batch API 요청 파일(JSONL)을 만들고,
+제출/상태 확인 후 결과를 reflection_reports 테이블에 저장합니다.
+저장된 리포트는 봇의 백그라운드 작업('weekly_report')이 사용자에게 전달합니다.
+
+사용법: python batch_analysis.py [submit|poll|run]  (기본 run: 제출 후 완료될 때까지 대기)
+"""
+
+import sys
+import json
+import time
+import datetime
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+import openai
+from ai_helper import reflection_pattern_messages
+from database import Database
+from timeutil import local_now
+from config import (OPENAI_API_KEY, GPT_MODEL, MAX_TOKENS, TEMPERATURE, REPORT_PERIOD_DAYS, REPORT_USER_CHUNK,
+                    BATCH_MAX_REQUESTS, BATCH_MAX_BYTES, BATCH_POLL_INTERVAL, BATCH_COMPLETION_WINDOW)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# 더 이상 상태가 바뀌지 않는 배치 상태 (expired/cancelled도 완료된 요청의 결과 파일은 있음)
+BATCH_FINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+def last_week(today: datetime.date) -> Tuple[str, str]:
+    """오늘 이전 REPORT_PERIOD_DAYS일 기간 ('YYYY-MM-DD', 'YYYY-MM-DD')"""
+    end = today - datetime.timedelta(days=1)
+    start = today - datetime.timedelta(days=REPORT_PERIOD_DAYS)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+def parse_result_line(line: bytes) -> Tuple[int, str, Optional[str], Optional[str]]:
+    """배치 결과/오류 파일 한 줄 -> (user_id, period_start, 리포트, 오류)"""
+    item = json.loads(line)
+    user_id, period_start = item['custom_id'].split(':', 1)
+    response = item.get('response') or {}
+    if item.get('error') or response.get('status_code') != 200:
+        error = item.get('error') or (response.get('body') or {}).get('error') or response
+        return int(user_id), period_start, None, json.dumps(error, ensure_ascii=False)[:500]
+    content = response['body']['choices'][0]['message'].get('content') or ''
+    if not content.strip():
+        return int(user_id), period_start, None, "빈 응답"
+    return int(user_id), period_start, content.strip(), None
+
+class _BatchFile:
+    """제출 전 요청을 모아두는 임시 JSONL 파일 (메모리에 전부 올리지 않음)"""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.user_ids: List[int] = []
+        self.size = 0
+
+    def write(self, user_id: int, line: bytes):
+        self.file.write(line)
+        self.user_ids.append(user_id)
+        self.size += len(line)
+
+class BatchReportJob:
+    """사용자별 최근 회고 10개를 analyze_reflection_patterns와 같은 프롬프트로 배치 분석"""
+
+    def __init__(self, db: Database, client=None, user_chunk: int = REPORT_USER_CHUNK,
+                 max_requests: int = BATCH_MAX_REQUESTS, max_bytes: int = BATCH_MAX_BYTES,
+                 poll_interval: float = BATCH_POLL_INTERVAL):
+        self.db = db
+        self.client = client or openai.OpenAI(api_key=OPENAI_API_KEY)
+        self.user_chunk = user_chunk
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+
+    def build_request(self, user_id: int, period_start: str, reflections: List[Dict]) -> Dict[str, Any]:
+        """배치 입력 파일의 요청 한 줄 (custom_id로 결과를 사용자/기간에 연결)"""
+        return {
+            'custom_id': f"{user_id}:{period_start}",
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': {
+                'model': GPT_MODEL,
+                'messages': reflection_pattern_messages(reflections),
+                'max_tokens': MAX_TOKENS,
+                'temperature': TEMPERATURE,
+            },
+        }
+
+    def submit(self, period_start: str, period_end: str) -> List[str]:
+        """기간 내 회고가 있는 사용자의 요청을 파일 한도에 맞게 나눠 제출하고 배치 ID 목록 반환"""
+        batch_ids: List[str] = []
+        current = _BatchFile()
+        after_user_id = 0
+        while True:
+            # user_id 순 키셋 페이지로 사용자 묶음을 읽음 (전체 회고를 한 번에 읽지 않음)
+            user_ids = self.db.get_reflection_user_ids(period_start, period_end, after_user_id, self.user_chunk)
+            if not user_ids:
+                break
+            after_user_id = user_ids[-1]
+            claimed = self.db.claim_reflection_reports(user_ids, period_start, period_end)
+            if not claimed:
+                continue
+            reflections = self.db.get_recent_reflections_for_users(claimed, period_start, period_end)
+            for user_id in claimed:
+                request = self.build_request(user_id, period_start, reflections[user_id])
+                line = (json.dumps(request, ensure_ascii=False) + "\n").encode('utf-8')
+                if current.user_ids and (len(current.user_ids) >= self.max_requests or current.size + len(line) > self.max_bytes):
+                    batch_ids.append(self._submit_file(current, period_start, period_end))
+                    current = _BatchFile()
+                current.write(user_id, line)
+        if current.user_ids:
+            batch_ids.append(self._submit_file(current, period_start, period_end))
+        else:
+            current.file.close()
+        return batch_ids
+
+    def _submit_file(self, batch_file: _BatchFile, period_start: str, period_end: str) -> str:
+        try:
+            batch_file.file.seek(0)
+            uploaded = self.client.files.create(file=("reflection_reports.jsonl", batch_file.file), purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=BATCH_COMPLETION_WINDOW,
+                metadata={'job': 'weekly_reflection_report', 'period_start': period_start},
+            )
+        finally:
+            batch_file.file.close()
+        self.db.add_report_batch(batch.id, period_start, period_end, uploaded.id, batch.status,
+                                 batch_file.user_ids, time.time())
+        print(f"📤 회고 리포트 배치 제출 {batch.id}: {len(batch_file.user_ids)}명, {batch_file.size / 1024:.0f}KB")
+        return batch.id
+
+    def poll(self) -> int:
+        """진행 중인 배치 상태를 확인하고 끝난 배치의 결과를 저장, 남은 배치 수 반환"""
+        remaining = 0
+        for row in self.db.get_open_report_batches():
+            try:
+                batch = self.client.batches.retrieve(row['id'])
+            except openai.OpenAIError as e:
+                print(f"배치 상태 확인 오류 ({row['id']}): {e}")
+                remaining += 1
+                continue
+            if batch.status not in BATCH_FINAL_STATUSES:
+                if batch.status != row['status']:
+                    self.db.update_report_batch(batch.id, batch.status)
+                remaining += 1
+                continue
+            self._process(batch)
+        return remaining
+
+    def _process(self, batch) -> Dict[str, int]:
+        """결과/오류 파일을 스트리밍으로 읽어 저장하고 완료된 사용자에게 전달 작업 추가"""
+        counts = {'done': 0, 'failed': 0}
+        self.db.update_report_batch(batch.id, batch.status, batch.output_file_id, batch.error_file_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                self._save_results(batch.id, file_id, counts)
+        # 결과가 오지 않은 요청 (배치 실패/만료/취소) -> 다음 실행 때 다시 요청
+        counts['failed'] += self.db.fail_pending_reports(batch.id, f"배치 {batch.status}")
+        self.db.update_report_batch(batch.id, 'processed', now=time.time())
+        print(f"📥 회고 리포트 배치 {batch.id} ({batch.status}): 완료 {counts['done']}건, 실패 {counts['failed']}건")
+        return counts
+
+    def _save_results(self, batch_id: str, file_id: str, counts: Dict[str, int]):
+        results: List[Tuple[int, str, Optional[str], Optional[str]]] = []
+        with self.client.files.with_streaming_response.content(file_id) as response:
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                results.append(parse_result_line(line))
+                if len(results) >= self.user_chunk:
+                    self._save_chunk(batch_id, results, counts)
+                    results = []
+        if results:
+            self._save_chunk(batch_id, results, counts)
+
+    def _save_chunk(self, batch_id: str, results: List[Tuple[int, str, Optional[str], Optional[str]]], counts: Dict[str, int]):
+        self.db.save_reflection_reports(batch_id, results)
+        done = [user_id for user_id, _, report, _ in results if report is not None]
+        counts['done'] += len(done)
+        counts['failed'] += len(results) - len(done)
+        # 개인 채팅이라 chat_id = user_id, 같은 사용자 작업이 이미 대기 중이면 중복 추가하지 않음
+        self.db.enqueue_jobs([(user_id, user_id, 'weekly_report', None) for user_id in done], time.time())
+
+    def run(self, period_start: str, period_end: str, wait: bool = True) -> List[str]:
+        """제출 후 (wait이면) 모든 배치가 끝날 때까지 poll_interval초 간격으로 확인"""
+        batch_ids = self.submit(period_start, period_end)
+        while wait and self.poll():
+            time.sleep(self.poll_interval)
+        return batch_ids
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    job = BatchReportJob(Database())
+    period_start, period_end = last_week(local_now().date())
+    if command == 'submit':
+        job.submit(period_start, period_end)
+    elif command == 'poll':
+        print(f"진행 중인 배치 {job.poll()}개")
+    elif command == 'run':
+        job.run(period_start, period_end)
+    else:
+        print(f"❌ 알 수 없는 명령: {command} (가능: submit, poll, run)")
+    job.db.close()
+
+if __name__ == "__main__":
+    main()
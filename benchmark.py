@@ -0,0 +1,702 @@
+#!/usr/bin/env python3
+"""
+성능 벤치마크 파일
+로컬에서 임시 데이터베이스를 만들어 주요 경로의 지연 시간/처리량을 측정합니다.
+
+사용법: python benchmark.py [이름 ...]  (이름 생략 시 전체 실행)
+"""
+
+import os
+import sys
+import math
+import time
+import base64
+import asyncio
+import datetime
+import tempfile
+import multiprocessing
+from typing import Dict, List
+import pytz
+import openai
+from telegram import Bot, PhotoSize
+from telegram.request import HTTPXRequest
+from database import Database, AsyncDatabase
+from ai_helper import AIHelper
+from media_pipeline import MediaPipeline
+from fake_openai import FakeOpenAIServer
+from fake_telegram import FakeTelegramServer
+from notifier import NotificationDispatcher
+from ai_executor import TokenBucket
+from config import GPT_MODEL, DEFAULT_TIMEZONE, NOTIFY_CONCURRENCY, NOTIFY_GLOBAL_RATE, EMBEDDING_DIM
+
+def percentile(values: List[float], pct: float) -> float:
+    """백분위수 계산 (values는 비어있지 않아야 함)"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class SlowWriteDatabase(Database):
+    """fsync/잠금 대기를 흉내 내기 위해 쓰기마다 지연을 넣은 Database"""
+
+    def __init__(self, db_path: str, delay: float):
+        self.delay = delay
+        super().__init__(db_path)
+
+    def add_schedule(self, *args, **kwargs) -> bool:
+        time.sleep(self.delay)
+        return super().add_schedule(*args, **kwargs)
+
+async def _simulate_updates(db, is_async: bool, updates: int, interval: float) -> Dict[str, List[float]]:
+    """동시에 도착하는 업데이트를 흉내 내고 핸들러 종류별 지연 시간(ms)을 반환"""
+    latencies = {'db': [], 'light': []}
+
+    async def handler(i: int):
+        await asyncio.sleep(i * interval)  # 도착 시각
+        arrived = time.perf_counter()
+        user_id = i % 50
+        if i % 2 == 0:
+            # 일정 추가 + 조회 (DB 사용)
+            if is_async:
+                await db.add_schedule(user_id, f"일정 {i}", "", "2024-01-15", "09:00")
+                await db.get_schedules(user_id, "2024-01-15")
+            else:
+                db.add_schedule(user_id, f"일정 {i}", "", "2024-01-15", "09:00")
+                db.get_schedules(user_id, "2024-01-15")
+        else:
+            # /help 같은 DB를 쓰지 않는 핸들러
+            await asyncio.sleep(0)
+        kind = 'db' if i % 2 == 0 else 'light'
+        latencies[kind].append((time.perf_counter() - arrived) * 1000)
+
+    await asyncio.gather(*(handler(i) for i in range(updates)))
+    return latencies
+
+def bench_async_database(updates: int = 400, interval: float = 0.005, write_delay: float = 0.005):
+    """동기 Database vs AsyncDatabase 핸들러 p99 지연 비교"""
+    print(f"\n⏱️ 핸들러 지연 벤치마크 (업데이트 {updates}개, 쓰기 지연 {write_delay * 1000:.0f}ms)")
+    with tempfile.TemporaryDirectory() as tmp:
+        sync_db = SlowWriteDatabase(os.path.join(tmp, 'sync.db'), write_delay)
+        sync_latencies = asyncio.run(_simulate_updates(sync_db, False, updates, interval))
+        sync_db.close()
+
+        async_db = AsyncDatabase(SlowWriteDatabase(os.path.join(tmp, 'async.db'), write_delay))
+        async_latencies = asyncio.run(_simulate_updates(async_db, True, updates, interval))
+        async_db.close()
+
+    for name, result in (('동기 Database', sync_latencies), ('AsyncDatabase', async_latencies)):
+        for kind, label in (('db', 'DB 핸들러'), ('light', '일반 핸들러')):
+            values = result[kind]
+            print(f"  {name:14s} {label:7s} p50={percentile(values, 50):8.2f}ms  p99={percentile(values, 99):8.2f}ms")
+
+def _legacy_update_routine_completion(db: Database, routine_id: int, completion_date: str, is_done: bool = True) -> bool:
+    """이전 구현 (SELECT 후 UPDATE 또는 INSERT)"""
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM routine_completions WHERE routine_id = ? AND completion_date = ?', (routine_id, completion_date))
+        if cursor.fetchone():
+            cursor.execute('UPDATE routine_completions SET is_done = ?, created_at = CURRENT_TIMESTAMP WHERE routine_id = ? AND completion_date = ?', (is_done, routine_id, completion_date))
+        else:
+            cursor.execute('INSERT INTO routine_completions (routine_id, completion_date, is_done) VALUES (?, ?, ?)', (routine_id, completion_date, is_done))
+        conn.commit()
+    return True
+
+def bench_routine_completions(routines: int = 50, days: int = 60):
+    """루틴 완료 처리량 (초당 완료 기록 수) 비교"""
+    print(f"\n⏱️ 루틴 완료 처리량 벤치마크 (루틴 {routines}개 x {days}일)")
+    start = datetime.date(2024, 1, 1)
+    dates = [(start + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    total = routines * len(dates)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'routines.db'))
+        for i in range(routines):
+            db.add_routine(1, f"루틴 {i}", "", 'daily', dates[0])
+        cases = (
+            ('SELECT+UPDATE/INSERT', lambda r, d: _legacy_update_routine_completion(db, r, d)),
+            ('upsert', lambda r, d: db.update_routine_completion(r, d)),
+        )
+        for name, update in cases:
+            db.pool.connection().execute('DELETE FROM routine_completions')
+            db.pool.connection().commit()
+            began = time.perf_counter()
+            for routine_id in range(1, routines + 1):
+                for date in dates:
+                    update(routine_id, date)
+            elapsed = time.perf_counter() - began
+            print(f"  {name:22s} {total / elapsed:10.0f} 건/초")
+
+        db.pool.connection().execute('DELETE FROM routine_completions')
+        db.pool.connection().commit()
+        began = time.perf_counter()
+        db.bulk_update_routine_completions(1, list(range(1, routines + 1)), dates[0], dates[-1])
+        elapsed = time.perf_counter() - began
+        print(f"  {'bulk upsert (1 트랜잭션)':22s} {total / elapsed:10.0f} 건/초")
+        db.close()
+
+def estimate_vision_tokens(width: int, height: int, detail: str) -> int:
+    """Vision 입력 토큰 추정 (low는 고정 85, 그 외에는 512px 타일당 170)"""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+async def _legacy_analyze_image(pipeline: MediaPipeline, client, bot, photo: List[PhotoSize]) -> str:
+    """이전 구현 (가장 큰 사진을 그대로 base64로 전송, detail 기본값)"""
+    original = await pipeline.fetch(bot, photo[-1].file_id, 20 * 1024 * 1024)
+    encoded = base64.b64encode(original).decode('utf-8')
+    response = await client.chat.completions.create(
+        model=GPT_MODEL,
+        messages=[{"role": "user", "content": [
+            {"type": "text", "text": "이 이미지를 회고 관점에서 분석해주세요."},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}},
+        ]}],
+        max_tokens=500,
+    )
+    return response.choices[0].message.content
+
+def bench_image_prep(images: int = 10, vision_latency: float = 0.3):
+    """이미지 회고 전송 바이트/Vision 토큰/지연 비교"""
+    print(f"\n⏱️ 이미지 준비 벤치마크 (이미지 {images}개, 가짜 Vision 지연 {vision_latency * 1000:.0f}ms)")
+    # 텔레그램이 보내주는 사진 크기별 대략적인 JPEG 용량
+    sizes = [(90, 67, 2), (320, 240, 20), (800, 600, 85), (1280, 960, 210)]
+
+    async def run(telegram_server: FakeTelegramServer, openai_server: FakeOpenAIServer):
+        albums = []
+        for i in range(images):
+            photo = []
+            for width, height, kb in sizes:
+                file_id = f"img{i}-{width}"
+                telegram_server.add_file(file_id, f"photos/{file_id}.jpg", os.urandom(kb * 1024))
+                photo.append(PhotoSize(file_id, file_id, width, height, file_size=kb * 1024))
+            albums.append(photo)
+        client = openai.AsyncOpenAI(api_key="bench", base_url=openai_server.base_url)
+        pipeline = MediaPipeline(AIHelper(client=client))
+        results = {}
+        async with Bot(telegram_server.token, base_url=telegram_server.base_url,
+                       base_file_url=telegram_server.base_file_url) as bot:
+            cases = (
+                ('가장 큰 사진 그대로', lambda photo: _legacy_analyze_image(pipeline, client, bot, photo), sizes[-1], "auto"),
+                ('크기 선택 + low', lambda photo: pipeline.process_image(bot, photo), sizes[2], "low"),
+                ('같은 이미지 재요청', lambda photo: pipeline.process_image(bot, photo), sizes[2], "low"),
+            )
+            for name, analyze, (width, height, _), detail in cases:
+                sent = 0
+                latencies = []
+                for photo in albums:
+                    requests_before = len(openai_server.requests)
+                    began = time.perf_counter()
+                    await analyze(photo)
+                    latencies.append((time.perf_counter() - began) * 1000)
+                    sent += sum(r['bytes'] for r in openai_server.requests[requests_before:])
+                results[name] = (sent / images, estimate_vision_tokens(width, height, detail) if sent else 0, latencies)
+        await pipeline.close()
+        await client.close()
+        return results
+
+    with FakeTelegramServer() as telegram_server, FakeOpenAIServer(response_delay=vision_latency) as openai_server:
+        results = asyncio.run(run(telegram_server, openai_server))
+    for name, (sent, tokens, latencies) in results.items():
+        print(f"  {name:14s} 전송 {sent / 1024:7.1f}KB/이미지  Vision 토큰 ~{tokens:4d}  p50={percentile(latencies, 50):7.1f}ms")
+
+class _NullBot:
+    """전송하지 않는 봇 (DB/요약 생성 단계만 측정)"""
+
+    async def send_message(self, chat_id, text, **kwargs):
+        pass
+
+def _seed_notifications(db: Database, users: int, date: str):
+    """사용자마다 08:00 아침 알림, 일정 2개, 루틴 2개 생성"""
+    conn = db.pool.connection()
+    with conn:
+        conn.executemany("INSERT INTO notifications (user_id, notification_type, notification_time, message) VALUES (?, 'morning', '08:00', '오늘의 일정 알림')",
+                         [(user_id,) for user_id in range(1, users + 1)])
+        conn.executemany("INSERT INTO schedules (user_id, title, description, date, time, is_done) VALUES (?, ?, '', ?, ?, 0)",
+                         [(user_id, f"일정 {i}", date, f"{9 + i}:00") for user_id in range(1, users + 1) for i in range(2)])
+        conn.executemany("INSERT INTO routines (user_id, title, description, frequency, start_date, weekday_mask) VALUES (?, ?, '', ?, '2024-01-01', 127)",
+                         [(user_id, title, frequency) for user_id in range(1, users + 1)
+                          for title, frequency in (("스트레칭", 'daily'), ("주간 점검", 'weekly'))])
+
+def bench_notifications(users: int = 100000, http_users: int = 5000):
+    """아침 알림 부하 테스트: 한 시각에 몰린 사용자 알림의 조회/요약 처리량과 가짜 Bot API 전송 처리량"""
+    print(f"\n⏱️ 아침 알림 부하 테스트 (같은 시각 사용자 {users}명, HTTP 전송 {http_users}명)")
+    now = pytz.timezone(DEFAULT_TIMEZONE).localize(datetime.datetime(2024, 6, 3, 8, 0))
+
+    async def run(db: AsyncDatabase, bot, rate: float) -> Dict:
+        dispatcher = NotificationDispatcher(db, rate=rate, per_chat_interval=0)
+        stats = await dispatcher.dispatch(bot, now)
+        await dispatcher.stop()
+        return stats
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'notify.db')))
+        began = time.perf_counter()
+        _seed_notifications(db.db, users, '2024-06-03')
+        print(f"  데이터 생성 {time.perf_counter() - began:.1f}초")
+        stats = asyncio.run(run(db, _NullBot(), 1e9))
+        print(f"  조회+요약 (전송 제외)  {stats['notifications']}건  {stats['elapsed_ms'] / 1000:6.2f}초  "
+              f"DB {stats['db_ms'] / 1000:.2f}초  {stats['per_second']:9.0f}건/초")
+        db.close()
+
+        db = AsyncDatabase(Database(os.path.join(tmp, 'notify_http.db')))
+        _seed_notifications(db.db, http_users, '2024-06-03')
+
+        async def run_http(server: FakeTelegramServer) -> Dict:
+            request = HTTPXRequest(connection_pool_size=NOTIFY_CONCURRENCY)
+            async with Bot(server.token, base_url=server.base_url, request=request) as bot:
+                return await run(db, bot, 1e9)
+
+        with FakeTelegramServer() as server:
+            stats = asyncio.run(run_http(server))
+        print(f"  가짜 Bot API 전송      {stats['sent']}건  {stats['elapsed_ms'] / 1000:6.2f}초  {stats['per_second']:9.0f}건/초")
+        db.close()
+
+    for rate in (NOTIFY_GLOBAL_RATE, 1000):
+        # 전송 한도가 병목: 한 시각 알림이 다음 분 전에 끝나려면 users <= rate * 60
+        print(f"  초당 {rate:4d}건 한도에서 {users}명 발송 예상 {users / rate / 60:6.1f}분")
+
+_SEARCH_WORDS = ("운동을 했다 산책 독서 공부 회의가 길었다 프로젝트 가족과 친구를 만났다 커피 점심 저녁 아침 피곤했다 "
+                 "행복했다 감사한 걱정 계획 목표 성장 습관 달리기 요가 수영 영화 음악 여행 출근 퇴근 야근 휴식 명상 "
+                 "코딩 리뷰 발표 면접 시험 과제 청소 요리 쇼핑 병원 약속 대화 반성 다짐 결심 실수 배움 도전").split()
+
+def _search_corpus(rows: int, users: int, heavy_rows: int):
+    """사용자 users명에게 고르게 나눈 회고 rows개 + 회고가 많은 사용자 1명 (user_id 0)"""
+    import random
+    rng = random.Random(42)
+    vocabulary = _SEARCH_WORDS + [f"키워드{i}" for i in range(5000)]
+    for i in range(rows + heavy_rows):
+        user_id = 0 if i < heavy_rows else rng.randrange(1, users + 1)
+        words = rng.choices(_SEARCH_WORDS, k=5) + rng.choices(vocabulary, k=rng.randint(5, 20))
+        yield (user_id, 'daily', ' '.join(words), f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")
+
+def bench_search(rows: int = 1000000, users: int = 10000, heavy_rows: int = 20000, queries: int = 200):
+    """회고 검색 지연: 전체 회고를 불러와 파이썬에서 찾기 vs search_reflections"""
+    import random
+    print(f"\n⏱️ 회고 검색 벤치마크 (회고 {rows:,}개, 사용자 {users:,}명 + 회고 {heavy_rows:,}개인 사용자 1명)")
+    rng = random.Random(7)
+    cases = (
+        ('3글자 이상 (색인)', '운동을'),
+        ('드문 단어 (색인)', '키워드1234'),
+        ('2글자 (본문 확인)', '요가'),
+        ('여러 단어', '감사한 요가'),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'search.db'))
+        began = time.perf_counter()
+        with db.pool.connection() as conn:
+            conn.executemany('INSERT INTO reflections (user_id, type, content, date) VALUES (?, ?, ?, ?)',
+                             _search_corpus(rows, users, heavy_rows))
+        print(f"  데이터 생성 + 색인     {time.perf_counter() - began:6.1f}초 ({os.path.getsize(db.db_path) / 1024 / 1024:.0f}MB)")
+
+        def legacy_search(user_id: int, query: str) -> List[Dict]:
+            terms = query.lower().split()
+            return [r for r in db.get_reflections(user_id) if all(t in r['content'].lower() for t in terms)][:10]
+
+        for label, query in cases:
+            for name, search in (('전체 조회 후 찾기', legacy_search), ('search_reflections', lambda u, q: db.search_reflections(u, q))):
+                latencies = []
+                for _ in range(queries):
+                    user_id = rng.randrange(1, users + 1)
+                    began = time.perf_counter()
+                    search(user_id, query)
+                    latencies.append((time.perf_counter() - began) * 1000)
+                heavy_began = time.perf_counter()
+                search(0, query)
+                heavy = (time.perf_counter() - heavy_began) * 1000
+                print(f"  {label:14s} {name:18s} p50={percentile(latencies, 50):7.2f}ms  "
+                      f"p99={percentile(latencies, 99):7.2f}ms  회고 많은 사용자={heavy:8.2f}ms")
+        db.close()
+
+def bench_embeddings(vectors: int = 1000000, users: int = 10000, dim: int = EMBEDDING_DIM, queries: int = 50, k: int = 20):
+    """관련 회고 검색 지연: 벡터 색인 top-k (전체 / 사용자별), 전체 정렬 대비"""
+    import numpy as np
+    from embedding_index import EmbeddingIndex, HashingEmbedder, _normalize
+    print(f"\n⏱️ 임베딩 색인 벤치마크 (벡터 {vectors:,}개 x {dim}차원, 사용자 {users:,}명, top-{k})")
+    rng = np.random.default_rng(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = EmbeddingIndex(os.path.join(tmp, 'vectors'), dim, 'bench')
+        began = time.perf_counter()
+        chunk = 50000
+        for start in range(0, vectors, chunk):
+            count = min(chunk, vectors - start)
+            ids = list(range(start + 1, start + count + 1))
+            index.append(ids, rng.integers(1, users + 1, count).tolist(),
+                         _normalize(rng.standard_normal((count, dim), dtype=np.float32)))
+        print(f"  색인 생성             {time.perf_counter() - began:6.1f}초 ({vectors * dim * 4 / 1024 / 1024:.0f}MB)")
+        embedder = HashingEmbedder(dim)
+        began = time.perf_counter()
+        asyncio.run(embedder.embed(["오늘은 아침 운동을 하고 독서 모임에 다녀왔다. 감사한 하루"] * queries))
+        print(f"  질의 임베딩 (로컬)      {(time.perf_counter() - began) * 1000 / queries:7.2f}ms/건")
+
+        def full_sort(query):
+            return np.argsort(-(index._vectors @ query))[:k]
+
+        cases = (
+            ('전체 정렬 (argsort)', full_sort),
+            ('search (전체)', lambda q: index.search(q, k)),
+            ('search (사용자별)', lambda q: index.search(q, k, user_id=int(rng.integers(1, users + 1)))),
+        )
+        for label, search in cases:
+            search(_normalize(rng.standard_normal((1, dim), dtype=np.float32))[0])  # 페이지 캐시 예열
+            latencies = []
+            for _ in range(queries):
+                query = _normalize(rng.standard_normal((1, dim), dtype=np.float32))[0]
+                began = time.perf_counter()
+                search(query)
+                latencies.append((time.perf_counter() - began) * 1000)
+            print(f"  {label:20s} p50={percentile(latencies, 50):8.2f}ms  p99={percentile(latencies, 99):8.2f}ms")
+
+def bench_prompts(conversations: int = 2000):
+    """대화 프롬프트 토큰: 최근 10턴 고정 vs 토큰 예산 구성 (짧은/긴 메시지가 섞인 대화)"""
+    import random
+    from prompt_builder import PromptBuilder, count_prompt_tokens
+    print(f"\n⏱️ 프롬프트 구성 벤치마크 (대화 {conversations:,}개, 대화당 최대 30턴)")
+    rng = random.Random(11)
+    builder = PromptBuilder()
+    budget = builder.budget('chat_with_gpt')
+    system = "당신은 친근하고 도움이 되는 AI 어시스턴트입니다."
+    results = {'최근 10턴 고정': [], '토큰 예산': []}
+    turns_used = {'최근 10턴 고정': [], '토큰 예산': []}
+    build_times = []
+    for _ in range(conversations):
+        history = []
+        for i in range(rng.randint(2, 30)):
+            # 대부분 짧은 말, 가끔 긴 글 (붙여넣은 일기/문서 등)
+            length = rng.choice([15, 30, 60, 120]) if rng.random() < 0.9 else rng.randint(800, 3000)
+            history.append({'role': 'user' if i % 2 == 0 else 'assistant', 'content': "가" * length})
+        legacy = [{'role': 'system', 'content': system}] + history[-10:] + [{'role': 'user', 'content': "질문"}]
+        results['최근 10턴 고정'].append(count_prompt_tokens(legacy))
+        turns_used['최근 10턴 고정'].append(len(history[-10:]))
+        began = time.perf_counter()
+        built = builder.build('chat_with_gpt', system, "질문", history)
+        build_times.append((time.perf_counter() - began) * 1000)
+        results['토큰 예산'].append(built['prompt_tokens'])
+        turns_used['토큰 예산'].append(built['history_turns'])
+    for name, tokens in results.items():
+        over = sum(1 for t in tokens if t > budget) / len(tokens) * 100
+        print(f"  {name:12s} 평균={sum(tokens) / len(tokens):7.0f}토큰  p99={percentile(tokens, 99):7.0f}토큰  "
+              f"예산({budget}) 초과={over:5.1f}%  평균 턴={sum(turns_used[name]) / len(tokens):5.1f}")
+    print(f"  구성 시간             p50={percentile(build_times, 50):.3f}ms  p99={percentile(build_times, 99):.3f}ms")
+
+def bench_persistence(users: int = 2000, steps: int = 5, flush_every: int = 1000):
+    """업데이트 처리량: persistence 없음 vs SQLitePersistence (flush_every건마다 주기 저장 포함)"""
+    from telegram import Update
+    from telegram.ext import Application, ConversationHandler, CommandHandler, MessageHandler, filters
+    from persistence import SQLitePersistence
+    print(f"\n⏱️ 대화 흐름 상태 보관 벤치마크 (사용자 {users:,}명 x {steps}단계 입력, {flush_every}건마다 저장)")
+
+    async def entry(update, context):
+        context.user_data['flow'] = {'answers': []}
+        return 0
+
+    async def answer(update, context):
+        context.user_data['flow']['answers'].append(update.message.text)
+        return ConversationHandler.END if len(context.user_data['flow']['answers']) >= steps else 0
+
+    def updates(bot) -> List[Update]:
+        result = []
+        for step in range(steps + 1):
+            for user_id in range(1, users + 1):
+                text = "/flow" if step == 0 else f"답변 {step}"
+                message = {'message_id': len(result) + 1, 'date': int(time.time()), 'text': text,
+                           'chat': {'id': user_id, 'type': 'private'},
+                           'from': {'id': user_id, 'is_bot': False, 'first_name': 'u'}}
+                if step == 0:
+                    message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': 5}]
+                result.append(Update.de_json({'update_id': len(result) + 1, 'message': message}, bot))
+        return result
+
+    async def run(server: FakeTelegramServer, persistence) -> Dict:
+        builder = Application.builder().token(server.token).base_url(server.base_url)
+        if persistence is not None:
+            builder = builder.persistence(persistence)
+        app = builder.build()
+        app.add_handler(ConversationHandler(
+            entry_points=[CommandHandler('flow', entry)],
+            states={0: [MessageHandler(filters.TEXT & ~filters.COMMAND, answer)]},
+            fallbacks=[], name='flow', persistent=persistence is not None))
+        await app.initialize()
+        pending = updates(app.bot)
+        flush_times = []
+        began = time.perf_counter()
+        for i, update in enumerate(pending, 1):
+            await app.process_update(update)
+            if persistence is not None and i % flush_every == 0:
+                flush_began = time.perf_counter()
+                await app.update_persistence()
+                await persistence.flush()
+                flush_times.append((time.perf_counter() - flush_began) * 1000)
+        elapsed = time.perf_counter() - began
+        await app.shutdown()
+        return {'per_second': len(pending) / elapsed, 'updates': len(pending), 'flush_times': flush_times}
+
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegramServer() as server:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'persistence.db')))
+        for name, persistence in (('persistence 없음', None), ('SQLitePersistence', SQLitePersistence(db, update_interval=3600))):
+            stats = asyncio.run(run(server, persistence))
+            line = f"  {name:18s} {stats['updates']:,}건  {stats['per_second']:8.0f}건/초"
+            if stats['flush_times']:
+                line += (f"  저장 {len(stats['flush_times'])}회 p50={percentile(stats['flush_times'], 50):6.1f}ms"
+                         f"  쓰기 트랜잭션 {persistence.writes}회")
+            print(line)
+        db.close()
+
+def _echo_app(base_url: str, primary: bool):
+    """확장 실행 벤치마크용 워커 Application (받은 글을 되돌려 보냄)"""
+    from telegram.ext import Application, MessageHandler, filters
+
+    async def echo(update, context):
+        await update.message.reply_text(update.message.text)
+
+    app = Application.builder().token("123:TEST").base_url(base_url).updater(None).build()
+    app.add_handler(MessageHandler(filters.TEXT, echo))
+    return app
+
+def bench_scale_out(updates: int = 3000, users: int = 200, worker_counts=(1, 2, 4)):
+    """리더 1개 + 워커 N개 처리량 (가짜 텔레그램 서버로 getUpdates → 워커 분배 → sendMessage)"""
+    import functools
+    from scale_out import ScaleOutRunner
+    print(f"\n⏱️ 확장 실행 벤치마크 (업데이트 {updates:,}건, 사용자 {users}명, CPU {os.cpu_count()}개)")
+
+    async def run(server: FakeTelegramServer, path: str, workers: int) -> float:
+        db = AsyncDatabase(Database(path))
+        runner = ScaleOutRunner(functools.partial(_echo_app, server.base_url), db, workers=workers,
+                                token=server.token, base_url=server.base_url, poll_timeout=0.5)
+        stop = asyncio.Event()
+        task = asyncio.create_task(runner.serve(stop))
+        while not runner.is_leader:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(3.0)  # 워커 프로세스 시작 대기
+        sent_before = sum(1 for call in server.calls if call[0] == 'sendMessage')
+        began = time.perf_counter()
+        for i in range(updates):
+            message = {'message_id': i + 1, 'date': int(time.time()), 'text': f"메시지 {i}",
+                       'chat': {'id': i % users + 1, 'type': 'private'},
+                       'from': {'id': i % users + 1, 'is_bot': False, 'first_name': 'u'}}
+            server.add_update({'update_id': i + 1, 'message': message})
+        while sum(1 for call in server.calls if call[0] == 'sendMessage') - sent_before < updates:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - began
+        stop.set()
+        await task
+        db.close()
+        return updates / elapsed
+
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as tmp, FakeTelegramServer() as server:
+            per_second = asyncio.run(run(server, os.path.join(tmp, 'scale_out.db'), workers))
+        print(f"  워커 {workers}개  {per_second:8.0f}건/초")
+
+def _webhook_instance(base_url: str, concurrency: int, ports):
+    """webhook 벤치마크용 봇 인스턴스 프로세스 (받은 글을 되돌려 보냄, 열린 포트를 ports로 알림)"""
+    from telegram.ext import Application, MessageHandler, filters
+    from webhook_server import WebhookIngress
+    from update_processor import PerUserUpdateProcessor
+
+    async def echo(update, context):
+        await update.message.reply_text(update.message.text)
+
+    async def main():
+        app = (Application.builder().token("123:TEST").base_url(base_url).updater(None)
+               .concurrent_updates(PerUserUpdateProcessor(concurrency)).build())
+        app.add_handler(MessageHandler(filters.TEXT, echo))
+        await app.initialize()
+        ingress = WebhookIngress(app, "secret", metrics_token="metrics")
+        await ingress.start("127.0.0.1", 0)
+        ports.put(ingress.port)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+async def replay_webhook_updates(url: str, secret: str, metrics_token: str, updates: int, users: int, concurrency: int,
+                                 first_update_id: int = 1) -> Dict:
+    """합성 업데이트를 webhook 주소로 동시에 보내고 /metrics로 모두 처리될 때까지 기다림 (503은 텔레그램처럼 잠시 후 재전송)"""
+    import httpx
+    from webhook_server import SECRET_HEADER
+    metrics_url = str(httpx.URL(url).copy_with(path='/metrics'))
+    metrics_headers = {'Authorization': f"Bearer {metrics_token}"}
+    ack_times: List[float] = []
+    shed = 0
+    pending = iter(range(first_update_id, first_update_id + updates))
+
+    async with httpx.AsyncClient(headers={SECRET_HEADER: secret}, timeout=30.0,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        processed_before = (await client.get(metrics_url, headers=metrics_headers)).json()['processed']
+
+        async def sender():
+            nonlocal shed
+            for update_id in pending:
+                user_id = update_id % users + 1
+                body = {'update_id': update_id, 'message': {
+                    'message_id': update_id, 'date': int(time.time()), 'text': f"메시지 {update_id}",
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': 'u'}}}
+                while True:
+                    began = time.perf_counter()
+                    response = await client.post(url, json=body)
+                    ack_times.append((time.perf_counter() - began) * 1000)
+                    if response.status_code != 503:
+                        break
+                    shed += 1
+                    await asyncio.sleep(0.05)
+
+        began = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+        acked = time.perf_counter() - began
+        while True:
+            metrics = (await client.get(metrics_url, headers=metrics_headers)).json()
+            if metrics['processed'] - processed_before >= updates:
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - began
+    return {'acked_per_second': updates / acked, 'processed_per_second': updates / elapsed, 'shed': shed,
+            'ack_p50_ms': percentile(ack_times, 50), 'ack_p99_ms': percentile(ack_times, 99),
+            'wait_p99_ms': metrics['wait_p99_ms']}
+
+def bench_webhook(updates: int = 2000, users: int = 500, concurrency: int = 40, processor_limits=(1, 8),
+                  latency: float = 0.05):
+    """webhook 수신 처리량 (기본: 응답 지연 latency초인 가짜 텔레그램 서버로 답장하는 로컬 인스턴스,
+    WEBHOOK_LOADGEN_URL/WEBHOOK_SECRET_TOKEN/METRICS_TOKEN을 주면 실행 중인 봇으로 보냄)"""
+    print(f"\n⏱️ webhook 수신 벤치마크 (업데이트 {updates:,}건, 사용자 {users}명, 동시 연결 {concurrency}개, "
+          f"텔레그램 응답 지연 {latency * 1000:.0f}ms)")
+
+    def report(name: str, stats: Dict):
+        print(f"  {name:10s} 처리 {stats['processed_per_second']:7.0f}건/초  응답 {stats['acked_per_second']:7.0f}건/초  "
+              f"응답 p50={stats['ack_p50_ms']:6.2f}ms p99={stats['ack_p99_ms']:6.2f}ms  "
+              f"503 재전송 {stats['shed']}회  큐 대기 p99={stats['wait_p99_ms']:7.1f}ms")
+
+    target = os.getenv('WEBHOOK_LOADGEN_URL')
+    if target:
+        report("대상 서버", asyncio.run(replay_webhook_updates(target, os.getenv('WEBHOOK_SECRET_TOKEN', ''),
+                                                              os.getenv('METRICS_TOKEN', ''), updates, users, concurrency,
+                                                              first_update_id=int(time.time()))))
+        return
+
+    for limit in processor_limits:
+        # 봇 인스턴스는 별도 프로세스 (부하 생성기/가짜 텔레그램 서버와 GIL을 나눠 쓰지 않도록)
+        context = multiprocessing.get_context('spawn')
+        ports = context.Queue()
+        with FakeTelegramServer() as server:
+            server.latency = latency
+            instance = context.Process(target=_webhook_instance, args=(server.base_url, limit, ports), daemon=True)
+            instance.start()
+            try:
+                url = f"http://127.0.0.1:{ports.get(timeout=60)}/telegram"
+                report(f"동시 {limit}개", asyncio.run(replay_webhook_updates(url, "secret", "metrics", updates, users, concurrency)))
+            finally:
+                instance.terminate()
+                instance.join()
+
+def bench_update_processor(users: int = 200, per_user: int = 5, slow_updates: int = 3, slow_seconds: float = 2.0,
+                           latency: float = 0.02):
+    """오래 걸리는 요청이 섞인 부하에서 다른 사용자의 응답 시간: 순차 처리(기본) vs PerUserUpdateProcessor"""
+    from telegram import Update
+    from telegram.ext import Application, MessageHandler, filters
+    from update_processor import PerUserUpdateProcessor
+    print(f"\n⏱️ 업데이트 처리 방식 벤치마크 (사용자 {users}명 x {per_user}건 + {slow_seconds:.0f}초 걸리는 요청 {slow_updates}건, "
+          f"텔레그램 응답 지연 {latency * 1000:.0f}ms)")
+
+    async def run(server: FakeTelegramServer, concurrent_updates) -> Dict:
+        finished: Dict[int, float] = {}
+
+        async def handle(update, context):
+            if update.message.text == "slow":
+                await asyncio.sleep(slow_seconds)  # /ai_pattern_analysis 같은 오래 걸리는 요청
+            await update.message.reply_text("ok")
+            finished[update.update_id] = time.perf_counter()
+
+        app = (Application.builder().token(server.token).base_url(server.base_url).updater(None)
+               .concurrent_updates(concurrent_updates).build())
+        app.add_handler(MessageHandler(filters.TEXT, handle))
+        pending = []
+        for step in range(per_user):
+            for user_id in range(1, users + 1):
+                text = "slow" if user_id == 1 and step < slow_updates else "view"
+                message = {'message_id': len(pending) + 1, 'date': int(time.time()), 'text': text,
+                           'chat': {'id': user_id, 'type': 'private'},
+                           'from': {'id': user_id, 'is_bot': False, 'first_name': 'u'}}
+                pending.append({'update_id': len(pending) + 1, 'message': message})
+        async with app:
+            await app.start()
+            began = time.perf_counter()
+            for data in pending:
+                await app.update_queue.put(Update.de_json(data, app.bot))
+            while len(finished) < len(pending):
+                await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - began
+            await app.stop()
+        # 느린 사용자(1번)를 뺀 나머지 사용자의 완료 시간
+        others = [(finished[data['update_id']] - began) * 1000 for data in pending if data['message']['chat']['id'] != 1]
+        return {'per_second': len(pending) / elapsed, 'p50': percentile(others, 50), 'p99': percentile(others, 99)}
+
+    for name, concurrent_updates in (("순차 처리(기본)", False), ("사용자별 동시(32)", PerUserUpdateProcessor(32))):
+        with FakeTelegramServer() as server:
+            server.latency = latency
+            stats = asyncio.run(run(server, concurrent_updates))
+        print(f"  {name:14s} {stats['per_second']:7.0f}건/초  다른 사용자 완료 p50={stats['p50']:8.0f}ms  p99={stats['p99']:8.0f}ms")
+
+def bench_outbox(users: int = 300, latency: float = 0.05, rates=(NOTIFY_GLOBAL_RATE, 1000)):
+    """응답 두 개를 보내는 동작(일정 수정/삭제/완료)을 사용자들이 동시에 할 때: 바로 전송 vs MessageOutbox"""
+    from outbox import MessageOutbox
+    print(f"\n⏱️ 응답 전송 벤치마크 (사용자 {users}명이 동시에 응답 2개짜리 동작, 텔레그램 응답 지연 {latency * 1000:.0f}ms)")
+
+    async def run(server: FakeTelegramServer, rate: float, outbox: bool) -> Dict:
+        request = HTTPXRequest(connection_pool_size=NOTIFY_CONCURRENCY)
+        async with Bot(server.token, base_url=server.base_url, request=request) as bot:
+            sender = MessageOutbox(rate=rate) if outbox else None
+            bucket = TokenBucket(rate * 60, burst=rate)  # 바로 전송도 같은 전체 한도를 지킨다고 가정
+            done: List[float] = []
+
+            async def action(chat_id: int):
+                began = time.perf_counter()
+                if sender is not None:
+                    await sender.send(bot, chat_id, "✅ 일정이 성공적으로 수정되었습니다!", wait=False)
+                    await sender.send(bot, chat_id, f"🔔 '일정 {chat_id}' 일정이 수정되었습니다.")
+                else:
+                    for text in ("✅ 일정이 성공적으로 수정되었습니다!", f"🔔 '일정 {chat_id}' 일정이 수정되었습니다."):
+                        await bucket.acquire(1)
+                        await bot.send_message(chat_id=chat_id, text=text)
+                done.append((time.perf_counter() - began) * 1000)
+
+            calls = len(server.calls)
+            began = time.perf_counter()
+            await asyncio.gather(*(action(chat_id) for chat_id in range(1, users + 1)))
+            elapsed = time.perf_counter() - began
+            return {'requests': len(server.calls) - calls, 'elapsed': elapsed,
+                    'p50': percentile(done, 50), 'p99': percentile(done, 99)}
+
+    for rate in rates:
+        for name, outbox in (("바로 전송", False), ("outbox", True)):
+            with FakeTelegramServer() as server:
+                server.latency = latency
+                stats = asyncio.run(run(server, rate, outbox))
+            print(f"  초당 {rate:4d}건 한도 {name:8s} 요청 {stats['requests']:4d}건  {stats['elapsed']:6.2f}초  "
+                  f"완료 p50={stats['p50']:7.0f}ms  p99={stats['p99']:7.0f}ms")
+
+BENCHMARKS = {
+    'async_database': bench_async_database,
+    'routine_completions': bench_routine_completions,
+    'image_prep': bench_image_prep,
+    'notifications': bench_notifications,
+    'search': bench_search,
+    'embeddings': bench_embeddings,
+    'prompts': bench_prompts,
+    'persistence': bench_persistence,
+    'scale_out': bench_scale_out,
+    'webhook': bench_webhook,
+    'update_processor': bench_update_processor,
+    'outbox': bench_outbox,
+}
+
+def main():
+    """메인 벤치마크 함수"""
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ 알 수 없는 벤치마크: {name} (가능: {', '.join(BENCHMARKS)})")
+            continue
+        BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,26 @@ import sqlite3
 import pytz
 import random
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import secrets
+from typing import Optional
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Voice, PhotoSize
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, ConversationHandler
-from database import Database
+from database import AsyncDatabase
 from ai_helper import AIHelper
-from config import BOT_TOKEN, COMMANDS, DAILY_PROMPTS, WEEKLY_PROMPTS, MONTHLY_PROMPTS, AI_REFLECTION_PROMPTS, MOTIVATIONAL_QUOTES, COMPLETION_MESSAGES
+from ai_cache import ResponseCache
+from media_pipeline import MediaPipeline, MediaTooLargeError
+from streaming import StreamingReply
+from task_queue import TaskQueue
+from notifier import NotificationDispatcher
+from outbox import MessageOutbox
+from embedding_index import ReflectionMemory, format_reflection_line
+from timeutil import local_now, normalize_timezone
+from conversation_store import ConversationStore
+from persistence import SQLitePersistence
+from webhook_server import run_webhook
+from update_processor import PerUserUpdateProcessor
+from config import BOT_TOKEN, COMMANDS, DAILY_PROMPTS, WEEKLY_PROMPTS, MONTHLY_PROMPTS, AI_REFLECTION_PROMPTS, MOTIVATIONAL_QUOTES, COMPLETION_MESSAGES, NOTIFY_MORNING_TIME, NOTIFY_GLOBAL_RATE, SEARCH_PAGE_SIZE, VIEW_PAGE_SIZE, VIEW_PREVIEW_CHARS, EMBEDDING_INDEX_PATH
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, METRICS_LOG_INTERVAL, METRICS_TOKEN
 
 # 로깅 설정
 logging.basicConfig(
@@ -22,10 +37,10 @@ WAITING_SCHEDULE_TITLE, WAITING_SCHEDULE_DESC, WAITING_SCHEDULE_DATE, WAITING_SC
 WAITING_DAILY_FACT, WAITING_DAILY_THINK, WAITING_DAILY_TODO = range(4, 7)
 WAITING_WEEKLY_FACT, WAITING_WEEKLY_THINK, WAITING_WEEKLY_TODO, WAITING_WEEKLY_TODO_FINAL = range(7, 11)
 WAITING_MONTHLY_FACT, WAITING_MONTHLY_THINK, WAITING_MONTHLY_TODO, WAITING_MONTHLY_TODO_FINAL = range(11, 15)
-WAITING_FEEDBACK = range(15, 16)
+WAITING_FEEDBACK = 15  # 상태가 하나인 흐름은 정수 (대화 상태를 JSON으로 저장)
 WAITING_EDIT_TITLE, WAITING_EDIT_DESC, WAITING_EDIT_DATE, WAITING_EDIT_TIME = range(16, 20)
-WAITING_AI_REFLECTION = range(20, 21)
-WAITING_CHATGPT = range(21, 22)
+WAITING_AI_REFLECTION = 20
+WAITING_CHATGPT = 21
 WAITING_ROUTINE_TITLE, WAITING_ROUTINE_DESC, WAITING_ROUTINE_FREQ, WAITING_ROUTINE_DAYS, WAITING_ROUTINE_DATE, WAITING_ROUTINE_TIME = range(22, 28)
 WAITING_VOICE_REFLECTION, WAITING_IMAGE_REFLECTION = range(28, 30)
 WAITING_EDIT_SELECT, WAITING_EDIT_FIELD, WAITING_EDIT_VALUE = range(30, 33)
@@ -33,11 +48,89 @@ WAITING_DELETE_SELECT, WAITING_DELETE_CONFIRM = range(33, 35)
 WAITING_COMPLETE_SELECT = 35
 
 class ScheduleBot:
-    def __init__(self):
-        self.db = Database()
-        self.ai_helper = AIHelper()
-        self.user_states = {}  # 사용자별 상태 저장
-        self.ai_conversations = {}  # AI 대화 히스토리 저장
+    def __init__(self, send_rate: float = NOTIFY_GLOBAL_RATE, notify_rate: Optional[float] = None):
+        self.db = AsyncDatabase()
+        self.ai_helper = AIHelper(cache=ResponseCache(self.db))  # 반복 분석 요청은 캐시 응답 사용
+        self.ai_conversations = ConversationStore(self.db)  # AI 대화 히스토리 저장 (턴 수/메모리 제한)
+        self.jobs = TaskQueue(self.db)  # 오래 걸리는 AI 분석은 백그라운드에서 처리 후 결과 전송
+        self.jobs.register('routine_analysis', self._job_routine_analysis)
+        self.jobs.register('ai_pattern_analysis', self._job_ai_pattern_analysis)
+        self.jobs.register('ai_schedule_summary', self._job_ai_schedule_summary)
+        self.jobs.register('weekly_report', self._job_weekly_report)  # batch_analysis.py가 저장한 주간 리포트 전달
+        self.media = MediaPipeline(self.ai_helper)  # 음성/이미지는 메모리로 받아 바로 분석
+        self.jobs.register('voice_reflection', self._job_voice_reflection)
+        self.jobs.register('image_reflection', self._job_image_reflection)
+        self.outbox = MessageOutbox(rate=send_rate)  # 이어서 보내는 응답은 한 메시지로 합치고 전송 한도 안에서 전송
+        # 매 분 발송 시각이 된 아침 알림 전송 (notify_rate가 없으면 응답 전송과 전체 전송 한도 공유)
+        if notify_rate is None:
+            self.notifier = NotificationDispatcher(self.db, bucket=self.outbox.bucket)
+        else:
+            self.notifier = NotificationDispatcher(self.db, rate=notify_rate)
+        # 회고 임베딩 색인 (numpy가 없으면 None, 패턴 분석에 관련 과거 회고를 함께 넣음)
+        self.memory = ReflectionMemory.create(self.db, EMBEDDING_INDEX_PATH, self.ai_helper.client, self.ai_helper.executor)
+    
+    async def post_init(self, application: Application):
+        """애플리케이션 시작 시 백그라운드 작업 워커와 알림 발송 실행"""
+        await self.jobs.start(application.bot)
+        await self.notifier.start(application)
+        if self.memory is not None:
+            self.memory.notify()  # 꺼져 있던 동안 추가/수정된 회고 색인
+    
+    async def post_shutdown(self, application: Application):
+        """애플리케이션 종료 시 워커 정리"""
+        await self.notifier.stop()
+        await self.jobs.stop()
+        await self.media.close()
+        await self.flush(application)
+
+    async def flush(self, application: Application):
+        """남은 응답을 모두 보내고(전송 지표는 로그로) 모아 둔 대화 기록을 저장"""
+        await self.outbox.close()
+        print(f"📤 응답 전송 지표: {self.outbox.stats()}")
+        await self.ai_conversations.close()
+    
+    def metrics(self) -> dict:
+        """운영 지표 (webhook 서버의 /metrics에 함께 내보냄)"""
+        return {
+            'outbox': self.outbox.stats(),  # 응답 전송 지연, 대기열 길이
+            'notifications': self.notifier.stats(),  # 아침 알림 발송 처리/전송 수
+            'prompts': self.ai_helper.prompt_stats(),  # AI 메서드별 프롬프트 토큰 수
+        }
+
+    def log_metrics(self, application: Application, interval: float = METRICS_LOG_INTERVAL):
+        """/metrics가 없는 polling/확장 모드에서 처리 지표와 운영 지표를 주기적으로 로그에 남김"""
+        if interval <= 0:
+            return
+        if application.job_queue is None:
+            print("⚠️ JobQueue를 사용할 수 없어 처리 지표를 로그로 남기지 않습니다. (pip install \"python-telegram-bot[job-queue]\")")
+            return
+        application.job_queue.run_repeating(self._log_metrics_job, interval=interval, first=interval,
+                                            name='metrics_log')
+
+    async def _log_metrics_job(self, context: ContextTypes.DEFAULT_TYPE):
+        metrics = self.metrics()
+        processor_stats = getattr(context.application.update_processor, 'stats', None)
+        if processor_stats is not None:
+            metrics['update_processor'] = processor_stats()
+        print(f"📊 처리 지표 (pid {os.getpid()}): {metrics}")
+
+    async def _enqueue_ai_job(self, update: Update, command: str, started_text: str):
+        """AI 작업을 대기열에 넣고 바로 응답 (결과는 완료 후 별도 메시지로 전송)"""
+        job_id = await self.jobs.enqueue(update.effective_user.id, update.effective_chat.id, command)
+        if job_id is None:
+            await update.message.reply_text("❌ 분석 요청을 등록하지 못했습니다. 잠시 후 다시 시도해주세요.")
+        elif job_id == 0:
+            await update.message.reply_text("⏳ 이미 같은 분석을 진행하고 있습니다. 결과가 준비되면 보내드릴게요.")
+        else:
+            await update.message.reply_text(started_text)
+    
+    async def _reply(self, update: Update, text: str, wait: bool = True) -> bool:
+        """outbox로 응답 (wait=False면 넣기만 하고, 바로 이어서 보내는 메시지와 한 메시지로 합쳐짐)"""
+        return await self.outbox.send(update.get_bot(), update.effective_chat.id, text, wait=wait)
+
+    async def _today(self, user_id: int) -> str:
+        """사용자 시간대 기준 오늘 날짜"""
+        return local_now(await self.db.get_user_timezone(user_id)).strftime('%Y-%m-%d')
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """봇 시작 명령어"""
@@ -82,7 +175,7 @@ class ScheduleBot:
 
 2️⃣ **일정 관리**
 - `/add_schedule` : 새로운 일정을 추가합니다. (대화형 입력)
-- `/view_schedule` : 오늘의 일정을 확인합니다.
+- `/view_schedule` : 오늘 이후 일정을 페이지 단위로 확인합니다. (특정 날짜: `/view_schedule 2024-06-01`)
 - `/edit_schedule` : 일정을 수정합니다. (목록에서 선택)
 - `/delete_schedule` : 일정을 삭제합니다. (목록에서 선택)
 - `/complete_schedule` : 일정을 완료 처리하고 응원 메시지를 받아보세요.
@@ -102,9 +195,11 @@ class ScheduleBot:
 - `/voice_reflection` : 음성 회고 (음성 메시지 → AI 분석)
 - `/image_reflection` : 이미지 회고 (이미지 → AI 분석)
 - `/view_reflections` : 전체 회고 목록 보기
+- `/search` : 회고 검색 (예: `/search 운동`)
 
 5️⃣ **기타**
 - `/motivate` : 랜덤 명언/동기부여 메시지 받기
+- `/timezone` : 시간대 확인/설정 (예: `/timezone America/New_York`)
 - `/help` : 이 도움말 다시 보기
 
 ---
@@ -130,8 +225,7 @@ class ScheduleBot:
         """
         일정 추가 대화 시작 - UX 개선 (HTML 안내, 예시, 입력 유도)
         """
-        user_id = update.effective_user.id
-        self.user_states[user_id] = {'step': 1, 'data': {}}
+        context.user_data['schedule'] = {}
         await update.message.reply_text(
             '🗓️ <b>일정 추가를 시작합니다!</b>\n\n날짜를 입력해주세요.\n예시: <code>2024-07-01</code>',
             parse_mode='HTML'
@@ -142,9 +236,8 @@ class ScheduleBot:
         try:
             if not update.effective_user or not update.message:
                 return ConversationHandler.END
-            user_id = update.effective_user.id
             title = update.message.text
-            self.user_states[user_id] = {'title': title}
+            context.user_data['schedule'] = {'title': title}
             await update.message.reply_text("📄 일정에 대한 설명을 입력해주세요 (선택사항):")
             return WAITING_SCHEDULE_DESC
         except Exception as e:
@@ -156,9 +249,8 @@ class ScheduleBot:
         try:
             if not update.effective_user or not update.message:
                 return ConversationHandler.END
-            user_id = update.effective_user.id
             description = update.message.text
-            self.user_states[user_id]['description'] = description
+            context.user_data.setdefault('schedule', {})['description'] = description
             await update.message.reply_text("📅 일정 날짜를 입력해주세요 (YYYY-MM-DD 형식):")
             return WAITING_SCHEDULE_DATE
         except Exception as e:
@@ -170,11 +262,10 @@ class ScheduleBot:
         try:
             if not update.effective_user or not update.message:
                 return ConversationHandler.END
-            user_id = update.effective_user.id
             date_text = update.message.text
             try:
                 datetime.datetime.strptime(date_text, '%Y-%m-%d')
-                self.user_states[user_id]['date'] = date_text
+                context.user_data.setdefault('schedule', {})['date'] = date_text
                 await update.message.reply_text("⏰ 일정 시간을 입력해주세요 (HH:MM 형식, 선택사항):")
                 return WAITING_SCHEDULE_TIME
             except ValueError:
@@ -197,8 +288,8 @@ class ScheduleBot:
                     time = time_text
                 else:
                     time = None
-                state = self.user_states[user_id]
-                success = self.db.add_schedule(
+                state = context.user_data.get('schedule', {})
+                success = await self.db.add_schedule(
                     user_id=user_id,
                     title=state['title'],
                     description=state['description'],
@@ -206,11 +297,12 @@ class ScheduleBot:
                     time=time
                 )
                 if success:
+                    # 일정을 추가한 사용자는 매일 아침 알림을 받음
+                    await self.db.ensure_morning_notification(user_id, NOTIFY_MORNING_TIME, "오늘의 일정 알림")
                     await update.message.reply_text("✅ 일정이 성공적으로 추가되었습니다!")
                 else:
                     await update.message.reply_text("❌ 일정 추가 중 오류가 발생했습니다.")
-                if user_id in self.user_states:
-                    del self.user_states[user_id]
+                context.user_data.pop('schedule', None)
                 return ConversationHandler.END
             except ValueError:
                 await update.message.reply_text("❌ 잘못된 시간 형식입니다. HH:MM 형식으로 입력해주세요.")
@@ -222,22 +314,104 @@ class ScheduleBot:
     
     async def view_schedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
-        일정 조회 UX 개선 (입력 유도)
+        일정 조회 (/view_schedule 2024-06-01은 해당 날짜, 날짜 없이 입력하면 오늘부터 페이지 단위로)
         """
         user_id = update.effective_user.id
-        self.user_states[user_id] = {'view': True}
-        await update.message.reply_text(
-            '조회할 날짜를 입력해주세요. (예: 2024-06-01, "전체" 입력 시 모든 일정)',
-            parse_mode='HTML'
-        )
-        return WAITING_SCHEDULE_DATE
+        if context.args:
+            date = context.args[0]
+            try:
+                datetime.datetime.strptime(date, '%Y-%m-%d')
+            except ValueError:
+                await update.message.reply_text("❌ 잘못된 날짜 형식입니다. 예: /view_schedule 2024-06-01")
+                return
+            schedules = await self.db.get_schedules(user_id, date)
+            if not schedules:
+                await update.message.reply_text(f"📅 {date}에 등록된 일정이 없습니다.")
+                return
+            lines = [f"📅 {date} 일정"] + [self._schedule_line(s) for s in schedules]
+            await update.message.reply_text("\n".join(lines))
+            return
+        # 오늘 이후 일정부터 (없으면 지난 일정)
+        start = (await self._today(user_id), None, 0)
+        page = await self.db.get_schedules_page(user_id, start, 'next', VIEW_PAGE_SIZE)
+        if not page['items']:
+            page = await self.db.get_schedules_page(user_id, start, 'prev', VIEW_PAGE_SIZE)
+        if not page['items']:
+            await update.message.reply_text("등록된 일정이 없습니다. /add_schedule 로 추가해보세요!")
+            return
+        text, markup = self._schedules_page_message(page)
+        await update.message.reply_text(text, reply_markup=markup)
+    
+    async def view_reflections(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        회고 목록 (최신순, 페이지 단위)
+        """
+        page = await self.db.get_reflections_page(update.effective_user.id, None, 'older', VIEW_PAGE_SIZE)
+        if not page['items']:
+            await update.message.reply_text("작성한 회고가 없습니다. /daily_reflection 으로 시작해보세요!")
+            return
+        text, markup = self._reflections_page_message(page)
+        await update.message.reply_text(text, reply_markup=markup)
+    
+    async def page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """목록의 이전/다음 버튼 처리 (callback_data: 'page:종류:방향:기준 항목')"""
+        query = update.callback_query
+        await query.answer()
+        try:
+            _, kind, direction, key = query.data.split(':', 3)
+            first, second, item_id = key.split('|')
+            cursor = (first, None if second == '-' else second, int(item_id))
+        except ValueError:
+            return
+        user_id = query.from_user.id
+        if kind == 'r':
+            page = await self.db.get_reflections_page(user_id, cursor, direction, VIEW_PAGE_SIZE)
+            render = self._reflections_page_message
+        else:
+            page = await self.db.get_schedules_page(user_id, cursor, direction, VIEW_PAGE_SIZE)
+            render = self._schedules_page_message
+        if not page['items']:
+            await query.edit_message_text("더 이상 항목이 없습니다.")
+            return
+        text, markup = render(page)
+        await query.edit_message_text(text, reply_markup=markup)
+    
+    def _schedule_line(self, schedule: dict) -> str:
+        done = "✅" if schedule.get('is_done') else "⬜"
+        return f"{done} {schedule['date']} {schedule['time'] or ''} {schedule['title']}".replace('  ', ' ')
+    
+    def _page_buttons(self, kind: str, page: dict, back: str, forward: str, labels: tuple, key):
+        """앞/뒤 페이지 버튼 (callback_data는 텔레그램 제한 64바이트 안에 들도록 기준 항목 키만 담음)"""
+        items = page['items']
+        buttons = []
+        if page[f"has_{back}"]:
+            buttons.append(InlineKeyboardButton(labels[0], callback_data=f"page:{kind}:{back}:{key(items[0])}"))
+        if page[f"has_{forward}"]:
+            buttons.append(InlineKeyboardButton(labels[1], callback_data=f"page:{kind}:{forward}:{key(items[-1])}"))
+        return InlineKeyboardMarkup([buttons]) if buttons else None
+    
+    def _schedules_page_message(self, page: dict):
+        lines = ["📅 일정 목록"] + [self._schedule_line(s) for s in page['items']]
+        markup = self._page_buttons('s', page, 'prev', 'next', ("◀ 이전 일정", "다음 일정 ▶"),
+                                    lambda s: f"{s['date']}|{s['time'] or '-'}|{s['id']}")
+        return "\n".join(lines), markup
+    
+    def _reflections_page_message(self, page: dict):
+        lines = ["📖 회고 목록"]
+        for reflection in page['items']:
+            content = reflection['content']
+            if len(content) > VIEW_PREVIEW_CHARS:
+                content = content[:VIEW_PREVIEW_CHARS] + "…"
+            lines.append(f"\n📅 {reflection['date']} ({reflection['type']})\n{content}")
+        markup = self._page_buttons('r', page, 'newer', 'older', ("◀ 최근 회고", "이전 회고 ▶"),
+                                    lambda r: f"{r['date']}|{r['created_at']}|{r['id']}")
+        return "\n".join(lines), markup
     
     async def daily_reflection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         일일 회고 UX 개선 (입력 유도)
         """
-        user_id = update.effective_user.id
-        self.user_states[user_id] = {'reflection': True}
+        context.user_data['reflection'] = {}
         await update.message.reply_text(
             '오늘 하루를 돌아보며 회고를 작성해주세요.',
             parse_mode='HTML'
@@ -273,12 +447,14 @@ class ScheduleBot:
             if not update.effective_user or not update.message:
                 return ConversationHandler.END
             user_id = update.effective_user.id
-            today = datetime.datetime.now().strftime('%Y-%m-%d')
+            today = await self._today(user_id)
             context.user_data['reflection']['todo'] = update.message.text
             r = context.user_data['reflection']
             content = f"[사실] {r['fact']}\n[생각] {r['think']}\n[실천] {r['todo']}"
-            success = self.db.add_reflection(user_id, 'daily', content, today)
+            success = await self.db.add_reflection(user_id, 'daily', content, today)
             if success:
+                if self.memory is not None:
+                    self.memory.notify()
                 await update.message.reply_text("✅ 오늘의 T형 회고가 저장되었습니다!")
             else:
                 await update.message.reply_text("❌ 회고 저장 중 오류가 발생했습니다.")
@@ -292,10 +468,8 @@ class ScheduleBot:
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             user_id = update.effective_user.id
-            if user_id in self.user_states:
-                del self.user_states[user_id]
-            if user_id in self.ai_conversations:
-                del self.ai_conversations[user_id]
+            context.user_data.clear()  # 진행 중이던 입력 흐름 데이터
+            await self.ai_conversations.clear(user_id)
             await update.message.reply_text("❌ 작업이 취소되었습니다.")
             return ConversationHandler.END
         except Exception as e:
@@ -308,8 +482,6 @@ class ScheduleBot:
         """
         일정 수정 UX 개선 (입력 유도)
         """
-        user_id = update.effective_user.id
-        self.user_states[user_id] = {'step': 1, 'data': {}}
         await update.message.reply_text(
             '수정할 일정의 날짜를 입력해주세요. (예: 2024-06-01)',
             parse_mode='HTML'
@@ -355,10 +527,10 @@ class ScheduleBot:
             new_date = value
         elif field == 'time':
             new_time = value
-        success = self.db.update_schedule(selected['id'], selected['user_id'], new_title, new_desc, new_date, new_time)
+        success = await self.db.update_schedule(selected['id'], selected['user_id'], new_title, new_desc, new_date, new_time)
         if success:
-            await update.message.reply_text("✅ 일정이 성공적으로 수정되었습니다!")
-            await update.message.reply_text(f"🔔 '{new_title}' 일정이 수정되었습니다.")
+            await self._reply(update, "✅ 일정이 성공적으로 수정되었습니다!", wait=False)
+            await self._reply(update, f"🔔 '{new_title}' 일정이 수정되었습니다.")
         else:
             await update.message.reply_text("❌ 일정 수정 중 오류가 발생했습니다.")
         context.user_data.pop('edit_schedules', None)
@@ -371,8 +543,6 @@ class ScheduleBot:
         """
         일정 삭제 UX 개선 (입력 유도)
         """
-        user_id = update.effective_user.id
-        self.user_states[user_id] = {'step': 1, 'data': {}}
         await update.message.reply_text(
             '삭제할 일정의 날짜를 입력해주세요. (예: 2024-06-01)',
             parse_mode='HTML'
@@ -397,10 +567,10 @@ class ScheduleBot:
         answer = update.message.text.strip().lower()
         selected = context.user_data['delete_selected']
         if answer == 'yes':
-            success = self.db.delete_schedule(selected['id'], selected['user_id'])
+            success = await self.db.delete_schedule(selected['id'], selected['user_id'])
             if success:
-                await update.message.reply_text("✅ 일정이 성공적으로 삭제되었습니다!")
-                await update.message.reply_text(f"🔔 '{selected['title']}' 일정이 삭제되었습니다.")
+                await self._reply(update, "✅ 일정이 성공적으로 삭제되었습니다!", wait=False)
+                await self._reply(update, f"🔔 '{selected['title']}' 일정이 삭제되었습니다.")
             else:
                 await update.message.reply_text("❌ 일정 삭제 중 오류가 발생했습니다.")
         else:
@@ -412,8 +582,8 @@ class ScheduleBot:
     # 일정 완료 대화 흐름
     async def complete_schedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        today = datetime.datetime.now().strftime('%Y-%m-%d')
-        schedules = self.db.get_schedules(user_id, today)
+        today = await self._today(user_id)
+        schedules = await self.db.get_schedules(user_id, today)
         incomplete = [s for s in schedules if not s.get('is_done')]
         if not incomplete:
             await update.message.reply_text("오늘 완료할 일정이 없습니다.")
@@ -433,16 +603,16 @@ class ScheduleBot:
                 await update.message.reply_text("잘못된 번호입니다. 다시 입력하세요.")
                 return WAITING_COMPLETE_SELECT
             selected = schedules[idx]
-            success = self.db.update_schedule_done(selected['id'], selected['user_id'])
+            success = await self.db.update_schedule_done(selected['id'], selected['user_id'])
             if success:
                 # AI 응원 메시지
                 if self.ai_helper.is_available():
                     msg = await self.ai_helper.get_completion_motivation(selected['title'])
                 else:
                     msg = f"🎉 '{selected['title']}' 일정 완료! 정말 수고하셨어요! 💪"
-                await update.message.reply_text(msg)
+                await self._reply(update, msg, wait=False)
                 # 알림 메시지
-                await update.message.reply_text(f"🔔 '{selected['title']}' 일정이 완료 처리되었습니다.")
+                await self._reply(update, f"🔔 '{selected['title']}' 일정이 완료 처리되었습니다.")
             else:
                 await update.message.reply_text("❌ 일정 완료 처리 중 오류가 발생했습니다.")
             context.user_data.pop('complete_schedules', None)
@@ -494,12 +664,12 @@ class ScheduleBot:
         routine = context.user_data['routine']
         routine['end_date'] = update.message.text.strip() if update.message.text.strip() else None
         await update.message.reply_text("루틴 시간을 입력하세요 (HH:MM, 선택):")
-        return self._save_routine(update, context)
+        return await self._save_routine(update, context)
 
     async def _save_routine(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         routine = context.user_data['routine']
         user_id = update.effective_user.id
-        success = self.db.add_routine(
+        success = await self.db.add_routine(
             user_id=user_id,
             title=routine['title'],
             description=routine.get('description', ''),
@@ -519,7 +689,7 @@ class ScheduleBot:
     # 루틴 전체 목록
     async def view_routines(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        routines = self.db.get_routines(user_id, active_only=False)
+        routines = await self.db.get_routines(user_id, active_only=False)
         if not routines:
             await update.message.reply_text("등록된 루틴이 없습니다.")
             return
@@ -531,7 +701,7 @@ class ScheduleBot:
     # 오늘의 루틴
     async def today_routines(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        routines = self.db.get_today_routines(user_id)
+        routines = await self.db.get_today_routines(user_id)
         if not routines:
             await update.message.reply_text("오늘 해당되는 루틴이 없습니다.")
             return
@@ -543,22 +713,27 @@ class ScheduleBot:
     # 루틴 분석 (AI)
     async def routine_analysis(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        routines = self.db.get_routines(user_id, active_only=True)
+        routines = await self.db.get_routines(user_id, active_only=True)
         if not routines:
             await update.message.reply_text("분석할 루틴이 없습니다.")
             return
         if self.ai_helper.is_available():
-            msg = await self.ai_helper.analyze_reflection_patterns(routines)
+            await self._enqueue_ai_job(update, 'routine_analysis', "🔄 루틴을 분석하고 있습니다. 결과가 준비되면 메시지로 보내드릴게요.")
         else:
-            msg = "AI 분석 기능이 비활성화되어 있습니다."
-        await update.message.reply_text(msg)
+            await update.message.reply_text("AI 분석 기능이 비활성화되어 있습니다.")
+
+    async def _job_routine_analysis(self, bot, job: dict) -> str:
+        routines = await self.db.get_routines(job['user_id'], active_only=True)
+        if not routines:
+            return "분석할 루틴이 없습니다."
+        return await self.ai_helper.analyze_reflection_patterns(routines)
 
     async def feedback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         최근 회고에 대한 F형(Feeling/Feedback/Forward) AI 피드백 제공
         """
         user_id = update.effective_user.id
-        reflections = self.db.get_reflections(user_id)
+        reflections = await self.db.get_reflections(user_id)
         if not reflections:
             await update.message.reply_text("최근 회고가 없습니다. 먼저 회고를 작성해 주세요.")
             return
@@ -580,7 +755,7 @@ class ScheduleBot:
         최근 회고에 대한 F형(Feeling/Feedback/Forward) AI 인사이트 제공
         """
         user_id = update.effective_user.id
-        reflections = self.db.get_reflections(user_id)
+        reflections = await self.db.get_reflections(user_id)
         if not reflections:
             await update.message.reply_text("최근 회고가 없습니다. 먼저 회고를 작성해 주세요.")
             return
@@ -602,40 +777,150 @@ class ScheduleBot:
         전체 회고 기록에 대한 AI 패턴 분석 결과를 제공합니다.
         """
         user_id = update.effective_user.id
-        reflections = self.db.get_reflections(user_id)
+        reflections = await self.db.get_reflections(user_id)
         if not reflections:
             await update.message.reply_text("분석할 회고가 없습니다. 먼저 회고를 작성해 주세요.")
             return
         if self.ai_helper.is_available():
-            analysis = await self.ai_helper.analyze_reflection_patterns(reflections)
+            await self._enqueue_ai_job(update, 'ai_pattern_analysis', "🔄 회고 패턴을 분석하고 있습니다. 결과가 준비되면 메시지로 보내드릴게요.")
         else:
-            analysis = "AI 분석 기능이 비활성화되어 있습니다."
-        await update.message.reply_text(f"📊 전체 회고 패턴 분석 결과:\n{analysis}")
+            await update.message.reply_text("📊 전체 회고 패턴 분석 결과:\nAI 분석 기능이 비활성화되어 있습니다.")
+
+    async def _job_ai_pattern_analysis(self, bot, job: dict) -> str:
+        reflections = await self.db.get_reflections(job['user_id'])
+        if not reflections:
+            return "분석할 회고가 없습니다. 먼저 회고를 작성해 주세요."
+        related = await self.memory.related(job['user_id'], reflections[:10]) if self.memory is not None else []
+        analysis = await self.ai_helper.analyze_reflection_patterns(reflections, related)
+        return f"📊 전체 회고 패턴 분석 결과:\n{analysis}"
 
     async def ai_schedule_summary(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         전체 일정 데이터에 대한 AI 요약/분석 결과를 제공합니다.
         """
         user_id = update.effective_user.id
-        schedules = self.db.get_schedules(user_id)
+        schedules = await self.db.get_schedules(user_id)
         if not schedules:
             await update.message.reply_text("분석할 일정이 없습니다. 먼저 일정을 추가해 주세요.")
             return
         if self.ai_helper.is_available():
-            summary = await self.ai_helper.get_schedule_summary(schedules)
+            await self._enqueue_ai_job(update, 'ai_schedule_summary', "🔄 일정을 분석하고 있습니다. 결과가 준비되면 메시지로 보내드릴게요.")
         else:
-            summary = "AI 분석 기능이 비활성화되어 있습니다."
-        await update.message.reply_text(f"📊 전체 일정 요약/분석 결과:\n{summary}")
+            await update.message.reply_text("📊 전체 일정 요약/분석 결과:\nAI 분석 기능이 비활성화되어 있습니다.")
+
+    async def _job_ai_schedule_summary(self, bot, job: dict) -> str:
+        schedules = await self.db.get_schedules(job['user_id'])
+        if not schedules:
+            return "분석할 일정이 없습니다. 먼저 일정을 추가해 주세요."
+        summary = await self.ai_helper.get_schedule_summary(schedules)
+        return f"📊 전체 일정 요약/분석 결과:\n{summary}"
+
+    async def _job_weekly_report(self, bot, job: dict) -> str:
+        # 전송에 성공한 뒤에 전달 기록 (실패하면 작업 재시도 때 다시 전송)
+        reports = await self.db.get_undelivered_reports(job['user_id'])
+        for report in reports:
+            await bot.send_message(
+                chat_id=job['chat_id'],
+                text=f"📊 주간 회고 패턴 리포트 ({report['period_start']} ~ {report['period_end']})\n\n{report['report']}"
+            )
+            await self.db.mark_reports_delivered([report['id']])
+        return ""
 
     async def motivate(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         랜덤 명언/동기부여 메시지 전송
         """
         quote = random.choice(MOTIVATIONAL_QUOTES)
-        await update.message.reply_text(f"💡 {quote}")
-        if self.ai_helper.is_available():
-            ai_msg = await self.ai_helper.get_motivational_message()
-            await update.message.reply_text(f"🤖 AI 동기부여: {ai_msg}")
+        if not self.ai_helper.is_available():
+            await self._reply(update, f"💡 {quote}")
+            return
+        # 명언은 먼저 대기열에 넣고 (AI 응답이 창 안에 오면 한 메시지로 합쳐짐)
+        await self._reply(update, f"💡 {quote}", wait=False)
+        ai_msg = await self.ai_helper.get_motivational_message()
+        await self._reply(update, f"🤖 AI 동기부여: {ai_msg}")
+
+    async def voice_reflection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """음성 회고 시작"""
+        user_id = update.effective_user.id
+        if await self.db.get_reflections(user_id, 'voice', await self._today(user_id)):
+            await update.message.reply_text("🎤 오늘 이미 음성 회고를 작성하셨습니다.")
+            return ConversationHandler.END
+        await update.message.reply_text("🎤 **음성 회고**\n\n음성 메시지를 보내주세요. AI가 음성을 텍스트로 변환하고 회고 내용을 분석해드립니다.")
+        return WAITING_VOICE_REFLECTION
+
+    async def handle_voice_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """음성 메시지 처리 (분석은 백그라운드 작업으로 넘기고 바로 응답)"""
+        if not self.ai_helper.is_available():
+            await update.message.reply_text("❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요.")
+            return ConversationHandler.END
+        job_id = await self.jobs.enqueue(update.effective_user.id, update.effective_chat.id, 'voice_reflection',
+                                         {'voice': update.message.voice.to_dict()})
+        if job_id is None:
+            await update.message.reply_text("❌ 음성 회고 분석을 등록하지 못했습니다. 잠시 후 다시 보내주세요.")
+        elif job_id == 0:
+            await update.message.reply_text("⏳ 이전 음성 회고를 아직 분석하고 있습니다. 결과가 준비되면 보내드릴게요.")
+        else:
+            await update.message.reply_text("🎤 음성을 분석하고 있습니다... 결과가 준비되면 메시지로 보내드릴게요.")
+        return ConversationHandler.END
+
+    async def _job_voice_reflection(self, bot, job: dict) -> str:
+        """음성을 메모리로 받아 텍스트 변환 후 분석하고 회고로 저장"""
+        voice = Voice.de_json(job['payload']['voice'], bot)
+        try:
+            result = await self.media.process_voice(bot, voice)
+        except MediaTooLargeError as e:
+            print(f"음성 처리 오류: {e}")
+            return "❌ 음성 메시지가 너무 깁니다. 더 짧게 나눠서 보내주세요."
+        print(f"음성 회고 처리 시간: {result['summary']}")
+        transcription = result['transcription']
+        if not transcription:
+            return "❌ 음성 인식에 실패했습니다. 다시 시도해주세요."
+        ai_analysis = result['analysis']
+        content = f"[음성 변환] {transcription}\n\n[AI 분석] {ai_analysis}"
+        if not await self.db.add_reflection(job['user_id'], 'voice', content, await self._today(job['user_id'])):
+            return "❌ 회고 저장 중 오류가 발생했습니다."
+        if self.memory is not None:
+            self.memory.notify()
+        return f"✅ **음성 회고가 저장되었습니다!**\n\n🎤 **음성 내용**\n{transcription}\n\n🤖 **AI 분석**\n{ai_analysis}"
+
+    async def image_reflection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """이미지 회고 시작"""
+        user_id = update.effective_user.id
+        if await self.db.get_reflections(user_id, 'image', await self._today(user_id)):
+            await update.message.reply_text("🖼️ 오늘 이미 이미지 회고를 작성하셨습니다.")
+            return ConversationHandler.END
+        await update.message.reply_text("🖼️ **이미지 회고**\n\n이미지를 보내주세요. AI가 이미지를 분석하고 회고 내용을 생성해드립니다.")
+        return WAITING_IMAGE_REFLECTION
+
+    async def handle_image_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """이미지 메시지 처리 (분석은 백그라운드 작업으로 넘기고 바로 응답)"""
+        if not self.ai_helper.is_available():
+            await update.message.reply_text("❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요.")
+            return ConversationHandler.END
+        job_id = await self.jobs.enqueue(update.effective_user.id, update.effective_chat.id, 'image_reflection',
+                                         {'photo': [size.to_dict() for size in update.message.photo]})
+        if job_id is None:
+            await update.message.reply_text("❌ 이미지 회고 분석을 등록하지 못했습니다. 잠시 후 다시 보내주세요.")
+        elif job_id == 0:
+            await update.message.reply_text("⏳ 이전 이미지 회고를 아직 분석하고 있습니다. 결과가 준비되면 보내드릴게요.")
+        else:
+            await update.message.reply_text("🖼️ 이미지를 분석하고 있습니다... 결과가 준비되면 메시지로 보내드릴게요.")
+        return ConversationHandler.END
+
+    async def _job_image_reflection(self, bot, job: dict) -> str:
+        """분석에 충분한 가장 작은 사진을 골라 축소 후 분석하고 회고로 저장 (같은 이미지는 다시 분석하지 않음)"""
+        photo = PhotoSize.de_list(job['payload']['photo'], bot)
+        result = await self.media.process_image(bot, photo)
+        print(f"이미지 회고 처리 시간: {result['summary']} (전송 {result['sent_bytes']}바이트)")
+        analysis = result['analysis']
+        if not analysis:
+            return "❌ 이미지 분석에 실패했습니다. 다시 시도해주세요."
+        content = f"[이미지 분석] {analysis}"
+        if not await self.db.add_reflection(job['user_id'], 'image', content, await self._today(job['user_id'])):
+            return "❌ 회고 저장 중 오류가 발생했습니다."
+        if self.memory is not None:
+            self.memory.notify()
+        return f"✅ **이미지 회고가 저장되었습니다!**\n\n🖼️ **AI 분석**\n{analysis}"
 
     async def ai_reflection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
@@ -650,10 +935,13 @@ class ScheduleBot:
     async def ai_reflection_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_input = update.message.text
         if self.ai_helper.is_available():
-            response = await self.ai_helper.get_ai_reflection_guidance(user_input)
+            # 입력과 주제가 비슷한 과거 회고를 참고 자료로 함께 전달 (토큰 예산 안에서)
+            related = await self.memory.related_to_text(update.effective_user.id, user_input) if self.memory is not None else []
+            context_lines = [format_reflection_line(reflection) for reflection in related]
+            # 생성되는 대로 답장을 보내고 이어서 수정
+            await StreamingReply(update.message).run(self.ai_helper.stream_ai_reflection_guidance(user_input, context=context_lines))
         else:
-            response = "AI 묵상 기능이 비활성화되어 있습니다."
-        await update.message.reply_text(response, parse_mode='HTML')
+            await update.message.reply_text("AI 묵상 기능이 비활성화되어 있습니다.", parse_mode='HTML')
         return ConversationHandler.END
 
     async def chatgpt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -669,45 +957,87 @@ class ScheduleBot:
     async def chatgpt_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_message = update.message.text
         user_id = update.effective_user.id
-        # 대화 히스토리 관리 (옵션)
-        if user_id not in self.ai_conversations:
-            self.ai_conversations[user_id] = []
-        self.ai_conversations[user_id].append({"role": "user", "content": user_message})
+        # 대화 히스토리 관리 (현재 메시지는 stream_chat_with_gpt가 직접 추가하므로 이전 기록만 전달)
+        history = await self.ai_conversations.get(user_id)
+        summary = await self.ai_conversations.get_summary(user_id)  # 보관 턴 수를 넘어 밀려난 대화
         if self.ai_helper.is_available():
-            response = await self.ai_helper.chat_with_gpt(user_message, self.ai_conversations[user_id])
+            # 생성되는 대로 답장을 보내고 이어서 수정
+            response = await StreamingReply(update.message).run(self.ai_helper.stream_chat_with_gpt(user_message, history, summary))
         else:
             response = "AI 대화 기능이 비활성화되어 있습니다."
-        self.ai_conversations[user_id].append({"role": "assistant", "content": response})
-        await update.message.reply_text(response, parse_mode='HTML')
+            await update.message.reply_text(response, parse_mode='HTML')
+        await self.ai_conversations.append(user_id, "user", user_message)
+        await self.ai_conversations.append(user_id, "assistant", response)
         return ConversationHandler.END
 
+    async def timezone(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        시간대 확인/설정 ('오늘' 기준과 아침 알림 시각에 사용)
+        """
+        user_id = update.effective_user.id
+        if not context.args:
+            current = await self.db.get_user_timezone(user_id)
+            await update.message.reply_text(
+                f"🕒 현재 시간대: {current} (현지 시각 {local_now(current):%Y-%m-%d %H:%M})\n"
+                "변경하려면 /timezone Asia/Seoul 또는 /timezone America/New_York 처럼 입력해주세요."
+            )
+            return
+        timezone = normalize_timezone(' '.join(context.args))
+        if timezone is None:
+            await update.message.reply_text("❌ 알 수 없는 시간대입니다. 예: Asia/Seoul, Europe/London, America/New_York")
+            return
+        if await self.db.set_user_timezone(user_id, timezone):
+            await update.message.reply_text(
+                f"✅ 시간대를 {timezone}(으)로 설정했습니다. (현지 시각 {local_now(timezone):%Y-%m-%d %H:%M})\n"
+                "오늘의 일정/루틴/통계와 아침 알림이 이 시간대를 기준으로 동작합니다."
+            )
+        else:
+            await update.message.reply_text("❌ 시간대 저장 중 오류가 발생했습니다.")
+    
+    async def search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        회고 검색 (검색어의 모든 단어를 포함한 회고를 관련도 순으로)
+        """
+        query = ' '.join(context.args or [])
+        if not query.strip():
+            await update.message.reply_text("🔍 검색어를 함께 입력해주세요. 예: /search 운동\n여러 단어를 입력하면 모두 포함한 회고를 찾습니다.")
+            return
+        results = await self.db.search_reflections(update.effective_user.id, query, SEARCH_PAGE_SIZE + 1)
+        if not results:
+            await update.message.reply_text(f"🔍 '{query}'이(가) 들어간 회고가 없습니다.")
+            return
+        lines = [f"🔍 '{query}' 검색 결과"]
+        for reflection in results[:SEARCH_PAGE_SIZE]:
+            lines.append(f"\n📅 {reflection['date']} ({reflection['type']})\n{reflection['snippet']}")
+        if len(results) > SEARCH_PAGE_SIZE:
+            lines.append(f"\n관련도가 높은 {SEARCH_PAGE_SIZE}개만 보여드렸어요. 검색어를 더 구체적으로 입력해보세요.")
+        await update.message.reply_text("\n".join(lines))
+    
     async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         주간/월간 일정/회고 통계 제공
         """
         user_id = update.effective_user.id
-        # 일정 통계
-        schedule_week = self.db.get_schedule_stats(user_id, period='week') if hasattr(self.db, 'get_schedule_stats') else None
-        schedule_month = self.db.get_schedule_stats(user_id, period='month') if hasattr(self.db, 'get_schedule_stats') else None
-        # 회고 통계
-        reflection_week = self.db.get_reflection_stats(user_id, period='week')
-        reflection_month = self.db.get_reflection_stats(user_id, period='month')
+        # 집계 테이블에서 기간별 1회씩 조회
+        week = await self.db.get_stats_summary(user_id, period='week')
+        month = await self.db.get_stats_summary(user_id, period='month')
         msg = "<b>📊 주간/월간 일정·회고 통계</b>\n\n"
-        if schedule_week and schedule_month:
-            msg += f"<b>일정 작성률</b>\n- 이번 주: {schedule_week['written']}/{schedule_week['total']} ({schedule_week['rate']:.1f}%)\n- 이번 달: {schedule_month['written']}/{schedule_month['total']} ({schedule_month['rate']:.1f}%)\n\n"
-        msg += f"<b>회고 작성률</b>\n- 이번 주: {reflection_week['written']}/{reflection_week['total']} ({reflection_week['rate']:.1f}%)\n- 이번 달: {reflection_month['written']}/{reflection_month['total']} ({reflection_month['rate']:.1f}%)"
+        msg += "<b>일정 완료율</b>\n"
+        for label, summary in (('이번 주', week), ('이번 달', month)):
+            schedule = summary['schedule']
+            total = schedule['done'] + schedule['not_done']
+            rate = (schedule['done'] / total) * 100 if total > 0 else 0.0
+            msg += f"- {label}: {schedule['done']}/{total} ({rate:.1f}%)\n"
+        msg += "\n<b>회고 작성률</b>\n"
+        for label, summary in (('이번 주', week), ('이번 달', month)):
+            reflection = summary['reflection']
+            msg += f"- {label}: {reflection['written']}/{reflection['total']} ({reflection['rate']:.1f}%)\n"
+        msg += f"\n<b>루틴 완료</b>\n- 이번 주: {week['routines_completed']}회\n- 이번 달: {month['routines_completed']}회"
         await update.message.reply_text(msg, parse_mode='HTML')
 
-def main():
-    """메인 함수"""
-    if not BOT_TOKEN:
-        print("❌ BOT_TOKEN이 설정되지 않았습니다. .env 파일을 확인해주세요.")
-        return
-    
-    bot = ScheduleBot()
-    
-    # Application 생성
-    application = Application.builder().token(BOT_TOKEN).build()
+def register_handlers(application: Application, bot: ScheduleBot):
+    """명령어/대화 흐름 핸들러 등록 (persistence가 있으면 대화 흐름 상태를 보관)"""
+    persistent = application.persistence is not None
     
     # 일정 추가 대화 핸들러
     schedule_handler = ConversationHandler(
@@ -718,7 +1048,8 @@ def main():
             WAITING_SCHEDULE_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.schedule_date)],
             WAITING_SCHEDULE_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.schedule_time)],
         },
-        fallbacks=[CommandHandler('cancel', bot.cancel)]
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='add_schedule', persistent=persistent
     )
     
     # 회고 작성 대화 핸들러
@@ -729,7 +1060,8 @@ def main():
             WAITING_DAILY_THINK: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.daily_think)],
             WAITING_DAILY_TODO: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.daily_todo)],
         },
-        fallbacks=[CommandHandler('cancel', bot.cancel)]
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='daily_reflection', persistent=persistent
     )
     
     # 일정 수정 대화 핸들러
@@ -740,7 +1072,8 @@ def main():
             WAITING_EDIT_FIELD: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.edit_field)],
             WAITING_EDIT_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.edit_value)],
         },
-        fallbacks=[CommandHandler('cancel', bot.cancel)]
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='edit_schedule', persistent=persistent
     )
     # 일정 삭제 대화 핸들러
     delete_handler = ConversationHandler(
@@ -749,7 +1082,8 @@ def main():
             WAITING_DELETE_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.delete_select)],
             WAITING_DELETE_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.delete_confirm)],
         },
-        fallbacks=[CommandHandler('cancel', bot.cancel)]
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='delete_schedule', persistent=persistent
     )
     
     # 일정 완료 대화 핸들러
@@ -758,7 +1092,8 @@ def main():
         states={
             WAITING_COMPLETE_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.complete_select)],
         },
-        fallbacks=[CommandHandler('cancel', bot.cancel)]
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='complete_schedule', persistent=persistent
     )
     
     # 루틴 추가 대화 핸들러
@@ -772,7 +1107,8 @@ def main():
             WAITING_ROUTINE_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.routine_date)],
             WAITING_ROUTINE_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.routine_time)],
         },
-        fallbacks=[CommandHandler('cancel', bot.cancel)]
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='add_routine', persistent=persistent
     )
     
     # 핸들러 등록
@@ -795,24 +1131,66 @@ def main():
     application.add_handler(CommandHandler("ai_schedule_summary", bot.ai_schedule_summary))
     application.add_handler(CommandHandler("motivate", bot.motivate))
     application.add_handler(CommandHandler('stats', bot.stats))
+    application.add_handler(CommandHandler('timezone', bot.timezone))
+    application.add_handler(CommandHandler('search', bot.search))
+    application.add_handler(CommandHandler('view_reflections', bot.view_reflections))
+    application.add_handler(CallbackQueryHandler(bot.page_callback, pattern=r'^page:'))
     
+    # 음성/이미지 회고 핸들러 등록 (분석은 백그라운드 작업)
+    voice_reflection_handler = ConversationHandler(
+        entry_points=[CommandHandler('voice_reflection', bot.voice_reflection)],
+        states={
+            WAITING_VOICE_REFLECTION: [MessageHandler(filters.VOICE, bot.handle_voice_message)],
+        },
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='voice_reflection', persistent=persistent
+    )
+    image_reflection_handler = ConversationHandler(
+        entry_points=[CommandHandler('image_reflection', bot.image_reflection)],
+        states={
+            WAITING_IMAGE_REFLECTION: [MessageHandler(filters.PHOTO, bot.handle_image_message)],
+        },
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='image_reflection', persistent=persistent
+    )
+    application.add_handler(voice_reflection_handler)
+    application.add_handler(image_reflection_handler)
+
     # AI 묵상 핸들러 등록
     ai_reflection_handler = ConversationHandler(
         entry_points=[CommandHandler('ai_reflection', bot.ai_reflection)],
         states={
             WAITING_AI_REFLECTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.ai_reflection_input)],
         },
-        fallbacks=[CommandHandler('cancel', bot.cancel)]
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='ai_reflection', persistent=persistent
     )
     chatgpt_handler = ConversationHandler(
         entry_points=[CommandHandler('chatgpt', bot.chatgpt)],
         states={
             WAITING_CHATGPT: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.chatgpt_input)],
         },
-        fallbacks=[CommandHandler('cancel', bot.cancel)]
+        fallbacks=[CommandHandler('cancel', bot.cancel)],
+        name='chatgpt', persistent=persistent
     )
     application.add_handler(ai_reflection_handler)
     application.add_handler(chatgpt_handler)
+
+def main():
+    """메인 함수"""
+    if not BOT_TOKEN:
+        print("❌ BOT_TOKEN이 설정되지 않았습니다. .env 파일을 확인해주세요.")
+        return
+    
+    bot = ScheduleBot()
+    
+    # Application 생성 (진행 중인 입력 흐름은 SQLite에 보관해 재시작/배포 후에도 이어짐)
+    # 서로 다른 사용자의 업데이트는 동시에, 같은 사용자의 업데이트는 받은 순서대로 처리
+    application = (Application.builder().token(BOT_TOKEN).persistence(SQLitePersistence(bot.db))
+                   .concurrent_updates(PerUserUpdateProcessor())
+                   .post_init(bot.post_init).post_shutdown(bot.post_shutdown).build())
+    
+    register_handlers(application, bot)
     
     # 봇 시작
     print("🤖 텔레그램 봇이 시작되었습니다...")
@@ -824,17 +1202,15 @@ def main():
     # Render 환경에서는 webhook 사용, 로컬에서는 polling 사용
     if os.getenv('RENDER'):
         port = int(os.environ.get('PORT', 8080))
-        webhook_url = "https://telebot-svrq.onrender.com/" + BOT_TOKEN
+        webhook_url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
         print(f"🌐 Webhook 모드로 시작합니다. Port: {port}, Webhook URL: {webhook_url}")
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=port,
-            url_path=BOT_TOKEN,
-            webhook_url=webhook_url
-        )
+        # URL에 토큰을 넣지 않고 secret_token 헤더로 확인, 받은 업데이트는 큐에 넣고 바로 응답
+        run_webhook(application, webhook_url, WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32), port=port,
+                    extra_metrics=bot.metrics, metrics_token=METRICS_TOKEN)
     else:
         # 로컬 환경에서 polling 사용
         print("🔄 Polling 모드로 시작합니다...")
+        bot.log_metrics(application)
         try:
             application.run_polling(drop_pending_updates=True)
         except Exception as e:
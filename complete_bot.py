@@ -3,30 +3,51 @@ import datetime
 import sqlite3
 import pytz
 import random
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Voice, PhotoSize
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, ConversationHandler
-from database import Database
+from database import Database, AsyncDatabase
 from ai_helper import AIHelper
-from config import BOT_TOKEN, COMMANDS, DAILY_PROMPTS, WEEKLY_PROMPTS, MONTHLY_PROMPTS, AI_REFLECTION_PROMPTS, MOTIVATIONAL_QUOTES, COMPLETION_MESSAGES
+from media_pipeline import MediaPipeline, MediaTooLargeError
+from task_queue import TaskQueue
+from timeutil import local_today
+from embedding_index import ReflectionMemory
+from config import BOT_TOKEN, COMMANDS, DAILY_PROMPTS, WEEKLY_PROMPTS, MONTHLY_PROMPTS, AI_REFLECTION_PROMPTS, MOTIVATIONAL_QUOTES, COMPLETION_MESSAGES, EMBEDDING_INDEX_PATH
 
-# 대화 상태
+# 대화 상태 (bot.py와 같은 번호)
 WAITING_SCHEDULE_TITLE, WAITING_SCHEDULE_DESC, WAITING_SCHEDULE_DATE, WAITING_SCHEDULE_TIME = range(4)
 WAITING_DAILY_FACT, WAITING_DAILY_THINK, WAITING_DAILY_TODO = range(4, 7)
-WAITING_WEEKLY_FACT, WAITING_WEEKLY_THINK, WAITING_WEEKLY_TODO, WAITING_WEEKLY_TODO_FINAL = range(7, 10, 10, 11)
-WAITING_MONTHLY_FACT, WAITING_MONTHLY_THINK, WAITING_MONTHLY_TODO, WAITING_MONTHLY_TODO_FINAL = range(10, 13, 13, 14)
-WAITING_FEEDBACK = range(14, 15)
-WAITING_EDIT_TITLE, WAITING_EDIT_DESC, WAITING_EDIT_DATE, WAITING_EDIT_TIME = range(15, 19)
-WAITING_AI_REFLECTION = range(19, 20)
-WAITING_CHATGPT = range(20, 21)
-WAITING_ROUTINE_TITLE, WAITING_ROUTINE_DESC, WAITING_ROUTINE_FREQ, WAITING_ROUTINE_DAYS, WAITING_ROUTINE_DATE, WAITING_ROUTINE_TIME = range(21, 27)
-WAITING_VOICE_REFLECTION, WAITING_IMAGE_REFLECTION = range(27, 29)
+WAITING_WEEKLY_FACT, WAITING_WEEKLY_THINK, WAITING_WEEKLY_TODO, WAITING_WEEKLY_TODO_FINAL = range(7, 11)
+WAITING_MONTHLY_FACT, WAITING_MONTHLY_THINK, WAITING_MONTHLY_TODO, WAITING_MONTHLY_TODO_FINAL = range(11, 15)
+WAITING_FEEDBACK = 15
+WAITING_EDIT_TITLE, WAITING_EDIT_DESC, WAITING_EDIT_DATE, WAITING_EDIT_TIME = range(16, 20)
+WAITING_AI_REFLECTION = 20
+WAITING_CHATGPT = 21
+WAITING_ROUTINE_TITLE, WAITING_ROUTINE_DESC, WAITING_ROUTINE_FREQ, WAITING_ROUTINE_DAYS, WAITING_ROUTINE_DATE, WAITING_ROUTINE_TIME = range(22, 28)
+WAITING_VOICE_REFLECTION, WAITING_IMAGE_REFLECTION = range(28, 30)
 
 class ScheduleBot:
     def __init__(self):
         self.db = Database()
         self.ai_helper = AIHelper()
+        self.media = MediaPipeline(self.ai_helper)  # 음성/이미지는 메모리로 받아 바로 분석
+        self.jobs = TaskQueue(AsyncDatabase(self.db))  # 음성/이미지 분석은 백그라운드에서 처리 후 결과 전송
+        self.jobs.register('voice_reflection', self._job_voice_reflection)
+        self.jobs.register('image_reflection', self._job_image_reflection)
         self.user_states = {}  # 사용자별 상태 저장
         self.ai_conversations = {}  # AI 대화 히스토리 저장
+        # 회고 임베딩 색인 (numpy가 없으면 None, 음성/이미지 회고도 저장할 때 바로 색인)
+        self.memory = ReflectionMemory.create(self.jobs.db, EMBEDDING_INDEX_PATH, self.ai_helper.client, self.ai_helper.executor)
+    
+    async def post_init(self, application: Application):
+        """애플리케이션 시작 시 백그라운드 작업 워커 실행"""
+        await self.jobs.start(application.bot)
+        if self.memory is not None:
+            self.memory.notify()  # 꺼져 있던 동안 추가/수정된 회고 색인
+    
+    async def post_shutdown(self, application: Application):
+        """애플리케이션 종료 시 워커와 다운로드 연결 정리"""
+        await self.jobs.stop()
+        await self.media.close()
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """봇 시작 명령어"""
@@ -113,7 +134,7 @@ class ScheduleBot:
     async def voice_reflection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """음성 회고 시작"""
         user_id = update.effective_user.id
-        today = datetime.datetime.now().strftime('%Y-%m-%d')
+        today = local_today(self.db.get_user_timezone(user_id))
         existing_reflections = self.db.get_reflections(user_id, 'voice', today)
         if existing_reflections:
             await update.message.reply_text("🎤 오늘 이미 음성 회고를 작성하셨습니다. 수정하시겠습니까?")
@@ -124,54 +145,56 @@ class ScheduleBot:
         return WAITING_VOICE_REFLECTION
     
     async def handle_voice_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """음성 메시지 처리"""
+        """음성 메시지 처리 (분석은 백그라운드 작업으로 넘기고 바로 응답)"""
         user_id = update.effective_user.id
         
         if not update.message.voice:
             await update.message.reply_text("❌ 음성 메시지가 아닙니다. 음성 메시지를 보내주세요.")
             return WAITING_VOICE_REFLECTION
         
-        await update.message.reply_text("🎤 음성을 분석하고 있습니다...")
+        if not self.ai_helper.is_available():
+            await update.message.reply_text("❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요.")
+            return ConversationHandler.END
         
+        job_id = await self.jobs.enqueue(user_id, update.effective_chat.id, 'voice_reflection',
+                                         {'voice': update.message.voice.to_dict()})
+        if job_id is None:
+            await update.message.reply_text("❌ 음성 회고 분석을 등록하지 못했습니다. 잠시 후 다시 보내주세요.")
+        elif job_id == 0:
+            await update.message.reply_text("⏳ 이전 음성 회고를 아직 분석하고 있습니다. 결과가 준비되면 보내드릴게요.")
+        else:
+            await update.message.reply_text("🎤 음성을 분석하고 있습니다... 결과가 준비되면 메시지로 보내드릴게요.")
+        context.user_data['voice_reflection'] = {}
+        return ConversationHandler.END
+    
+    async def _job_voice_reflection(self, bot, job: dict) -> str:
+        """음성을 메모리로 받아 텍스트 변환 후 분석하고 회고로 저장 (OpenAI Whisper 사용)"""
+        voice = Voice.de_json(job['payload']['voice'], bot)
         try:
-            # 음성 파일 다운로드
-            voice_file = await context.bot.get_file(update.message.voice.file_id)
-            voice_path = f"voice_{user_id}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.ogg"
-            
-            # 음성을 텍스트로 변환 (OpenAI Whisper 사용)
-            if self.ai_helper.is_available():
-                transcription = self.ai_helper.transcribe_voice(voice_file.file_path)
-                if transcription:
-                    # AI 분석 및 회고 생성
-                    ai_analysis = self.ai_helper.analyze_voice_reflection(transcription)
-                    
-                    # 회고 저장
-                    today = datetime.datetime.now().strftime('%Y-%m-%d')
-                    content = f"[음성 변환] {transcription}\n\n[AI 분석] {ai_analysis}"
-                    success = self.db.add_reflection(user_id, 'voice', content, today)
-                    
-                    if success:
-                        message = f"✅ **음성 회고가 저장되었습니다!**\n\n🎤 **음성 내용**\n{transcription}\n\n🤖 **AI 분석**\n{ai_analysis}"
-                        await update.message.reply_text(message)
-                    else:
-                        await update.message.reply_text("❌ 회고 저장 중 오류가 발생했습니다.")
-                else:
-                    await update.message.reply_text("❌ 음성 인식에 실패했습니다. 다시 시도해주세요.")
-            else:
-                await update.message.reply_text("❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요.")
-            
-            context.user_data['voice_reflection'] = {}
-            return ConversationHandler.END
-            
-        except Exception as e:
+            result = await self.media.process_voice(bot, voice)
+        except MediaTooLargeError as e:
             print(f"음성 처리 오류: {e}")
-            await update.message.reply_text("❌ 음성 처리 중 오류가 발생했습니다. 다시 시도해주세요.")
-            return WAITING_VOICE_REFLECTION
+            return "❌ 음성 메시지가 너무 깁니다. 더 짧게 나눠서 보내주세요."
+        print(f"음성 회고 처리 시간: {result['summary']}")
+        transcription = result['transcription']
+        if not transcription:
+            return "❌ 음성 인식에 실패했습니다. 다시 시도해주세요."
+        ai_analysis = result['analysis']
+        
+        # 회고 저장
+        today = local_today(await self.jobs.db.get_user_timezone(job['user_id']))
+        content = f"[음성 변환] {transcription}\n\n[AI 분석] {ai_analysis}"
+        success = await self.jobs.db.add_reflection(job['user_id'], 'voice', content, today)
+        if not success:
+            return "❌ 회고 저장 중 오류가 발생했습니다."
+        if self.memory is not None:
+            self.memory.notify()
+        return f"✅ **음성 회고가 저장되었습니다!**\n\n🎤 **음성 내용**\n{transcription}\n\n🤖 **AI 분석**\n{ai_analysis}"
     
     async def image_reflection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """이미지 회고 시작"""
         user_id = update.effective_user.id
-        today = datetime.datetime.now().strftime('%Y-%m-%d')
+        today = local_today(self.db.get_user_timezone(user_id))
         existing_reflections = self.db.get_reflections(user_id, 'image', today)
         if existing_reflections:
             await update.message.reply_text("🖼️ 오늘 이미 이미지 회고를 작성하셨습니다. 수정하시겠습니까?")
@@ -182,46 +205,46 @@ class ScheduleBot:
         return WAITING_IMAGE_REFLECTION
     
     async def handle_image_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """이미지 메시지 처리"""
+        """이미지 메시지 처리 (분석은 백그라운드 작업으로 넘기고 바로 응답)"""
         user_id = update.effective_user.id
         
         if not update.message.photo:
             await update.message.reply_text("❌ 이미지가 아닙니다. 이미지를 보내주세요.")
             return WAITING_IMAGE_REFLECTION
         
-        await update.message.reply_text("🖼️ 이미지를 분석하고 있습니다...")
-        
-        try:
-            # 이미지 파일 다운로드
-            photo = update.message.photo[-1]  # 가장 큰 해상도 선택
-            image_file = await context.bot.get_file(photo.file_id)
-            
-            # 이미지 분석 (OpenAI Vision 사용)
-            if self.ai_helper.is_available():
-                analysis = self.ai_helper.analyze_image_reflection(image_file.file_path)
-                if analysis:
-                    # 회고 저장
-                    today = datetime.datetime.now().strftime('%Y-%m-%d')
-                    content = f"[이미지 분석] {analysis}"
-                    success = self.db.add_reflection(user_id, 'image', content, today)
-                    
-                    if success:
-                        message = f"✅ **이미지 회고가 저장되었습니다!**\n\n🖼️ **AI 분석**\n{analysis}"
-                        await update.message.reply_text(message)
-                    else:
-                        await update.message.reply_text("❌ 회고 저장 중 오류가 발생했습니다.")
-                else:
-                    await update.message.reply_text("❌ 이미지 분석에 실패했습니다. 다시 시도해주세요.")
-            else:
-                await update.message.reply_text("❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요.")
-            
-            context.user_data['image_reflection'] = {}
+        if not self.ai_helper.is_available():
+            await update.message.reply_text("❌ AI 기능을 사용할 수 없습니다. OpenAI API 키를 설정해주세요.")
             return ConversationHandler.END
-            
-        except Exception as e:
-            print(f"이미지 처리 오류: {e}")
-            await update.message.reply_text("❌ 이미지 처리 중 오류가 발생했습니다. 다시 시도해주세요.")
-            return WAITING_IMAGE_REFLECTION
+        
+        job_id = await self.jobs.enqueue(user_id, update.effective_chat.id, 'image_reflection',
+                                         {'photo': [size.to_dict() for size in update.message.photo]})
+        if job_id is None:
+            await update.message.reply_text("❌ 이미지 회고 분석을 등록하지 못했습니다. 잠시 후 다시 보내주세요.")
+        elif job_id == 0:
+            await update.message.reply_text("⏳ 이전 이미지 회고를 아직 분석하고 있습니다. 결과가 준비되면 보내드릴게요.")
+        else:
+            await update.message.reply_text("🖼️ 이미지를 분석하고 있습니다... 결과가 준비되면 메시지로 보내드릴게요.")
+        context.user_data['image_reflection'] = {}
+        return ConversationHandler.END
+    
+    async def _job_image_reflection(self, bot, job: dict) -> str:
+        """분석에 충분한 가장 작은 사진을 골라 축소 후 분석하고 회고로 저장 (OpenAI Vision 사용)"""
+        photo = PhotoSize.de_list(job['payload']['photo'], bot)
+        result = await self.media.process_image(bot, photo)
+        print(f"이미지 회고 처리 시간: {result['summary']} (전송 {result['sent_bytes']}바이트)")
+        analysis = result['analysis']
+        if not analysis:
+            return "❌ 이미지 분석에 실패했습니다. 다시 시도해주세요."
+        
+        # 회고 저장
+        today = local_today(await self.jobs.db.get_user_timezone(job['user_id']))
+        content = f"[이미지 분석] {analysis}"
+        success = await self.jobs.db.add_reflection(job['user_id'], 'image', content, today)
+        if not success:
+            return "❌ 회고 저장 중 오류가 발생했습니다."
+        if self.memory is not None:
+            self.memory.notify()
+        return f"✅ **이미지 회고가 저장되었습니다!**\n\n🖼️ **AI 분석**\n{analysis}"
 
     async def motivate(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
@@ -286,7 +309,7 @@ def main():
     bot = ScheduleBot()
     
     # Application 생성
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(bot.post_init).post_shutdown(bot.post_shutdown).build()
     
     # 핸들러 등록
     application.add_handler(CommandHandler("start", bot.start))
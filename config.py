@@ -12,10 +12,104 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 # Database
 DATABASE_PATH = 'schedule_bot.db'
 
+# SQLite 연결 튜닝 (연결 생성 시 1회 적용)
+DB_BUSY_TIMEOUT = 5.0  # 잠금 대기 시간(초)
+DB_MMAP_SIZE = 64 * 1024 * 1024  # 64MB 메모리 매핑
+DB_CACHE_SIZE_KB = 16 * 1024  # 16MB 페이지 캐시
+DB_READER_THREADS = 4  # 비동기 조회용 리더 스레드 수
+
+# 대화 기록/상태 메모리 관리
+CONVERSATION_MAX_TURNS = 30  # 사용자별 보관 턴 수 (AI 요청에는 토큰 예산 안에 드는 최근 턴만 사용, 밀려난 턴은 요약)
+CONVERSATION_MAX_BYTES = 32 * 1024 * 1024  # 전체 대화 기록 메모리 예산
+CONVERSATION_TTL = 60 * 60  # 유휴 사용자 대화 기록을 메모리에서 내리는 시간(초)
+CONVERSATION_FLUSH_INTERVAL = 5.0  # 대화 턴을 모아 SQLite에 저장하는 간격(초), 정상 종료 시에는 바로 저장
+USER_STATE_TTL = 30 * 60  # 중단된 입력 흐름 상태 보관 시간(초), 재시작 시 이보다 오래 멈춘 흐름은 버림
+USER_STATE_MAX = 10000  # 동시에 보관할 최대 사용자 상태 수
+PERSISTENCE_UPDATE_INTERVAL = 15.0  # 바뀐 대화 흐름 상태를 SQLite에 모아 저장하는 간격(초), 정상 종료 시에는 바로 저장
+
+# 여러 프로세스/인스턴스로 확장 실행 (python scale_out.py)
+SCALE_OUT_WORKERS = int(os.getenv('SCALE_OUT_WORKERS', os.cpu_count() or 1))  # 업데이트를 처리하는 워커 프로세스 수
+LEADER_LEASE_TTL = 30.0  # 리더 임대 유지 시간(초), 리더가 멈추면 이 시간 뒤 다른 인스턴스가 이어받음
+LEADER_POLL_TIMEOUT = 10.0  # getUpdates 롱 폴링 대기(초), 임대 연장이 늦지 않도록 LEADER_LEASE_TTL의 1/3 이하
+WORKER_QUEUE_SIZE = 1000  # 워커별 대기 업데이트 수 (가득 차면 리더가 받기를 멈춤)
+SCALE_OUT_BROADCAST_SHARE = 0.5  # 워커가 여럿일 때 아침 알림(0번 워커)에 따로 주는 전체 전송 한도 비율, 나머지는 워커들의 응답 전송이 나눠 씀
+
+# 업데이트 동시 처리 (update_processor.py, 같은 사용자의 업데이트는 받은 순서대로 하나씩)
+UPDATE_CONCURRENCY = 32  # 동시에 처리하는 업데이트 수 (서로 다른 사용자)
+UPDATE_MAX_PENDING = 4096  # 처리 중 + 사용자 차례를 기다리는 업데이트 최대 수 (넘으면 자리가 날 때까지 대기)
+METRICS_LOG_INTERVAL = 300.0  # polling/확장 모드에서 처리 지표(사용자별 밀림 등)를 로그로 남기는 간격(초), 0이면 끔
+
+# webhook 수신 (Render 배포, webhook_server.py)
+WEBHOOK_URL = os.getenv('RENDER_EXTERNAL_URL', 'https://telebot-svrq.onrender.com')  # 봇 서버 외부 주소
+WEBHOOK_PATH = '/telegram'  # 업데이트를 받는 경로 (토큰 대신 secret_token 헤더로 확인)
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')  # 없으면 시작할 때마다 새로 만들어 webhook에 등록
+WEBHOOK_QUEUE_SIZE = 1000  # 받았지만 처리가 끝나지 않은 업데이트 최대 수 (넘으면 503으로 거절, 텔레그램이 다시 보냄)
+WEBHOOK_MAX_CONNECTIONS = 40  # 텔레그램이 동시에 여는 webhook 연결 수 (1~100)
+WEBHOOK_RETRY_AFTER = 5  # 503 응답의 Retry-After(초)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # /metrics 조회 토큰 (Authorization: Bearer <토큰>), 없으면 /metrics를 열지 않음 (사용자 id가 담겨 있음)
+
+# 백그라운드 작업 큐 (오래 걸리는 AI 분석)
+JOB_WORKERS = 2  # 동시에 처리하는 작업 수
+JOB_POLL_INTERVAL = 1.0  # 새 작업 확인 간격(초)
+JOB_MAX_ATTEMPTS = 3  # 작업당 최대 시도 횟수
+JOB_RETENTION = 24 * 60 * 60  # 끝난 작업 보관 시간(초)
+JOB_RETRY_BASE_DELAY = 5.0  # 실패한 작업을 다시 실행하기까지 대기(초), 시도마다 2배
+JOB_RETRY_MAX_DELAY = 300.0  # 재시도 최대 대기(초)
+
+# 시간대 (사용자가 /timezone으로 바꾸지 않으면 한국 시간 기준으로 '오늘'을 계산)
+DEFAULT_TIMEZONE = 'Asia/Seoul'
+
+# 아침 알림 발송 (notification_time은 사용자 시간대 기준)
+NOTIFY_MORNING_TIME = '08:00'  # 일정 추가 시 자동으로 등록되는 아침 알림 시각
+NOTIFY_CATCHUP_MINUTES = 10  # 재시작/지연 시 놓친 알림을 이만큼 거슬러 올라가 발송(분)
+NOTIFY_BATCH_SIZE = 1000  # 한 번에 가져와 요약을 만드는 알림 수
+NOTIFY_GLOBAL_RATE = 30  # 봇 전체 초당 전송 수 (텔레그램 기본 한도, 유료 브로드캐스트는 최대 1000)
+NOTIFY_PER_CHAT_INTERVAL = 1.0  # 같은 채팅으로 보내는 메시지 최소 간격(초)
+NOTIFY_CONCURRENCY = 32  # 동시에 진행하는 전송 요청 수
+NOTIFY_MAX_RETRIES = 3  # 네트워크 오류/429 재시도 횟수
+NOTIFY_CLAIM_TIMEOUT = 300.0  # 전송에 넘긴 뒤 결과가 기록되지 않은 알림(프로세스 중단 등)을 다시 보내기까지 기다리는 시간(초)
+
+# 대화 응답 전송 (outbox.py, 전체 전송 한도는 아침 알림과 함께 NOTIFY_GLOBAL_RATE를 나눠 씀)
+OUTBOX_COALESCE_WINDOW = 0.05  # 같은 채팅으로 이어서 보내는 메시지를 이 시간(초) 동안 모아 한 메시지로 합침
+OUTBOX_MESSAGE_LIMIT = 4096  # 텔레그램 메시지 최대 길이 (넘으면 줄바꿈에서 나눠 전송)
+OUTBOX_PER_CHAT_RATE = 1.0  # 채팅별 초당 전송 수
+OUTBOX_PER_CHAT_BURST = 3  # 채팅별로 한 번에 보낼 수 있는 메시지 수
+OUTBOX_MAX_PENDING = 1000  # 전송을 기다리는 메시지 최대 수 (넘으면 자리가 날 때까지 대기)
+OUTBOX_MAX_RETRIES = 3  # 네트워크 오류/429 재시도 횟수
+
+# 주간 회고 패턴 리포트 (OpenAI Batch API, 일반 호출 대비 절반 가격 / 24시간 내 완료)
+REPORT_PERIOD_DAYS = 7  # 리포트 대상 기간(일)
+REPORT_USER_CHUNK = 500  # 회고를 한 번에 읽어오는 사용자 수
+BATCH_MAX_REQUESTS = 50000  # 배치 파일 하나에 넣는 최대 요청 수 (API 한도)
+BATCH_MAX_BYTES = 100 * 1024 * 1024  # 배치 입력 파일 최대 크기 (API 한도 200MB보다 여유 있게)
+BATCH_POLL_INTERVAL = 60.0  # 배치 상태 확인 간격(초)
+BATCH_COMPLETION_WINDOW = "24h"
+
+# 회고 검색 (/search)
+SEARCH_PAGE_SIZE = 5  # 한 번에 보여주는 검색 결과 수
+SEARCH_MAX_TERMS = 8  # 검색어 최대 단어 수
+SEARCH_MAX_CANDIDATES = 2000  # 순위를 매기는 최대 회고 수 (최근 회고부터)
+SEARCH_SNIPPET_CHARS = 40  # 검색어 앞뒤로 보여주는 글자 수
+
+# 목록 페이지 (/view_schedule, /view_reflections)
+VIEW_PAGE_SIZE = 5  # 한 페이지에 보여주는 항목 수
+VIEW_PREVIEW_CHARS = 300  # 목록에서 보여주는 회고 내용 길이 (텔레그램 메시지 4096자 제한 고려)
+
+# 회고 임베딩 색인 (분석 프롬프트에 관련 과거 회고 포함, numpy 필요)
+EMBEDDING_INDEX_PATH = 'reflection_vectors'  # 벡터 파일 디렉터리
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'local')  # local: 해시 임베딩(무료, API 호출 없음), openai: OpenAI 임베딩 API
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 256  # 벡터 차원 (100만 개 = 약 1GB)
+EMBEDDING_BATCH_SIZE = 256  # 한 번에 임베딩하는 회고 수
+RETRIEVAL_TOP_K = 20  # 관련 회고 후보 수
+RETRIEVAL_TOKEN_BUDGET = 800  # 프롬프트에 넣는 관련 회고의 토큰 예산
+RETRIEVAL_ITEM_CHARS = 400  # 관련 회고 하나당 최대 글자 수
+
 # Bot Commands
 COMMANDS = {
     'start': '봇 시작하기',
     'help': '도움말 보기',
+    'timezone': '시간대 확인/설정하기',
     'add_schedule': '일정 추가하기',
     'view_schedule': '일정 보기',
     'edit_schedule': '일정 수정하기',
@@ -24,6 +118,7 @@ COMMANDS = {
     'weekly_reflection': '주간 회고 작성하기',
     'monthly_reflection': '월간 회고 작성하기',
     'view_reflections': '회고 보기',
+    'search': '회고 검색하기',
     'feedback': '피드백 받기',
     'ai_reflection': 'AI와 함께 묵상하기',
     'ai_feedback': 'AI 피드백 받기'
@@ -99,4 +194,37 @@ COMPLETION_MESSAGES = [
 # GPT-4o-mini 설정
 GPT_MODEL = "gpt-4o-mini"
 MAX_TOKENS = 500
-TEMPERATURE = 0.7 
\ No newline at end of file
+TEMPERATURE = 0.7
+AI_MAX_CONCURRENCY = 4  # 동시에 보내는 OpenAI 요청 수
+AI_REQUESTS_PER_MINUTE = 500  # 분당 요청 한도 (계정 등급에 맞게 조정)
+AI_TOKENS_PER_MINUTE = 200000  # 분당 토큰 한도
+AI_MAX_RETRIES = 3  # 429/5xx 재시도 횟수
+AI_RETRY_BASE_DELAY = 0.5  # 재시도 기본 대기(초), 시도마다 2배 + 지터
+AI_RETRY_MAX_DELAY = 8.0  # 재시도 최대 대기(초)
+AI_BREAKER_FAILURES = 5  # 연속 실패 시 회로 차단
+AI_BREAKER_RESET = 30.0  # 차단 후 시험 요청까지 대기(초)
+VOICE_MAX_BYTES = 20 * 1024 * 1024  # 음성 회고 최대 크기 (텔레그램 봇 다운로드 한도 20MB)
+IMAGE_MIN_SIDE = 512  # 이 크기 이상인 텔레그램 사진 중 가장 작은 것을 사용
+IMAGE_MAX_PIXELS = 768 * 768  # 분석용 이미지 픽셀 예산 (이보다 크면 축소)
+IMAGE_JPEG_QUALITY = 80  # 재압축 품질
+IMAGE_DETAIL = "low"  # Vision 해상도 옵션 (low는 이미지당 고정 토큰)
+# 프롬프트 토큰 예산 (시스템 프롬프트 + 현재 메시지를 먼저 넣고 남은 만큼 관련 자료/최근 대화를 채움)
+PROMPT_TOKEN_BUDGETS = {
+    'chat_with_gpt': 2000,
+    'get_ai_reflection_guidance': 1500,
+}
+PROMPT_DEFAULT_BUDGET = 1500
+PROMPT_SUMMARY_TOKENS = 300  # 예산에 들지 않는 오래된 대화를 줄인 요약의 최대 토큰
+PROMPT_CONTEXT_SHARE = 0.3  # 남은 예산 중 관련 자료(과거 회고 등)에 쓸 수 있는 비율
+PROMPT_SUMMARY_LINE_CHARS = 60  # 요약에 남기는 턴 하나당 최대 글자 수
+STREAM_EDIT_INTERVAL = 1.0  # 스트리밍 응답 중 메시지 수정 최소 간격(초), 텔레그램 수정 빈도 제한 고려
+STREAM_FINAL_RETRIES = 3  # 마지막 수정이 429를 받을 때 retry_after만큼 기다려 다시 시도하는 횟수 (그래도 안 되면 새 메시지로 전송)
+
+# AI 응답 캐시 (같은 프롬프트 반복 호출 시 재사용)
+AI_CACHE_MAX_ENTRIES = 1000  # 메모리 캐시 최대 항목 수
+AI_CACHE_TTLS = {  # 메서드별 캐시 유지 시간(초), 없는 메서드는 캐시하지 않음
+    'get_reflection_feedback': 24 * 60 * 60,
+    'analyze_reflection_patterns': 6 * 60 * 60,
+    'get_schedule_summary': 60 * 60,
+    'analyze_image_reflection': 7 * 24 * 60 * 60,  # 같은 이미지(해시 기준)는 다시 분석하지 않음
+}
@@ -0,0 +1,206 @@
+import time
+import asyncio
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from config import (CONVERSATION_MAX_TURNS, CONVERSATION_MAX_BYTES, CONVERSATION_TTL, CONVERSATION_FLUSH_INTERVAL,
+                    USER_STATE_TTL, USER_STATE_MAX)
+from prompt_builder import fold_summary
+
+class ExpiringDict(MutableMapping):
+    """마지막 접근 후 ttl초가 지나면 사라지는 dict (최대 크기 초과 시 가장 오래 안 쓴 항목부터 제거)"""
+
+    def __init__(self, ttl: float = USER_STATE_TTL, max_size: int = USER_STATE_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: "OrderedDict[Any, list]" = OrderedDict()  # key -> [value, 마지막 접근 시각]
+
+    def _prune(self):
+        """만료된 항목 제거 (접근 순서대로 정렬되어 있으므로 앞에서부터 확인)"""
+        now = time.monotonic()
+        while self._data:
+            key, (_, touched) = next(iter(self._data.items()))
+            if now - touched <= self.ttl:
+                break
+            del self._data[key]
+
+    def __getitem__(self, key):
+        self._prune()
+        entry = self._data[key]
+        entry[1] = time.monotonic()
+        self._data.move_to_end(key)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        self._data[key] = [value, time.monotonic()]
+        self._data.move_to_end(key)
+        self._prune()
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key) -> bool:
+        self._prune()
+        return key in self._data
+
+    def __iter__(self) -> Iterator:
+        self._prune()
+        return iter(list(self._data))
+
+    def __len__(self) -> int:
+        self._prune()
+        return len(self._data)
+
+class ConversationStore:
+    """사용자별 AI 대화 기록 저장소 (턴 수 제한, 밀려난 턴 요약, 전체 메모리 예산, LRU/TTL 축출, 선택적 SQLite 보관)
+
+    SQLite에는 flush_interval초 동안 모은 턴을 한 트랜잭션으로 저장 (종료 시 close()로 바로 저장)
+    """
+
+    def __init__(self, db=None, max_turns: int = CONVERSATION_MAX_TURNS, max_bytes: int = CONVERSATION_MAX_BYTES,
+                 ttl: float = CONVERSATION_TTL, flush_interval: float = CONVERSATION_FLUSH_INTERVAL):
+        self.db = db  # AsyncDatabase (None이면 메모리에만 보관)
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._conversations: "OrderedDict[int, Dict]" = OrderedDict()  # user_id -> {'turns', 'summary', 'bytes', 'touched'}
+        self._pending: Dict[int, List[Tuple[str, str]]] = {}  # 아직 저장하지 않은 턴 (user_id -> [(role, content)])
+        self._pending_summaries: Dict[int, str] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.resident_bytes = 0
+        self.evictions = 0
+        self.flushes = 0  # SQLite 저장 트랜잭션 수
+
+    @staticmethod
+    def _turn_size(turn: Dict[str, str]) -> int:
+        return len(turn['content'].encode('utf-8')) + len(turn['role'])
+
+    def _drop(self, user_id: int):
+        entry = self._conversations.pop(user_id)
+        self.resident_bytes -= entry['bytes']
+
+    def _evict(self):
+        """유휴 시간이 지난 사용자와 메모리 예산을 넘는 사용자를 오래된 순서대로 축출"""
+        now = time.monotonic()
+        while self._conversations:
+            user_id, entry = next(iter(self._conversations.items()))
+            if now - entry['touched'] <= self.ttl and self.resident_bytes <= self.max_bytes:
+                break
+            self._drop(user_id)
+            self.evictions += 1
+
+    async def _load(self, user_id: int) -> Dict:
+        """메모리에 없으면 SQLite에서 최근 기록을 불러옴"""
+        entry = self._conversations.get(user_id)
+        if entry is None and self.db:
+            if user_id in self._pending or user_id in self._pending_summaries or self._flush_lock.locked():
+                await self.flush()  # 축출된 뒤 아직 저장되지 않은 턴이 있으면 먼저 저장
+            turns = await self.db.get_conversation_turns(user_id, self.max_turns)
+            summary = await self.db.get_conversation_summary(user_id)
+            # 불러오는 동안 같은 사용자를 먼저 불러온 요청이 있으면 그 기록을 씀 (메모리 사용량을 두 번 더하지 않음)
+            entry = self._conversations.get(user_id)
+            if entry is None:
+                entry = self._add_entry(user_id, turns, summary)
+        elif entry is None:
+            entry = self._add_entry(user_id, [], "")
+        entry['touched'] = time.monotonic()
+        self._conversations.move_to_end(user_id)
+        return entry
+
+    def _add_entry(self, user_id: int, turns: List[Dict[str, str]], summary: str) -> Dict:
+        entry = {'turns': turns, 'summary': summary, 'touched': 0.0,
+                 'bytes': sum(self._turn_size(t) for t in turns) + len(summary.encode('utf-8'))}
+        self._conversations[user_id] = entry
+        self.resident_bytes += entry['bytes']
+        return entry
+
+    async def get(self, user_id: int) -> List[Dict[str, str]]:
+        """최근 대화 기록 (오래된 순서)"""
+        entry = await self._load(user_id)
+        turns = list(entry['turns'])
+        self._evict()
+        return turns
+
+    async def get_summary(self, user_id: int) -> str:
+        """보관 턴 수를 넘어 밀려난 대화의 요약"""
+        entry = await self._load(user_id)
+        summary = entry['summary']
+        self._evict()
+        return summary
+
+    async def append(self, user_id: int, role: str, content: str):
+        """대화 턴 추가 (최근 max_turns개만 유지, 밀려난 턴은 요약에 추가)"""
+        entry = await self._load(user_id)
+        turn = {'role': role, 'content': content}
+        entry['turns'].append(turn)
+        entry['bytes'] += self._turn_size(turn)
+        self.resident_bytes += self._turn_size(turn)
+        removed = []
+        while len(entry['turns']) > self.max_turns:
+            removed.append(entry['turns'].pop(0))
+        if removed:
+            summary = fold_summary(entry['summary'], removed)
+            size = len(summary.encode('utf-8')) - len(entry['summary'].encode('utf-8')) - sum(self._turn_size(t) for t in removed)
+            entry['summary'] = summary
+            entry['bytes'] += size
+            self.resident_bytes += size
+        if self.db:
+            self._pending.setdefault(user_id, []).append((role, content))
+            if removed:
+                self._pending_summaries[user_id] = entry['summary']
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.create_task(self._flush_later())
+        self._evict()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """모아 둔 턴과 요약을 한 트랜잭션으로 SQLite에 저장 (실패하면 다음 저장 때 다시 시도)"""
+        async with self._flush_lock:
+            if not self._pending and not self._pending_summaries:
+                return
+            pending, summaries = self._pending, self._pending_summaries
+            self._pending, self._pending_summaries = {}, {}
+            turns = [(user_id, role, content) for user_id, items in pending.items() for role, content in items]
+            if await self.db.add_conversation_turns(turns, summaries, self.max_turns):
+                self.flushes += 1
+                return
+            for user_id, items in pending.items():
+                self._pending[user_id] = (items + self._pending.get(user_id, []))[-self.max_turns:]
+            for user_id, summary in summaries.items():
+                self._pending_summaries.setdefault(user_id, summary)
+
+    async def close(self):
+        """저장 대기 중인 턴을 바로 저장 (종료 시)"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        if self.db:
+            await self.flush()
+
+    async def clear(self, user_id: int):
+        """사용자의 대화 기록 삭제 (SQLite 포함)"""
+        if user_id in self._conversations:
+            self._drop(user_id)
+        self._pending.pop(user_id, None)
+        self._pending_summaries.pop(user_id, None)
+        if self.db:
+            await self.db.clear_conversation_turns(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """메모리에 올라와 있는 사용자 수/바이트 및 축출 횟수"""
+        self._evict()
+        return {
+            'resident_users': len(self._conversations),
+            'resident_bytes': self.resident_bytes,
+            'evictions': self.evictions,
+            'pending_turns': sum(len(items) for items in self._pending.values()),
+            'flushes': self.flushes,
+        }
@@ -1,113 +1,712 @@
+import json
 import sqlite3
+import asyncio
 import datetime
-from typing import List, Dict, Optional
-from config import DATABASE_PATH
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+from config import DATABASE_PATH, DB_BUSY_TIMEOUT, DB_MMAP_SIZE, DB_CACHE_SIZE_KB, DB_READER_THREADS, DEFAULT_TIMEZONE
+from config import SEARCH_MAX_CANDIDATES
+from timeutil import local_now
+from reflection_search import parse_query, fts_match_expression, rank_matches, make_snippet, FTS_MIN_TERM_LENGTH
+
+class ConnectionPool:
+    """스레드별로 재사용되는 SQLite 연결 관리자"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _open(self) -> sqlite3.Connection:
+        """새 연결 생성 및 PRAGMA 적용"""
+        # 연결은 소유 스레드에서만 사용하지만, close()를 다른 스레드에서 호출할 수 있도록 허용
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(DB_MMAP_SIZE)}')
+        conn.execute(f'PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _prune(self):
+        """종료된 스레드의 연결 정리 (lock 보유 상태에서 호출)"""
+        for ident, (thread, conn) in list(self._connections.items()):
+            if not thread.is_alive():
+                conn.close()
+                del self._connections[ident]
+
+    def connection(self) -> sqlite3.Connection:
+        """현재 스레드의 연결 반환 (없으면 생성)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            with self._lock:
+                self.hits += 1
+            return conn
+        conn = self._open()
+        thread = threading.current_thread()
+        with self._lock:
+            self._prune()
+            self._connections[thread.ident] = (thread, conn)
+            self.misses += 1
+        self._local.conn = conn
+        return conn
+
+    def stats(self) -> Dict:
+        """풀 크기 및 재사용 지표"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'connections': len(self._connections),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) * 100 if total > 0 else 0.0
+            }
+
+    def close(self):
+        """모든 연결 종료"""
+        with self._lock:
+            for _, conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+# 요일 이름 → 번호 (월=1, ..., 일=7)
+WEEKDAY_NAMES = {'월': 1, '화': 2, '수': 3, '목': 4, '금': 5, '토': 6, '일': 7}
+
+# get_routines_for_range 한 번에 펼칠 수 있는 최대 일수
+MAX_ROUTINE_RANGE_DAYS = 366
+
+def weekday_mask_from_days(days_of_week: Optional[str]) -> int:
+    """'1,3,5' 또는 '월,수,금' 형식의 요일 문자열을 비트마스크로 변환 (월=bit 0, 일=bit 6)"""
+    mask = 0
+    for token in (days_of_week or '').replace(' ', '').split(','):
+        day = WEEKDAY_NAMES.get(token) or (int(token) if token.isdigit() else 0)
+        if 1 <= day <= 7:
+            mask |= 1 << (day - 1)
+    return mask
+
+def month_day_from_date(date: Optional[str]) -> Optional[int]:
+    """'YYYY-MM-DD'에서 일(day) 추출 (매월 반복 루틴용)"""
+    try:
+        return int(date.split('-')[2]) if date else None
+    except (IndexError, ValueError):
+        return None
+
+def _period_range(period: str, today: datetime.date) -> Optional[Tuple[str, str, int]]:
+    """today가 속한 기간('week', 'month', 'year')의 시작일, 종료일, 일수"""
+    now = today
+    if period == 'week':
+        start = now - datetime.timedelta(days=now.weekday())
+        end = start + datetime.timedelta(days=6)
+    elif period == 'month':
+        start = now.replace(day=1)
+        if now.month == 12:
+            next_month = now.replace(year=now.year+1, month=1, day=1)
+        else:
+            next_month = now.replace(month=now.month+1, day=1)
+        end = next_month - datetime.timedelta(days=1)
+    elif period == 'year':
+        start = now.replace(month=1, day=1)
+        end = now.replace(month=12, day=31)
+    else:
+        return None
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), (end - start).days + 1
+
+def _has_column(cursor: sqlite3.Cursor, table: str, column: str) -> bool:
+    """테이블에 컬럼이 있는지 확인"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return column in [row[1] for row in cursor.fetchall()]
+
+def _migration_001_initial_schema(cursor: sqlite3.Cursor):
+    """기본 테이블 생성"""
+    # 일정 테이블
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            date TEXT NOT NULL,
+            time TEXT,
+            is_done INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 회고 테이블
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reflections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL, -- 'daily', 'weekly', 'monthly'
+            content TEXT NOT NULL,
+            date TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 피드백 테이블
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            reflection_id INTEGER,
+            feedback_text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (reflection_id) REFERENCES reflections (id)
+        )
+    ''')
+
+    # 알림 테이블
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            schedule_id INTEGER,
+            notification_type TEXT NOT NULL, -- 'morning', 'custom'
+            notification_time TEXT NOT NULL, -- '08:00' 형식
+            message TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (schedule_id) REFERENCES schedules (id)
+        )
+    ''')
+
+    # 루틴(반복 일정) 테이블
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS routines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            frequency TEXT NOT NULL, -- 'daily', 'weekly', 'monthly'
+            days_of_week TEXT, -- '1,2,3,4,5' (월=1, 화=2, ...)
+            start_date TEXT NOT NULL,
+            end_date TEXT,
+            time TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 루틴 완료 기록 테이블
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS routine_completions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            routine_id INTEGER NOT NULL,
+            completion_date TEXT NOT NULL,
+            is_done BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (routine_id) REFERENCES routines (id)
+        )
+    ''')
+
+def _migration_002_schedule_is_done(cursor: sqlite3.Cursor):
+    """버전 관리 이전에 만들어진 schedules 테이블에 is_done 컬럼 추가"""
+    if not _has_column(cursor, 'schedules', 'is_done'):
+        cursor.execute('ALTER TABLE schedules ADD COLUMN is_done INTEGER DEFAULT 0')
+
+def _migration_003_query_indexes(cursor: sqlite3.Cursor):
+    """조회 경로별 복합 인덱스 추가"""
+    # 유니크 인덱스 생성 전에 중복 완료 기록 정리 (가장 최근 기록만 유지)
+    cursor.execute('''
+        DELETE FROM routine_completions
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM routine_completions GROUP BY routine_id, completion_date
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_routine_completions_routine_date ON routine_completions (routine_id, completion_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_schedules_user_date_time ON schedules (user_id, date, time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reflections_user_type_date ON reflections (user_id, type, date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reflections_user_date ON reflections (user_id, date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_feedback_reflection ON feedback (reflection_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_active ON notifications (user_id, is_active)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_routines_user_active ON routines (user_id, is_active)')
+
+def _migration_004_routine_recurrence(cursor: sqlite3.Cursor):
+    """루틴 반복 규칙을 조회 가능한 형태(요일 비트마스크, 매월 날짜)로 저장"""
+    if not _has_column(cursor, 'routines', 'weekday_mask'):
+        cursor.execute('ALTER TABLE routines ADD COLUMN weekday_mask INTEGER DEFAULT 0')
+    if not _has_column(cursor, 'routines', 'month_day'):
+        cursor.execute('ALTER TABLE routines ADD COLUMN month_day INTEGER')
+    cursor.execute('SELECT id, days_of_week, start_date FROM routines')
+    rows = [(weekday_mask_from_days(days), month_day_from_date(start), routine_id)
+            for routine_id, days, start in cursor.fetchall()]
+    cursor.executemany('UPDATE routines SET weekday_mask = ?, month_day = ? WHERE id = ?', rows)
+
+# 일별 통계의 원본 집계 (user_id, date, done, pending, written, completed)
+DAILY_STATS_SOURCE_SQL = '''
+    SELECT user_id, date, COALESCE(is_done, 0) = 1 AS done, COALESCE(is_done, 0) != 1 AS pending,
+           0 AS written, 0 AS completed
+    FROM schedules
+    UNION ALL
+    SELECT user_id, date, 0, 0, 1, 0 FROM reflections
+    UNION ALL
+    SELECT r.user_id, rc.completion_date, 0, 0, 0, 1
+    FROM routine_completions rc JOIN routines r ON r.id = rc.routine_id
+    WHERE rc.is_done = 1
+'''
+
+# 쓰기 경로에 관계없이 daily_user_stats를 증분 갱신하는 트리거
+# (upsert에서 발생한 트리거는 바깥 문장의 충돌 정책을 따르므로 INSERT OR IGNORE 대신 NOT EXISTS 사용)
+DAILY_STATS_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_schedule_insert AFTER INSERT ON schedules
+    BEGIN
+        INSERT INTO daily_user_stats (user_id, date)
+        SELECT NEW.user_id, NEW.date
+        WHERE NOT EXISTS (SELECT 1 FROM daily_user_stats WHERE user_id = NEW.user_id AND date = NEW.date);
+        UPDATE daily_user_stats
+        SET schedules_done = schedules_done + (COALESCE(NEW.is_done, 0) = 1),
+            schedules_pending = schedules_pending + (COALESCE(NEW.is_done, 0) != 1)
+        WHERE user_id = NEW.user_id AND date = NEW.date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_schedule_delete AFTER DELETE ON schedules
+    BEGIN
+        UPDATE daily_user_stats
+        SET schedules_done = schedules_done - (COALESCE(OLD.is_done, 0) = 1),
+            schedules_pending = schedules_pending - (COALESCE(OLD.is_done, 0) != 1)
+        WHERE user_id = OLD.user_id AND date = OLD.date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_schedule_update AFTER UPDATE OF user_id, date, is_done ON schedules
+    BEGIN
+        UPDATE daily_user_stats
+        SET schedules_done = schedules_done - (COALESCE(OLD.is_done, 0) = 1),
+            schedules_pending = schedules_pending - (COALESCE(OLD.is_done, 0) != 1)
+        WHERE user_id = OLD.user_id AND date = OLD.date;
+        INSERT INTO daily_user_stats (user_id, date)
+        SELECT NEW.user_id, NEW.date
+        WHERE NOT EXISTS (SELECT 1 FROM daily_user_stats WHERE user_id = NEW.user_id AND date = NEW.date);
+        UPDATE daily_user_stats
+        SET schedules_done = schedules_done + (COALESCE(NEW.is_done, 0) = 1),
+            schedules_pending = schedules_pending + (COALESCE(NEW.is_done, 0) != 1)
+        WHERE user_id = NEW.user_id AND date = NEW.date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_reflection_insert AFTER INSERT ON reflections
+    BEGIN
+        INSERT INTO daily_user_stats (user_id, date)
+        SELECT NEW.user_id, NEW.date
+        WHERE NOT EXISTS (SELECT 1 FROM daily_user_stats WHERE user_id = NEW.user_id AND date = NEW.date);
+        UPDATE daily_user_stats SET reflections_written = reflections_written + 1
+        WHERE user_id = NEW.user_id AND date = NEW.date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_reflection_delete AFTER DELETE ON reflections
+    BEGIN
+        UPDATE daily_user_stats SET reflections_written = reflections_written - 1
+        WHERE user_id = OLD.user_id AND date = OLD.date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_reflection_update AFTER UPDATE OF user_id, date ON reflections
+    BEGIN
+        UPDATE daily_user_stats SET reflections_written = reflections_written - 1
+        WHERE user_id = OLD.user_id AND date = OLD.date;
+        INSERT INTO daily_user_stats (user_id, date)
+        SELECT NEW.user_id, NEW.date
+        WHERE NOT EXISTS (SELECT 1 FROM daily_user_stats WHERE user_id = NEW.user_id AND date = NEW.date);
+        UPDATE daily_user_stats SET reflections_written = reflections_written + 1
+        WHERE user_id = NEW.user_id AND date = NEW.date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_completion_insert AFTER INSERT ON routine_completions
+    WHEN NEW.is_done = 1
+    BEGIN
+        INSERT INTO daily_user_stats (user_id, date)
+        SELECT r.user_id, NEW.completion_date FROM routines r
+        WHERE r.id = NEW.routine_id
+        AND NOT EXISTS (SELECT 1 FROM daily_user_stats WHERE user_id = r.user_id AND date = NEW.completion_date);
+        UPDATE daily_user_stats SET routines_completed = routines_completed + 1
+        WHERE user_id = (SELECT user_id FROM routines WHERE id = NEW.routine_id) AND date = NEW.completion_date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_completion_delete AFTER DELETE ON routine_completions
+    WHEN OLD.is_done = 1
+    BEGIN
+        UPDATE daily_user_stats SET routines_completed = routines_completed - 1
+        WHERE user_id = (SELECT user_id FROM routines WHERE id = OLD.routine_id) AND date = OLD.completion_date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_completion_update AFTER UPDATE OF routine_id, completion_date, is_done ON routine_completions
+    BEGIN
+        UPDATE daily_user_stats SET routines_completed = routines_completed - (OLD.is_done = 1)
+        WHERE user_id = (SELECT user_id FROM routines WHERE id = OLD.routine_id) AND date = OLD.completion_date;
+        INSERT INTO daily_user_stats (user_id, date)
+        SELECT r.user_id, NEW.completion_date FROM routines r
+        WHERE r.id = NEW.routine_id
+        AND NOT EXISTS (SELECT 1 FROM daily_user_stats WHERE user_id = r.user_id AND date = NEW.completion_date);
+        UPDATE daily_user_stats SET routines_completed = routines_completed + (NEW.is_done = 1)
+        WHERE user_id = (SELECT user_id FROM routines WHERE id = NEW.routine_id) AND date = NEW.completion_date;
+    END
+    ''',
+]
+
+def _migration_005_daily_user_stats(cursor: sqlite3.Cursor):
+    """사용자별 일별 통계 집계 테이블 및 갱신 트리거 생성 후 기존 데이터로 채움"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_user_stats (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            schedules_done INTEGER NOT NULL DEFAULT 0,
+            schedules_pending INTEGER NOT NULL DEFAULT 0,
+            reflections_written INTEGER NOT NULL DEFAULT 0,
+            routines_completed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date)
+        ) WITHOUT ROWID
+    ''')
+    for trigger in DAILY_STATS_TRIGGERS:
+        cursor.execute(trigger)
+    cursor.execute('DELETE FROM daily_user_stats')
+    cursor.execute(f'''
+        INSERT INTO daily_user_stats (user_id, date, schedules_done, schedules_pending, reflections_written, routines_completed)
+        SELECT user_id, date, SUM(done), SUM(pending), SUM(written), SUM(completed)
+        FROM ({DAILY_STATS_SOURCE_SQL})
+        GROUP BY user_id, date
+    ''')
+
+def _migration_006_conversation_turns(cursor: sqlite3.Cursor):
+    """AI 대화 기록 보관 테이블 생성"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_turns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL, -- 'user', 'assistant'
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_turns_user ON conversation_turns (user_id, id)')
+
+def _migration_007_ai_response_cache(cursor: sqlite3.Cursor):
+    """AI 응답 캐시 테이블 생성"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_response_cache (
+            cache_key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            expires_at REAL NOT NULL, -- UNIX 시각
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ai_response_cache_expires ON ai_response_cache (expires_at)')
+
+def _migration_008_background_jobs(cursor: sqlite3.Cursor):
+    """백그라운드 작업 큐 테이블 생성"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS background_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            command TEXT NOT NULL,
+            payload TEXT, -- JSON
+            status TEXT NOT NULL DEFAULT 'pending', -- pending, running, done, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL NOT NULL, -- UNIX 시각
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    # 사용자별 같은 명령은 대기/실행 중인 작업이 하나만 있도록 제한
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_background_jobs_active
+        ON background_jobs (user_id, command) WHERE status IN ('pending', 'running')
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_background_jobs_status ON background_jobs (status, id)')
+
+def _migration_009_notification_dispatch(cursor: sqlite3.Cursor):
+    """알림 발송 날짜 기록 컬럼과 발송 시각 조회 인덱스 추가"""
+    if not _has_column(cursor, 'notifications', 'last_sent_date'):
+        cursor.execute("ALTER TABLE notifications ADD COLUMN last_sent_date TEXT NOT NULL DEFAULT ''")
+    # 시각별로 오늘 아직 보내지 않은 활성 알림만 범위 스캔 (보낸 알림은 인덱스 뒤쪽으로 이동)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notifications_due
+        ON notifications (notification_time, last_sent_date) WHERE is_active = 1
+    ''')
+
+def _migration_010_user_timezones(cursor: sqlite3.Cursor):
+    """사용자별 시간대 테이블과 알림 시간대 컬럼 추가 (기존 사용자는 한국 시간)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            timezone TEXT NOT NULL DEFAULT 'Asia/Seoul',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    if not _has_column(cursor, 'notifications', 'timezone'):
+        cursor.execute("ALTER TABLE notifications ADD COLUMN timezone TEXT NOT NULL DEFAULT 'Asia/Seoul'")
+    # 시간대별로 현지 발송 시각이 된 알림만 범위 스캔
+    cursor.execute('DROP INDEX IF EXISTS idx_notifications_due')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notifications_due
+        ON notifications (timezone, notification_time, last_sent_date) WHERE is_active = 1
+    ''')
+
+def _migration_011_reflection_reports(cursor: sqlite3.Cursor):
+    """배치 회고 리포트 테이블 생성"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_batches (
+            id TEXT PRIMARY KEY, -- OpenAI 배치 ID
+            period_start TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            input_file_id TEXT NOT NULL,
+            output_file_id TEXT,
+            error_file_id TEXT,
+            status TEXT NOT NULL, -- validating, in_progress, finalizing, completed, failed, expired, cancelled, processed
+            request_count INTEGER NOT NULL,
+            created_at REAL NOT NULL, -- UNIX 시각
+            finished_at REAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reflection_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            period_start TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            batch_id TEXT,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending, done, failed
+            report TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP
+        )
+    ''')
+    # 사용자/기간별 리포트는 하나만 (배치를 다시 실행해도 중복 요청하지 않음)
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reflection_reports_user_period
+        ON reflection_reports (user_id, period_start)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reflection_reports_batch ON reflection_reports (batch_id, status)')
+
+# 검색 색인 rowid = (사용자 번호 << 32) | 회고 id -> 사용자별 회고가 색인에서 연속 구간이 되어 rowid 범위로 바로 찾음
+_SEARCH_KEY = "((SELECT seq FROM reflection_search_users WHERE user_id = {row}.user_id) << 32) | {row}.id"
+
+def _migration_012_reflection_search(cursor: sqlite3.Cursor):
+    """회고 전문 검색 색인(FTS5 trigram)과 동기화 트리거 추가"""
+    # 텔레그램 user_id는 32비트를 넘을 수 있어 색인 키에는 작은 사용자 번호를 사용
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reflection_search_users (
+            seq INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL UNIQUE
+        )
+    ''')
+    # 본문은 reflections에만 저장 (contentless), 한국어 부분 일치를 위해 trigram 토크나이저 사용
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS reflections_fts USING fts5(content, content='', tokenize='trigram')")
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reflections_fts_insert AFTER INSERT ON reflections BEGIN
+            INSERT OR IGNORE INTO reflection_search_users (user_id) VALUES (new.user_id);
+            INSERT INTO reflections_fts (rowid, content) VALUES ({_SEARCH_KEY.format(row='new')}, new.content);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reflections_fts_delete AFTER DELETE ON reflections BEGIN
+            INSERT INTO reflections_fts (reflections_fts, rowid, content) VALUES ('delete', {_SEARCH_KEY.format(row='old')}, old.content);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reflections_fts_update AFTER UPDATE OF user_id, content ON reflections BEGIN
+            INSERT INTO reflections_fts (reflections_fts, rowid, content) VALUES ('delete', {_SEARCH_KEY.format(row='old')}, old.content);
+            INSERT OR IGNORE INTO reflection_search_users (user_id) VALUES (new.user_id);
+            INSERT INTO reflections_fts (rowid, content) VALUES ({_SEARCH_KEY.format(row='new')}, new.content);
+        END
+    ''')
+    # 기존 회고 색인
+    cursor.execute('INSERT OR IGNORE INTO reflection_search_users (user_id) SELECT DISTINCT user_id FROM reflections ORDER BY user_id')
+    cursor.execute('''
+        INSERT INTO reflections_fts (rowid, content)
+        SELECT (s.seq << 32) | r.id, r.content FROM reflections r JOIN reflection_search_users s ON s.user_id = r.user_id
+    ''')
+
+def _migration_013_reflection_page_index(cursor: sqlite3.Cursor):
+    """회고 페이지 조회용 인덱스 ((date, created_at, id) 순서를 인덱스로 바로 읽음)"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reflections_user_date_created ON reflections (user_id, date, created_at)')
+    # (user_id, date) 인덱스는 새 인덱스의 앞부분과 같아 제거
+    cursor.execute('DROP INDEX IF EXISTS idx_reflections_user_date')
+
+def _migration_014_conversation_summaries(cursor: sqlite3.Cursor):
+    """보관 턴 수를 넘어 밀려난 AI 대화의 요약"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_015_bot_persistence(cursor: sqlite3.Cursor):
+    """텔레그램 대화 흐름 상태 (재시작/배포 후에도 진행 중인 입력 흐름 유지)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_conversations (
+            name TEXT NOT NULL,
+            conversation_key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (name, conversation_key)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_persisted_conversations_updated ON persisted_conversations (updated_at)')
+
+def _migration_016_leader_leases(cursor: sqlite3.Cursor):
+    """여러 인스턴스 중 하나만 업데이트를 받도록 하는 리더 임대 (scale_out.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leader_leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            update_offset INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+def _migration_017_job_retry_backoff(cursor: sqlite3.Cursor):
+    """실패한 작업을 바로 다시 가져가지 않도록 다음 실행 가능 시각 추가"""
+    if not _has_column(cursor, 'background_jobs', 'available_at'):
+        cursor.execute('ALTER TABLE background_jobs ADD COLUMN available_at REAL NOT NULL DEFAULT 0')
+
+def _migration_018_notification_claims(cursor: sqlite3.Cursor):
+    """발송 처리한 알림의 전송 대기/진행 상태 기록 (중단된 전송을 다시 보내기 위함)"""
+    # 0: 전송 완료 또는 대상 아님, 양수: 발송 처리 시각(전송 대기), 음수: -전송에 넘긴 시각(결과 대기)
+    if not _has_column(cursor, 'notifications', 'claimed_at'):
+        cursor.execute('ALTER TABLE notifications ADD COLUMN claimed_at REAL NOT NULL DEFAULT 0')
+    # 전송 대기(양수)/결과 대기(음수) 알림만 범위 스캔 (대부분인 0은 건너뜀)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_claimed ON notifications (claimed_at)')
+
+def _migration_019_reflection_reindex_queue(cursor: sqlite3.Cursor):
+    """내용이 바뀐 회고를 임베딩 색인에서 다시 계산하도록 기록"""
+    # 같은 회고를 다시 고치면 seq가 새로 매겨져, 이전 내용으로 계산 중이던 작업이 기록을 지우지 못함
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reflection_reindex_queue (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            reflection_id INTEGER NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS reflections_reindex_update AFTER UPDATE OF content ON reflections BEGIN
+            INSERT OR REPLACE INTO reflection_reindex_queue (reflection_id) VALUES (new.id);
+        END
+    ''')
+
+# 스키마 마이그레이션 목록 (버전, 설명, 함수) - 버전 순서대로 한 번씩만 적용
+MIGRATIONS = [
+    (1, '기본 테이블 생성', _migration_001_initial_schema),
+    (2, 'schedules.is_done 컬럼 추가', _migration_002_schedule_is_done),
+    (3, '조회용 복합 인덱스 추가', _migration_003_query_indexes),
+    (4, '루틴 반복 규칙 컬럼 추가', _migration_004_routine_recurrence),
+    (5, '일별 사용자 통계 집계 테이블 추가', _migration_005_daily_user_stats),
+    (6, 'AI 대화 기록 테이블 추가', _migration_006_conversation_turns),
+    (7, 'AI 응답 캐시 테이블 추가', _migration_007_ai_response_cache),
+    (8, '백그라운드 작업 큐 테이블 추가', _migration_008_background_jobs),
+    (9, '알림 발송 기록 컬럼 및 인덱스 추가', _migration_009_notification_dispatch),
+    (10, '사용자 시간대 테이블 및 알림 시간대 컬럼 추가', _migration_010_user_timezones),
+    (11, '배치 회고 리포트 테이블 추가', _migration_011_reflection_reports),
+    (12, '회고 전문 검색 색인 추가', _migration_012_reflection_search),
+    (13, '회고 페이지 조회 인덱스 추가', _migration_013_reflection_page_index),
+    (14, 'AI 대화 요약 테이블 추가', _migration_014_conversation_summaries),
+    (15, '대화 흐름 상태 보관 테이블 추가', _migration_015_bot_persistence),
+    (16, '리더 임대 테이블 추가', _migration_016_leader_leases),
+    (17, '작업 재시도 대기 시각 컬럼 추가', _migration_017_job_retry_backoff),
+    (18, '알림 전송 대기 시각 컬럼 추가', _migration_018_notification_claims),
+    (19, '회고 재색인 대기열 추가', _migration_019_reflection_reindex_queue),
+]
+
+# 루틴 완료 기록 upsert (idx_routine_completions_routine_date 유니크 인덱스 필요)
+ROUTINE_COMPLETION_UPSERT = '''
+    INSERT INTO routine_completions (routine_id, completion_date, is_done)
+    VALUES (?, ?, ?)
+    ON CONFLICT (routine_id, completion_date)
+    DO UPDATE SET is_done = excluded.is_done, created_at = CURRENT_TIMESTAMP
+'''
+
+# 루틴 r이 날짜 days.day에 해당하는지 (시작/종료일, 매일/요일/매월 반복 규칙)
+ROUTINE_OCCURS_ON_DAY = '''
+    r.is_active = 1
+    AND r.start_date <= days.day
+    AND (r.end_date IS NULL OR r.end_date >= days.day)
+    AND (
+        r.frequency = 'daily'
+        OR (r.frequency = 'weekly'
+            AND (r.weekday_mask & (1 << ((CAST(strftime('%w', days.day) AS INTEGER) + 6) % 7))) != 0)
+        OR (r.frequency = 'monthly'
+            AND r.month_day = CAST(strftime('%d', days.day) AS INTEGER))
+    )
+'''
 
 class Database:
-    def __init__(self):
-        self.db_path = DATABASE_PATH
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or DATABASE_PATH
+        self.pool = ConnectionPool(self.db_path)
         self.init_database()
-    
+
+    def _connect(self) -> sqlite3.Connection:
+        """풀에서 현재 스레드의 연결을 가져옴 (with 블록은 트랜잭션 범위로만 사용)"""
+        return self.pool.connection()
+
+    def get_pool_stats(self) -> Dict:
+        """연결 풀 지표 조회"""
+        return self.pool.stats()
+
+    def close(self):
+        """모든 연결 종료"""
+        self.pool.close()
+
     def init_database(self):
-        """데이터베이스 테이블 초기화 및 마이그레이션"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # 일정 테이블
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS schedules (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    date TEXT NOT NULL,
-                    time TEXT,
-                    is_done INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 마이그레이션: is_done 컬럼 없으면 추가
-            cursor.execute("PRAGMA table_info(schedules)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'is_done' not in columns:
-                cursor.execute('ALTER TABLE schedules ADD COLUMN is_done INTEGER DEFAULT 0')
-            
-            # 회고 테이블
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS reflections (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    type TEXT NOT NULL, -- 'daily', 'weekly', 'monthly'
-                    content TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 피드백 테이블
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS feedback (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    reflection_id INTEGER,
-                    feedback_text TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (reflection_id) REFERENCES reflections (id)
-                )
-            ''')
-            
-            # 알림 테이블
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS notifications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    schedule_id INTEGER,
-                    notification_type TEXT NOT NULL, -- 'morning', 'custom'
-                    notification_time TEXT NOT NULL, -- '08:00' 형식
-                    message TEXT NOT NULL,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (schedule_id) REFERENCES schedules (id)
-                )
-            ''')
-            
-            # 루틴(반복 일정) 테이블
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS routines (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    frequency TEXT NOT NULL, -- 'daily', 'weekly', 'monthly'
-                    days_of_week TEXT, -- '1,2,3,4,5' (월=1, 화=2, ...)
-                    start_date TEXT NOT NULL,
-                    end_date TEXT,
-                    time TEXT,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 루틴 완료 기록 테이블
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS routine_completions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    routine_id INTEGER NOT NULL,
-                    completion_date TEXT NOT NULL,
-                    is_done BOOLEAN DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (routine_id) REFERENCES routines (id)
-                )
-            ''')
-            
-            conn.commit()
+        """데이터베이스 스키마를 최신 버전으로 마이그레이션"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        for version, description, migrate in MIGRATIONS:
+            if version <= self.get_schema_version():
+                continue
+            # 마이그레이션마다 하나의 트랜잭션 (여러 프로세스가 동시에 시작해도 한 번만 적용)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+                if cursor.fetchone() is None:
+                    migrate(cursor)
+                    cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def get_schema_version(self) -> int:
+        """현재 적용된 스키마 버전 조회"""
+        cursor = self._connect().execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        return cursor.fetchone()[0]
     
     def add_schedule(self, user_id: int, title: str, description: str, date: str, time: Optional[str] = None) -> bool:
         """일정 추가"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO schedules (user_id, title, description, date, time, is_done)
@@ -122,7 +721,7 @@ class Database:
     def get_schedules(self, user_id: int, date: Optional[str] = None) -> List[Dict]:
         """일정 조회"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 if date:
                     cursor.execute('''
@@ -143,10 +742,59 @@ class Database:
             print(f"일정 조회 오류: {e}")
             return []
     
+    def get_schedules_page(self, user_id: int, cursor: Optional[Tuple[str, Optional[str], int]] = None,
+                           direction: str = 'next', limit: int = 10) -> Dict:
+        """일정을 날짜/시간순으로 한 페이지씩 조회 (키셋 페이지: cursor는 기준 일정의 (date, time, id))
+
+        direction='next'면 cursor 이후, 'prev'면 이전 일정을 가져오며 결과는 항상 날짜순 items와
+        앞뒤 페이지 존재 여부(has_prev, has_next)로 반환. (오늘, None, 0)을 넘기면 오늘 일정부터 시작
+        """
+        page = {'items': [], 'has_prev': False, 'has_next': False}
+        # time이 없는(NULL) 일정은 인덱스 순서대로 같은 날짜의 맨 앞
+        after = '''date >= :date AND (date > :date OR (time > :time OR (:time IS NULL AND time IS NOT NULL)
+                   OR (time IS :time AND id > :id)))'''
+        before = '''date <= :date AND (date < :date OR (time < :time OR (:time IS NOT NULL AND time IS NULL)
+                    OR (time IS :time AND id < :id)))'''
+        prev = direction == 'prev'
+        try:
+            with self._connect() as conn:
+                db_cursor = conn.cursor()
+                params = {'user_id': user_id, 'limit': limit + 1}
+                condition = ''
+                if cursor:
+                    params.update(date=cursor[0], time=cursor[1], id=cursor[2])
+                    condition = f"AND {before if prev else after}"
+                order = 'DESC' if prev else 'ASC'
+                db_cursor.execute(f'''
+                    SELECT * FROM schedules
+                    WHERE user_id = :user_id {condition}
+                    ORDER BY date {order}, time {order}, id {order}
+                    LIMIT :limit
+                ''', params)
+                columns = [description[0] for description in db_cursor.description]
+                rows = [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                if prev:
+                    rows.reverse()
+                page['items'] = rows
+                if not rows:
+                    return page
+                edge = rows[-1] if prev else rows[0]
+                db_cursor.execute(f'''
+                    SELECT EXISTS (SELECT 1 FROM schedules WHERE user_id = :user_id AND {after if prev else before})
+                ''', {'user_id': user_id, 'date': edge['date'], 'time': edge['time'], 'id': edge['id']})
+                has_other = bool(db_cursor.fetchone()[0])
+                page['has_prev'], page['has_next'] = (has_more, has_other) if prev else (has_other, has_more)
+                return page
+        except Exception as e:
+            print(f"일정 페이지 조회 오류: {e}")
+            return page
+
     def update_schedule(self, schedule_id: int, user_id: int, title: str, description: str, date: str, time: Optional[str] = None) -> bool:
         """일정 수정"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE schedules 
@@ -162,7 +810,7 @@ class Database:
     def delete_schedule(self, schedule_id: int, user_id: int) -> bool:
         """일정 삭제"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     DELETE FROM schedules 
@@ -177,7 +825,7 @@ class Database:
     def add_reflection(self, user_id: int, reflection_type: str, content: str, date: str) -> bool:
         """회고 추가"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO reflections (user_id, type, content, date)
@@ -189,10 +837,23 @@ class Database:
             print(f"회고 추가 오류: {e}")
             return False
     
+    def update_reflection(self, reflection_id: int, user_id: int, content: str) -> bool:
+        """회고 내용 수정 (검색 색인은 트리거로 갱신, 임베딩 색인은 재색인 대기열에 기록됨)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('UPDATE reflections SET content = ? WHERE id = ? AND user_id = ?',
+                               (content, reflection_id, user_id))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            print(f"회고 수정 오류: {e}")
+            return False
+
     def get_reflections(self, user_id: int, reflection_type: Optional[str] = None, date: Optional[str] = None) -> List[Dict]:
         """회고 조회"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 if reflection_type and date:
                     cursor.execute('''
@@ -219,10 +880,153 @@ class Database:
             print(f"회고 조회 오류: {e}")
             return []
     
+    def get_reflections_after(self, after_id: int, limit: int) -> List[Dict]:
+        """after_id 이후 회고를 id 순으로 limit개 조회 (전체 사용자, 임베딩 색인 갱신용)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, user_id, content FROM reflections
+                    WHERE id > ? ORDER BY id LIMIT ?
+                ''', (after_id, limit))
+                columns = [description[0] for description in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"색인할 회고 조회 오류: {e}")
+            return []
+
+    def get_reindex_reflections(self, limit: int) -> List[Dict]:
+        """내용이 바뀌어 임베딩을 다시 계산할 회고 (seq, id, user_id, content, 삭제된 회고는 content가 None)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT q.seq, q.reflection_id AS id, r.user_id, r.content
+                    FROM reflection_reindex_queue q LEFT JOIN reflections r ON r.id = q.reflection_id
+                    ORDER BY q.seq LIMIT ?
+                ''', (limit,))
+                columns = [description[0] for description in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"재색인할 회고 조회 오류: {e}")
+            return []
+
+    def clear_reindex_reflections(self, seqs: List[int]) -> bool:
+        """다시 계산한 회고를 재색인 대기열에서 제거 (그사이 다시 고친 회고는 seq가 바뀌어 남음)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM reflection_reindex_queue WHERE seq IN (SELECT value FROM json_each(?))',
+                               (json.dumps(seqs),))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"재색인 대기열 정리 오류: {e}")
+            return False
+
+    def get_reflections_by_ids(self, user_id: int, reflection_ids: List[int]) -> List[Dict]:
+        """사용자의 회고를 id 목록으로 조회 (없는 id는 제외)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM reflections
+                    WHERE id IN (SELECT value FROM json_each(?)) AND user_id = ?
+                ''', (json.dumps(reflection_ids), user_id))
+                columns = [description[0] for description in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"회고 조회 오류: {e}")
+            return []
+
+    def get_reflections_page(self, user_id: int, cursor: Optional[Tuple[str, str, int]] = None,
+                             direction: str = 'older', limit: int = 10) -> Dict:
+        """회고를 최신순으로 한 페이지씩 조회 (키셋 페이지: cursor는 기준 회고의 (date, created_at, id))
+
+        direction='older'면 cursor보다 오래된 회고, 'newer'면 더 최근 회고를 가져오며
+        결과는 항상 최신순 items와 앞뒤 페이지 존재 여부(has_older, has_newer)로 반환
+        """
+        page = {'items': [], 'has_older': False, 'has_newer': False}
+        newer = direction == 'newer'
+        comparison, order = ('>', 'ASC') if newer else ('<', 'DESC')
+        try:
+            with self._connect() as conn:
+                db_cursor = conn.cursor()
+                db_cursor.execute(f'''
+                    SELECT * FROM reflections
+                    WHERE user_id = ? {f"AND (date, created_at, id) {comparison} (?, ?, ?)" if cursor else ""}
+                    ORDER BY date {order}, created_at {order}, id {order}
+                    LIMIT ?
+                ''', (user_id, *(cursor or ()), limit + 1))
+                columns = [description[0] for description in db_cursor.description]
+                rows = [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                if newer:
+                    rows.reverse()
+                page['items'] = rows
+                if not rows:
+                    return page
+                # 반대 방향은 경계 회고 너머에 회고가 있는지만 확인
+                edge = rows[-1] if newer else rows[0]
+                db_cursor.execute(f'''
+                    SELECT EXISTS (
+                        SELECT 1 FROM reflections
+                        WHERE user_id = ? AND (date, created_at, id) {'<' if newer else '>'} (?, ?, ?)
+                    )
+                ''', (user_id, edge['date'], edge['created_at'], edge['id']))
+                has_other = bool(db_cursor.fetchone()[0])
+                page['has_older'], page['has_newer'] = (has_other, has_more) if newer else (has_more, has_other)
+                return page
+        except Exception as e:
+            print(f"회고 페이지 조회 오류: {e}")
+            return page
+
+    def search_reflections(self, user_id: int, query: str, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """회고 검색 (검색어의 모든 단어를 포함한 회고를 순위순으로, 검색어 주변 snippet과 score 포함)"""
+        terms = parse_query(query)
+        if not terms:
+            return []
+        # 3글자 미만 단어는 색인으로 찾을 수 없어 후보 회고 본문에서 직접 확인
+        short_terms = [term for term in terms if len(term) < FTS_MIN_TERM_LENGTH]
+        short_filter = ''.join(' AND instr(lower(r.content), ?) > 0' for _ in short_terms)
+        match = fts_match_expression(terms)
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                if match:
+                    cursor.execute(f'''
+                        SELECT r.id, r.type, r.content, r.date, r.created_at
+                        FROM reflections_fts f JOIN reflections r ON r.id = (f.rowid & 4294967295)
+                        WHERE reflections_fts MATCH ?
+                            AND f.rowid BETWEEN (SELECT seq << 32 FROM reflection_search_users WHERE user_id = ?)
+                                            AND (SELECT (seq << 32) | 4294967295 FROM reflection_search_users WHERE user_id = ?)
+                            {short_filter}
+                        ORDER BY f.rowid DESC
+                        LIMIT ?
+                    ''', (match, user_id, user_id, *short_terms, SEARCH_MAX_CANDIDATES))
+                else:
+                    cursor.execute(f'''
+                        SELECT r.id, r.type, r.content, r.date, r.created_at
+                        FROM reflections r
+                        WHERE r.user_id = ? {short_filter}
+                        ORDER BY r.date DESC
+                        LIMIT ?
+                    ''', (user_id, *short_terms, SEARCH_MAX_CANDIDATES))
+                columns = [description[0] for description in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"회고 검색 오류: {e}")
+            return []
+        results = rank_matches(rows, terms)[offset:offset + limit]
+        for row in results:
+            row['snippet'] = make_snippet(row['content'], terms)
+        return results
+
     def add_feedback(self, user_id: int, reflection_id: int, feedback_text: str) -> bool:
         """피드백 추가"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO feedback (user_id, reflection_id, feedback_text)
@@ -237,7 +1041,7 @@ class Database:
     def get_feedback(self, reflection_id: int) -> List[Dict]:
         """피드백 조회"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT * FROM feedback 
@@ -251,15 +1055,63 @@ class Database:
             print(f"피드백 조회 오류: {e}")
             return []
     
+    # 사용자 시간대
+    def get_user_timezone(self, user_id: int) -> str:
+        """사용자 시간대 조회 (설정하지 않았으면 기본 시간대)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT timezone FROM users WHERE user_id = ?', (user_id,))
+                result = cursor.fetchone()
+                return result[0] if result else DEFAULT_TIMEZONE
+        except Exception as e:
+            print(f"시간대 조회 오류: {e}")
+            return DEFAULT_TIMEZONE
+
+    def set_user_timezone(self, user_id: int, timezone: str) -> bool:
+        """사용자 시간대 저장 (등록된 알림의 시간대도 함께 변경)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO users (user_id, timezone) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET timezone = excluded.timezone, updated_at = CURRENT_TIMESTAMP
+                ''', (user_id, timezone))
+                cursor.execute('UPDATE notifications SET timezone = ? WHERE user_id = ?', (timezone, user_id))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"시간대 저장 오류: {e}")
+            return False
+
+    def get_notification_timezones(self) -> List[str]:
+        """활성 알림이 있는 시간대 목록 (인덱스를 시간대 단위로 건너뛰며 조회하므로 사용자 수와 무관)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    WITH RECURSIVE zones(name) AS (
+                        SELECT MIN(timezone) FROM notifications WHERE is_active = 1
+                        UNION ALL
+                        SELECT (SELECT MIN(timezone) FROM notifications WHERE is_active = 1 AND timezone > zones.name)
+                        FROM zones WHERE zones.name IS NOT NULL
+                    )
+                    SELECT name FROM zones WHERE name IS NOT NULL
+                ''')
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"알림 시간대 조회 오류: {e}")
+            return []
+
     def add_notification(self, user_id: int, schedule_id: int, notification_type: str, notification_time: str, message: str) -> bool:
         """알림 추가"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO notifications (user_id, schedule_id, notification_type, notification_time, message)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (user_id, schedule_id, notification_type, notification_time, message))
+                    INSERT INTO notifications (user_id, schedule_id, notification_type, notification_time, message, timezone)
+                    VALUES (?, ?, ?, ?, ?, COALESCE((SELECT timezone FROM users WHERE user_id = ?), ?))
+                ''', (user_id, schedule_id, notification_type, notification_time, message, user_id, DEFAULT_TIMEZONE))
                 conn.commit()
                 return True
         except Exception as e:
@@ -269,7 +1121,7 @@ class Database:
     def get_notifications(self, user_id: int, notification_type: Optional[str] = None) -> List[Dict]:
         """알림 조회"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 if notification_type:
                     cursor.execute('''
@@ -293,11 +1145,169 @@ class Database:
         except Exception as e:
             print(f"알림 조회 오류: {e}")
             return []
+
+    def ensure_morning_notification(self, user_id: int, notification_time: str, message: str) -> bool:
+        """사용자의 아침 알림이 없으면 추가 (꺼져 있으면 다시 켬)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE notifications SET is_active = 1
+                    WHERE user_id = ? AND notification_type = 'morning'
+                ''', (user_id,))
+                if cursor.rowcount == 0:
+                    cursor.execute('''
+                        INSERT INTO notifications (user_id, schedule_id, notification_type, notification_time, message, timezone)
+                        VALUES (?, NULL, 'morning', ?, ?, COALESCE((SELECT timezone FROM users WHERE user_id = ?), ?))
+                    ''', (user_id, notification_time, message, user_id, DEFAULT_TIMEZONE))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"아침 알림 등록 오류: {e}")
+            return False
+
+    def claim_due_notifications(self, timezone: str, notification_time: str, date: str, limit: int,
+                                claimed_at: float) -> int:
+        """시간대의 현지 시각 알림 중 현지 date에 아직 보내지 않은 것을 사용자 최대 limit명분 발송 처리 (전송 대기로 표시)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                # 한 사용자의 알림이 한 번에 발송 처리되도록 사용자 단위로 가져옴
+                # (바깥 조건의 +는 사용자 인덱스로 찾도록 발송 시각 인덱스 사용을 막음)
+                cursor.execute('''
+                    UPDATE notifications SET last_sent_date = ?, claimed_at = ?
+                    WHERE user_id IN (
+                            SELECT user_id FROM notifications
+                            WHERE timezone = ? AND notification_time = ? AND last_sent_date < ? AND is_active = 1
+                            LIMIT ?
+                        )
+                        AND +timezone = ? AND +notification_time = ? AND +last_sent_date < ? AND is_active = 1
+                ''', (date, claimed_at, timezone, notification_time, date, limit, timezone, notification_time, date))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"발송할 알림 조회 오류: {e}")
+            return 0
+
+    def take_claimed_notifications(self, limit: int, taken_at: float) -> List[Dict]:
+        """전송 대기 알림을 발송 처리된 순서대로 사용자 최대 limit명분 가져와 결과 대기로 표시"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                # 한 사용자의 같은 시각 알림은 함께 가져와 한 메시지로 보냄
+                cursor.execute('''
+                    UPDATE notifications SET claimed_at = ?
+                    WHERE user_id IN (
+                            SELECT user_id FROM notifications WHERE claimed_at > 0 ORDER BY claimed_at LIMIT ?
+                        )
+                        AND claimed_at > 0
+                    RETURNING id, user_id, schedule_id, notification_type, message, last_sent_date AS date
+                ''', (-taken_at, limit))
+                columns = [description[0] for description in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                conn.commit()
+                return sorted(rows, key=lambda row: row['id'])
+        except Exception as e:
+            print(f"전송할 알림 조회 오류: {e}")
+            return []
+
+    def confirm_notifications(self, notification_ids: List[int]) -> bool:
+        """전송한 알림의 대기 표시 해제"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('UPDATE notifications SET claimed_at = 0 WHERE id IN (SELECT value FROM json_each(?))',
+                               (json.dumps(notification_ids),))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"알림 전송 기록 오류: {e}")
+            return False
+
+    def reclaim_stale_notifications(self, before: float) -> int:
+        """before 전에 전송에 넘겼지만 결과가 기록되지 않은 알림(중단된 프로세스 등)을 다시 전송 대기로 되돌림"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('UPDATE notifications SET claimed_at = -claimed_at WHERE claimed_at < 0 AND claimed_at > ?',
+                               (-before,))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"알림 재전송 처리 오류: {e}")
+            return 0
+
+    def release_notifications(self, notification_ids: List[int]) -> bool:
+        """보내지 못한 알림을 다시 발송 대상으로 되돌림"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany("UPDATE notifications SET last_sent_date = '', claimed_at = 0 WHERE id = ?",
+                                   [(notification_id,) for notification_id in notification_ids])
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"알림 발송 취소 오류: {e}")
+            return False
+
+    def deactivate_notifications(self, user_ids: List[int]) -> bool:
+        """봇을 차단한 사용자의 알림 끄기"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('UPDATE notifications SET is_active = 0, claimed_at = 0 WHERE user_id = ? AND is_active = 1',
+                                   [(user_id,) for user_id in user_ids])
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"알림 비활성화 오류: {e}")
+            return False
+
+    def get_daily_digests(self, user_ids: List[int], date: str) -> Dict[int, Dict[str, List[Dict]]]:
+        """여러 사용자의 해당 날짜 일정과 루틴을 쿼리 두 번으로 조회 (get_schedules + get_routines_for_date 일괄 버전)"""
+        digests = {user_id: {'schedules': [], 'routines': []} for user_id in user_ids}
+        try:
+            day = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+            users_json = json.dumps(list(digests))
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM schedules
+                    WHERE user_id IN (SELECT value FROM json_each(?)) AND date = ?
+                    ORDER BY user_id, time ASC, created_at ASC
+                ''', (users_json, date))
+                columns = [description[0] for description in cursor.description]
+                for row in cursor.fetchall():
+                    schedule = dict(zip(columns, row))
+                    digests[schedule['user_id']]['schedules'].append(schedule)
+
+                cursor.execute('''
+                    SELECT r.*, ? AS date, COALESCE(rc.is_done, 0) AS is_done
+                    FROM routines r
+                    LEFT JOIN routine_completions rc ON rc.routine_id = r.id AND rc.completion_date = ?
+                    WHERE r.user_id IN (SELECT value FROM json_each(?)) AND r.is_active = 1
+                        AND r.start_date <= ?
+                        AND (r.end_date IS NULL OR r.end_date >= ?)
+                        AND (
+                            r.frequency = 'daily'
+                            OR (r.frequency = 'weekly' AND (r.weekday_mask & ?) != 0)
+                            OR (r.frequency = 'monthly' AND r.month_day = ?)
+                        )
+                    ORDER BY r.user_id, r.time ASC, r.id ASC
+                ''', (date, date, users_json, date, date, 1 << day.weekday(), day.day))
+                columns = [description[0] for description in cursor.description]
+                for row in cursor.fetchall():
+                    routine = dict(zip(columns, row))
+                    digests[routine['user_id']]['routines'].append(routine)
+            return digests
+        except Exception as e:
+            print(f"일일 요약 조회 오류: {e}")
+            return digests
     
     def get_last_schedule_id(self, user_id: int) -> Optional[int]:
         """사용자의 마지막 일정 ID 조회"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT id FROM schedules 
@@ -315,7 +1325,7 @@ class Database:
     def update_schedule_done(self, schedule_id: int, user_id: int) -> bool:
         """일정 완료 처리"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE schedules SET is_done = 1, updated_at = CURRENT_TIMESTAMP
@@ -327,54 +1337,85 @@ class Database:
             print(f"일정 완료 처리 오류: {e}")
             return False
     
-    def get_schedule_stats(self, user_id: int, period: str = 'week') -> dict:
-        """주간/월간 일정 완료/미완료 개수 반환"""
-        import datetime
-        now = datetime.datetime.now()
-        if period == 'week':
-            start = (now - datetime.timedelta(days=now.weekday())).strftime('%Y-%m-%d')
-            end = (now + datetime.timedelta(days=6-now.weekday())).strftime('%Y-%m-%d')
-        elif period == 'month':
-            start = now.replace(day=1).strftime('%Y-%m-%d')
-            if now.month == 12:
-                next_month = now.replace(year=now.year+1, month=1, day=1)
-            else:
-                next_month = now.replace(month=now.month+1, day=1)
-            end = (next_month - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-        else:
-            return {'done': 0, 'not_done': 0}
-        with sqlite3.connect(self.db_path) as conn:
+    def get_stats_summary(self, user_id: int, period: str = 'week') -> dict:
+        """기간별 일정/회고/루틴 통계 (daily_user_stats 집계 테이블에서 한 번의 쿼리로 조회)"""
+        period_range = _period_range(period, local_now(self.get_user_timezone(user_id)).date())
+        if period_range is None:
+            return {'schedule': {'done': 0, 'not_done': 0},
+                    'reflection': {'written': 0, 'total': 0, 'rate': 0.0},
+                    'routines_completed': 0}
+        start, end, total = period_range
+        with self._connect() as conn:
             cursor = conn.cursor()
-            cursor.execute('''SELECT COUNT(*) FROM schedules WHERE user_id = ? AND date BETWEEN ? AND ? AND is_done = 1''', (user_id, start, end))
-            done = cursor.fetchone()[0]
-            cursor.execute('''SELECT COUNT(*) FROM schedules WHERE user_id = ? AND date BETWEEN ? AND ? AND is_done = 0''', (user_id, start, end))
-            not_done = cursor.fetchone()[0]
-        return {'done': done, 'not_done': not_done}
+            cursor.execute('''
+                SELECT COALESCE(SUM(schedules_done), 0), COALESCE(SUM(schedules_pending), 0),
+                       COALESCE(SUM(reflections_written > 0), 0), COALESCE(SUM(routines_completed), 0)
+                FROM daily_user_stats
+                WHERE user_id = ? AND date BETWEEN ? AND ?
+            ''', (user_id, start, end))
+            done, not_done, written, routines_completed = cursor.fetchone()
+        rate = (written / total) * 100 if total > 0 else 0.0
+        return {'schedule': {'done': done, 'not_done': not_done},
+                'reflection': {'written': written, 'total': total, 'rate': rate},
+                'routines_completed': routines_completed}
+
+    def get_schedule_stats(self, user_id: int, period: str = 'week') -> dict:
+        """주간/월간/연간 일정 완료/미완료 개수 반환"""
+        return self.get_stats_summary(user_id, period)['schedule']
 
     def get_reflection_stats(self, user_id: int, period: str = 'week') -> dict:
-        """주간/월간 회고 작성률 반환 (작성/전체/비율)"""
-        import datetime
-        now = datetime.datetime.now()
-        if period == 'week':
-            start = (now - datetime.timedelta(days=now.weekday())).strftime('%Y-%m-%d')
-            end = (now + datetime.timedelta(days=6-now.weekday())).strftime('%Y-%m-%d')
-            total = 7
-        elif period == 'month':
-            start = now.replace(day=1).strftime('%Y-%m-%d')
-            if now.month == 12:
-                next_month = now.replace(year=now.year+1, month=1, day=1)
-            else:
-                next_month = now.replace(month=now.month+1, day=1)
-            end = (next_month - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-            total = int(end.split('-')[2])
-        else:
-            return {'written': 0, 'total': 0, 'rate': 0.0}
-        with sqlite3.connect(self.db_path) as conn:
+        """주간/월간/연간 회고 작성률 반환 (작성/전체/비율)"""
+        return self.get_stats_summary(user_id, period)['reflection']
+
+    def rebuild_daily_stats(self, user_id: Optional[int] = None) -> bool:
+        """원본 테이블로부터 daily_user_stats 재계산 (user_id 생략 시 전체)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                if user_id is None:
+                    cursor.execute('DELETE FROM daily_user_stats')
+                    cursor.execute(f'''
+                        INSERT INTO daily_user_stats (user_id, date, schedules_done, schedules_pending, reflections_written, routines_completed)
+                        SELECT user_id, date, SUM(done), SUM(pending), SUM(written), SUM(completed)
+                        FROM ({DAILY_STATS_SOURCE_SQL})
+                        GROUP BY user_id, date
+                    ''')
+                else:
+                    cursor.execute('DELETE FROM daily_user_stats WHERE user_id = ?', (user_id,))
+                    cursor.execute(f'''
+                        INSERT INTO daily_user_stats (user_id, date, schedules_done, schedules_pending, reflections_written, routines_completed)
+                        SELECT user_id, date, SUM(done), SUM(pending), SUM(written), SUM(completed)
+                        FROM ({DAILY_STATS_SOURCE_SQL})
+                        WHERE user_id = ?
+                        GROUP BY user_id, date
+                    ''', (user_id,))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"일별 통계 재계산 오류: {e}")
+            return False
+
+    def check_daily_stats(self, user_id: Optional[int] = None) -> List[Dict]:
+        """daily_user_stats와 원본 테이블 집계를 비교해 불일치 행(원본 - 집계 차이) 반환"""
+        user_filter = 'WHERE user_id = ?' if user_id is not None else ''
+        params = (user_id,) if user_id is not None else ()
+        with self._connect() as conn:
             cursor = conn.cursor()
-            cursor.execute('''SELECT COUNT(DISTINCT date) FROM reflections WHERE user_id = ? AND date BETWEEN ? AND ?''', (user_id, start, end))
-            written = cursor.fetchone()[0]
-        rate = (written / total) * 100 if total > 0 else 0.0
-        return {'written': written, 'total': total, 'rate': rate}
+            cursor.execute(f'''
+                SELECT user_id, date, SUM(done) AS schedules_done, SUM(pending) AS schedules_pending,
+                       SUM(written) AS reflections_written, SUM(completed) AS routines_completed
+                FROM (
+                    {DAILY_STATS_SOURCE_SQL}
+                    UNION ALL
+                    SELECT user_id, date, -schedules_done, -schedules_pending, -reflections_written, -routines_completed
+                    FROM daily_user_stats
+                )
+                {user_filter}
+                GROUP BY user_id, date
+                HAVING SUM(done) != 0 OR SUM(pending) != 0 OR SUM(written) != 0 OR SUM(completed) != 0
+            ''', params)
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
     
     # 루틴(반복 일정) 관리 함수들
     def add_routine(self, user_id: int, title: str, description: str, frequency: str, 
@@ -382,12 +1423,13 @@ class Database:
                    days_of_week: Optional[str] = None) -> bool:
         """루틴 추가"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO routines (user_id, title, description, frequency, start_date, end_date, time, days_of_week)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (user_id, title, description, frequency, start_date, end_date, time, days_of_week))
+                    INSERT INTO routines (user_id, title, description, frequency, start_date, end_date, time, days_of_week, weekday_mask, month_day)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, title, description, frequency, start_date, end_date, time, days_of_week,
+                      weekday_mask_from_days(days_of_week), month_day_from_date(start_date)))
                 conn.commit()
                 return True
         except Exception as e:
@@ -397,7 +1439,7 @@ class Database:
     def get_routines(self, user_id: int, active_only: bool = True) -> List[Dict]:
         """루틴 조회"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 if active_only:
                     cursor.execute('''
@@ -419,88 +1461,99 @@ class Database:
             return []
     
     def get_today_routines(self, user_id: int) -> List[Dict]:
-        """오늘의 루틴 조회"""
-        import datetime
-        today = datetime.datetime.now()
-        today_str = today.strftime('%Y-%m-%d')
-        weekday = today.weekday() + 1  # 월=1, 화=2, ..., 일=7
-        
+        """오늘의 루틴 조회 (사용자 시간대 기준 오늘)"""
+        today_str = local_now(self.get_user_timezone(user_id)).strftime('%Y-%m-%d')
+        return self.get_routines_for_date(user_id, today_str)
+
+    def get_routines_for_date(self, user_id: int, date: str) -> List[Dict]:
+        """특정 날짜에 해당하는 루틴 조회 (완료 여부 포함)"""
+        return self.get_routines_for_range(user_id, date, date)
+
+    def get_routines_for_range(self, user_id: int, start_date: str, end_date: str) -> List[Dict]:
+        """기간 내 날짜별 루틴 발생 목록을 한 번의 쿼리로 조회 (각 항목에 'date' 포함)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            start = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
+            end = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
+            if end < start or (end - start).days > MAX_ROUTINE_RANGE_DAYS:
+                return []
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT r.*, rc.is_done 
-                    FROM routines r
-                    LEFT JOIN routine_completions rc ON r.id = rc.routine_id AND rc.completion_date = ?
-                    WHERE r.user_id = ? AND r.is_active = 1
-                    AND r.start_date <= ?
-                    AND (r.end_date IS NULL OR r.end_date >= ?)
-                ''', (today_str, user_id, today_str, today_str))
-                
-                routines = []
-                for row in cursor.fetchall():
-                    routine = {
-                        'id': row[0], 'user_id': row[1], 'title': row[2], 'description': row[3],
-                        'frequency': row[4], 'days_of_week': row[5], 'start_date': row[6],
-                        'end_date': row[7], 'time': row[8], 'is_active': row[9],
-                        'created_at': row[10], 'is_done': row[11] if row[11] is not None else 0
-                    }
-                    
-                    # 주간 루틴인 경우 요일 확인
-                    if routine['frequency'] == 'weekly' and routine['days_of_week']:
-                        days = [int(d) for d in routine['days_of_week'].split(',')]
-                        if weekday in days:
-                            routines.append(routine)
-                    elif routine['frequency'] == 'daily':
-                        routines.append(routine)
-                    elif routine['frequency'] == 'monthly':
-                        # 월간 루틴은 매월 같은 날짜
-                        start_day = int(routine['start_date'].split('-')[2])
-                        if today.day == start_day:
-                            routines.append(routine)
-                
-                return routines
+                # 요일/날짜 매칭은 weekday_mask, month_day 컬럼으로 SQL 안에서 처리
+                cursor.execute(f'''
+                    WITH RECURSIVE days(day) AS (
+                        SELECT ?
+                        UNION ALL
+                        SELECT date(day, '+1 day') FROM days WHERE day < ?
+                    )
+                    SELECT r.*, days.day AS date, COALESCE(rc.is_done, 0) AS is_done
+                    FROM days
+                    JOIN routines r ON r.user_id = ? AND {ROUTINE_OCCURS_ON_DAY}
+                    LEFT JOIN routine_completions rc ON rc.routine_id = r.id AND rc.completion_date = days.day
+                    ORDER BY days.day ASC, r.time ASC, r.id ASC
+                ''', (start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), user_id))
+
+                columns = [description[0] for description in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
         except Exception as e:
-            print(f"오늘의 루틴 조회 오류: {e}")
+            print(f"기간 루틴 조회 오류: {e}")
             return []
     
     def update_routine_completion(self, routine_id: int, completion_date: str, is_done: bool = True) -> bool:
-        """루틴 완료 상태 업데이트"""
+        """루틴 완료 상태 업데이트 (routine_id, completion_date 유니크 키 기반 upsert)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                # 기존 완료 기록 확인
-                cursor.execute('''
-                    SELECT id FROM routine_completions 
-                    WHERE routine_id = ? AND completion_date = ?
-                ''', (routine_id, completion_date))
-                
-                existing = cursor.fetchone()
-                if existing:
-                    # 기존 기록 업데이트
-                    cursor.execute('''
-                        UPDATE routine_completions 
-                        SET is_done = ?, created_at = CURRENT_TIMESTAMP
-                        WHERE routine_id = ? AND completion_date = ?
-                    ''', (is_done, routine_id, completion_date))
-                else:
-                    # 새 기록 추가
-                    cursor.execute('''
-                        INSERT INTO routine_completions (routine_id, completion_date, is_done)
-                        VALUES (?, ?, ?)
-                    ''', (routine_id, completion_date, is_done))
-                
+                cursor.execute(ROUTINE_COMPLETION_UPSERT, (routine_id, completion_date, is_done))
                 conn.commit()
                 return True
         except Exception as e:
             print(f"루틴 완료 상태 업데이트 오류: {e}")
             return False
+
+    def bulk_update_routine_completions(self, user_id: int, routine_ids: List[int], start_date: str, end_date: str,
+                                        is_done: bool = True) -> int:
+        """사용자의 여러 루틴의 기간 내 완료 상태를 한 트랜잭션으로 업데이트 (처리한 기록 수 반환)
+
+        루틴이 예정된 날짜(반복 규칙, 시작/종료일)만 기록하고, 다른 사용자의 루틴 id는 무시
+        """
+        try:
+            start = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
+            end = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
+            if end < start:
+                return 0
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                # SELECT 뒤 ON CONFLICT가 JOIN 조건으로 읽히지 않도록 WHERE를 둠
+                cursor.execute(f'''
+                    INSERT INTO routine_completions (routine_id, completion_date, is_done)
+                    WITH RECURSIVE days(day) AS (
+                        SELECT ?
+                        UNION ALL
+                        SELECT date(day, '+1 day') FROM days WHERE day < ?
+                    )
+                    SELECT r.id, days.day, ?
+                    FROM days
+                    JOIN routines r ON r.user_id = ? AND r.id IN (SELECT value FROM json_each(?)) AND {ROUTINE_OCCURS_ON_DAY}
+                    WHERE true
+                    ON CONFLICT (routine_id, completion_date)
+                    DO UPDATE SET is_done = excluded.is_done, created_at = CURRENT_TIMESTAMP
+                ''', (start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), is_done, user_id, json.dumps(routine_ids)))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"루틴 일괄 완료 처리 오류: {e}")
+            return 0
     
     def delete_routine(self, routine_id: int, user_id: int) -> bool:
-        """루틴 삭제"""
+        """루틴 삭제 (완료 기록 포함)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
+                # 통계 트리거가 루틴의 user_id를 참조하므로 완료 기록을 먼저 삭제
+                cursor.execute('''
+                    DELETE FROM routine_completions
+                    WHERE routine_id IN (SELECT id FROM routines WHERE id = ? AND user_id = ?)
+                ''', (routine_id, user_id))
                 cursor.execute('''
                     DELETE FROM routines 
                     WHERE id = ? AND user_id = ?
@@ -509,4 +1562,563 @@ class Database:
                 return cursor.rowcount > 0
         except Exception as e:
             print(f"루틴 삭제 오류: {e}")
-            return False 
\ No newline at end of file
+            return False
+
+    # AI 대화 기록
+    def add_conversation_turns(self, turns: List[Tuple[int, str, str]], summaries: Dict[int, str], max_turns: int) -> bool:
+        """여러 사용자의 대화 턴(user_id, role, content)과 요약을 한 트랜잭션으로 저장 (사용자별 최근 max_turns개만 유지)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO conversation_turns (user_id, role, content)
+                    VALUES (?, ?, ?)
+                ''', turns)
+                cursor.executemany('''
+                    DELETE FROM conversation_turns
+                    WHERE user_id = ? AND id <= (
+                        SELECT id FROM conversation_turns WHERE user_id = ?
+                        ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )
+                ''', [(user_id, user_id, max_turns) for user_id in {turn[0] for turn in turns}])
+                cursor.executemany('''
+                    INSERT INTO conversation_summaries (user_id, summary) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET summary = excluded.summary, updated_at = CURRENT_TIMESTAMP
+                ''', list(summaries.items()))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"대화 기록 저장 오류: {e}")
+            return False
+
+    def get_conversation_turns(self, user_id: int, limit: int) -> List[Dict]:
+        """최근 대화 턴 조회 (오래된 순서, role/content만)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT role, content FROM (
+                        SELECT id, role, content FROM conversation_turns
+                        WHERE user_id = ?
+                        ORDER BY id DESC LIMIT ?
+                    ) ORDER BY id ASC
+                ''', (user_id, limit))
+                return [{'role': role, 'content': content} for role, content in cursor.fetchall()]
+        except Exception as e:
+            print(f"대화 기록 조회 오류: {e}")
+            return []
+
+    def get_conversation_summary(self, user_id: int) -> str:
+        """밀려난 대화의 요약 조회 (없으면 빈 문자열)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT summary FROM conversation_summaries WHERE user_id = ?', (user_id,))
+                row = cursor.fetchone()
+                return row[0] if row else ""
+        except Exception as e:
+            print(f"대화 요약 조회 오류: {e}")
+            return ""
+
+    def set_conversation_summary(self, user_id: int, summary: str) -> bool:
+        """밀려난 대화의 요약 저장 (사용자당 하나)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO conversation_summaries (user_id, summary) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET summary = excluded.summary, updated_at = CURRENT_TIMESTAMP
+                ''', (user_id, summary))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"대화 요약 저장 오류: {e}")
+            return False
+
+    def clear_conversation_turns(self, user_id: int) -> bool:
+        """사용자의 대화 기록(요약 포함) 삭제"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM conversation_turns WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM conversation_summaries WHERE user_id = ?', (user_id,))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"대화 기록 삭제 오류: {e}")
+            return False
+
+    # 대화 흐름 상태 (persistence.py)
+    def get_persisted_user_data(self, user_id: int) -> Optional[str]:
+        """사용자 흐름 데이터(JSON) 조회"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT data FROM persisted_user_data WHERE user_id = ?', (user_id,))
+                row = cursor.fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            print(f"흐름 데이터 조회 오류: {e}")
+            return None
+
+    def get_persisted_user_ids(self) -> List[int]:
+        """흐름 데이터가 저장된 사용자 id 목록 (진행 중인 흐름이 있는 사용자만 남아 있음)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT user_id FROM persisted_user_data')
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"흐름 데이터 조회 오류: {e}")
+            return []
+
+    def get_persisted_conversations(self, name: str, since: float) -> List[Tuple[str, str]]:
+        """since 이후 갱신된 대화 상태 (conversation_key, state) 목록"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT conversation_key, state FROM persisted_conversations
+                    WHERE name = ? AND updated_at >= ?
+                ''', (name, since))
+                return cursor.fetchall()
+        except Exception as e:
+            print(f"대화 상태 조회 오류: {e}")
+            return []
+
+    def save_persisted_state(self, user_data: List[Tuple[int, Optional[str]]],
+                             conversations: List[Tuple[str, str, Optional[str]]], now: float) -> bool:
+        """모아둔 흐름 데이터/대화 상태를 한 트랜잭션으로 저장 (값이 None이면 삭제)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO persisted_user_data (user_id, data, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                ''', [(user_id, data, now) for user_id, data in user_data if data is not None])
+                cursor.executemany('DELETE FROM persisted_user_data WHERE user_id = ?',
+                                   [(user_id,) for user_id, data in user_data if data is None])
+                cursor.executemany('''
+                    INSERT INTO persisted_conversations (name, conversation_key, state, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (name, conversation_key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+                ''', [(name, key, state, now) for name, key, state in conversations if state is not None])
+                cursor.executemany('DELETE FROM persisted_conversations WHERE name = ? AND conversation_key = ?',
+                                   [(name, key) for name, key, state in conversations if state is None])
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"흐름 상태 저장 오류: {e}")
+            return False
+
+    def prune_persisted_state(self, before: float) -> int:
+        """before 이전에 멈춘 대화 상태와 흐름 데이터 삭제 (중단된 입력 흐름 만료)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM persisted_conversations WHERE updated_at < ?', (before,))
+                deleted = cursor.rowcount
+                cursor.execute('DELETE FROM persisted_user_data WHERE updated_at < ?', (before,))
+                conn.commit()
+                return deleted
+        except Exception as e:
+            print(f"흐름 상태 정리 오류: {e}")
+            return 0
+
+    # 리더 임대 (scale_out.py)
+    def acquire_lease(self, name: str, holder: str, now: float, ttl: float,
+                      update_offset: Optional[int] = None) -> Optional[int]:
+        """임대 획득/연장 후 저장된 업데이트 offset 반환 (다른 인스턴스가 만료 전 임대를 갖고 있으면 None)
+
+        update_offset을 주면 함께 저장해, 리더가 바뀌어도 다음 리더가 이어서 받음
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO leader_leases (name, holder, expires_at, update_offset) VALUES (?, ?, ?, COALESCE(?, 0))
+                    ON CONFLICT (name) DO UPDATE SET
+                        holder = excluded.holder, expires_at = excluded.expires_at,
+                        update_offset = COALESCE(?, leader_leases.update_offset)
+                    WHERE leader_leases.holder = excluded.holder OR leader_leases.expires_at < ?
+                ''', (name, holder, now + ttl, update_offset, update_offset, now))
+                acquired = cursor.rowcount > 0
+                cursor.execute('SELECT update_offset FROM leader_leases WHERE name = ?', (name,))
+                offset = cursor.fetchone()[0]
+                conn.commit()
+                return offset if acquired else None
+        except Exception as e:
+            print(f"리더 임대 오류: {e}")
+            return None
+
+    def release_lease(self, name: str, holder: str, update_offset: Optional[int] = None) -> bool:
+        """임대 반납 (다른 인스턴스가 바로 이어받을 수 있도록 만료 처리)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE leader_leases SET expires_at = 0, update_offset = COALESCE(?, update_offset)
+                    WHERE name = ? AND holder = ?
+                ''', (update_offset, name, holder))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            print(f"리더 임대 반납 오류: {e}")
+            return False
+
+    # AI 응답 캐시
+    def get_ai_cache(self, cache_key: str, now: float) -> Optional[Tuple[str, float]]:
+        """만료되지 않은 캐시 응답과 만료 시각 조회"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT response, expires_at FROM ai_response_cache
+                    WHERE cache_key = ? AND expires_at > ?
+                ''', (cache_key, now))
+                result = cursor.fetchone()
+                return (result[0], result[1]) if result else None
+        except Exception as e:
+            print(f"AI 캐시 조회 오류: {e}")
+            return None
+
+    def set_ai_cache(self, cache_key: str, response: str, expires_at: float) -> bool:
+        """캐시 응답 저장 (만료된 항목도 함께 정리)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO ai_response_cache (cache_key, response, expires_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (cache_key) DO UPDATE SET response = excluded.response, expires_at = excluded.expires_at
+                ''', (cache_key, response, expires_at))
+                cursor.execute("DELETE FROM ai_response_cache WHERE expires_at <= CAST(strftime('%s', 'now') AS REAL)")
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"AI 캐시 저장 오류: {e}")
+            return False
+
+    # 백그라운드 작업 큐
+    def enqueue_job(self, user_id: int, chat_id: int, command: str, payload: Optional[str], now: float) -> Optional[int]:
+        """작업 추가 후 작업 ID 반환 (같은 사용자/명령의 작업이 이미 대기/실행 중이면 0, 저장 오류면 None)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR IGNORE INTO background_jobs (user_id, chat_id, command, payload, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, chat_id, command, payload, now))
+                conn.commit()
+                return cursor.lastrowid if cursor.rowcount else 0
+        except Exception as e:
+            print(f"작업 추가 오류: {e}")
+            return None
+
+    def claim_job(self, now: float) -> Optional[Dict]:
+        """실행할 때가 된 가장 오래된 대기 작업을 실행 중으로 바꾸고 반환 (재시도 대기 중인 작업은 건너뜀)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE background_jobs
+                    SET status = 'running', started_at = ?, attempts = attempts + 1
+                    WHERE id = (SELECT id FROM background_jobs WHERE status = 'pending' AND available_at <= ?
+                                ORDER BY id LIMIT 1)
+                    RETURNING id, user_id, chat_id, command, payload, attempts, created_at
+                ''', (now, now))
+                result = cursor.fetchone()
+                conn.commit()
+                if not result:
+                    return None
+                return {
+                    'id': result[0], 'user_id': result[1], 'chat_id': result[2], 'command': result[3],
+                    'payload': result[4], 'attempts': result[5], 'created_at': result[6]
+                }
+        except Exception as e:
+            print(f"작업 가져오기 오류: {e}")
+            return None
+
+    def finish_job(self, job_id: int, status: str, error: Optional[str], now: float, retention: float,
+                   available_at: float = 0.0) -> bool:
+        """작업 종료 처리 (status: done/failed/pending), 보관 기간이 지난 종료 작업은 정리
+
+        pending(재시도)이면 available_at 이후에 다시 가져감
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE background_jobs SET status = ?, error = ?, finished_at = ?, available_at = ?
+                    WHERE id = ?
+                ''', (status, error, now if status != 'pending' else None, available_at, job_id))
+                cursor.execute('''
+                    DELETE FROM background_jobs
+                    WHERE status IN ('done', 'failed') AND finished_at < ?
+                ''', (now - retention,))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"작업 종료 처리 오류: {e}")
+            return False
+
+    def requeue_running_jobs(self) -> int:
+        """재시작 전에 실행 중이던 작업을 다시 대기 상태로"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE background_jobs SET status = 'pending' WHERE status = 'running'")
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"작업 재대기 처리 오류: {e}")
+            return 0
+
+    def get_job_stats(self, now: float) -> Dict:
+        """상태별 작업 수와 가장 오래 기다린 작업의 대기 시간(초)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT status, COUNT(*), MIN(created_at) FROM background_jobs GROUP BY status')
+                stats = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0, 'oldest_pending_age': 0.0}
+                for status, count, oldest in cursor.fetchall():
+                    stats[status] = count
+                    if status == 'pending' and oldest is not None:
+                        stats['oldest_pending_age'] = now - oldest
+                return stats
+        except Exception as e:
+            print(f"작업 통계 조회 오류: {e}")
+            return {'pending': 0, 'running': 0, 'done': 0, 'failed': 0, 'oldest_pending_age': 0.0}
+
+    def enqueue_jobs(self, jobs: List[Tuple[int, int, str, Optional[str]]], now: float) -> int:
+        """작업 여러 개를 한 트랜잭션으로 추가 (user_id, chat_id, command, payload), 추가된 수 반환"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO background_jobs (user_id, chat_id, command, payload, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [(*job, now) for job in jobs])
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"작업 일괄 추가 오류: {e}")
+            return 0
+
+    # 배치 회고 리포트
+    def get_reflection_user_ids(self, start_date: str, end_date: str, after_user_id: int, limit: int) -> List[int]:
+        """기간 내 회고를 쓴 사용자 ID를 after_user_id 다음부터 limit명 조회 (user_id 순 키셋 페이지)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT DISTINCT user_id FROM reflections
+                    WHERE user_id > ? AND date BETWEEN ? AND ?
+                    ORDER BY user_id
+                    LIMIT ?
+                ''', (after_user_id, start_date, end_date, limit))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"회고 사용자 조회 오류: {e}")
+            return []
+
+    def get_recent_reflections_for_users(self, user_ids: List[int], start_date: str, end_date: str,
+                                         per_user: int = 10) -> Dict[int, List[Dict]]:
+        """여러 사용자의 기간 내 최근 회고를 사용자별 per_user개씩 한 번에 조회 (get_reflections 일괄 버전)"""
+        reflections: Dict[int, List[Dict]] = {user_id: [] for user_id in user_ids}
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, user_id, type, content, date, created_at FROM (
+                        SELECT r.*, ROW_NUMBER() OVER (
+                            PARTITION BY r.user_id ORDER BY r.date DESC, r.created_at DESC
+                        ) AS rank
+                        FROM reflections r
+                        WHERE r.user_id IN (SELECT value FROM json_each(?)) AND r.date BETWEEN ? AND ?
+                    )
+                    WHERE rank <= ?
+                    ORDER BY user_id, rank
+                ''', (json.dumps(user_ids), start_date, end_date, per_user))
+                columns = [description[0] for description in cursor.description]
+                for row in cursor.fetchall():
+                    reflection = dict(zip(columns, row))
+                    reflections[reflection['user_id']].append(reflection)
+                return reflections
+        except Exception as e:
+            print(f"사용자별 회고 일괄 조회 오류: {e}")
+            return reflections
+
+    def claim_reflection_reports(self, user_ids: List[int], period_start: str, period_end: str) -> List[int]:
+        """리포트 행을 만들고 요청해야 할 사용자 ID 반환 (새 사용자, 배치에 못 들어간 대기 행, 실패한 행)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO reflection_reports (user_id, period_start, period_end)
+                    SELECT value, ?, ? FROM json_each(?) WHERE true
+                    ON CONFLICT (user_id, period_start) DO UPDATE SET status = 'pending', error = NULL, batch_id = NULL
+                    WHERE reflection_reports.status = 'failed'
+                        OR (reflection_reports.status = 'pending' AND reflection_reports.batch_id IS NULL)
+                    RETURNING user_id
+                ''', (period_start, period_end, json.dumps(user_ids)))
+                claimed = [row[0] for row in cursor.fetchall()]
+                conn.commit()
+                return claimed
+        except Exception as e:
+            print(f"리포트 대상 등록 오류: {e}")
+            return []
+
+    def add_report_batch(self, batch_id: str, period_start: str, period_end: str, input_file_id: str,
+                         status: str, user_ids: List[int], now: float) -> bool:
+        """제출한 배치를 기록하고 해당 사용자 리포트에 배치 ID 연결"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO report_batches (id, period_start, period_end, input_file_id, status, request_count, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (batch_id, period_start, period_end, input_file_id, status, len(user_ids), now))
+                cursor.execute('''
+                    UPDATE reflection_reports SET batch_id = ?
+                    WHERE period_start = ? AND user_id IN (SELECT value FROM json_each(?))
+                ''', (batch_id, period_start, json.dumps(user_ids)))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"배치 기록 오류: {e}")
+            return False
+
+    def get_open_report_batches(self) -> List[Dict]:
+        """결과를 아직 반영하지 않은 배치 목록"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM report_batches WHERE status != 'processed' ORDER BY created_at")
+                columns = [description[0] for description in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"배치 목록 조회 오류: {e}")
+            return []
+
+    def update_report_batch(self, batch_id: str, status: str, output_file_id: Optional[str] = None,
+                            error_file_id: Optional[str] = None, now: Optional[float] = None) -> bool:
+        """배치 상태 갱신 (now를 넘기면 종료 시각 기록)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE report_batches
+                    SET status = ?, output_file_id = COALESCE(?, output_file_id),
+                        error_file_id = COALESCE(?, error_file_id), finished_at = COALESCE(?, finished_at)
+                    WHERE id = ?
+                ''', (status, output_file_id, error_file_id, now, batch_id))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"배치 상태 갱신 오류: {e}")
+            return False
+
+    def save_reflection_reports(self, batch_id: str, results: List[Tuple[int, str, Optional[str], Optional[str]]]) -> bool:
+        """배치 결과 저장 (user_id, period_start, 리포트, 오류) - 리포트가 있으면 done, 없으면 failed"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    UPDATE reflection_reports
+                    SET status = CASE WHEN ?1 IS NULL THEN 'failed' ELSE 'done' END, report = ?1, error = ?2
+                    WHERE user_id = ?3 AND period_start = ?4 AND batch_id = ?5 AND status = 'pending'
+                ''', [(report, error, user_id, period_start, batch_id) for user_id, period_start, report, error in results])
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"리포트 저장 오류: {e}")
+            return False
+
+    def fail_pending_reports(self, batch_id: str, error: str) -> int:
+        """배치에서 결과가 오지 않은 리포트를 실패 처리 (다음 실행 때 다시 요청)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE reflection_reports SET status = 'failed', error = ?
+                    WHERE batch_id = ? AND status = 'pending'
+                ''', (error, batch_id))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"리포트 실패 처리 오류: {e}")
+            return 0
+
+    def get_undelivered_reports(self, user_id: int) -> List[Dict]:
+        """아직 전달하지 않은 완료 리포트 (오래된 기간부터)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, period_start, period_end, report FROM reflection_reports
+                    WHERE user_id = ? AND status = 'done' AND delivered_at IS NULL
+                    ORDER BY period_start
+                ''', (user_id,))
+                columns = [description[0] for description in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"리포트 조회 오류: {e}")
+            return []
+
+    def mark_reports_delivered(self, report_ids: List[int]) -> bool:
+        """리포트 전달 완료 기록"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('UPDATE reflection_reports SET delivered_at = CURRENT_TIMESTAMP WHERE id = ?',
+                                   [(report_id,) for report_id in report_ids])
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"리포트 전달 기록 오류: {e}")
+            return False
+
+class AsyncDatabase:
+    """Database의 코루틴 버전 (쓰기는 전용 스레드 1개, 조회는 리더 스레드 풀에서 실행)"""
+
+    # 리더 풀에서 동시에 실행해도 되는 조회 메서드
+    READ_METHODS = {
+        'get_schedules', 'get_reflections', 'get_feedback', 'get_notifications',
+        'get_last_schedule_id', 'get_schedule_stats', 'get_reflection_stats',
+        'get_stats_summary', 'check_daily_stats',
+        'get_routines', 'get_today_routines', 'get_routines_for_date',
+        'get_routines_for_range', 'get_conversation_turns', 'get_conversation_summary', 'get_ai_cache', 'get_job_stats', 'get_pool_stats',
+        'get_daily_digests', 'get_user_timezone', 'get_notification_timezones',
+        'get_reflection_user_ids', 'get_recent_reflections_for_users', 'get_open_report_batches',
+        'get_undelivered_reports', 'search_reflections', 'get_reflections_page', 'get_schedules_page',
+        'get_reflections_after', 'get_reflections_by_ids', 'get_reindex_reflections',
+        'get_persisted_user_data', 'get_persisted_user_ids', 'get_persisted_conversations',
+    }
+
+    def __init__(self, db: Optional[Database] = None, readers: int = DB_READER_THREADS):
+        self.db = db or Database()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+
+    def __getattr__(self, name):
+        # Database의 공개 메서드를 같은 이름의 코루틴으로 노출
+        if name == 'db' or name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+        executor = self._readers if name in self.READ_METHODS else self._writer
+
+        async def method(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(attr, *args, **kwargs))
+
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    def close(self):
+        """스레드 풀 및 연결 종료"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.db.close()
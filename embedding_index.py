@@ -0,0 +1,347 @@
+"""
+회고 임베딩 색인
+회고를 벡터로 바꿔 디스크의 float32 배열 파일에 순서대로 덧붙이고(memory-mapped),
+AI 프롬프트에 넣을 관련 과거 회고를 찾습니다. numpy가 없으면 사용하지 않습니다.
+"""
+
+import os
+import re
+import json
+import zlib
+import asyncio
+from typing import Dict, List, Optional, Sequence, Tuple
+from ai_executor import estimate_tokens
+from config import (EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_DIM, EMBEDDING_BATCH_SIZE,
+                    RETRIEVAL_TOP_K, RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_ITEM_CHARS)
+
+try:
+    import numpy as np
+except ImportError:  # numpy가 없으면 관련 회고 검색 없이 최근 회고만 사용
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: 프로세스 간 잠금 없이 사용 (한 프로세스에서만 덧붙임)
+    fcntl = None
+
+def format_reflection_line(reflection: Dict, max_chars: int = RETRIEVAL_ITEM_CHARS) -> str:
+    """프롬프트에 넣는 회고 한 줄"""
+    content = reflection['content']
+    if len(content) > max_chars:
+        content = content[:max_chars] + "..."
+    return f"[{reflection['date']}] {reflection['type']}: {content}"
+
+class HashingEmbedder:
+    """글자 2/3-gram을 해시해 고정 차원에 누적하는 로컬 임베딩 (API 호출 없음, 같은 입력은 항상 같은 벡터)"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-v1:{dim}"
+
+    def _vector(self, text: str):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r'\w+', text.lower()):
+            padded = f" {word} "
+            for n in (2, 3):
+                for i in range(len(padded) - n + 1):
+                    # 파이썬 hash()는 실행마다 달라서 crc32 사용, 최상위 비트로 부호 결정
+                    h = zlib.crc32(padded[i:i + n].encode('utf-8'))
+                    vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vector
+
+    async def embed(self, texts: Sequence[str]):
+        vectors = np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        return _normalize(vectors)
+
+class OpenAIEmbedder:
+    """OpenAI 임베딩 API (executor를 넘기면 AIHelper와 같은 요청 한도/재시도 적용)"""
+
+    def __init__(self, client, model: str = EMBEDDING_MODEL, dim: int = EMBEDDING_DIM, executor=None):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.executor = executor
+        self.name = f"openai:{model}:{dim}"
+
+    async def embed(self, texts: Sequence[str]):
+        if not texts:
+            return np.zeros((0, self.dim), np.float32)
+
+        def request():
+            return self.client.embeddings.create(model=self.model, input=list(texts), dimensions=self.dim)
+
+        if self.executor is not None:
+            response = await self.executor.run(request, sum(len(text) for text in texts) // 2)
+        else:
+            response = await request()
+        vectors = np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype=np.float32)
+        return _normalize(vectors)
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+def make_embedder(client=None, executor=None):
+    """설정(EMBEDDING_BACKEND)에 맞는 임베딩 (openai인데 클라이언트가 없으면 로컬 임베딩)"""
+    if EMBEDDING_BACKEND == 'openai' and client is not None:
+        return OpenAIEmbedder(client, executor=executor)
+    return HashingEmbedder()
+
+class EmbeddingIndex:
+    """디스크 벡터 색인: vectors.f32 (N x dim float32), ids.i64 (N x [reflection_id, user_id])
+
+    회고 id 순서로만 덧붙이므로 ids는 정렬되어 있고, 마지막 id 이후 회고만 추가하면 됨 (수정된 회고는 제자리에서 바꿈).
+    파일은 memory-mapped로 읽어 프로세스 메모리에 전체를 올리지 않음.
+    여러 프로세스가 함께 쓸 때는 acquire()/release() 사이에서만 덧붙임 (scale_out.py 워커).
+    """
+
+    def __init__(self, path: str, dim: int, embedder_name: str):
+        self.path = path
+        self.dim = dim
+        self.embedder_name = embedder_name
+        self._vectors = None
+        self._ids = None
+        self._count = -1  # 아직 파일을 열지 않음
+        self._lock_file = None
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _open(self):
+        """파일 확인 (임베딩 종류가 바뀌었으면 비우고, 쓰다 중단된 꼬리는 잘라냄)"""
+        os.makedirs(self.path, exist_ok=True)
+        meta = {'dim': self.dim, 'embedder': self.embedder_name}
+        try:
+            with open(self._file('meta.json'), encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = None
+        if stored != meta:
+            for name in ('vectors.f32', 'ids.i64'):
+                open(self._file(name), 'wb').close()
+            with open(self._file('meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        for name in ('vectors.f32', 'ids.i64'):
+            if not os.path.exists(self._file(name)):
+                open(self._file(name), 'wb').close()
+        count = min(os.path.getsize(self._file('vectors.f32')) // (4 * self.dim),
+                    os.path.getsize(self._file('ids.i64')) // 16)
+        os.truncate(self._file('vectors.f32'), count * 4 * self.dim)
+        os.truncate(self._file('ids.i64'), count * 16)
+        if count != self._count:
+            self._count = count
+            self._map()
+
+    def acquire(self):
+        """프로세스 간 쓰기 잠금 후 다른 프로세스가 덧붙인 벡터까지 다시 읽음 (잠금을 기다리며 블로킹)"""
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = open(self._file('lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self._open()
+
+    def release(self):
+        """쓰기 잠금 해제 (파일을 닫으면 잠금도 풀림)"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _map(self):
+        if self._count == 0:
+            self._vectors = np.zeros((0, self.dim), np.float32)
+            self._ids = np.zeros((0, 2), np.int64)
+            return
+        self._vectors = np.memmap(self._file('vectors.f32'), dtype=np.float32, mode='r', shape=(self._count, self.dim))
+        self._ids = np.memmap(self._file('ids.i64'), dtype=np.int64, mode='r', shape=(self._count, 2))
+
+    def __len__(self) -> int:
+        if self._count < 0:
+            self._open()
+        return self._count
+
+    @property
+    def last_id(self) -> int:
+        """색인된 마지막 회고 id (없으면 0)"""
+        return int(self._ids[-1, 0]) if len(self) else 0
+
+    def append(self, reflection_ids: Sequence[int], user_ids: Sequence[int], vectors):
+        """벡터 덧붙이기 (reflection_ids는 last_id보다 큰 오름차순이어야 함)"""
+        if len(self) and reflection_ids and reflection_ids[0] <= self.last_id:
+            raise ValueError("이미 색인된 회고 id입니다.")
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = np.array([reflection_ids, user_ids], dtype=np.int64).T
+        # 벡터를 먼저 쓰고 id를 나중에 써서, 중간에 중단되면 다음 _open에서 짝이 맞는 곳까지 잘라냄
+        with open(self._file('vectors.f32'), 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(self._file('ids.i64'), 'ab') as f:
+            f.write(np.ascontiguousarray(ids).tobytes())
+        self._count += len(reflection_ids)
+        self._map()
+
+    def replace(self, reflection_ids: Sequence[int], vectors) -> int:
+        """이미 색인된 회고의 벡터를 제자리에서 바꿈 (색인에 없는 id는 건너뜀, 바꾼 수 반환)"""
+        if not len(self) or not reflection_ids:
+            return 0
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = self._ids[:, 0]
+        positions = np.searchsorted(ids, np.asarray(reflection_ids, dtype=np.int64))
+        replaced = 0
+        with open(self._file('vectors.f32'), 'r+b') as f:
+            for reflection_id, position, vector in zip(reflection_ids, positions, vectors):
+                if position >= len(ids) or ids[position] != reflection_id:
+                    continue
+                f.seek(int(position) * 4 * self.dim)
+                f.write(vector.tobytes())
+                replaced += 1
+        self._map()
+        return replaced
+
+    def vectors_for(self, reflection_ids: Sequence[int]):
+        """색인된 회고의 벡터 (id가 정렬되어 있어 이진 탐색)"""
+        if not len(self) or not reflection_ids:
+            return np.zeros((0, self.dim), np.float32)
+        ids = self._ids[:, 0]
+        wanted = np.asarray(reflection_ids, dtype=np.int64)
+        positions = np.searchsorted(ids, wanted)
+        positions = positions[(positions < len(ids))]
+        positions = positions[np.isin(ids[positions], wanted)]
+        return np.asarray(self._vectors[positions])
+
+    def search(self, query, k: int, user_id: Optional[int] = None,
+               exclude_ids: Sequence[int] = ()) -> List[Tuple[int, float]]:
+        """코사인 유사도 상위 k개 (reflection_id, 점수), user_id를 주면 그 사용자 회고 중에서만"""
+        if not len(self) or k <= 0:
+            return []
+        positions = None
+        if user_id is not None:
+            positions = np.flatnonzero(self._ids[:, 1] == user_id)
+            if exclude_ids:
+                positions = positions[~np.isin(self._ids[positions, 0], np.asarray(exclude_ids, dtype=np.int64))]
+            if not len(positions):
+                return []
+            scores = self._vectors[positions] @ query
+        else:
+            scores = self._vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if positions is not None:
+            rows = positions[top]
+        else:
+            rows = top
+        return [(int(self._ids[row, 0]), float(scores[index])) for row, index in zip(rows, top)]
+
+class ReflectionMemory:
+    """새 회고를 색인에 덧붙이고, 분석 프롬프트에 넣을 관련 과거 회고를 토큰 예산 안에서 고름"""
+
+    def __init__(self, db, index: EmbeddingIndex, embedder, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.db = db  # AsyncDatabase
+        self.index = index
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False  # 색인 중에 추가/수정된 회고가 있음
+
+    @classmethod
+    def create(cls, db, path: str, client=None, executor=None) -> Optional["ReflectionMemory"]:
+        """numpy가 없으면 None"""
+        if np is None:
+            return None
+        embedder = make_embedder(client, executor)
+        return cls(db, EmbeddingIndex(path, embedder.dim, embedder.name), embedder)
+
+    async def sync(self) -> int:
+        """마지막으로 색인한 회고 이후 회고를 배치로 임베딩해 덧붙이고 수정된 회고는 다시 계산, 추가/갱신한 수 반환"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        added = 0
+        async with self._lock:
+            await asyncio.to_thread(self.index.acquire)
+            try:
+                while True:
+                    last_id = self.index.last_id
+                    rows = await self.db.get_reflections_after(last_id, self.batch_size)
+                    if not rows:
+                        break
+                    vectors = await self.embedder.embed([row['content'] for row in rows])
+                    await asyncio.to_thread(self.index.append, [row['id'] for row in rows],
+                                            [row['user_id'] for row in rows], vectors)
+                    added += len(rows)
+                while True:
+                    rows = await self.db.get_reindex_reflections(self.batch_size)
+                    if not rows:
+                        return added
+                    edited = [row for row in rows if row['content'] is not None]  # 삭제된 회고는 검색 때 건너뜀
+                    if edited:
+                        vectors = await self.embedder.embed([row['content'] for row in edited])
+                        added += await asyncio.to_thread(self.index.replace, [row['id'] for row in edited], vectors)
+                    if not await self.db.clear_reindex_reflections([row['seq'] for row in rows]):
+                        return added
+            finally:
+                self.index.release()
+
+    def notify(self):
+        """회고 추가/수정 후 호출 (백그라운드에서 색인, 이미 진행 중이면 그 작업이 이어서 처리)"""
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sync_quietly())
+
+    async def _sync_quietly(self):
+        while self._dirty:
+            self._dirty = False
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"회고 색인 오류: {e}")
+                return
+
+    async def related(self, user_id: int, recent: List[Dict], k: int = RETRIEVAL_TOP_K,
+                      token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List[Dict]:
+        """최근 회고(recent)와 주제가 비슷한 과거 회고를 점수순으로 골라 token_budget 안에서 날짜순으로 반환"""
+        if not recent:
+            return []
+        try:
+            await self.sync()
+            recent_ids = [reflection['id'] for reflection in recent]
+            vectors = await asyncio.to_thread(self.index.vectors_for, recent_ids)
+            if len(vectors) == 0:
+                vectors = await self.embedder.embed([reflection['content'] for reflection in recent])
+            # 최근 회고 벡터의 평균 방향 = 요즘 쓰는 주제
+            query = _normalize(vectors.mean(axis=0, keepdims=True))[0]
+            return await self._select(user_id, query, k, token_budget, recent_ids)
+        except Exception as e:
+            print(f"관련 회고 검색 오류: {e}")
+            return []
+
+    async def related_to_text(self, user_id: int, text: str, k: int = RETRIEVAL_TOP_K,
+                              token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List[Dict]:
+        """입력한 글(text)과 주제가 비슷한 과거 회고 (묵상 대화 등에 함께 넣을 자료)"""
+        if not text.strip():
+            return []
+        try:
+            await self.sync()
+            query = (await self.embedder.embed([text]))[0]
+            return await self._select(user_id, query, k, token_budget)
+        except Exception as e:
+            print(f"관련 회고 검색 오류: {e}")
+            return []
+
+    async def _select(self, user_id: int, query, k: int, token_budget: int,
+                      exclude_ids: Sequence[int] = ()) -> List[Dict]:
+        hits = await asyncio.to_thread(self.index.search, query, k, user_id, exclude_ids)
+        if not hits:
+            return []
+        rows = {row['id']: row for row in await self.db.get_reflections_by_ids(user_id, [hit[0] for hit in hits])}
+        selected, used = [], 0
+        for reflection_id, score in hits:
+            row = rows.get(reflection_id)  # 삭제된 회고는 건너뜀
+            if row is None:
+                continue
+            cost = estimate_tokens([{'content': format_reflection_line(row)}], 0)
+            if used + cost > token_budget:
+                continue
+            used += cost
+            selected.append(dict(row, score=round(score, 4)))
+        return sorted(selected, key=lambda row: (row['date'], row['id']))
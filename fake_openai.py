@@ -0,0 +1,219 @@
+"""
+로컬 가짜 OpenAI API 서버
+테스트/벤치마크에서 실제 API 대신 openai.AsyncOpenAI(base_url=server.base_url)로 사용합니다.
+배치 API(/files, /batches)도 흉내 내며, 배치는 batch_polls번 조회된 뒤 완료됩니다.
+"""
+
+import json
+import time
+import zlib
+import base64
+from array import array
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Set
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"  # 스트리밍 응답은 연결 종료로 끝을 알림
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_bytes(self, data: bytes):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _multipart_fields(self, raw: bytes) -> Dict[str, bytes]:
+        """multipart/form-data 본문 -> {필드 이름: 값}"""
+        message = BytesParser().parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + raw)
+        return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                for part in message.get_payload()}
+
+    def do_GET(self):
+        server: "FakeOpenAIServer" = self.server.owner
+        server.requests.append({'path': self.path, 'body': {}, 'bytes': 0})
+        parts = self.path.strip('/').split('/')  # v1/batches/{id}, v1/files/{id}/content
+        if len(parts) == 3 and parts[1] == 'batches' and parts[2] in server.batches:
+            self._send_json(200, server.poll_batch(parts[2]))
+        elif len(parts) == 4 and parts[1] == 'files' and parts[3] == 'content' and parts[2] in server.files:
+            self._send_bytes(server.files[parts[2]])
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        server: "FakeOpenAIServer" = self.server.owner
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length)
+        # 음성 변환/파일 업로드 요청은 multipart라 본문은 기록하지 않음 (크기만 기록)
+        body = json.loads(raw or b'{}') if 'json' in self.headers.get('Content-Type', '') else {}
+        server.requests.append({'path': self.path, 'body': body, 'bytes': len(raw)})
+        if server.failures:
+            # 주입된 오류 응답 (상태 코드 또는 (상태 코드, 오류 코드))
+            failure = server.failures.pop(0)
+            status, code = failure if isinstance(failure, tuple) else (failure, None)
+            self._send_json(status, {'error': {'message': f"fake error {status}", 'type': 'fake_error', 'code': code}})
+            return
+        if self.path.endswith('/chat/completions'):
+            if body.get('stream'):
+                self._stream_chat(server, body)
+            else:
+                time.sleep(server.response_delay)
+                self._send_json(200, server.chat_completion(body))
+        elif self.path.endswith('/embeddings'):
+            self._send_json(200, server.embeddings(body))
+        elif self.path.endswith('/audio/transcriptions'):
+            self._send_json(200, {'text': server.transcription})
+        elif self.path.endswith('/files'):
+            fields = self._multipart_fields(raw)
+            self._send_json(200, server.add_file(fields['file'], fields['purpose'].decode('utf-8')))
+        elif self.path.endswith('/batches'):
+            self._send_json(200, server.create_batch(body))
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def _stream_chat(self, server: "FakeOpenAIServer", body: Dict[str, Any]):
+        """토큰마다 token_delay초 간격으로 SSE 청크 전송"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for token in server.tokens:
+            time.sleep(server.token_delay)
+            chunk = {
+                'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': body.get('model', ''),
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+class FakeOpenAIServer:
+    """별도 스레드에서 동작하는 가짜 OpenAI 서버"""
+
+    def __init__(self, tokens: List[str] = None, token_delay: float = 0.0, transcription: str = "음성 변환 결과",
+                 response_delay: float = 0.0):
+        self.tokens = tokens or ["안녕", "하세요"]
+        self.response_delay = response_delay  # 스트리밍이 아닌 응답의 지연(초)
+        self.transcription = transcription
+        self.token_delay = token_delay
+        self.requests: List[Dict[str, Any]] = []
+        self.failures: List[Any] = []  # 다음 요청들에 순서대로 돌려줄 오류
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.batch_polls = 1  # 배치가 완료되기 전까지 in_progress로 응답하는 조회 횟수
+        self.batch_failures: Set[str] = set()  # 오류 파일로 보낼 요청의 custom_id
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def chat_completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', ''),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': ''.join(self.tokens)}}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': len(self.tokens), 'total_tokens': 1 + len(self.tokens)},
+        }
+
+    def embeddings(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """입력마다 같은 값이 나오는 벡터 (crc32 위치에 1.0), base64 요청이면 float32 바이트로"""
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        dim = body.get('dimensions') or 8
+        data = []
+        for index, text in enumerate(inputs):
+            vector = [0.0] * dim
+            vector[zlib.crc32(text.encode('utf-8')) % dim] = 1.0
+            if body.get('encoding_format') == 'base64':
+                embedding = base64.b64encode(array('f', vector).tobytes()).decode('ascii')
+            else:
+                embedding = vector
+            data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+        return {'object': 'list', 'data': data, 'model': body.get('model', ''),
+                'usage': {'prompt_tokens': len(inputs), 'total_tokens': len(inputs)}}
+
+    def add_file(self, data: bytes, purpose: str) -> Dict[str, Any]:
+        with self._lock:
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = data
+        return {'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                'filename': f"{file_id}.jsonl", 'purpose': purpose, 'status': 'processed'}
+
+    def create_batch(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            batch_id = f"batch_{len(self.batches) + 1}"
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': body['endpoint'], 'errors': None,
+                'input_file_id': body['input_file_id'], 'completion_window': body['completion_window'],
+                'status': 'validating', 'output_file_id': None, 'error_file_id': None,
+                'created_at': int(time.time()), 'metadata': body.get('metadata'), 'polls': 0,
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            }
+            return self._batch_view(batch_id)
+
+    def poll_batch(self, batch_id: str) -> Dict[str, Any]:
+        """조회할 때마다 진행, batch_polls번 이후 입력 파일의 요청을 처리해 결과/오류 파일 생성"""
+        with self._lock:
+            batch = self.batches[batch_id]
+            batch['polls'] += 1
+            if batch['status'] != 'completed':
+                if batch['polls'] <= self.batch_polls:
+                    batch['status'] = 'in_progress'
+                else:
+                    self._complete_batch(batch)
+            return self._batch_view(batch_id)
+
+    def _complete_batch(self, batch: Dict[str, Any]):
+        outputs, errors = [], []
+        for line in self.files[batch['input_file_id']].splitlines():
+            request = json.loads(line)
+            if request['custom_id'] in self.batch_failures:
+                errors.append({'id': f"batch_req_{len(errors)}", 'custom_id': request['custom_id'], 'error': None,
+                               'response': {'status_code': 500, 'request_id': 'req-fake',
+                                            'body': {'error': {'message': 'fake batch error', 'type': 'server_error'}}}})
+            else:
+                outputs.append({'id': f"batch_req_{len(outputs)}", 'custom_id': request['custom_id'], 'error': None,
+                                'response': {'status_code': 200, 'request_id': 'req-fake',
+                                             'body': self.chat_completion(request['body'])}})
+        for key, items in (('output_file_id', outputs), ('error_file_id', errors)):
+            if items:
+                file_id = f"file-{len(self.files) + 1}"
+                self.files[file_id] = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode('utf-8')
+                batch[key] = file_id
+        batch['status'] = 'completed'
+        batch['request_counts'] = {'total': len(outputs) + len(errors), 'completed': len(outputs), 'failed': len(errors)}
+
+    def _batch_view(self, batch_id: str) -> Dict[str, Any]:
+        return {key: value for key, value in self.batches[batch_id].items() if key != 'polls'}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
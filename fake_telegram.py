@@ -0,0 +1,163 @@
+"""
+로컬 가짜 텔레그램 Bot API 서버
+테스트/벤치마크에서 Bot(token, base_url=server.base_url, base_file_url=server.base_file_url)로 사용합니다.
+"""
+
+import json
+import time
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Set
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 연결 재사용 (모든 응답에 Content-Length 포함)
+    disable_nagle_algorithm = True  # 헤더와 본문을 나눠 쓸 때 지연 ACK로 응답이 늦어지지 않도록
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, data: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reply(self, result: Any):
+        self._send(200, json.dumps({'ok': True, 'result': result}, ensure_ascii=False).encode('utf-8'))
+
+    def _error(self, status: int, description: str, parameters: Dict[str, Any] = None):
+        body = {'ok': False, 'error_code': status, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        self._send(status, json.dumps(body).encode('utf-8'))
+
+    def _params(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if 'json' in content_type:
+            return json.loads(raw or b'{}')
+        if 'x-www-form-urlencoded' in content_type:
+            return {key: values[0] for key, values in parse_qs(raw.decode('utf-8')).items()}
+        return {}
+
+    def do_GET(self):
+        server: "FakeTelegramServer" = self.server.owner
+        prefix = f"/file/bot{server.token}/"
+        if self.path.startswith(prefix) and self.path[len(prefix):] in server.files:
+            server.downloads.append(self.path[len(prefix):])
+            self._send(200, server.files[self.path[len(prefix):]], 'application/octet-stream')
+        else:
+            self._error(404, "Not Found")
+
+    def do_POST(self):
+        server: "FakeTelegramServer" = self.server.owner
+        method = self.path.rsplit('/', 1)[-1]
+        params = self._params()
+        with server.lock:
+            server.calls.append((method, params, time.monotonic()))
+        if method == 'getMe':
+            self._reply({'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'})
+        elif method == 'getUpdates':
+            self._reply(server.poll_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0)))
+        elif method == 'getFile':
+            file_path = server.file_paths.get(params.get('file_id'))
+            if file_path is None:
+                self._error(400, "Bad Request: invalid file_id")
+                return
+            result = {'file_id': params['file_id'], 'file_unique_id': params['file_id'], 'file_path': file_path}
+            if server.report_file_size:
+                result['file_size'] = len(server.files[file_path])
+            self._reply(result)
+        elif method in ('sendMessage', 'editMessageText'):
+            if server.latency:
+                time.sleep(server.latency)
+            with server.lock:
+                failure = server.failures.pop(0) if server.failures else None
+            if failure is not None:
+                # 주입된 오류 응답 (상태 코드 또는 (429, retry_after))
+                status, retry_after = failure if isinstance(failure, tuple) else (failure, None)
+                if status == 429:
+                    self._error(429, f"Too Many Requests: retry after {retry_after}", {'retry_after': retry_after})
+                else:
+                    self._error(status, f"fake error {status}")
+                return
+            if int(params.get('chat_id', 0)) in server.blocked_chats:
+                self._error(403, "Forbidden: bot was blocked by the user")
+                return
+            with server.lock:
+                server.message_id += 1
+                message_id = int(params.get('message_id', server.message_id))
+            self._reply({'message_id': message_id, 'date': int(time.time()),
+                         'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                         'text': params.get('text', '')})
+        else:
+            self._reply(True)
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # 동시 연결이 많은 부하 테스트용
+
+class FakeTelegramServer:
+    """별도 스레드에서 동작하는 가짜 텔레그램 서버 (getMe/getUpdates/getFile/파일 다운로드/메시지 전송, 오류 주입)"""
+
+    def __init__(self, token: str = "123:TEST"):
+        self.token = token
+        self.files: Dict[str, bytes] = {}  # file_path -> 내용
+        self.file_paths: Dict[str, str] = {}  # file_id -> file_path
+        self.calls: List[tuple] = []  # (메서드, 파라미터, 시각)
+        self.downloads: List[str] = []
+        self.message_id = 0
+        self.report_file_size = True  # False면 getFile 응답에서 file_size 생략
+        self.failures: List[Any] = []  # 다음 메시지 전송 요청들에 순서대로 돌려줄 오류
+        self.blocked_chats: Set[int] = set()  # 403(봇 차단)을 돌려줄 chat_id
+        self.latency = 0.0  # 메시지 전송 응답 지연(초), 실제 텔레그램 왕복 시간 흉내
+        self.lock = threading.Lock()
+        self.updates: List[Dict[str, Any]] = []  # getUpdates로 돌려줄 업데이트 (offset으로 확인되면 삭제)
+        self._new_updates = threading.Condition(self.lock)
+        self._httpd = _Server(('127.0.0.1', 0), _Handler)
+        self._httpd.owner = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/file/bot"
+
+    def add_file(self, file_id: str, file_path: str, content: bytes):
+        """getFile/다운로드로 제공할 파일 등록"""
+        self.file_paths[file_id] = file_path
+        self.files[file_path] = content
+
+    def add_update(self, update: Dict[str, Any]):
+        """getUpdates로 받을 업데이트 추가"""
+        with self.lock:
+            self.updates.append(update)
+            self._new_updates.notify_all()
+
+    def poll_updates(self, offset: int, timeout: float, limit: int = 100) -> List[Dict[str, Any]]:
+        """offset보다 앞선 업데이트는 확인된 것으로 보고 삭제, 없으면 timeout까지 대기 (롱 폴링)"""
+        with self.lock:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            if not self.updates and timeout > 0:
+                self._new_updates.wait(min(timeout, 1.0))
+            return self.updates[:limit]
+
+    def start(self) -> "FakeTelegramServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeTelegramServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
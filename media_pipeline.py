@@ -0,0 +1,138 @@
+import io
+import math
+import time
+import asyncio
+import contextlib
+from typing import Any, Dict, Iterator, Optional, Sequence
+import httpx
+from config import VOICE_MAX_BYTES, IMAGE_MIN_SIDE, IMAGE_MAX_PIXELS, IMAGE_JPEG_QUALITY
+
+try:
+    from PIL import Image
+except ImportError:  # requirements.txt에 포함, 설치되지 않은 환경에서는 텔레그램이 만든 JPEG를 그대로 사용
+    Image = None
+
+IMAGE_MAX_BYTES = 20 * 1024 * 1024  # 텔레그램 봇 다운로드 한도
+
+class MediaTooLargeError(Exception):
+    """허용 크기를 넘는 미디어 파일"""
+
+class StageTimer:
+    """파이프라인 단계별 소요 시간(ms) 기록"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (time.perf_counter() - began) * 1000
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {ms:.0f}ms" for name, ms in self.timings.items())
+
+def select_photo_size(photo_sizes: Sequence, min_side: int = IMAGE_MIN_SIDE):
+    """긴 변이 min_side 이상인 사진 중 가장 작은 것 (없으면 가장 큰 것)"""
+    ordered = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if max(size.width, size.height) >= min_side:
+            return size
+    return ordered[-1]
+
+def downscale_image(data: bytes, max_pixels: int = IMAGE_MAX_PIXELS, quality: int = IMAGE_JPEG_QUALITY) -> bytes:
+    """픽셀 예산에 맞게 축소하고 메타데이터 없이 JPEG로 재압축 (Pillow가 없거나 열 수 없으면 원본 반환)"""
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            resized = width * height > max_pixels
+            has_metadata = bool(image.getexif()) or bool(image.info.get('exif'))
+            if resized:
+                scale = math.sqrt(max_pixels / (width * height))
+                image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+            output = io.BytesIO()
+            # EXIF 등 메타데이터는 넘기지 않으므로 저장 시 제거됨
+            image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        print(f"이미지 축소 오류: {e}")
+        return data
+    result = output.getvalue()
+    # 축소했거나 EXIF(위치 정보 등)가 있으면 더 커지더라도 재압축한 이미지를 사용
+    return result if resized or has_metadata or len(result) < len(data) else data
+
+class MediaPipeline:
+    """텔레그램 미디어를 디스크를 거치지 않고 메모리로 받아 AI 분석까지 처리"""
+
+    def __init__(self, ai_helper, max_voice_bytes: int = VOICE_MAX_BYTES):
+        self.ai_helper = ai_helper
+        self.max_voice_bytes = max_voice_bytes
+        self._http: Optional[httpx.AsyncClient] = None  # 다운로드용 연결 재사용
+
+    async def fetch(self, bot, file_id: str, max_bytes: int) -> bytes:
+        """텔레그램 파일을 청크 단위로 받아 메모리에 보관 (max_bytes를 넘으면 즉시 중단)"""
+        tg_file = await bot.get_file(file_id)
+        if tg_file.file_size and tg_file.file_size > max_bytes:
+            raise MediaTooLargeError(f"파일 크기 {tg_file.file_size}바이트가 제한 {max_bytes}바이트를 넘습니다.")
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=30.0)
+        chunks = []
+        received = 0
+        async with self._http.stream("GET", tg_file.file_path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                if received > max_bytes:
+                    raise MediaTooLargeError(f"파일 크기가 제한 {max_bytes}바이트를 넘습니다.")
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def process_voice(self, bot, voice) -> Dict[str, Any]:
+        """음성 다운로드 -> 텍스트 변환 -> 회고 분석 (단계별 소요 시간 포함)"""
+        timer = StageTimer()
+        if voice.file_size and voice.file_size > self.max_voice_bytes:
+            raise MediaTooLargeError(f"음성 크기 {voice.file_size}바이트가 제한 {self.max_voice_bytes}바이트를 넘습니다.")
+        with timer.stage("download"):
+            audio = await self.fetch(bot, voice.file_id, self.max_voice_bytes)
+        with timer.stage("transcribe"):
+            transcription = await self.ai_helper.transcribe_voice(audio, "voice.ogg")
+        analysis = ""
+        if transcription:
+            with timer.stage("analyze"):
+                analysis = await self.ai_helper.analyze_voice_reflection(transcription)
+        return {
+            'transcription': transcription,
+            'analysis': analysis,
+            'bytes': len(audio),
+            'timings': timer.timings,
+            'summary': timer.summary(),
+        }
+
+    async def process_image(self, bot, photo_sizes: Sequence) -> Dict[str, Any]:
+        """적당한 크기 선택 -> 다운로드 -> 축소/재압축 -> 회고 분석 (단계별 소요 시간 포함)"""
+        timer = StageTimer()
+        photo = select_photo_size(photo_sizes)
+        with timer.stage("download"):
+            original = await self.fetch(bot, photo.file_id, IMAGE_MAX_BYTES)
+        with timer.stage("prepare"):
+            # 이미지 처리는 CPU 작업이므로 이벤트 루프 밖에서 실행
+            image = await asyncio.get_running_loop().run_in_executor(None, downscale_image, original)
+        with timer.stage("analyze"):
+            analysis = await self.ai_helper.analyze_image_reflection(image, "image/jpeg")
+        return {
+            'analysis': analysis,
+            'width': photo.width,
+            'height': photo.height,
+            'downloaded_bytes': len(original),
+            'sent_bytes': len(image),
+            'timings': timer.timings,
+            'summary': timer.summary(),
+        }
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
@@ -0,0 +1,342 @@
+import time
+import asyncio
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import pytz
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from ai_executor import TokenBucket
+from config import (NOTIFY_CATCHUP_MINUTES, NOTIFY_BATCH_SIZE, NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_INTERVAL,
+                    NOTIFY_CONCURRENCY, NOTIFY_MAX_RETRIES, NOTIFY_CLAIM_TIMEOUT)
+
+def format_digest(date: str, digest: Dict[str, List[Dict]], messages: List[str]) -> str:
+    """아침 알림 메시지 (오늘 일정 + 오늘 루틴 + 사용자 지정 알림 문구)"""
+    lines = [f"🌅 좋은 아침입니다! {date} 오늘의 계획입니다."]
+    if digest['schedules']:
+        lines.append("\n📅 일정")
+        for schedule in digest['schedules']:
+            done = "✅" if schedule.get('is_done') else "⬜"
+            lines.append(f"{done} {schedule['time'] or '종일'} {schedule['title']}")
+    if digest['routines']:
+        lines.append("\n🔄 루틴")
+        for routine in digest['routines']:
+            done = "✅" if routine.get('is_done') else "⬜"
+            time_text = f"{routine['time']} " if routine['time'] else ""
+            lines.append(f"{done} {time_text}{routine['title']}")
+    if not digest['schedules'] and not digest['routines']:
+        lines.append("\n오늘 등록된 일정과 루틴이 없습니다. /add_schedule 로 추가해보세요!")
+    for message in messages:
+        lines.append(f"\n🔔 {message}")
+    return "\n".join(lines)
+
+class RateLimitedSender:
+    """텔레그램 전송 한도(봇 전체 초당 전송 수, 채팅별 간격)를 지키며 여러 워커로 동시에 전송"""
+
+    def __init__(self, bot, rate: float = NOTIFY_GLOBAL_RATE, per_chat_interval: float = NOTIFY_PER_CHAT_INTERVAL,
+                 concurrency: int = NOTIFY_CONCURRENCY, max_retries: int = NOTIFY_MAX_RETRIES,
+                 bucket: Optional[TokenBucket] = None):
+        self.bot = bot
+        self.bucket = bucket or TokenBucket(rate * 60, burst=rate)  # 다른 전송과 나눠 쓰는 버킷을 받으면 rate는 무시
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._next_chat_slot: Dict[int, float] = {}  # 채팅별 다음 전송 가능 시각
+        self._paused_until = 0.0  # 429 응답 시 모든 워커가 함께 대기
+
+        # 결과
+        self.sent = 0
+        self.retries = 0
+        self.delivered: List[Any] = []  # 보낸 메시지의 context
+        self.failed: List[Any] = []  # 보내지 못한 메시지의 context
+        self.blocked: List[int] = []  # 봇을 차단한 chat_id
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.concurrency * 4)  # 생산자가 너무 앞서가지 않도록 제한
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def put(self, chat_id: int, text: str, context: Any = None):
+        """전송 대기열에 추가 (대기열이 차 있으면 빈자리가 날 때까지 대기)"""
+        await self._queue.put((chat_id, text, context))
+
+    async def join(self):
+        """지금까지 넣은 메시지의 전송이 끝날 때까지 대기"""
+        await self._queue.join()
+
+    def pending(self) -> int:
+        """전송을 기다리는 메시지 수"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def take_results(self) -> Tuple[List[Any], List[Any], List[int]]:
+        """지난 호출 이후 보낸/보내지 못한 메시지의 context와 차단한 chat_id (계속 쓰는 전송기에서 결과 기록용)"""
+        results = (self.delivered, self.failed, self.blocked)
+        self.delivered, self.failed, self.blocked = [], [], []
+        return results
+
+    async def close(self):
+        """대기열이 빌 때까지 전송한 뒤 워커 종료"""
+        await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _wait_for_slot(self, chat_id: int):
+        """429 대기와 채팅별 간격이 지난 뒤 전체 한도에서 한 건 확보"""
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until, self._next_chat_slot.get(chat_id, 0.0)) - now
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        self._next_chat_slot[chat_id] = now + self.per_chat_interval
+        await self.bucket.acquire(1)
+
+    async def _worker(self):
+        while True:
+            chat_id, text, context = await self._queue.get()
+            try:
+                await self._send(chat_id, text, context)
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, chat_id: int, text: str, context: Any):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+            await self._wait_for_slot(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                self.sent += 1
+                self.delivered.append(context)
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, datetime.timedelta) else e.retry_after
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            except Forbidden:
+                self.blocked.append(chat_id)
+                return
+            except BadRequest as e:
+                print(f"알림 전송 오류 ({chat_id}): {e}")
+                self.failed.append(context)
+                return
+            except NetworkError as e:
+                print(f"알림 전송 오류 ({chat_id}): {e}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(5.0, 0.5 * (2 ** attempt)))
+        self.failed.append(context)
+
+class NotificationDispatcher:
+    """매 분 시간대별로 현지 발송 시각이 된 알림을 발송 처리하고, 계속 도는 전송기가 일일 요약을 만들어 전송
+
+    발송 처리(claim)는 DB 표시만 하므로 앞선 시각의 전송이 오래 걸려도 매 분 제시간에 실행되고,
+    전송은 발송 처리된 순서대로 이어서 진행됨. 전송에 넘긴 알림은 결과를 기록할 때까지 표시가 남아
+    프로세스가 중단돼도 claim_timeout 뒤 다시 전송됨
+    """
+
+    def __init__(self, db, batch_size: int = NOTIFY_BATCH_SIZE, catchup_minutes: int = NOTIFY_CATCHUP_MINUTES,
+                 claim_timeout: float = NOTIFY_CLAIM_TIMEOUT, **sender_options):
+        self.db = db  # AsyncDatabase
+        self.batch_size = batch_size
+        self.catchup_minutes = catchup_minutes
+        self.claim_timeout = claim_timeout
+        self.sender_options = sender_options
+        self.sender: Optional[RateLimitedSender] = None
+        self.last_stats: Dict[str, Any] = {}
+        self._claim_lock = asyncio.Lock()  # 발송 처리는 한 번에 하나씩 (앞 실행이 끝나면 바로 이어서)
+        self._last_slot: Optional[datetime.datetime] = None  # 마지막으로 발송 처리한 시각 (재시작 등으로 지나간 시각도 처리)
+        self._task: Optional[asyncio.Task] = None
+        self._feeder: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()  # 새로 발송 처리된 알림이 있음
+        self._progress = asyncio.Event()  # 전송 대기 알림이 비었음을 확인
+        self._requested = 0  # drain 요청 번호
+        self._checked = 0  # 전송 대기 알림이 비었음을 확인한 시점의 요청 번호
+
+        # 지표 (누적)
+        self.claimed = 0
+        self.failed = 0
+        self.blocked = 0
+        self.reclaimed = 0
+        self.db_time = 0.0
+
+    async def start(self, application):
+        """전송기를 띄우고 매 분 0초에 발송 처리 실행 (JobQueue가 없으면 asyncio 태스크로 대체)"""
+        await self._start_sender(application.bot)
+        if application.job_queue is not None:
+            application.job_queue.run_repeating(self._run_job, interval=60, first=self._seconds_to_next_minute(),
+                                                name='notification_dispatch')
+        else:
+            print("⚠️ JobQueue를 사용할 수 없어 알림 발송을 asyncio 태스크로 실행합니다. (pip install \"python-telegram-bot[job-queue]\")")
+            self._task = asyncio.create_task(self._loop(application.bot))
+
+    async def stop(self):
+        """발송 처리를 멈추고 전송에 넘긴 알림까지 보낸 뒤 종료 (남은 전송 대기 알림은 다음 실행에서 전송)"""
+        for task in (self._task, self._feeder):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._feeder = None
+        if self.sender is not None:
+            await self.sender.close()
+            await self._settle()
+            self.sender = None
+
+    async def _start_sender(self, bot):
+        if self.sender is None:
+            self.sender = RateLimitedSender(bot, **self.sender_options)
+            await self.sender.start()
+        if self._feeder is None:
+            self._feeder = asyncio.create_task(self._feed())
+
+    def _seconds_to_next_minute(self) -> float:
+        return 60 - time.time() % 60
+
+    async def _run_job(self, context):
+        await self.dispatch(context.bot, wait=False)
+
+    async def _loop(self, bot):
+        while True:
+            await asyncio.sleep(self._seconds_to_next_minute())
+            try:
+                await self.dispatch(bot, wait=False)
+            except Exception as e:
+                print(f"알림 발송 오류: {e}")
+
+    def _due_minutes(self, now: datetime.datetime) -> List[datetime.datetime]:
+        """지난 실행 이후 시각과 최근 catchup_minutes분(실패 재시도)의 분 단위 시각 목록"""
+        start = now - datetime.timedelta(minutes=self.catchup_minutes)
+        if self._last_slot is not None and self._last_slot < start:
+            start = self._last_slot + datetime.timedelta(minutes=1)
+        minutes = int((now - start).total_seconds() // 60)
+        return [now - datetime.timedelta(minutes=offset) for offset in range(minutes, -1, -1)]
+
+    async def _claim(self, now: datetime.datetime) -> int:
+        """발송 시각이 된 알림을 시간대/배치 단위로 발송 처리 (전송은 _feed가 이어서 진행)"""
+        claimed = 0
+        async with self._claim_lock:
+            claimed_at = time.time()
+            timezones = await self.db.get_notification_timezones()
+            for minute in self._due_minutes(now):
+                for timezone in timezones:
+                    # 시간대마다 현지 시각/날짜가 다르므로 (시간대, 현지 시각) 단위로 처리
+                    local = minute.astimezone(pytz.timezone(timezone))
+                    slot, date = local.strftime('%H:%M'), local.strftime('%Y-%m-%d')
+                    while True:
+                        # 발송 처리된 알림은 인덱스 범위에서 빠지므로 같은 조건으로 다음 배치를 처리
+                        count = await self.db.claim_due_notifications(timezone, slot, date, self.batch_size, claimed_at)
+                        if not count:
+                            break
+                        claimed += count
+            self._last_slot = now
+        return claimed
+
+    def _take_limit(self) -> int:
+        """한 번에 가져올 사용자 수 (전송 한도로 claim_timeout 절반 안에 보낼 수 있는 만큼, 결과 기록 전에 다시 전송되지 않도록)"""
+        return max(1, min(self.batch_size, int(self.sender.bucket.rate * self.claim_timeout / 2)))
+
+    async def _feed(self):
+        """전송 대기 알림을 발송 처리된 순서대로 가져와 요약을 만들어 전송기에 넣고, 다 보내면 결과 기록"""
+        while True:
+            requested = self._requested
+            self._wakeup.clear()
+            try:
+                db_began = time.perf_counter()
+                rows = await self.db.take_claimed_notifications(self._take_limit(), time.time())
+                if rows:
+                    by_date: Dict[Tuple[str, int], List[Dict]] = {}
+                    for row in rows:
+                        by_date.setdefault((row['date'], row['user_id']), []).append(row)
+                    digests: Dict[str, Dict[int, Dict[str, List[Dict]]]] = {}
+                    for date in {date for date, _ in by_date}:
+                        digests[date] = await self.db.get_daily_digests(
+                            [user_id for day, user_id in by_date if day == date], date)
+                    self.db_time += time.perf_counter() - db_began
+                    for (date, user_id), notifications in by_date.items():
+                        custom = [n['message'] for n in notifications if n['notification_type'] != 'morning']
+                        text = format_digest(date, digests[date][user_id], custom)
+                        await self.sender.put(user_id, text, [n['id'] for n in notifications])
+                    await self.sender.join()  # 가져온 배치의 결과를 claim_timeout 전에 기록
+                await self._settle()
+                if rows:
+                    continue
+            except Exception as e:
+                print(f"알림 전송 준비 오류: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            self._checked = requested
+            self._progress.set()
+            await self._wakeup.wait()
+
+    async def _settle(self):
+        """전송 결과 기록 (보낸 알림은 대기 표시 해제, 실패는 다음 실행에서 다시 발송, 차단한 사용자는 알림 끔)"""
+        delivered, failed, blocked = self.sender.take_results()
+        delivered_ids = [notification_id for ids in delivered for notification_id in ids]
+        failed_ids = [notification_id for ids in failed for notification_id in ids]
+        if delivered_ids:
+            await self.db.confirm_notifications(delivered_ids)
+        if failed_ids:
+            await self.db.release_notifications(failed_ids)
+        if blocked:
+            await self.db.deactivate_notifications(blocked)
+        self.failed += len(failed)
+        self.blocked += len(blocked)
+
+    async def drain(self):
+        """지금까지 발송 처리된 알림을 모두 보내고 결과를 기록할 때까지 대기"""
+        self._requested += 1
+        target = self._requested
+        self._wakeup.set()
+        while self._checked < target:
+            self._progress.clear()
+            await self._progress.wait()
+        await self.sender.join()
+        await self._settle()
+
+    async def dispatch(self, bot, now: Optional[datetime.datetime] = None, wait: bool = True) -> Dict[str, Any]:
+        """발송 시각이 된 알림을 발송 처리하고 전송기에 알림 (wait=True면 이번에 처리한 알림의 전송까지 대기)"""
+        began = time.perf_counter()
+        now = (now or datetime.datetime.now(pytz.utc)).replace(second=0, microsecond=0)
+        await self._start_sender(bot)
+        sent, retries, failed, blocked, db_time = (self.sender.sent, self.sender.retries, self.failed,
+                                                   self.blocked, self.db_time)
+        db_began = time.perf_counter()
+        claimed = await self._claim(now)
+        reclaimed = await self.db.reclaim_stale_notifications(time.time() - self.claim_timeout)
+        self.db_time += time.perf_counter() - db_began
+        self.claimed += claimed
+        self.reclaimed += reclaimed
+        if reclaimed:
+            print(f"♻️ 전송 결과가 기록되지 않은 알림 {reclaimed}건을 다시 전송합니다.")
+        if claimed or reclaimed:
+            self._wakeup.set()
+        if wait:
+            await self.drain()
+
+        elapsed = time.perf_counter() - began
+        sent = self.sender.sent - sent
+        self.last_stats = {
+            'time': now.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M UTC'),
+            'notifications': claimed,
+            'reclaimed': reclaimed,
+            'sent': sent,
+            'failed': self.failed - failed,
+            'blocked': self.blocked - blocked,
+            'retries': self.sender.retries - retries,
+            'db_ms': (self.db_time - db_time) * 1000,
+            'elapsed_ms': elapsed * 1000,
+            'per_second': sent / elapsed if elapsed > 0 else 0.0,
+        }
+        if claimed:
+            print(f"🔔 알림 발송 처리 {self.last_stats['time']}: {claimed}건")
+        return self.last_stats
+
+    def stats(self) -> Dict[str, Any]:
+        """누적 발송 처리/전송/실패/차단 수와 전송기 대기열 길이"""
+        return {
+            'claimed': self.claimed,
+            'reclaimed': self.reclaimed,
+            'sent': self.sender.sent if self.sender is not None else 0,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'queued': self.sender.pending() if self.sender is not None else 0,
+        }
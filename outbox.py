@@ -0,0 +1,247 @@
+"""
+대화 응답 전송 대기열
+핸들러가 같은 채팅으로 이어서 보내는 메시지를 짧은 시간 모아 한 메시지로 합치고(4096자 넘으면 나눔),
+채팅별/전체 토큰 버킷으로 전송 한도를 지키며 429 응답은 retry_after만큼 모든 전송을 멈췄다가 다시 보냅니다.
+
+- 같은 채팅의 메시지는 넣은 순서대로 전송
+- parse_mode가 있는 메시지는 합치거나 나누지 않음 (태그가 잘리지 않도록)
+"""
+
+import time
+import asyncio
+import datetime
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from ai_executor import TokenBucket
+from task_queue import _percentile_ms
+from config import (NOTIFY_GLOBAL_RATE, OUTBOX_COALESCE_WINDOW, OUTBOX_MESSAGE_LIMIT, OUTBOX_PER_CHAT_RATE,
+                    OUTBOX_PER_CHAT_BURST, OUTBOX_MAX_PENDING, OUTBOX_MAX_RETRIES)
+
+SEPARATOR = "\n\n"  # 합친 메시지 사이
+_MAX_CHAT_BUCKETS = 10000  # 이보다 많으면 쉬고 있는 채팅의 버킷 정리
+
+def message_length(text: str) -> int:
+    """텔레그램 기준 길이 (UTF-16 코드 단위, 이모지 대부분은 2)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def _prefix(text: str, limit: int) -> str:
+    """길이가 limit 이하인 가장 긴 앞부분"""
+    units = 0
+    for index, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit:
+            return text[:index]
+    return text
+
+def split_message(text: str, limit: int = OUTBOX_MESSAGE_LIMIT) -> List[str]:
+    """limit 이하 조각으로 나눔 (가능하면 줄바꿈, 없으면 공백, 그래도 없으면 글자 단위에서)"""
+    chunks = []
+    while message_length(text) > limit:
+        head = _prefix(text, limit)
+        cut = head.rfind("\n")
+        if cut <= 0:
+            cut = head.rfind(" ")
+        if cut <= 0:
+            chunks.append(head)
+            text = text[len(head):]
+        else:
+            chunks.append(head[:cut])
+            text = text[cut + 1:]  # 나눈 자리의 줄바꿈/공백은 버림
+    chunks.append(text)
+    return chunks
+
+class _Outgoing:
+    """전송을 기다리는 메시지 하나 (future는 전송 성공 여부)"""
+    __slots__ = ('bot', 'text', 'parse_mode', 'queued_at', 'future')
+
+    def __init__(self, bot, text: str, parse_mode: Optional[str]):
+        self.bot = bot
+        self.text = text
+        self.parse_mode = parse_mode
+        self.queued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class _ChatQueue:
+    """채팅 하나의 대기열 (전송 태스크는 대기열이 빌 때까지만 실행)"""
+
+    def __init__(self):
+        self.pending: Deque[_Outgoing] = deque()
+        self.task: Optional[asyncio.Task] = None
+
+class MessageOutbox:
+    """채팅별로 메시지를 모아 합치고 전송 한도를 지키며 전송"""
+
+    def __init__(self, window: float = OUTBOX_COALESCE_WINDOW, limit: int = OUTBOX_MESSAGE_LIMIT,
+                 rate: float = NOTIFY_GLOBAL_RATE, per_chat_rate: float = OUTBOX_PER_CHAT_RATE,
+                 per_chat_burst: float = OUTBOX_PER_CHAT_BURST, max_pending: int = OUTBOX_MAX_PENDING,
+                 max_retries: int = OUTBOX_MAX_RETRIES):
+        self.window = window
+        self.limit = limit
+        # 봇 전체 한도 (RateLimitedSender와 나눠 쓸 수 있음, 확장 실행에서는 워커 수로 나눈 몫이라 1보다 작을 수 있음)
+        self.bucket = TokenBucket(rate * 60, burst=max(1.0, rate))
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self._slots = asyncio.Semaphore(max_pending)
+        self._chats: Dict[int, _ChatQueue] = {}
+        self._buckets: Dict[int, TokenBucket] = {}  # 채팅별 한도 (오래 쉬어 가득 찬 버킷은 정리)
+        self._paused_until = 0.0  # 429 응답 시 모든 채팅이 함께 대기
+
+        # 지표
+        self.queued = 0  # 넣은 메시지 수
+        self.delivered = 0  # 전송된 메시지 수 (합쳐진 메시지 포함)
+        self.requests = 0  # 성공한 sendMessage 요청 수
+        self.coalesced = 0  # 앞 메시지에 합쳐져 요청을 아낀 메시지 수
+        self.splits = 0  # 길이 제한으로 더 보낸 조각 수
+        self.retries = 0
+        self.failed = 0
+        self.blocked = 0  # 봇을 차단한 채팅으로 보내지 못한 메시지 수
+        self.latencies: deque = deque(maxlen=1000)  # 넣은 뒤 전송될 때까지(초)
+        self.send_times: deque = deque(maxlen=1000)  # sendMessage 요청 시간(초)
+
+    async def send(self, bot, chat_id: int, text: str, parse_mode: Optional[str] = None, wait: bool = True) -> bool:
+        """메시지를 대기열에 넣음
+
+        wait=True면 전송될 때까지 기다려 성공 여부를 돌려주고, False면 넣기만 하고 바로 True를 돌려줌
+        (바로 이어서 넣는 같은 채팅의 메시지와 합쳐짐, 대기열이 가득 차 있으면 자리가 날 때까지 대기)
+        """
+        await self._slots.acquire()
+        item = _Outgoing(bot, text, parse_mode)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue()
+        chat.pending.append(item)
+        self.queued += 1
+        if chat.task is None:
+            chat.task = asyncio.create_task(self._drain(chat_id, chat))
+        if not wait:
+            return True
+        return await asyncio.shield(item.future)  # 핸들러가 취소돼도 전송은 계속
+
+    async def close(self):
+        """대기열에 남은 메시지를 모두 전송"""
+        while self._chats:
+            await asyncio.gather(*[chat.task for chat in self._chats.values()], return_exceptions=True)
+
+    def _take(self, chat: _ChatQueue) -> Tuple[List[_Outgoing], str]:
+        """맨 앞 메시지와, 이어지는 일반 텍스트 메시지를 길이 제한 안에서 합침"""
+        first = chat.pending.popleft()
+        items, size = [first], message_length(first.text)
+        if first.parse_mode is None:
+            while chat.pending and chat.pending[0].parse_mode is None:
+                size += message_length(SEPARATOR) + message_length(chat.pending[0].text)
+                if size > self.limit:
+                    break
+                items.append(chat.pending.popleft())
+        return items, SEPARATOR.join(item.text for item in items)
+
+    async def _drain(self, chat_id: int, chat: _ChatQueue):
+        items: List[_Outgoing] = []
+        try:
+            while chat.pending:
+                # 바로 이어서 들어올 메시지를 기다림 (이미 기다린 메시지는 바로 전송)
+                wait = chat.pending[0].queued_at + self.window - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                items, text = self._take(chat)
+                try:
+                    ok = await self._deliver(items[0].bot, chat_id, text, items[0].parse_mode)
+                except Exception as e:
+                    print(f"메시지 전송 오류 ({chat_id}): {e}")
+                    ok = False
+                now = time.monotonic()
+                for item in items:
+                    if ok:
+                        self.latencies.append(now - item.queued_at)
+                    if not item.future.done():
+                        item.future.set_result(ok)
+                    self._slots.release()
+                if ok:
+                    self.delivered += len(items)
+                    self.coalesced += len(items) - 1
+                else:
+                    self.failed += len(items)
+        finally:
+            del self._chats[chat_id]
+            for item in [*items, *chat.pending]:  # 취소된 경우 (보내던 메시지와 남은 메시지)
+                if not item.future.done():
+                    item.future.set_result(False)
+                    self._slots.release()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_CHAT_BUCKETS:
+                # 버킷이 다시 가득 찰 만큼 쉰 채팅은 새 버킷과 같으므로 정리
+                idle = time.monotonic() - self.per_chat_burst / self.per_chat_rate
+                self._buckets = {key: value for key, value in self._buckets.items() if value.updated > idle}
+            bucket = self._buckets[chat_id] = TokenBucket(self.per_chat_rate * 60, burst=self.per_chat_burst)
+        return bucket
+
+    async def _wait_for_slot(self, chat_id: int):
+        """429 대기가 끝난 뒤 채팅별 한도와 전체 한도에서 한 건 확보"""
+        while True:
+            wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self._chat_bucket(chat_id).acquire(1)
+        await self.bucket.acquire(1)
+
+    async def _deliver(self, bot, chat_id: int, text: str, parse_mode: Optional[str]) -> bool:
+        """합친 메시지를 (길면 나눠서) 전송, 모든 조각을 보내면 True"""
+        chunks = [text] if parse_mode is not None else split_message(text, self.limit)
+        self.splits += len(chunks) - 1
+        for chunk in chunks:
+            if not await self._send_chunk(bot, chat_id, chunk, parse_mode):
+                return False
+        return True
+
+    async def _send_chunk(self, bot, chat_id: int, text: str, parse_mode: Optional[str]) -> bool:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+            await self._wait_for_slot(chat_id)
+            began = time.monotonic()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                self.send_times.append(time.monotonic() - began)
+                self.requests += 1
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, datetime.timedelta) else e.retry_after
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            except Forbidden:
+                self.blocked += 1
+                return False
+            except BadRequest as e:
+                print(f"메시지 전송 오류 ({chat_id}): {e}")
+                return False
+            except NetworkError as e:
+                print(f"메시지 전송 오류 ({chat_id}): {e}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(5.0, 0.5 * (2 ** attempt)))
+        return False
+
+    def stats(self, top: int = 5) -> Dict[str, Any]:
+        """전송/합침/나눔/재시도 수, 대기열 길이(전체, 가장 밀린 채팅), 전송 지연"""
+        depths: List[Tuple[int, int]] = sorted(((chat_id, len(chat.pending)) for chat_id, chat in self._chats.items()),
+                                               key=lambda item: -item[1])
+        return {
+            'queued': self.queued,
+            'delivered': self.delivered,
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'splits': self.splits,
+            'retries': self.retries,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'pending': sum(depth for _, depth in depths),
+            'chats': len(depths),
+            'top_depths': depths[:top],
+            'latency_p50_ms': _percentile_ms(list(self.latencies), 50),
+            'latency_p99_ms': _percentile_ms(list(self.latencies), 99),
+            'send_p50_ms': _percentile_ms(list(self.send_times), 50),
+            'send_p99_ms': _percentile_ms(list(self.send_times), 99),
+        }
@@ -0,0 +1,156 @@
+"""
+SQLite 대화 흐름 상태 저장소 (python-telegram-bot BasePersistence)
+ConversationHandler 상태와 context.user_data를 SQLite에 보관해 재시작/배포 후에도 입력 흐름이 이어집니다.
+
+- 쓰기: Application이 update_interval마다 바뀐 사용자/대화만 넘겨주면, 모아서 한 트랜잭션으로 저장
+  (같은 내용이면 저장하지 않음)
+- 읽기: 시작할 때 최근 대화 상태만 불러오고, 사용자 데이터는 그 사용자의 업데이트가 처음 올 때 불러옴
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+from telegram.ext import BasePersistence, PersistenceInput
+from config import PERSISTENCE_UPDATE_INTERVAL, USER_STATE_TTL
+
+class SQLitePersistence(BasePersistence):
+    """AsyncDatabase에 흐름 상태를 보관 (user_data와 대화 상태만, chat_data/bot_data/callback_data는 사용하지 않음)
+
+    user_data와 대화 상태는 JSON으로 저장하므로 JSON으로 바꿀 수 있는 값(dict/list/str/int/None 등)만 넣어야 합니다.
+    (대화 상태에 range를 쓰면 저장되지 않으므로 상태가 하나인 흐름도 정수 상수를 사용)
+    """
+
+    def __init__(self, db, update_interval: float = PERSISTENCE_UPDATE_INTERVAL, ttl: float = USER_STATE_TTL):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self.db = db  # AsyncDatabase
+        self.ttl = ttl  # 이 시간 넘게 멈춘 흐름은 시작할 때 버림 (중단된 흐름 만료)
+        self._loaded: Set[int] = set()  # user_data를 불러온 사용자
+        self._stored: Set[int] = set()  # 시작할 때 저장된 user_data가 있던 사용자 (나머지는 조회하지 않음)
+        self._saved: Dict[int, str] = {}  # 사용자별 마지막으로 저장한 내용의 해시 (변경 없으면 다시 쓰지 않음)
+        self._pending_users: Dict[int, Optional[str]] = {}
+        self._pending_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._write_task: Optional[asyncio.Task] = None
+        self.writes = 0  # 실행한 저장 트랜잭션 수
+        self.skipped = 0  # 내용이 같아 건너뛴 user_data 저장 수
+
+    @staticmethod
+    def _digest(data: str) -> str:
+        return hashlib.blake2b(data.encode('utf-8'), digest_size=8).hexdigest()
+
+    # 읽기
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        """시작할 때 호출됨 (ttl보다 오래 멈춘 흐름은 정리하고, 내용은 refresh_user_data에서 사용자별로 불러옴)"""
+        await self.db.prune_persisted_state(time.time() - self.ttl)
+        self._stored = set(await self.db.get_persisted_user_ids())
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        """업데이트를 처리하기 전에 호출됨 (처음 보는 사용자면 저장된 흐름 데이터를 불러옴)"""
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        if user_id not in self._stored:
+            return
+        data = await self.db.get_persisted_user_data(user_id)
+        if data is None:
+            return
+        self._saved[user_id] = self._digest(data)
+        if not user_data:  # 메모리에 이미 새 데이터가 있으면 그대로 둠
+            user_data.update(json.loads(data))
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[int, ...], object]:
+        """ttl 안에 갱신된 대화 상태만 불러옴"""
+        rows = await self.db.get_persisted_conversations(name, time.time() - self.ttl)
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    # 쓰기 (모아서 한 번에)
+    def _schedule_write(self):
+        # Application은 한 번의 갱신에서 바뀐 항목마다 update_*를 동시에 호출하므로
+        # 다음 이벤트 루프 차례에 한 번만 저장
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        await asyncio.sleep(0)
+        while self._pending_users or self._pending_conversations:
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            rows = [(name, key, state) for (name, key), state in conversations.items()]
+            if await self.db.save_persisted_state(list(users.items()), rows, time.time()):
+                self.writes += 1
+            else:
+                # 저장 실패 시 다음 갱신 때 다시 시도 (그 사이 새로 바뀐 값이 우선)
+                self._pending_users = {**users, **self._pending_users}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                for user_id in users:
+                    self._saved.pop(user_id, None)
+                return
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        try:
+            serialized = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError) as e:
+            print(f"흐름 데이터 저장 오류 (JSON 변환 불가, 사용자 {user_id}): {e}")
+            return
+        digest = self._digest(serialized)
+        if self._saved.get(user_id, self._digest("{}")) == digest:
+            self.skipped += 1
+            return
+        self._saved[user_id] = digest
+        self._pending_users[user_id] = serialized if data else None
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._saved.pop(user_id, None)
+        self._pending_users[user_id] = None
+        self._schedule_write()
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        try:
+            state = json.dumps(new_state) if new_state is not None else None
+        except (TypeError, ValueError) as e:
+            print(f"대화 상태 저장 오류 (JSON 변환 불가, {name} {key}): {e}")
+            return
+        self._pending_conversations[(name, json.dumps(list(key)))] = state
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """종료 시 남은 변경 저장"""
+        if self._write_task is not None:
+            await self._write_task
+        await self._write()
+
+    def stats(self) -> Dict[str, int]:
+        """저장 트랜잭션 수, 건너뛴 저장 수, 불러온 사용자 수"""
+        return {'writes': self.writes, 'skipped': self.skipped, 'loaded_users': len(self._loaded & self._stored),
+                'pending': len(self._pending_users) + len(self._pending_conversations)}
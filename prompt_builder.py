@@ -0,0 +1,150 @@
+"""
+토큰 예산 기반 프롬프트 구성
+시스템 프롬프트와 현재 메시지를 먼저 넣고, 남은 예산 안에서 관련 자료와 최근 대화를 채웁니다.
+예산에 들지 않는 오래된 대화는 짧은 요약으로 대신합니다. tiktoken이 있으면 실제 토크나이저로 셉니다.
+"""
+
+from typing import Any, Dict, List, Optional
+from config import (GPT_MODEL, PROMPT_TOKEN_BUDGETS, PROMPT_DEFAULT_BUDGET, PROMPT_SUMMARY_TOKENS,
+                    PROMPT_CONTEXT_SHARE, PROMPT_SUMMARY_LINE_CHARS)
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken이 없으면 글자 수로 넉넉하게 추정
+    tiktoken = None
+
+# 채팅 메시지 하나당 역할/구분자 토큰, 응답 시작 토큰 (OpenAI 안내 기준)
+MESSAGE_OVERHEAD = 3
+REPLY_OVERHEAD = 3
+SUMMARY_HEADER = "이전 대화 요약:\n"
+
+_encoding = None  # None: 아직 불러오지 않음, False: 사용 불가
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = False
+        if tiktoken is not None:
+            try:
+                try:
+                    _encoding = tiktoken.encoding_for_model(GPT_MODEL)
+                except KeyError:
+                    _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:  # 인코딩 파일을 받지 못함 (오프라인 등)
+                print(f"⚠️ tiktoken 인코딩을 불러오지 못해 글자 수로 추정합니다: {e}")
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """텍스트 토큰 수 (tiktoken이 없으면 영문/숫자 4글자, 그 밖의 글자(한글 등) 1글자를 1토큰으로 추정)"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """메시지 하나의 토큰 수 (텍스트 부분만, 이미지 부분은 제외)"""
+    content = message.get('content')
+    if isinstance(content, list):
+        content = "\n".join(part.get('text', '') for part in content if isinstance(part, dict))
+    return MESSAGE_OVERHEAD + count_tokens(content or '')
+
+def count_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    """요청 전체 프롬프트 토큰 수"""
+    return REPLY_OVERHEAD + sum(message_tokens(message) for message in messages)
+
+def fold_summary(summary: str, turns: List[Dict[str, str]], max_tokens: int = PROMPT_SUMMARY_TOKENS) -> str:
+    """기존 요약 뒤에 밀려난 턴을 한 줄씩 줄여 붙이고, max_tokens를 넘으면 오래된 줄부터 버림"""
+    lines = summary.splitlines() if summary else []
+    for turn in turns:
+        text = " ".join(turn['content'].split())
+        if len(text) > PROMPT_SUMMARY_LINE_CHARS:
+            text = text[:PROMPT_SUMMARY_LINE_CHARS] + "…"
+        lines.append(f"{'사용자' if turn['role'] == 'user' else 'AI'}: {text}")
+    while lines and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+class PromptBuilder:
+    """메서드별 토큰 예산 안에서 시스템 프롬프트, 관련 자료, 대화 요약, 최근 대화, 현재 메시지 순으로 구성"""
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, summary_tokens: int = PROMPT_SUMMARY_TOKENS,
+                 context_share: float = PROMPT_CONTEXT_SHARE):
+        self.budgets = budgets if budgets is not None else PROMPT_TOKEN_BUDGETS
+        self.summary_tokens = summary_tokens
+        self.context_share = context_share
+
+    def budget(self, method: str) -> int:
+        return self.budgets.get(method, PROMPT_DEFAULT_BUDGET)
+
+    @staticmethod
+    def _fit_history(turns: List[Dict[str, str]], limit: int) -> List[Dict[str, str]]:
+        """최근 턴부터 limit 토큰 안에 드는 만큼 (중간을 건너뛰지 않음)"""
+        kept: List[Dict[str, str]] = []
+        used = 0
+        for turn in reversed(turns):
+            cost = message_tokens(turn)
+            if used + cost > limit:
+                break
+            kept.append(turn)
+            used += cost
+        kept.reverse()
+        return kept
+
+    def build(self, method: str, system: str, user_message: str,
+              history: Optional[List[Dict[str, Any]]] = None, context: Optional[List[str]] = None,
+              summary: str = "") -> Dict[str, Any]:
+        """프롬프트 메시지와 토큰 수 {'messages', 'prompt_tokens', 'budget', 'history_turns', 'evicted_turns', 'context_items'}
+
+        시스템 프롬프트와 현재 메시지는 예산을 넘어도 항상 포함합니다.
+        """
+        budget = self.budget(method)
+        messages: List[Dict[str, str]] = [{"role": "system", "content": system}]
+        user = {"role": "user", "content": user_message}
+        remaining = budget - REPLY_OVERHEAD - message_tokens(messages[0]) - message_tokens(user)
+
+        # 관련 자료는 관련도 순서로 들어오므로 남은 예산의 일부 안에서 앞에서부터 채움
+        context_items: List[str] = []
+        if context and remaining > 0:
+            header = "참고할 관련 기록:"
+            limit = int(remaining * self.context_share) - MESSAGE_OVERHEAD - count_tokens(header)
+            used = 0
+            for item in context:
+                cost = count_tokens(item) + 1
+                if used + cost <= limit:
+                    context_items.append(item)
+                    used += cost
+            if context_items:
+                messages.append({"role": "system", "content": header + "\n" + "\n".join(context_items)})
+                remaining -= message_tokens(messages[-1])
+
+        turns = [{"role": msg["role"], "content": msg["content"]} for msg in history or []
+                 if isinstance(msg, dict) and "role" in msg and "content" in msg]
+        summary_reserve = MESSAGE_OVERHEAD + count_tokens(SUMMARY_HEADER) + self.summary_tokens
+        # 요약이 없고 전체 대화가 들어가면 요약 자리를 비워두지 않음
+        kept = self._fit_history(turns, remaining - (summary_reserve if summary else 0))
+        if len(kept) < len(turns) and not summary:
+            kept = self._fit_history(turns, remaining - summary_reserve)
+        evicted = turns[:len(turns) - len(kept)]
+        lines: List[str] = []
+        if summary or evicted:
+            limit = remaining - (summary_reserve - self.summary_tokens) - sum(message_tokens(turn) for turn in kept)
+            lines = fold_summary(summary, evicted, min(self.summary_tokens, limit)).splitlines()
+        while True:
+            candidate = messages + ([{"role": "system", "content": SUMMARY_HEADER + "\n".join(lines)}] if lines else [])
+            candidate += kept + [user]
+            prompt_tokens = count_prompt_tokens(candidate)
+            # 토크나이저에 따라 이어 붙인 글의 토큰 수가 조금 달라질 수 있어 넘치면 오래된 요약 줄부터 버림
+            if prompt_tokens <= budget or not lines:
+                break
+            lines.pop(0)
+        return {
+            'messages': candidate,
+            'prompt_tokens': prompt_tokens,
+            'budget': budget,
+            'history_turns': len(kept),
+            'evicted_turns': len(evicted),
+            'context_items': len(context_items),
+        }
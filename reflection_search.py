@@ -0,0 +1,67 @@
+from typing import Dict, List, Optional, Tuple
+from config import SEARCH_MAX_TERMS, SEARCH_SNIPPET_CHARS
+
+# trigram 토크나이저는 3글자 이상 검색어만 색인으로 찾을 수 있음 (더 짧은 검색어는 사용자 회고를 직접 확인)
+FTS_MIN_TERM_LENGTH = 3
+
+# 순위 계산 (BM25의 단어 빈도 포화/길이 보정)
+_K1 = 1.2
+_B = 0.75
+
+def parse_query(query: str) -> List[str]:
+    """검색어를 공백 기준으로 나눠 소문자/중복 제거 (모든 단어를 포함한 회고만 검색)"""
+    terms: List[str] = []
+    for term in (query or '').lower().split():
+        if term not in terms:
+            terms.append(term)
+    return terms[:SEARCH_MAX_TERMS]
+
+def fts_match_expression(terms: List[str]) -> Optional[str]:
+    """색인으로 찾을 수 있는 검색어를 FTS5 구문으로 (각 단어를 따옴표로 감싸 연산자로 해석되지 않게 함)"""
+    phrases = ['"' + term.replace('"', '""') + '"' for term in terms if len(term) >= FTS_MIN_TERM_LENGTH]
+    return ' '.join(phrases) or None
+
+def rank_matches(rows: List[Dict], terms: List[str]) -> List[Dict]:
+    """검색어가 자주, 짧은 회고에 나올수록 높은 점수 (같으면 최근 회고 우선), 각 행에 score 추가"""
+    if not rows:
+        return rows
+    average_length = sum(len(row['content']) for row in rows) / len(rows) or 1
+    for row in rows:
+        content = row['content'].lower()
+        norm = _K1 * (1 - _B + _B * len(content) / average_length)
+        score = 0.0
+        for term in terms:
+            frequency = content.count(term)
+            score += frequency * (_K1 + 1) / (frequency + norm)
+        row['score'] = round(score, 4)
+    newest_first = sorted(rows, key=lambda row: (row['date'], row['id']), reverse=True)
+    return sorted(newest_first, key=lambda row: -row['score'])
+
+def make_snippet(content: str, terms: List[str], width: int = SEARCH_SNIPPET_CHARS,
+                 marks: Tuple[str, str] = ('«', '»')) -> str:
+    """첫 번째로 나오는 검색어 앞뒤 width글자를 잘라 검색어를 표시"""
+    lowered = content.lower()
+    hits = [(lowered.find(term), term) for term in terms if term in lowered]
+    if not hits:
+        return content[:width * 2] + ('…' if len(content) > width * 2 else '')
+    first = min(position for position, _ in hits)
+    start = max(0, first - width)
+    end = min(len(content), first + width)
+    # 잘린 구간 안의 검색어 위치 (겹치면 앞쪽 우선)
+    spans: List[Tuple[int, int]] = []
+    for term in terms:
+        position = lowered.find(term, start)
+        while position != -1 and position < end:
+            spans.append((position, min(end, position + len(term))))
+            position = lowered.find(term, position + len(term))
+    pieces = []
+    cursor = start
+    for span_start, span_end in sorted(spans):
+        if span_start < cursor:
+            continue
+        pieces.append(content[cursor:span_start])
+        pieces.append(marks[0] + content[span_start:span_end] + marks[1])
+        cursor = span_end
+    pieces.append(content[cursor:end])
+    text = ''.join(pieces).replace('\n', ' ')
+    return ('…' if start > 0 else '') + text + ('…' if end < len(content) else '')
@@ -0,0 +1,285 @@
+"""
+여러 프로세스/인스턴스로 확장 실행 (python scale_out.py, polling 방식)
+
+- 리더 선출: SQLite 리더 임대(leader_leases)를 가진 인스턴스 하나만 getUpdates로 업데이트를 받음
+  임대는 분배와 따로 도는 태스크가 연장하고, 연장에 실패하면 리더는 바로 분배를 멈춤
+  리더가 멈추면 LEADER_LEASE_TTL 뒤 다른 인스턴스가 마지막으로 분배를 마친 offset부터 이어받음
+- 분배: 리더는 user_id로 고른 워커 프로세스의 큐에 업데이트를 넣음
+  같은 사용자의 업데이트는 항상 같은 워커에서 받은 순서대로 처리되므로 대화 흐름 상태가 섞이지 않음
+- 워커: 각자 Application으로 업데이트를 처리하고 데이터/흐름 상태는 SQLite로 공유
+  워커 안에서는 PerUserUpdateProcessor로 서로 다른 사용자를 동시에 처리
+  백그라운드 작업/아침 알림은 0번 워커만 실행 (중복 발송 방지)
+"""
+
+import os
+import time
+import uuid
+import queue
+import signal
+import socket
+import asyncio
+import functools
+import multiprocessing
+from typing import Callable, List, Optional
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import Application
+from config import (BOT_TOKEN, SCALE_OUT_WORKERS, LEADER_LEASE_TTL, LEADER_POLL_TIMEOUT, WORKER_QUEUE_SIZE,
+                    NOTIFY_GLOBAL_RATE, SCALE_OUT_BROADCAST_SHARE)
+from database import AsyncDatabase
+from update_processor import PerUserUpdateProcessor
+
+LEASE_NAME = 'telegram_updates'
+DISPATCH_PUT_TIMEOUT = 1.0  # 워커 큐가 가득 찼을 때 임대를 다시 확인하는 간격(초)
+
+# 워커 Application 생성 함수: primary(백그라운드 작업 실행 여부) -> 핸들러가 등록된 Application
+# 워커 프로세스에서 호출되므로 모듈 최상위 함수(또는 그 functools.partial)여야 함
+AppFactory = Callable[[bool], Application]
+
+def route_key(update: Update) -> int:
+    """분배 기준 (사용자 → 채팅 → 업데이트 id 순으로 있는 값)"""
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return update.update_id
+
+def worker_for(update: Update, workers: int) -> int:
+    """업데이트를 처리할 워커 번호 (같은 사용자는 항상 같은 워커)"""
+    return route_key(update) % workers
+
+def bot_application(primary: bool, workers: int = SCALE_OUT_WORKERS) -> Application:
+    """실제 봇 워커 Application (primary 워커만 백그라운드 작업/알림 실행)
+
+    워커마다 전송 대기열이 따로 있으므로 봇 전체 전송 한도는 워커 수(workers)로 나눠 씀
+    (워커가 여럿이면 아침 알림에 SCALE_OUT_BROADCAST_SHARE만큼 따로 떼어 주고 나머지를 나눔)
+    """
+    from bot import ScheduleBot, register_handlers
+    from persistence import SQLitePersistence
+    broadcast = NOTIFY_GLOBAL_RATE * SCALE_OUT_BROADCAST_SHARE if workers > 1 else 0.0
+    bot = ScheduleBot(send_rate=(NOTIFY_GLOBAL_RATE - broadcast) / max(1, workers), notify_rate=broadcast or None)
+    builder = (Application.builder().token(BOT_TOKEN).updater(None).persistence(SQLitePersistence(bot.db))
+               .concurrent_updates(PerUserUpdateProcessor()))
+    if primary:
+        builder = builder.post_init(bot.post_init).post_shutdown(bot.post_shutdown)
+    else:
+        builder = builder.post_shutdown(bot.flush)  # 남은 응답 전송, 대화 기록 저장
+    application = builder.build()
+    register_handlers(application, bot)
+    bot.log_metrics(application)  # 워커별 사용자 밀림 등 처리 지표
+    return application
+
+def _worker_main(index: int, updates, factory: AppFactory, primary: bool):
+    """워커 프로세스 진입점 (종료는 리더가 큐에 넣는 None으로)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C는 리더가 받아 남은 업데이트를 처리한 뒤 종료시킴
+    asyncio.run(_run_worker(index, updates, factory, primary))
+
+async def _run_worker(index: int, updates, factory: AppFactory, primary: bool):
+    application = factory(primary)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()  # 흐름 상태 주기 저장, job_queue
+    # 받은 순서대로 update_processor에 넘김 (동시 처리 여부와 사용자별 순서는 processor가 정함)
+    # 처리 중인 업데이트가 WORKER_QUEUE_SIZE개면 큐에서 더 꺼내지 않아 리더까지 밀림이 전달됨
+    in_flight = asyncio.Semaphore(WORKER_QUEUE_SIZE)
+    tasks = set()
+
+    def finished(task: asyncio.Task):
+        tasks.discard(task)
+        in_flight.release()
+
+    try:
+        while True:
+            data = await asyncio.to_thread(updates.get)
+            if data is None:
+                break
+            update = Update.de_json(data, application.bot)
+            await in_flight.acquire()
+            task = asyncio.create_task(application.update_processor.process_update(
+                update, application.process_update(update)))
+            tasks.add(task)
+            task.add_done_callback(finished)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+class ScaleOutRunner:
+    """리더 임대를 얻으면 워커 프로세스를 띄우고 getUpdates로 받은 업데이트를 사용자별로 분배"""
+
+    def __init__(self, factory: AppFactory, db: AsyncDatabase, workers: int = SCALE_OUT_WORKERS,
+                 token: Optional[str] = None, base_url: Optional[str] = None,
+                 lease_ttl: float = LEADER_LEASE_TTL, poll_timeout: float = LEADER_POLL_TIMEOUT,
+                 queue_size: int = WORKER_QUEUE_SIZE, holder: Optional[str] = None):
+        self.factory = factory
+        self.db = db  # 리더 임대 저장 (워커와 같은 데이터베이스 파일)
+        self.workers = max(1, workers)
+        self.token = token or BOT_TOKEN
+        self.base_url = base_url
+        self.lease_ttl = lease_ttl
+        self.poll_timeout = min(poll_timeout, lease_ttl / 3)
+        self.queue_size = queue_size
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        # 자식 프로세스는 spawn으로 시작 (스레드를 가진 부모를 fork하지 않음)
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List = []
+        self._processes: List = []
+        self.is_leader = False
+        self._offset = 0  # 워커 큐에 모두 넣은 다음 업데이트 id (임대 연장 때 저장)
+        self._lease_valid_until = 0.0  # 마지막 임대 연장 기준 만료 시각 (monotonic)
+        self.dispatched = [0] * self.workers  # 워커별 분배한 업데이트 수
+        self.restarts = 0  # 비정상 종료로 다시 띄운 워커 수
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(target=_worker_main, name=f"bot-worker-{index}", daemon=True,
+                                        args=(index, self._queues[index], self.factory, index == 0))
+        process.start()
+        self._processes[index] = process
+
+    def _start_workers(self):
+        self._queues = [self._context.Queue(self.queue_size) for _ in range(self.workers)]
+        self._processes = [None] * self.workers
+        for index in range(self.workers):
+            self._start_worker(index)
+
+    def _check_workers(self):
+        """죽은 워커는 같은 큐로 다시 띄움 (큐에 남은 업데이트는 이어서 처리)"""
+        for index, process in enumerate(self._processes):
+            if not process.is_alive():
+                print(f"⚠️ 워커 {index}가 종료되어(코드 {process.exitcode}) 다시 시작합니다.")
+                self.restarts += 1
+                self._start_worker(index)
+
+    async def _stop_workers(self, timeout: float = 30.0):
+        """큐에 남은 업데이트를 처리하고 종료하도록 알린 뒤 기다림 (시간 초과 시 강제 종료)"""
+        for updates in self._queues:
+            await asyncio.to_thread(updates.put, None)
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+        self._queues, self._processes = [], []
+
+    def _holds_lease(self, lost: asyncio.Event) -> bool:
+        # 연장 태스크가 실패를 알렸거나, 연장이 늦어 임대가 만료됐을 수 있으면 더 분배하지 않음
+        return not lost.is_set() and time.monotonic() < self._lease_valid_until
+
+    async def _heartbeat(self, lost: asyncio.Event):
+        """분배와 상관없이 lease_ttl/3마다 임대 연장 (분배를 마친 offset도 함께 저장), 실패하면 lost 설정"""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            renewed_at = time.monotonic()
+            if await self.db.acquire_lease(LEASE_NAME, self.holder, time.time(), self.lease_ttl, self._offset) is None:
+                print("⚠️ 리더 임대를 잃어 업데이트 수신을 멈춥니다.")
+                lost.set()
+                return
+            self._lease_valid_until = renewed_at + self.lease_ttl
+
+    async def _dispatch(self, update: Update, lost: asyncio.Event) -> bool:
+        """업데이트를 워커 큐에 넣음 (큐가 가득 차 기다리는 동안 임대를 잃으면 넣지 않고 False)"""
+        index = worker_for(update, self.workers)
+        data = update.to_dict()
+        while self._holds_lease(lost):
+            try:
+                # 워커가 밀려 있으면 자리가 날 때까지 받기를 멈추되, 잠깐씩 기다리며 임대 확인
+                await asyncio.to_thread(self._queues[index].put, data, True, DISPATCH_PUT_TIMEOUT)
+            except queue.Full:
+                continue
+            self.dispatched[index] += 1
+            return True
+        return False
+
+    @staticmethod
+    async def _wait(stop: asyncio.Event, seconds: float):
+        try:
+            await asyncio.wait_for(stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _lead(self, bot: Bot, stop: asyncio.Event, offset: int) -> int:
+        """임대 연장 태스크를 두고 업데이트를 받아 분배, 멈추거나 임대를 잃으면 다음 offset 반환
+
+        임대를 잃으면 받은 업데이트 중 아직 분배하지 않은 것은 버림 (다음 리더가 저장된 offset부터 다시 받음)
+        """
+        self._offset = offset
+        self._lease_valid_until = time.monotonic() + self.lease_ttl
+        lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(lost))
+        try:
+            while not stop.is_set() and self._holds_lease(lost):
+                self._check_workers()
+                try:
+                    updates = await bot.get_updates(offset=self._offset or None, timeout=self.poll_timeout,
+                                                    allowed_updates=Update.ALL_TYPES)
+                except TelegramError as e:
+                    print(f"업데이트 수신 오류: {e}")
+                    await self._wait(stop, 1.0)
+                    continue
+                for update in updates:
+                    if not await self._dispatch(update, lost):
+                        break
+                    self._offset = update.update_id + 1
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+        return self._offset
+
+    async def serve(self, stop: asyncio.Event):
+        """stop이 설정될 때까지 리더가 되기를 시도하고, 리더인 동안 업데이트 분배"""
+        bot = Bot(self.token, base_url=self.base_url) if self.base_url else Bot(self.token)
+        async with bot:
+            while not stop.is_set():
+                offset = await self.db.acquire_lease(LEASE_NAME, self.holder, time.time(), self.lease_ttl)
+                if offset is None:
+                    await self._wait(stop, self.lease_ttl / 3)  # 다른 인스턴스가 리더 (대기)
+                    continue
+                print(f"👑 리더가 되었습니다 ({self.holder}), 워커 {self.workers}개로 업데이트를 처리합니다.")
+                self.is_leader = True
+                self._start_workers()
+                try:
+                    offset = await self._lead(bot, stop, offset)
+                finally:
+                    await self._stop_workers()
+                    self.is_leader = False
+                if stop.is_set():
+                    # 받은 업데이트 확인 후 임대 반납 (다음 리더가 바로 이어받음)
+                    try:
+                        await bot.get_updates(offset=offset or None, timeout=0)
+                    except TelegramError as e:
+                        print(f"업데이트 확인 오류: {e}")
+                    await self.db.release_lease(LEASE_NAME, self.holder, offset)
+
+    def run(self):
+        """SIGINT/SIGTERM을 받을 때까지 실행"""
+        async def main():
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop.set)
+                except NotImplementedError:  # Windows
+                    pass
+            await self.serve(stop)
+
+        asyncio.run(main())
+
+def main():
+    """확장 실행 진입점 (인스턴스마다 실행, 같은 데이터베이스 파일을 써야 함)"""
+    if not BOT_TOKEN:
+        print("❌ BOT_TOKEN이 설정되지 않았습니다. .env 파일을 확인해주세요.")
+        return
+    db = AsyncDatabase()  # 워커가 뜨기 전에 마이그레이션 적용
+    runner = ScaleOutRunner(functools.partial(bot_application, workers=SCALE_OUT_WORKERS), db,
+                            workers=SCALE_OUT_WORKERS)
+    print(f"🔄 확장 모드로 시작합니다 ({runner.holder}, 워커 {runner.workers}개). 리더 임대를 기다립니다...")
+    try:
+        runner.run()
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
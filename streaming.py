@@ -0,0 +1,123 @@
+import time
+import asyncio
+from typing import AsyncIterator, Optional
+from telegram.error import BadRequest, RetryAfter
+from config import STREAM_EDIT_INTERVAL, STREAM_FINAL_RETRIES
+
+TELEGRAM_MESSAGE_LIMIT = 4096  # 텔레그램 메시지 최대 길이
+
+class StreamingReply:
+    """AI 응답 조각을 받는 대로 답장 하나에 이어 붙이는 도우미 (수정은 interval초에 한 번만)
+
+    중간 텍스트는 일반 텍스트로, 마지막 텍스트는 parse_mode(기본 HTML)로 표시합니다.
+    """
+
+    def __init__(self, message, interval: float = STREAM_EDIT_INTERVAL, parse_mode: Optional[str] = 'HTML',
+                 max_retries: int = STREAM_FINAL_RETRIES):
+        self.message = message  # 답장할 사용자 메시지
+        self.interval = interval
+        self.parse_mode = parse_mode
+        self.max_retries = max_retries
+        self.sent = None  # 봇이 보낸 답장 메시지
+        self.text = ""
+        self.shown = ""  # 현재 답장에 표시된 텍스트
+        self.next_edit = 0.0
+        self.edits = 0
+        self.first_sent_after: Optional[float] = None  # 시작부터 첫 답장까지 걸린 시간(초)
+
+    def _hold(self, e: RetryAfter):
+        retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+        self.next_edit = time.monotonic() + retry_after
+
+    async def _edit(self, text: str, parse_mode: Optional[str] = None) -> bool:
+        """답장 수정 (429 응답이면 지정된 시간 동안 수정 보류)"""
+        try:
+            await self.sent.edit_text(text, parse_mode=parse_mode)
+        except RetryAfter as e:
+            self._hold(e)
+            return False
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self.shown = text
+        self.edits += 1
+        return True
+
+    async def feed(self, piece: str):
+        """응답 조각 추가"""
+        self.text += piece
+        visible = self.text[:TELEGRAM_MESSAGE_LIMIT]
+        now = time.monotonic()
+        if self.sent is None:
+            if not visible.strip():
+                return
+            # 중간 텍스트는 태그가 끊길 수 있어 일반 텍스트로 전송
+            self.sent = await self.message.reply_text(visible)
+            self.shown = visible
+            self.next_edit = now + self.interval
+        elif now >= self.next_edit and visible != self.shown:
+            self.next_edit = now + self.interval
+            await self._edit(visible)
+
+    async def _wait_hold(self):
+        delay = self.next_edit - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _final_edit(self, text: str, parse_mode: Optional[str]) -> bool:
+        """마지막 텍스트로 수정 (429면 retry_after만큼 기다려 max_retries번까지 다시, 태그 오류면 일반 텍스트로)"""
+        for _ in range(self.max_retries + 1):
+            await self._wait_hold()
+            try:
+                if await self._edit(text, parse_mode):
+                    return True
+            except BadRequest as e:
+                if parse_mode is None:
+                    raise
+                print(f"스트리밍 응답 서식 오류, 일반 텍스트로 표시합니다: {e}")
+                parse_mode = None
+        return False
+
+    async def _reply(self, text: str, parse_mode: Optional[str]):
+        """새 메시지로 전송 (429면 retry_after만큼 기다려 다시, 태그 오류면 일반 텍스트로)"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_hold()
+            try:
+                return await self.message.reply_text(text, parse_mode=parse_mode)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self._hold(e)
+            except BadRequest as e:
+                if parse_mode is None:
+                    raise
+                print(f"스트리밍 응답 서식 오류, 일반 텍스트로 표시합니다: {e}")
+                parse_mode = None
+
+    async def finish(self) -> str:
+        """남은 텍스트를 반영하고 전체 응답 반환 (길이 제한을 넘는 부분은 새 메시지로 전송)
+
+        마지막 수정이 끝내 실패하면 전체 텍스트를 새 메시지로 보내 응답이 빠지지 않게 함
+        """
+        visible = self.text[:TELEGRAM_MESSAGE_LIMIT]
+        # 여러 메시지로 나뉘면 태그가 잘릴 수 있어 일반 텍스트로
+        parse_mode = self.parse_mode if len(self.text) <= TELEGRAM_MESSAGE_LIMIT else None
+        if self.sent is None:
+            if visible.strip():
+                self.sent = await self._reply(visible, parse_mode)
+        elif visible != self.shown or parse_mode is not None:
+            if not await self._final_edit(visible, parse_mode):
+                print("스트리밍 응답 마지막 수정에 실패해 새 메시지로 보냅니다.")
+                self.sent = await self._reply(visible, parse_mode)
+        for start in range(TELEGRAM_MESSAGE_LIMIT, len(self.text), TELEGRAM_MESSAGE_LIMIT):
+            await self._reply(self.text[start:start + TELEGRAM_MESSAGE_LIMIT], None)
+        return self.text.strip()
+
+    async def run(self, chunks: AsyncIterator[str]) -> str:
+        """조각 스트림을 끝까지 보내고 전체 응답 반환"""
+        began = time.monotonic()
+        async for piece in chunks:
+            await self.feed(piece)
+            if self.sent is not None and self.first_sent_after is None:
+                self.first_sent_after = time.monotonic() - began
+        return await self.finish()
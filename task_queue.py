@@ -0,0 +1,126 @@
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config import JOB_WORKERS, JOB_POLL_INTERVAL, JOB_MAX_ATTEMPTS, JOB_RETENTION, JOB_RETRY_BASE_DELAY, JOB_RETRY_MAX_DELAY
+
+# 작업 처리 함수: (bot, 작업) -> 사용자에게 보낼 결과 메시지 (빈 문자열이면 보내지 않음)
+JobHandler = Callable[[Any, Dict[str, Any]], Awaitable[str]]
+
+def _percentile_ms(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] * 1000
+
+class TaskQueue:
+    """SQLite에 저장되는 백그라운드 작업 큐 (재시작 후에도 이어서 처리, 사용자/명령별 중복 방지)"""
+
+    def __init__(self, db, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retention: float = JOB_RETENTION,
+                 retry_delay: float = JOB_RETRY_BASE_DELAY, max_retry_delay: float = JOB_RETRY_MAX_DELAY):
+        self.db = db  # AsyncDatabase
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+        # 지표
+        self.completed = 0
+        self.failed = 0
+        self.latencies: deque = deque(maxlen=1000)  # 추가부터 완료까지(초)
+        self.run_times: deque = deque(maxlen=1000)  # 실행 시간(초)
+
+    def register(self, command: str, handler: JobHandler):
+        """명령별 처리 함수 등록"""
+        self.handlers[command] = handler
+
+    async def enqueue(self, user_id: int, chat_id: int, command: str, payload: Optional[Dict] = None) -> Optional[int]:
+        """작업 추가 후 작업 ID 반환 (같은 작업이 이미 대기/실행 중이면 0, 저장하지 못하면 None)"""
+        job_id = await self.db.enqueue_job(user_id, chat_id, command,
+                                           json.dumps(payload, ensure_ascii=False) if payload else None, time.time())
+        if job_id and self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def start(self, bot):
+        """워커 시작 (재시작 전에 실행 중이던 작업은 다시 대기열로)"""
+        requeued = await self.db.requeue_running_jobs()
+        if requeued:
+            print(f"🔄 중단된 백그라운드 작업 {requeued}개를 다시 처리합니다.")
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(bot)) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """진행 중인 작업을 기다렸다가 워커 종료 (시간 초과 시 취소, 남은 작업은 다음 시작 때 처리)"""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._tasks:
+            done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, bot):
+        while not self._stopping:
+            self._wakeup.clear()
+            job = await self.db.claim_job(time.time())
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(bot, job)
+
+    async def _run(self, bot, job: Dict[str, Any]):
+        """작업 실행 후 결과 전송 (실패 시 max_attempts까지 지수 백오프로 다시 대기열로)"""
+        job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+        began = time.monotonic()
+        try:
+            handler = self.handlers.get(job['command'])
+            if handler is None:
+                raise KeyError(f"등록되지 않은 작업: {job['command']}")
+            text = await handler(bot, job)
+            if text:
+                await bot.send_message(chat_id=job['chat_id'], text=text)
+        except Exception as e:
+            print(f"백그라운드 작업 오류 ({job['command']}): {e}")
+            if job['attempts'] < self.max_attempts:
+                # 같은 오류가 반복되는 작업을 바로 다시 가져가지 않도록 시도마다 대기 시간을 2배로
+                delay = min(self.max_retry_delay, self.retry_delay * (2 ** (job['attempts'] - 1)))
+                await self.db.finish_job(job['id'], 'pending', str(e), time.time(), self.retention, time.time() + delay)
+                return
+            self.failed += 1
+            await self.db.finish_job(job['id'], 'failed', str(e), time.time(), self.retention)
+            try:
+                await bot.send_message(chat_id=job['chat_id'], text="❌ 요청하신 작업을 처리하지 못했습니다. 잠시 후 다시 시도해주세요.")
+            except Exception as send_error:
+                print(f"작업 실패 알림 전송 오류: {send_error}")
+            return
+        await self.db.finish_job(job['id'], 'done', None, time.time(), self.retention)
+        self.completed += 1
+        self.run_times.append(time.monotonic() - began)
+        self.latencies.append(time.time() - job['created_at'])
+
+    async def stats(self) -> Dict[str, Any]:
+        """대기열 길이와 작업 지연 지표"""
+        stats = await self.db.get_job_stats(time.time())
+        stats.update({
+            'completed': self.completed,
+            'failed_total': self.failed,
+            'latency_p50_ms': _percentile_ms(list(self.latencies), 50),
+            'latency_p99_ms': _percentile_ms(list(self.latencies), 99),
+            'run_p50_ms': _percentile_ms(list(self.run_times), 50),
+        })
+        return stats
@@ -4,9 +4,39 @@
 실제 봇을 실행하기 전에 기본 기능들을 테스트할 수 있습니다.
 """
 
+import os
+import re
+import asyncio
 import sqlite3
 import datetime
-from database import Database
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from database import Database, AsyncDatabase, MIGRATIONS, _period_range
+from conversation_store import ConversationStore, ExpiringDict
+from ai_cache import ResponseCache
+from ai_helper import AIHelper
+from fake_openai import FakeOpenAIServer
+from streaming import StreamingReply
+from ai_executor import AIRequestExecutor, TokenBucket, estimate_tokens
+from ai_helper import FALLBACK_MESSAGES, reflection_pattern_messages
+from prompt_builder import PromptBuilder, count_tokens, count_prompt_tokens
+from fake_telegram import FakeTelegramServer
+from media_pipeline import MediaPipeline, MediaTooLargeError, select_photo_size
+from telegram import Bot, Voice, PhotoSize, Update
+from task_queue import TaskQueue
+import openai
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+from notifier import NotificationDispatcher, RateLimitedSender
+import pytz
+from timeutil import local_today, normalize_timezone
+from batch_analysis import BatchReportJob, last_week
+from persistence import SQLitePersistence
+from update_processor import PerUserUpdateProcessor
+from embedding_index import EmbeddingIndex, HashingEmbedder, OpenAIEmbedder, ReflectionMemory, format_reflection_line
+import json
 
 def test_database():
     """데이터베이스 기능 테스트"""
@@ -67,6 +97,1730 @@ def test_database():
     
     print("\n✅ 데이터베이스 테스트 완료!")
 
+def test_connection_pool():
+    """연결 풀 재사용 및 PRAGMA 테스트"""
+    print("\n🧪 연결 풀 테스트 시작...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'pool.db'))
+        for i in range(20):
+            db.add_schedule(1, f"일정 {i}", "", "2024-01-15")
+            db.get_schedules(1, "2024-01-15")
+
+        conn = db.pool.connection()
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+        # 다른 스레드는 자신의 연결을 별도로 가짐
+        worker = threading.Thread(target=lambda: db.get_schedules(1))
+        worker.start()
+        worker.join()
+
+        stats = db.get_pool_stats()
+        print(f"풀 지표: {stats}")
+        assert stats['misses'] == 2
+        assert stats['hits'] >= 40
+        db.close()
+        assert db.get_pool_stats()['connections'] == 0
+    print("✅ 연결 풀 테스트 완료!")
+
+def test_async_database():
+    """AsyncDatabase 코루틴 래퍼 테스트"""
+    print("\n🧪 비동기 데이터베이스 테스트 시작...")
+
+    async def run(db: AsyncDatabase):
+        # 쓰기는 전용 스레드에서 순서대로, 조회는 리더 풀에서 동시에 실행
+        results = await asyncio.gather(*(db.add_schedule(7, f"일정 {i}", "", "2024-02-01") for i in range(10)))
+        assert all(results)
+        schedules, reflections = await asyncio.gather(db.get_schedules(7, "2024-02-01"), db.get_reflections(7))
+        assert len(schedules) == 10
+        assert reflections == []
+        assert await db.delete_schedule(schedules[0]['id'], 7)
+        assert len(await db.get_schedules(7)) == 9
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'async.db')), readers=2)
+        asyncio.run(run(db))
+        db.close()
+    print("✅ 비동기 데이터베이스 테스트 완료!")
+
+def test_schema_migrations():
+    """버전 관리 이전 스키마에서 최신 버전으로 마이그레이션 테스트"""
+    print("\n🧪 스키마 마이그레이션 테스트 시작...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'legacy.db')
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE schedules (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, title TEXT NOT NULL, description TEXT, date TEXT NOT NULL, time TEXT)")
+            conn.execute("CREATE TABLE routine_completions (id INTEGER PRIMARY KEY AUTOINCREMENT, routine_id INTEGER NOT NULL, completion_date TEXT NOT NULL, is_done BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+            conn.execute("INSERT INTO schedules (user_id, title, date) VALUES (1, '기존 일정', '2024-01-01')")
+            conn.executemany("INSERT INTO routine_completions (routine_id, completion_date, is_done) VALUES (1, '2024-01-01', ?)", [(0,), (1,)])
+
+        db = Database(path)
+        assert db.get_schema_version() == MIGRATIONS[-1][0]
+        assert db.get_schedules(1)[0]['is_done'] == 0
+        rows = db.pool.connection().execute("SELECT is_done FROM routine_completions").fetchall()
+        assert rows == [(1,)]  # 중복 중 최신 기록만 남음
+        db.close()
+
+        # 재시작 시 이미 적용된 마이그레이션은 다시 실행되지 않음
+        db = Database(path)
+        count = db.pool.connection().execute("SELECT COUNT(*) FROM schema_version").fetchone()[0]
+        assert count == len(MIGRATIONS)
+        db.close()
+    print("✅ 스키마 마이그레이션 테스트 완료!")
+
+def test_hot_queries_use_indexes():
+    """주요 조회 쿼리가 전체 테이블 스캔 없이 인덱스를 사용하는지 EXPLAIN QUERY PLAN으로 확인"""
+    print("\n🧪 쿼리 플랜 테스트 시작...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'plan.db'))
+        db.add_schedule(1, "일정", "", "2024-01-15", "09:00")
+        db.add_reflection(1, 'daily', "회고", "2024-01-15")
+        db.add_routine(1, "루틴", "", 'daily', "2024-01-01")
+
+        conn = db.pool.connection()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        db.get_schedules(1, "2024-01-15")
+        db.get_schedules(1)
+        db.get_reflections(1, 'daily', "2024-01-15")
+        db.get_reflections(1, 'daily')
+        db.get_reflections(1)
+        db.get_feedback(1)
+        db.get_notifications(1)
+        db.get_notifications(1, 'morning')
+        db.get_last_schedule_id(1)
+        db.get_schedule_stats(1, 'week')
+        db.get_reflection_stats(1, 'month')
+        db.get_routines(1)
+        db.get_today_routines(1)
+        db.get_daily_digests([1], "2024-01-15")
+        db.get_user_timezone(1)
+        db.get_notification_timezones()
+        db.get_reflection_user_ids("2024-01-09", "2024-01-15", 0, 500)
+        db.get_recent_reflections_for_users([1], "2024-01-09", "2024-01-15")
+        db.get_undelivered_reports(1)
+        db.search_reflections(1, "회고를 찾기")
+        db.search_reflections(1, "회고")
+        db.get_reflections_page(1, ("2024-01-15", "2024-01-15 00:00:00", 5), 'older', 5)
+        db.get_reflections_page(1, ("2024-01-15", "2024-01-15 00:00:00", 5), 'newer', 5)
+        db.get_schedules_page(1, ("2024-01-15", None, 0), 'next', 5)
+        db.get_schedules_page(1, ("2024-01-15", "09:00", 3), 'prev', 5)
+        conn.set_trace_callback(None)
+
+        selects = [sql for sql in statements if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+        assert selects
+        for sql in selects:
+            plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+            ctes = set(re.findall(r'(\w+)\s*\([^)]*\)\s+AS\s*\(', sql))  # CTE 스캔은 테이블 스캔이 아님
+            full_scans = [step for step in plan if re.match(r'SCAN \w+$', step) and step.split()[1] not in ctes]
+            assert not full_scans, f"인덱스 미사용: {sql.strip()} -> {plan}"
+        db.close()
+    print("✅ 쿼리 플랜 테스트 완료!")
+
+def test_routine_completion_upsert():
+    """루틴 완료 upsert 및 일괄 처리 테스트"""
+    print("\n🧪 루틴 완료 upsert 테스트 시작...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'routine.db'))
+        conn = db.pool.connection()
+        for is_done in (True, False, True):
+            assert db.update_routine_completion(1, "2024-03-01", is_done)
+        rows = conn.execute("SELECT routine_id, completion_date, is_done FROM routine_completions").fetchall()
+        assert rows == [(1, "2024-03-01", 1)]
+
+        # 일주일 x 루틴 3개를 한 번에 완료 처리 (기존 기록은 갱신)
+        for title in ("스트레칭", "산책", "독서"):
+            db.add_routine(1, title, "", 'daily', "2024-01-01")
+        assert db.bulk_update_routine_completions(1, [1, 2, 3], "2024-03-01", "2024-03-07") == 21
+        assert conn.execute("SELECT COUNT(*) FROM routine_completions WHERE is_done = 1").fetchone()[0] == 21
+        assert db.bulk_update_routine_completions(1, [1], "2024-03-07", "2024-03-01") == 0
+
+        # 예정된 날짜만 기록 (주간: 월/수, 매월: 5일), 다른 사용자의 루틴은 건너뜀
+        db.add_routine(1, "주간 점검", "", 'weekly', "2024-01-01", days_of_week="월,수")
+        db.add_routine(1, "월간 정산", "", 'monthly', "2024-01-05")
+        db.add_routine(2, "남의 루틴", "", 'daily', "2024-01-01")
+        assert db.bulk_update_routine_completions(1, [4, 5, 6], "2024-03-01", "2024-03-31") == 8 + 1
+        dates = conn.execute("SELECT completion_date FROM routine_completions WHERE routine_id = 5").fetchall()
+        assert dates == [("2024-03-05",)]
+        assert conn.execute("SELECT COUNT(*) FROM routine_completions WHERE routine_id = 6").fetchone()[0] == 0
+        db.close()
+    print("✅ 루틴 완료 upsert 테스트 완료!")
+
+def test_routine_recurrence():
+    """요일/매월 반복 루틴의 날짜별 전개 테스트"""
+    print("\n🧪 루틴 반복 규칙 테스트 시작...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'recurrence.db'))
+        db.add_routine(1, "매일 물 마시기", "", 'daily', "2024-01-01")
+        db.add_routine(1, "운동", "", 'weekly', "2024-01-01", days_of_week="1,3,5")
+        db.add_routine(1, "독서 모임", "", 'weekly', "2024-01-01", days_of_week="토")
+        db.add_routine(1, "월세", "", 'monthly', "2023-12-05")
+        db.add_routine(1, "종료된 루틴", "", 'daily', "2023-01-01", end_date="2023-12-31")
+        db.add_routine(2, "다른 사용자", "", 'daily', "2024-01-01")
+
+        # 2024-01-01은 월요일
+        week = db.get_routines_for_range(1, "2024-01-01", "2024-01-07")
+        by_title = {}
+        for r in week:
+            by_title.setdefault(r['title'], []).append(r['date'])
+        assert len(by_title["매일 물 마시기"]) == 7
+        assert by_title["운동"] == ["2024-01-01", "2024-01-03", "2024-01-05"]
+        assert by_title["독서 모임"] == ["2024-01-06"]
+        assert by_title["월세"] == ["2024-01-05"]
+        assert "종료된 루틴" not in by_title and "다른 사용자" not in by_title
+
+        exercise_id = next(r['id'] for r in week if r['title'] == "운동")
+        db.update_routine_completion(exercise_id, "2024-01-03")
+        day = db.get_routines_for_date(1, "2024-01-03")
+        assert {r['title']: r['is_done'] for r in day} == {"매일 물 마시기": 0, "운동": 1}
+        db.close()
+    print("✅ 루틴 반복 규칙 테스트 완료!")
+
+def test_daily_stats_rollup():
+    """일별 통계 집계 테이블의 증분 갱신 및 재계산 테스트"""
+    print("\n🧪 일별 통계 집계 테스트 시작...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'stats.db'))
+        today = datetime.datetime.now().strftime('%Y-%m-%d')
+        for i in range(4):
+            db.add_schedule(1, f"일정 {i}", "", today)
+        schedules = db.get_schedules(1, today)
+        db.update_schedule_done(schedules[0]['id'], 1)
+        db.update_schedule_done(schedules[1]['id'], 1)
+        db.delete_schedule(schedules[2]['id'], 1)
+        db.update_schedule(schedules[3]['id'], 1, "옮긴 일정", "", "2000-01-01")
+        db.add_reflection(1, 'daily', "회고 1", today)
+        db.add_reflection(1, 'daily', "회고 2", today)
+        db.add_routine(1, "루틴", "", 'daily', today)
+        routine_id = db.get_routines(1)[0]['id']
+        db.update_routine_completion(routine_id, today, True)
+        db.update_routine_completion(routine_id, today, False)
+        db.update_routine_completion(routine_id, today, True)
+
+        assert db.check_daily_stats() == []
+        summary = db.get_stats_summary(1, 'week')
+        assert summary['schedule'] == {'done': 2, 'not_done': 0}
+        assert summary['reflection']['written'] == 1
+        assert summary['routines_completed'] == 1
+        assert db.get_schedule_stats(1, 'year')['done'] == 2
+
+        db.delete_routine(routine_id, 1)
+        assert db.check_daily_stats() == []
+
+        # 집계가 어긋나면 검사기로 찾고 재계산으로 복구
+        db.pool.connection().execute("UPDATE daily_user_stats SET schedules_done = 99 WHERE date = ?", (today,))
+        db.pool.connection().commit()
+        assert len(db.check_daily_stats(1)) == 1
+        assert db.rebuild_daily_stats(1)
+        assert db.check_daily_stats() == []
+        db.close()
+    print("✅ 일별 통계 집계 테스트 완료!")
+
+def test_conversation_store():
+    """대화 기록 저장소의 턴 제한/메모리 예산/축출/SQLite 보관 테스트"""
+    print("\n🧪 대화 기록 저장소 테스트 시작...")
+
+    async def run(path: str):
+        db = AsyncDatabase(Database(path))
+        store = ConversationStore(db, max_turns=4, max_bytes=200, ttl=60)
+        for i in range(6):
+            await store.append(1, "user", f"질문 {i}")
+        turns = await store.get(1)
+        assert [t['content'] for t in turns] == ["질문 2", "질문 3", "질문 4", "질문 5"]
+
+        # 메모리 예산을 넘으면 가장 오래 쓰지 않은 사용자부터 내림
+        await store.append(2, "user", "가" * 100)
+        await store.append(3, "user", "나" * 100)
+        stats = store.stats()
+        assert stats['resident_bytes'] <= 200 and stats['evictions'] >= 1
+        assert 1 not in store._conversations
+
+        # 턴은 모아서 한 트랜잭션으로 저장, 내려간 사용자(또는 재시작 후)는 SQLite에서 다시 불러옴
+        assert await db.get_conversation_turns(1, 4) == [] and store.stats()['pending_turns'] == 8
+        await store.close()
+        assert store.stats()['flushes'] == 1 and store.stats()['pending_turns'] == 0
+        restarted = ConversationStore(db, max_turns=4)
+        assert [t['content'] for t in await restarted.get(1)] == ["질문 2", "질문 3", "질문 4", "질문 5"]
+        await restarted.clear(1)
+        assert await ConversationStore(db).get(1) == []
+
+        # 같은 사용자를 동시에 불러와도 메모리 사용량은 한 번만 더함
+        concurrent = ConversationStore(db, max_turns=4)
+        await asyncio.gather(*[concurrent.get(2) for _ in range(5)])
+        assert concurrent.resident_bytes == concurrent._conversations[2]['bytes'] > 0
+
+        # 축출된 사용자의 저장 전 턴은 다시 불러오기 전에 저장, 시간이 지나면 자동 저장
+        lazy = ConversationStore(db, max_turns=4, max_bytes=0, flush_interval=0.05)
+        await lazy.append(4, "user", "저장 전")
+        assert 4 not in lazy._conversations
+        assert [t['content'] for t in await lazy.get(4)] == ["저장 전"]
+        await lazy.append(5, "user", "자동 저장")
+        await asyncio.sleep(0.2)
+        assert [t['content'] for t in await db.get_conversation_turns(5, 4)] == ["자동 저장"]
+
+        # 유휴 시간 초과 시 축출
+        idle = ConversationStore(max_turns=4, ttl=0.05)
+        await idle.append(9, "user", "안녕")
+        time.sleep(0.1)
+        assert idle.stats()['resident_users'] == 0
+        db.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, 'conversation.db')))
+
+    states = ExpiringDict(ttl=0.05, max_size=2)
+    states[1] = {'step': 1}
+    states[1]['date'] = "2024-01-01"
+    assert states[1] == {'step': 1, 'date': "2024-01-01"}
+    states[2] = {}
+    states[3] = {}
+    assert 1 not in states and len(states) == 2
+    time.sleep(0.1)
+    assert len(states) == 0
+    print("✅ 대화 기록 저장소 테스트 완료!")
+
+class FakeOpenAIClient:
+    """chat.completions.create 호출을 기록하고 고정 응답을 돌려주는 가짜 OpenAI 클라이언트"""
+
+    def __init__(self, reply: str = "가짜 응답"):
+        self.reply = reply
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        message = SimpleNamespace(content=f"{self.reply} {len(self.calls)}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def test_ai_response_cache():
+    """AI 응답 캐시 적중/TTL/SQLite 영구 계층 테스트"""
+    print("\n🧪 AI 응답 캐시 테스트 시작...")
+
+    async def run(path: str):
+        db = AsyncDatabase(Database(path))
+        client = FakeOpenAIClient()
+        helper = AIHelper(client=client, cache=ResponseCache(db))
+
+        # /feedback 후 /ai_feedback 처럼 같은 회고를 연달아 요청하면 API는 한 번만 호출
+        first = await helper.get_reflection_feedback("오늘은 테스트를 작성했다")
+        second = await helper.get_reflection_feedback("오늘은 테스트를 작성했다")
+        assert first == second == "가짜 응답 1" and len(client.calls) == 1
+        assert await helper.get_reflection_feedback("다른 회고") == "가짜 응답 2"
+
+        schedules = [{'date': '2024-01-15', 'title': '회의', 'is_done': True}]
+        await helper.get_schedule_summary(schedules)
+        await helper.get_schedule_summary(schedules)
+        assert len(client.calls) == 3
+        stats = helper.cache.stats()
+        assert stats['hits'] == 2 and stats['misses'] == 3
+
+        # 캐시 대상이 아닌 대화는 매번 호출
+        await helper.chat_with_gpt("안녕")
+        await helper.chat_with_gpt("안녕")
+        assert len(client.calls) == 5
+
+        # 재시작 후에도 SQLite 계층에서 응답 재사용
+        restarted = AIHelper(client=client, cache=ResponseCache(db))
+        assert await restarted.get_reflection_feedback("오늘은 테스트를 작성했다") == "가짜 응답 1"
+        assert len(client.calls) == 5 and restarted.cache.stats()['db_hits'] == 1
+
+        # 만료된 항목은 미적중
+        cache = ResponseCache(db, max_entries=1)
+        await cache.set("a", "값", ttl=0.05)
+        await cache.set("b", "값", ttl=60)
+        assert list(cache._entries) == ["b"]
+        time.sleep(0.1)
+        assert await cache.get("a") is None and await cache.get("b") == "값"
+        db.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, 'ai_cache.db')))
+    print("✅ AI 응답 캐시 테스트 완료!")
+
+class FakeTelegramMessage:
+    """reply_text/edit_text 호출 시각과 내용을 기록하는 가짜 텔레그램 메시지"""
+
+    def __init__(self, log=None, retry_after: int = 0):
+        self.log = log if log is not None else []
+        self.retry_after = retry_after  # 다음 수정 요청 몇 번에 429(RetryAfter)를 돌려줄지
+        self.text = ""
+
+    async def reply_text(self, text, parse_mode=None, **kwargs):
+        reply = FakeTelegramMessage(self.log, self.retry_after)
+        reply.text = text
+        self.log.append(('send', time.monotonic(), text, parse_mode))
+        return reply
+
+    async def edit_text(self, text, parse_mode=None, **kwargs):
+        if self.retry_after:
+            self.retry_after -= 1
+            raise RetryAfter(0.05)
+        self.text = text
+        self.log.append(('edit', time.monotonic(), text, parse_mode))
+        return self
+
+def test_streaming_reply():
+    """스트리밍 응답의 첫 표시 시간/수정 빈도 제한 테스트 (로컬 가짜 스트리밍 서버 사용)"""
+    print("\n🧪 스트리밍 응답 테스트 시작...")
+    tokens = [f"조각{i} " for i in range(12)]
+
+    async def run(server: FakeOpenAIServer):
+        client = openai.AsyncOpenAI(api_key="test", base_url=server.base_url)
+        helper = AIHelper(client=client)
+        await helper.chat_with_gpt("준비")  # 클라이언트 초기화 비용은 측정에서 제외
+        message = FakeTelegramMessage()
+        began = time.monotonic()
+        reply = StreamingReply(message, interval=0.1)
+        text = await reply.run(helper.stream_chat_with_gpt("안녕", [{'role': 'user', 'content': '이전 질문'}]))
+        elapsed = time.monotonic() - began
+        await client.close()
+
+        assert text == "".join(tokens).strip()
+        assert server.requests[1]['body']['stream'] is True
+        assert server.requests[1]['body']['messages'][-1]['content'] == "안녕"
+        # 첫 조각이 오자마자 답장을 보내고, 이후에는 수정 간격을 지킴
+        sends = [entry for entry in message.log if entry[0] == 'send']
+        edits = [entry for entry in message.log if entry[0] == 'edit']
+        assert len(sends) == 1 and sends[0][1] - began < elapsed / 2
+        assert reply.first_sent_after < 0.2
+        assert edits[-1][2] == "".join(tokens)
+        for previous, current in zip(edits, edits[1:]):
+            assert current[1] - previous[1] >= 0.09
+        assert len(edits) <= elapsed / 0.1 + 2
+
+    with FakeOpenAIServer(tokens=tokens, token_delay=0.03) as server:
+        asyncio.run(run(server))
+
+    async def pieces():
+        for piece in ("가", "나", "다"):
+            await asyncio.sleep(0.02)
+            yield piece
+
+    async def run_retry_after():
+        # 429(RetryAfter)를 받으면 수정을 미뤘다가 마지막에 HTML로 반영 (중간 수정은 일반 텍스트)
+        message = FakeTelegramMessage(retry_after=1)
+        reply = StreamingReply(message, interval=0.01)
+        assert await reply.run(pieces()) == "가나다"
+        assert message.log[0][3] is None
+        assert message.log[-1][0::2] == ('edit', "가나다") and message.log[-1][3] == 'HTML'
+
+        # 마지막 수정이 계속 429면 retry_after만큼 기다려 다시 시도한 뒤, 전체 응답을 새 메시지로 보냄
+        message = FakeTelegramMessage(retry_after=100)
+        reply = StreamingReply(message, interval=0.01, max_retries=2)
+        assert await reply.run(pieces()) == "가나다"
+        assert [entry[0] for entry in message.log] == ['send', 'send']
+        assert message.log[-1][2:] == ("가나다", 'HTML')
+
+    asyncio.run(run_retry_after())
+    print("✅ 스트리밍 응답 테스트 완료!")
+
+def test_ai_request_executor():
+    """AI 요청 실행기의 재시도/회로 차단/동시 요청 제한/분당 한도 테스트"""
+    print("\n🧪 AI 요청 실행기 테스트 시작...")
+    import httpx
+
+    async def run(server: FakeOpenAIServer):
+        client = openai.AsyncOpenAI(api_key="test", base_url=server.base_url, max_retries=0)
+        executor = AIRequestExecutor(max_retries=2, base_delay=0.01, failure_threshold=2, reset_timeout=0.2)
+        helper = AIHelper(client=client, executor=executor)
+
+        # 429/500은 지수 백오프로 재시도 후 성공
+        server.failures = [429, 500]
+        assert await helper.chat_with_gpt("안녕") == "안녕하세요"
+        assert len(server.requests) == 3 and executor.stats()['retries'] == 2
+
+        # 결제 미설정은 재시도 없이 바로 대체 문구
+        server.failures = [(429, 'insufficient_quota')]
+        assert await helper.chat_with_gpt("안녕") == FALLBACK_MESSAGES['chat_with_gpt'][0]
+        assert len(server.requests) == 4
+
+        # 연속 실패 시 회로가 열리고, 열린 동안은 API를 부르지 않고 대체 문구 반환
+        server.failures = [500] * 3
+        assert await helper.chat_with_gpt("안녕") == FALLBACK_MESSAGES['chat_with_gpt'][1]
+        assert executor.state == "open"
+        requests_before = len(server.requests)
+        assert await helper.get_motivational_message() == FALLBACK_MESSAGES['get_motivational_message'][1]
+        assert len(server.requests) == requests_before and executor.stats()['short_circuits'] == 1
+
+        # reset_timeout 후 시험 요청이 성공하면 다시 닫힘
+        await asyncio.sleep(0.25)
+        assert await helper.chat_with_gpt("안녕") == "안녕하세요"
+        assert executor.state == "closed"
+        await client.close()
+
+        # 스트림을 연 뒤 중간에 끊겨도 실패로 기록되어 회로가 열림 (받은 조각은 그대로 전달)
+        class BrokenStream:
+            def __init__(self):
+                self.sent = False
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                if self.sent:
+                    raise openai.APIConnectionError(request=httpx.Request("POST", server.base_url))
+                self.sent = True
+                return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="앞부분"))])
+
+        async def create_stream(**kwargs):
+            return BrokenStream()
+
+        streaming = AIRequestExecutor(max_retries=0, failure_threshold=2, reset_timeout=60)
+        broken = AIHelper(client=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create_stream))),
+                          executor=streaming)
+        for _ in range(2):
+            assert [piece async for piece in broken.stream_chat_with_gpt("안녕")] == ["앞부분"]
+        assert streaming.state == "open" and streaming.stats()['failures'] == 2
+        assert [piece async for piece in broken.stream_chat_with_gpt("안녕")] == [FALLBACK_MESSAGES['chat_with_gpt'][1]]
+
+        # 동시 요청 수 제한과 대기열 지표
+        limited = AIRequestExecutor(max_concurrency=2)
+        running = []
+        peak = []
+
+        async def call():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.02)
+            running.pop()
+            return True
+
+        assert all(await asyncio.gather(*(limited.run(call, 10) for _ in range(6))))
+        stats = limited.stats()
+        assert max(peak) == 2 and stats['max_queue_depth'] >= 4 and stats['queue_depth'] == 0
+        assert stats['wait_p99_ms'] >= 30
+
+        # 분당 한도: 초당 20개, 버스트 1개면 5개 획득에 약 0.2초
+        bucket = TokenBucket(20 * 60, burst=1)
+        began = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        assert time.monotonic() - began >= 0.18
+
+    with FakeOpenAIServer() as server:
+        asyncio.run(run(server))
+    print("✅ AI 요청 실행기 테스트 완료!")
+
+def test_voice_pipeline():
+    """음성 회고 파이프라인 테스트 (가짜 텔레그램 파일 서버 + 가짜 음성 변환 API)"""
+    print("\n🧪 음성 회고 파이프라인 테스트 시작...")
+    audio = os.urandom(200 * 1024)
+
+    async def run(telegram_server: FakeTelegramServer, openai_server: FakeOpenAIServer):
+        telegram_server.add_file("voice-1", "voice/file_1.oga", audio)
+        client = openai.AsyncOpenAI(api_key="test", base_url=openai_server.base_url)
+        pipeline = MediaPipeline(AIHelper(client=client))
+        files_before = set(os.listdir('.'))
+        async with Bot(telegram_server.token, base_url=telegram_server.base_url,
+                       base_file_url=telegram_server.base_file_url) as bot:
+            voice = Voice("voice-1", "voice-1", duration=5, file_size=len(audio))
+            result = await pipeline.process_voice(bot, voice)
+            assert result['transcription'] == "음성 변환 결과"
+            assert result['analysis'] == "안녕하세요"
+            assert result['bytes'] == len(audio)
+            assert list(result['timings']) == ["download", "transcribe", "analyze"]
+
+            # 업로드된 multipart 본문에 음성 전체가 담겼고, 디스크에는 아무것도 남지 않음
+            upload = [r for r in openai_server.requests if r['path'].endswith('/audio/transcriptions')][0]
+            assert upload['bytes'] > len(audio)
+            assert set(os.listdir('.')) == files_before
+
+            # 제한을 넘는 음성은 다운로드 전에 거절
+            small = MediaPipeline(AIHelper(client=client), max_voice_bytes=1024)
+            try:
+                await small.process_voice(bot, voice)
+                assert False, "MediaTooLargeError가 발생해야 합니다"
+            except MediaTooLargeError:
+                pass
+            assert telegram_server.downloads == ["voice/file_1.oga"]
+            # 크기를 미리 알 수 없어도 받는 도중 제한을 넘으면 중단
+            telegram_server.report_file_size = False
+            try:
+                await small.fetch(bot, "voice-1", 64 * 1024)
+                assert False, "MediaTooLargeError가 발생해야 합니다"
+            except MediaTooLargeError:
+                pass
+            assert len(telegram_server.downloads) == 2
+        await pipeline.close()
+        await client.close()
+
+    with FakeTelegramServer() as telegram_server, FakeOpenAIServer() as openai_server:
+        asyncio.run(run(telegram_server, openai_server))
+    print("✅ 음성 회고 파이프라인 테스트 완료!")
+
+def test_image_pipeline():
+    """이미지 회고 준비 단계 테스트 (적당한 크기 선택, low detail 전송, 같은 이미지 재분석 방지)"""
+    print("\n🧪 이미지 회고 파이프라인 테스트 시작...")
+    sizes = [(90, 67, 2), (320, 240, 20), (800, 600, 80), (1280, 960, 200)]  # (가로, 세로, KB)
+
+    async def run(telegram_server: FakeTelegramServer, openai_server: FakeOpenAIServer):
+        photo = []
+        for width, height, kb in sizes:
+            file_id = f"photo-{width}"
+            telegram_server.add_file(file_id, f"photos/{file_id}.jpg", os.urandom(kb * 1024))
+            photo.append(PhotoSize(file_id, file_id, width, height, file_size=kb * 1024))
+        client = openai.AsyncOpenAI(api_key="test", base_url=openai_server.base_url)
+        pipeline = MediaPipeline(AIHelper(client=client))
+        async with Bot(telegram_server.token, base_url=telegram_server.base_url,
+                       base_file_url=telegram_server.base_file_url) as bot:
+            result = await pipeline.process_image(bot, photo)
+            assert result['analysis'] == "안녕하세요"
+            assert (result['width'], result['height']) == (800, 600)
+            assert telegram_server.downloads == ["photos/photo-800.jpg"]
+            image_part = openai_server.requests[0]['body']['messages'][0]['content'][1]['image_url']
+            assert image_part['detail'] == "low"
+            assert openai_server.requests[0]['bytes'] < 200 * 1024
+
+            # 같은 이미지는 다시 분석하지 않음
+            again = await pipeline.process_image(bot, photo)
+            assert again['analysis'] == "안녕하세요" and len(openai_server.requests) == 1
+        await pipeline.close()
+        await client.close()
+
+    with FakeTelegramServer() as telegram_server, FakeOpenAIServer() as openai_server:
+        asyncio.run(run(telegram_server, openai_server))
+
+    # 픽셀 예산을 넘는 JPEG는 축소하고 EXIF(촬영 위치 등)는 지움
+    import io
+    from PIL import Image
+    from media_pipeline import downscale_image
+    from config import IMAGE_MAX_PIXELS
+
+    def jpeg_with_exif(width: int, height: int) -> bytes:
+        image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+        exif = Image.Exif()
+        exif[0x010F] = "TestCamera"  # Make
+        exif[0x8825] = {1: 'N', 2: (37.0, 33.0, 0.0)}  # GPSInfo
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=95, exif=exif)
+        return output.getvalue()
+
+    for width, height in ((2400, 1800), (400, 300)):
+        original = jpeg_with_exif(width, height)
+        assert Image.open(io.BytesIO(original)).getexif()
+        with Image.open(io.BytesIO(downscale_image(original))) as result:
+            assert result.format == 'JPEG' and result.width * result.height <= IMAGE_MAX_PIXELS
+            assert not result.getexif() and 'exif' not in result.info
+            if width * height <= IMAGE_MAX_PIXELS:
+                assert result.size == (width, height)  # 예산 안이면 크기 유지
+            else:
+                assert abs(result.width / result.height - width / height) < 0.01  # 비율 유지
+    assert downscale_image(b"not an image") == b"not an image"
+
+    # 충분히 큰 사진이 없으면 가장 큰 사진 사용
+    small = [PhotoSize("a", "a", 90, 67), PhotoSize("b", "b", 320, 240)]
+    assert select_photo_size(small).file_id == "b"
+    print("✅ 이미지 회고 파이프라인 테스트 완료!")
+
+def test_media_reflection_handlers():
+    """음성/이미지 회고 흐름 (명령 → 파일 전송 → 백그라운드 분석 → 회고 저장, 결과 전송) 테스트"""
+    print("\n🧪 음성/이미지 회고 흐름 테스트 시작...")
+    import complete_bot  # 예전 실행 스크립트도 불러올 수 있어야 함
+    from bot import ScheduleBot, register_handlers
+    from telegram.ext import Application
+    assert complete_bot.WAITING_VOICE_REFLECTION != complete_bot.WAITING_IMAGE_REFLECTION
+
+    async def run(telegram_server: FakeTelegramServer, openai_server: FakeOpenAIServer, path: str):
+        telegram_server.add_file("voice-1", "voice/file_1.oga", os.urandom(4096))
+        photo = []
+        for width, height, kb in [(90, 67, 2), (800, 600, 80), (1280, 960, 200)]:
+            file_id = f"photo-{width}"
+            telegram_server.add_file(file_id, f"photos/{file_id}.jpg", os.urandom(kb * 1024))
+            photo.append({'file_id': file_id, 'file_unique_id': file_id, 'width': width, 'height': height,
+                          'file_size': kb * 1024})
+        db = AsyncDatabase(Database(path))
+        client = openai.AsyncOpenAI(api_key="test", base_url=openai_server.base_url)
+        bot = ScheduleBot.__new__(ScheduleBot)
+        bot.db = db
+        bot.ai_conversations = ConversationStore(db)
+        bot.ai_helper = AIHelper(client=client)
+        bot.media = MediaPipeline(bot.ai_helper)
+        bot.memory = None
+        bot.jobs = TaskQueue(db, poll_interval=0.05)
+        bot.jobs.register('voice_reflection', bot._job_voice_reflection)
+        bot.jobs.register('image_reflection', bot._job_image_reflection)
+        app = (Application.builder().token(telegram_server.token).base_url(telegram_server.base_url)
+               .base_file_url(telegram_server.base_file_url).build())
+        register_handlers(app, bot)
+        await app.initialize()
+        await bot.jobs.start(app.bot)
+
+        async def send(update: dict):
+            await app.process_update(Update.de_json(update, app.bot))
+
+        def sent_to(chat_id: int) -> list:
+            return [params['text'] for method, params, _ in telegram_server.calls
+                    if method == 'sendMessage' and int(params['chat_id']) == chat_id]
+
+        async def wait_for_result(chat_id: int, prefix: str) -> str:
+            for _ in range(200):
+                texts = [text for text in sent_to(chat_id) if text.startswith(prefix)]
+                if texts:
+                    return texts[0]
+                await asyncio.sleep(0.05)
+            assert False, f"{prefix} 메시지가 오지 않았습니다"
+
+        await send(_text_update(1, 1, "/voice_reflection"))
+        voice = _text_update(2, 1, "")
+        del voice['message']['text']
+        voice['message']['voice'] = {'file_id': "voice-1", 'file_unique_id': "voice-1", 'duration': 5, 'file_size': 4096}
+        await send(voice)
+        assert sent_to(1)[-1].startswith("🎤 음성을 분석하고 있습니다")  # 분석을 기다리지 않고 바로 응답
+        result = await wait_for_result(1, "✅")
+        assert "음성 변환 결과" in result and "안녕하세요" in result
+        reflections = await db.get_reflections(1, 'voice')
+        assert len(reflections) == 1 and reflections[0]['content'].startswith("[음성 변환] 음성 변환 결과")
+        assert telegram_server.downloads == ["voice/file_1.oga"]
+        await send(_text_update(3, 1, "/voice_reflection"))  # 오늘 이미 작성함
+        assert sent_to(1)[-1].startswith("🎤 오늘 이미 음성 회고를 작성하셨습니다")
+
+        # 이미지: 분석에 충분한 가장 작은 사진만 받고, 같은 이미지는 다시 분석하지 않음
+        for update_id, user_id in ((10, 2), (12, 3)):
+            await send(_text_update(update_id, user_id, "/image_reflection"))
+            image = _text_update(update_id + 1, user_id, "")
+            del image['message']['text']
+            image['message']['photo'] = photo
+            await send(image)
+            assert sent_to(user_id)[-1].startswith("🖼️ 이미지를 분석하고 있습니다")
+            assert "안녕하세요" in await wait_for_result(user_id, "✅")
+        assert telegram_server.downloads[1:] == ["photos/photo-800.jpg"] * 2
+        vision = [r for r in openai_server.requests if r['path'].endswith('/chat/completions')
+                  and isinstance(r['body']['messages'][0]['content'], list)]
+        assert len(vision) == 1 and vision[0]['body']['messages'][0]['content'][1]['image_url']['detail'] == "low"
+        for user_id in (2, 3):
+            reflections = await db.get_reflections(user_id, 'image')
+            assert [r['content'] for r in reflections] == ["[이미지 분석] 안녕하세요"]
+
+        await bot.jobs.stop()
+        await bot.media.close()
+        await app.shutdown()
+        await client.close()
+        db.close()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegramServer() as telegram_server, FakeOpenAIServer() as openai_server:
+        asyncio.run(run(telegram_server, openai_server, os.path.join(tmp, 'media.db')))
+    print("✅ 음성/이미지 회고 흐름 테스트 완료!")
+
+class FakeBot:
+    """send_message 호출을 기록하는 가짜 봇"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+def test_task_queue():
+    """백그라운드 작업 큐의 중복 방지/결과 전송/재시작 후 처리/재시도 테스트"""
+    print("\n🧪 백그라운드 작업 큐 테스트 시작...")
+
+    async def wait_until(condition, timeout: float = 2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert condition()
+
+    async def run(path: str):
+        db = AsyncDatabase(Database(path))
+        queue = TaskQueue(db, workers=2, poll_interval=0.05, max_attempts=2)
+
+        async def slow_analysis(bot, job):
+            await asyncio.sleep(0.05)
+            return f"분석 결과 {job['payload'].get('n', 0)}"
+
+        queue.register('analysis', slow_analysis)
+        # 같은 사용자/명령은 대기 중인 작업이 하나만 존재
+        assert await queue.enqueue(1, 100, 'analysis', {'n': 1})
+        assert await queue.enqueue(1, 100, 'analysis', {'n': 2}) == 0  # 중복 (저장 오류인 None과 구분)
+        assert await queue.enqueue(2, 200, 'analysis')
+        assert (await queue.stats())['pending'] == 2
+
+        # 재시작: 실행 중이던 작업(크래시)과 대기 작업 모두 새 큐에서 처리
+        await db.claim_job(time.time())
+        db.close()
+        db = AsyncDatabase(Database(path))
+        queue = TaskQueue(db, workers=2, poll_interval=0.05, max_attempts=3, retry_delay=0.2)
+        queue.register('analysis', slow_analysis)
+        bot = FakeBot()
+        await queue.start(bot)
+        await wait_until(lambda: queue.completed == 2)
+        assert sorted(bot.sent) == [(100, "분석 결과 1"), (200, "분석 결과 0")]
+        stats = await queue.stats()
+        assert stats['pending'] == 0 and stats['done'] == 2 and stats['completed'] == 2
+        assert stats['latency_p50_ms'] > 0 and stats['run_p50_ms'] >= 40
+
+        # 끝난 작업은 다시 요청할 수 있음
+        assert await queue.enqueue(1, 100, 'analysis', {'n': 3}) is not None
+        await wait_until(lambda: len(bot.sent) == 3)
+
+        # 실패한 작업은 대기 시간을 2배씩 늘리며 max_attempts까지 재시도 후 실패 안내
+        attempts = []
+
+        async def broken(bot, job):
+            attempts.append((job['attempts'], time.monotonic()))
+            raise RuntimeError("분석 실패")
+
+        queue.register('broken', broken)
+        await queue.enqueue(3, 300, 'broken')
+        await wait_until(lambda: len(bot.sent) == 4)
+        assert [attempt for attempt, _ in attempts] == [1, 2, 3] and bot.sent[-1][0] == 300
+        gaps = [current - previous for (_, previous), (_, current) in zip(attempts, attempts[1:])]
+        assert gaps[0] >= 0.2 and gaps[1] >= 0.4
+        await wait_until(lambda: queue.failed == 1)
+        assert (await queue.stats())['failed'] == 1
+        await queue.stop()
+        db.close()
+
+    async def enqueue_error(path: str):
+        # 저장 오류는 중복과 다르게 None으로 알려 사용자에게 실패를 안내
+        from bot import ScheduleBot
+        db = AsyncDatabase(Database(path))
+        with db.db.pool.connection() as conn:
+            conn.execute('DROP TABLE background_jobs')
+        bot = ScheduleBot.__new__(ScheduleBot)
+        bot.jobs = TaskQueue(db)
+        assert await bot.jobs.enqueue(1, 100, 'analysis') is None
+        message = FakeTelegramMessage()
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=1), effective_chat=SimpleNamespace(id=100), message=message)
+        await bot._enqueue_ai_job(update, 'analysis', "분석을 시작합니다")
+        assert message.log[-1][2].startswith("❌")
+        db.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, 'jobs.db')))
+        asyncio.run(enqueue_error(os.path.join(tmp, 'jobs_error.db')))
+    print("✅ 백그라운드 작업 큐 테스트 완료!")
+
+def test_notification_dispatcher():
+    """아침 알림 일괄 조회/요약/전송 한도/차단 사용자/재시도 테스트"""
+    print("\n🧪 알림 발송 테스트 시작...")
+    tz = pytz.timezone('Asia/Seoul')
+
+    async def run(db: AsyncDatabase, server: FakeTelegramServer):
+        async with Bot(server.token, base_url=server.base_url,
+                       request=HTTPXRequest(connection_pool_size=8)) as bot:
+            dispatcher = NotificationDispatcher(db, batch_size=2, rate=1000, per_chat_interval=0,
+                                                max_retries=0)
+            stats = await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 8, 0)))
+            texts = {int(params['chat_id']): params['text'] for method, params, _ in server.calls if method == 'sendMessage'}
+            assert stats['notifications'] == 5 and stats['sent'] == 3 and stats['blocked'] == 1
+            # 3번은 차단 응답, 09:00 알림(4번)은 아직, 07:55 알림(5번)은 놓친 알림으로 발송
+            assert sorted(texts) == [1, 2, 3, 5]
+            assert "병원 예약" in texts[1] and "스트레칭" in texts[1] and "주간 점검" in texts[1]
+            assert "없습니다" in texts[2] and "물 마시기" in texts[2]
+            assert await db.get_notifications(3) == []  # 차단한 사용자는 알림 끔
+
+            # 같은 날 다시 실행해도 중복 발송하지 않음
+            assert (await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 8, 1))))['notifications'] == 0
+
+            # 전송 실패한 알림은 다음 실행에서 다시 발송
+            server.failures = [500]
+            stats = await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 9, 0)))
+            assert stats['notifications'] == 1 and stats['failed'] == 1
+            stats = await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 9, 1)))
+            assert stats['sent'] == 1
+
+            # 재시작 등으로 건너뛴 시각의 알림도 다음 실행에서 발송
+            await db.ensure_morning_notification(6, "09:30", "오늘의 일정 알림")
+            stats = await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 9, 50)))
+            assert stats['sent'] == 1
+
+            await dispatcher.stop()
+
+            # 뉴욕 사용자는 현지 08:00(한국 21:00)에 현지 날짜 기준 요약을 받음
+            server.calls.clear()
+            dispatcher = NotificationDispatcher(db, rate=1000, per_chat_interval=0)
+            stats = await dispatcher.dispatch(bot, datetime.datetime(2024, 6, 3, 12, 0, tzinfo=pytz.utc))
+            texts = [params['text'] for method, params, _ in server.calls if method == 'sendMessage']
+            assert stats['sent'] == 1 and "2024-06-03" in texts[0]
+            await dispatcher.stop()
+
+            # 앞 시각의 전송이 오래 걸려도 다음 시각은 제시간에 발송 처리되어 이어서 전송
+            server.calls.clear()
+            for user_id in range(10, 20):
+                await db.ensure_morning_notification(user_id, "10:00", "오늘의 일정 알림")
+            await db.ensure_morning_notification(20, "10:01", "오늘의 일정 알림")
+            dispatcher = NotificationDispatcher(db, batch_size=4, rate=5, per_chat_interval=0)
+            assert (await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 10, 0)), wait=False))['notifications'] == 10
+            stats = await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 10, 1)), wait=False)
+            assert stats['notifications'] == 1 and dispatcher.sender.sent < 10
+            await dispatcher.drain()
+            chats = [int(params['chat_id']) for method, params, _ in server.calls if method == 'sendMessage']
+            assert sorted(chats[:10]) == list(range(10, 20)) and chats[10:] == [20]
+            await dispatcher.stop()
+
+            # 발송 처리/전송 중 프로세스가 멈춘 알림: 전송 대기는 바로, 결과가 없는 전송은 claim_timeout 뒤 다시 전송
+            server.calls.clear()
+            for user_id in (30, 31):
+                await db.ensure_morning_notification(user_id, "11:00", "오늘의 일정 알림")
+            await db.ensure_morning_notification(32, "11:01", "오늘의 일정 알림")
+            assert await db.claim_due_notifications('Asia/Seoul', "11:00", "2024-06-03", 10, time.time()) == 2
+            stale = await db.take_claimed_notifications(1, time.time() - 600)  # 중단된 프로세스가 전송에 넘김
+            recent = await db.take_claimed_notifications(1, time.time())  # 방금 넘긴 전송은 아직 결과를 기다림
+            assert await db.claim_due_notifications('Asia/Seoul', "11:01", "2024-06-03", 10, time.time()) == 1
+            dispatcher = NotificationDispatcher(db, rate=1000, per_chat_interval=0, claim_timeout=300)
+            stats = await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 11, 5)))
+            chats = sorted(int(params['chat_id']) for method, params, _ in server.calls if method == 'sendMessage')
+            assert stats['notifications'] == 0 and stats['reclaimed'] == 1
+            assert chats == [stale[0]['user_id'], 32] and recent[0]['user_id'] not in chats
+            await dispatcher.stop()
+
+            # 전송 한도가 낮아도 가져온 알림을 claim_timeout 안에 보내고 기록하므로 보내는 중인 알림을 다시 보내지 않음
+            server.calls.clear()
+            await db.confirm_notifications([row['id'] for row in recent])  # 위에서 결과를 기다리던 전송은 끝난 것으로
+            for user_id in range(40, 52):
+                await db.ensure_morning_notification(user_id, "12:00", "오늘의 일정 알림")
+            dispatcher = NotificationDispatcher(db, rate=5, per_chat_interval=0, claim_timeout=1.0)
+            stats = await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 12, 0)), wait=False)
+            assert stats['notifications'] == 12
+            await asyncio.sleep(1.2)  # 12건을 초당 5건으로 보내는 도중 claim_timeout이 지남
+            stats = await dispatcher.dispatch(bot, tz.localize(datetime.datetime(2024, 6, 3, 12, 1)))
+            chats = sorted(int(params['chat_id']) for method, params, _ in server.calls if method == 'sendMessage')
+            assert stats['reclaimed'] == 0 and chats == list(range(40, 52))
+            await dispatcher.stop()
+
+            # 채팅별 간격과 429 retry_after 준수
+            server.calls.clear()
+            server.failures = [(429, 1)]
+            sender = RateLimitedSender(bot, rate=1000, per_chat_interval=0.2, concurrency=4)
+            await sender.start()
+            for i in range(3):
+                await sender.put(7, f"메시지 {i}")
+            await sender.close()
+            times = [at for method, params, at in server.calls if method == 'sendMessage']
+            assert sender.sent == 3 and sender.retries == 1 and len(times) == 4
+            assert times[1] - times[0] >= 0.9
+            assert all(b - a >= 0.15 for a, b in zip(times[1:], times[2:]))
+
+            # 봇 전체 초당 전송 한도 준수 (버스트 20 이후 초당 20건)
+            sender = RateLimitedSender(bot, rate=20, per_chat_interval=0, concurrency=8)
+            began = time.monotonic()
+            await sender.start()
+            for chat_id in range(100, 130):
+                await sender.put(chat_id, "안내")
+            await sender.close()
+            assert sender.sent == 30 and time.monotonic() - began >= 0.45
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'notify.db'))
+        db.add_schedule(1, "병원 예약", "", "2024-06-03", "10:00")
+        db.add_schedule(1, "다른 날 일정", "", "2024-06-04", "10:00")
+        db.add_routine(1, "스트레칭", "", 'daily', "2024-01-01")
+        db.add_routine(1, "주간 점검", "", 'weekly', "2024-01-01", days_of_week="월")
+        db.add_routine(1, "금요 회고", "", 'weekly', "2024-01-01", days_of_week="금")
+        for user_id in (1, 2, 3):
+            db.ensure_morning_notification(user_id, "08:00", "오늘의 일정 알림")
+        db.ensure_morning_notification(1, "08:00", "오늘의 일정 알림")
+        assert len(db.get_notifications(1)) == 1
+        db.add_notification(2, None, 'custom', "08:00", "물 마시기")
+        db.ensure_morning_notification(4, "09:00", "오늘의 일정 알림")
+        db.ensure_morning_notification(5, "07:55", "오늘의 일정 알림")
+        db.ensure_morning_notification(7, "08:00", "오늘의 일정 알림")
+        db.set_user_timezone(7, 'America/New_York')
+        assert db.get_notification_timezones() == ['America/New_York', 'Asia/Seoul']
+
+        digests = db.get_daily_digests([1, 2], "2024-06-03")
+        assert [s['title'] for s in digests[1]['schedules']] == ["병원 예약"]
+        assert [r['title'] for r in digests[1]['routines']] == ["스트레칭", "주간 점검"]
+        assert digests[2] == {'schedules': [], 'routines': []}
+
+        with FakeTelegramServer() as server:
+            server.blocked_chats.add(3)
+            async_db = AsyncDatabase(db)
+            asyncio.run(run(async_db, server))
+            async_db.close()
+    print("✅ 알림 발송 테스트 완료!")
+
+def test_user_timezones():
+    """사용자 시간대 저장과 시간대 기준 '오늘'/기간 계산 테스트"""
+    print("\n🧪 사용자 시간대 테스트 시작...")
+    assert normalize_timezone('asia/seoul') == 'Asia/Seoul'
+    assert normalize_timezone('서울') == 'Asia/Seoul'
+    assert normalize_timezone('Mars/Base') is None
+    # UTC+14와 UTC-11은 항상 날짜가 다름
+    assert local_today('Pacific/Kiritimati') != local_today('Pacific/Pago_Pago')
+    assert _period_range('week', datetime.date(2024, 6, 5)) == ('2024-06-03', '2024-06-09', 7)
+    assert _period_range('month', datetime.date(2024, 2, 10)) == ('2024-02-01', '2024-02-29', 29)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'tz.db'))
+        assert db.get_user_timezone(1) == 'Asia/Seoul'
+        assert db.set_user_timezone(1, 'Pacific/Kiritimati')
+        assert db.set_user_timezone(2, 'Pacific/Pago_Pago')
+        assert db.get_user_timezone(1) == 'Pacific/Kiritimati'
+
+        # 키리티마티의 오늘 시작하는 루틴은 파고파고에서는 아직 내일
+        start = local_today('Pacific/Kiritimati')
+        for user_id in (1, 2):
+            db.add_routine(user_id, "물 마시기", "", 'daily', start)
+        assert [r['date'] for r in db.get_today_routines(1)] == [start]
+        assert db.get_today_routines(2) == []
+
+        # 통계도 사용자 시간대의 오늘이 속한 주를 기준으로 집계
+        db.add_schedule(1, "완료 일정", "", start)
+        db.update_schedule_done(db.get_last_schedule_id(1), 1)
+        assert db.get_schedule_stats(1, 'week')['done'] == 1
+        db.close()
+    print("✅ 사용자 시간대 테스트 완료!")
+
+def test_batch_reports():
+    """배치 API로 주간 회고 리포트 생성 (파일 분할, 부분 실패 재요청, 결과 전달) 테스트"""
+    print("\n🧪 배치 회고 리포트 테스트 시작...")
+    from bot import ScheduleBot
+    period_start, period_end = last_week(datetime.date(2024, 6, 10))
+    assert (period_start, period_end) == ('2024-06-03', '2024-06-09')
+
+    with tempfile.TemporaryDirectory() as tmp, FakeOpenAIServer(tokens=["꾸준한 ", "회고"]) as server:
+        db = Database(os.path.join(tmp, 'reports.db'))
+        for user_id in range(1, 6):
+            db.add_reflection(user_id, 'daily', f"사용자 {user_id} 회고", '2024-06-05')
+        for day in range(3, 9):  # 사용자 1은 회고 13개 -> 최근 10개만 요청
+            db.add_reflection(1, 'daily', "오전 회고", f"2024-06-0{day}")
+            db.add_reflection(1, 'daily', "저녁 회고", f"2024-06-0{day}")
+        db.add_reflection(6, 'daily', "기간 밖 회고", '2024-05-20')
+
+        client = openai.OpenAI(api_key="test", base_url=server.base_url)
+        job = BatchReportJob(db, client, user_chunk=2, max_requests=2, poll_interval=0.01)
+        server.batch_failures = {f"3:{period_start}"}
+        assert len(job.run(period_start, period_end)) == 3  # 5명을 파일당 2건으로 분할
+
+        inputs = [json.loads(line) for batch in server.batches.values()
+                  for line in server.files[batch['input_file_id']].splitlines()]
+        assert sorted(request['custom_id'] for request in inputs) == [f"{u}:{period_start}" for u in range(1, 6)]
+        first = next(request for request in inputs if request['custom_id'].startswith('1:'))
+        assert first['url'] == '/v1/chat/completions' and first['body']['model']
+        assert first['body']['messages'][1]['content'].count('[2024-06-') == 10
+
+        conn = db.pool.connection()
+        reports = dict(conn.execute("SELECT user_id, status FROM reflection_reports").fetchall())
+        assert reports == {1: 'done', 2: 'done', 3: 'failed', 4: 'done', 5: 'done'}
+        jobs = conn.execute("SELECT user_id FROM background_jobs WHERE command = 'weekly_report' ORDER BY user_id").fetchall()
+        assert [row[0] for row in jobs] == [1, 2, 4, 5]
+        assert db.get_open_report_batches() == []
+
+        # 다시 실행하면 실패한 사용자만 요청
+        server.batch_failures = set()
+        assert len(job.run(period_start, period_end)) == 1
+        assert conn.execute("SELECT status, report FROM reflection_reports WHERE user_id = 3").fetchone() == ('done', "꾸준한 회고")
+        assert job.submit(period_start, period_end) == []
+
+        # 봇 작업이 리포트를 전달하고 전달 기록을 남김
+        async def deliver():
+            adb = AsyncDatabase(db)
+            bot = FakeBot()
+            owner = SimpleNamespace(db=adb)
+            assert await ScheduleBot._job_weekly_report(owner, bot, {'user_id': 1, 'chat_id': 1}) == ""
+            await ScheduleBot._job_weekly_report(owner, bot, {'user_id': 1, 'chat_id': 1})
+            assert len(bot.sent) == 1 and "꾸준한 회고" in bot.sent[0][1] and period_start in bot.sent[0][1]
+            adb.close()
+
+        asyncio.run(deliver())
+    print("✅ 배치 회고 리포트 테스트 완료!")
+
+def test_reflection_search():
+    """회고 전문 검색 (부분 일치, 짧은 검색어, 사용자 분리, 트리거 동기화, 기존 회고 색인) 테스트"""
+    print("\n🧪 회고 검색 테스트 시작...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'search.db')
+        db = Database(path)
+        db.add_reflection(1, 'daily', "아침에 운동을 했다. 저녁에도 운동 30분", '2024-01-01')
+        db.add_reflection(1, 'daily', "독서 모임에서 운동 이야기를 들었다", '2024-01-02')
+        db.add_reflection(1, 'weekly', "Running 10km this week", '2024-01-07')
+        db.add_reflection(2, 'daily', "운동 운동 운동을 했다", '2024-01-02')
+
+        # 조사가 붙은 한국어도 부분 일치, 다른 사용자 회고는 나오지 않음
+        results = db.search_reflections(1, "운동을")
+        assert [r['id'] for r in results] == [1]
+        assert "«운동을»" in results[0]['snippet']
+        # 2글자 검색어는 색인 대신 본문 확인, 자주 나온 회고가 먼저
+        assert [r['id'] for r in db.search_reflections(1, "운동")] == [1, 2]
+        assert [r['id'] for r in db.search_reflections(1, "운동", limit=1, offset=1)] == [2]
+        assert [r['id'] for r in db.search_reflections(1, "운동 모임에서")] == [2]
+        assert [r['id'] for r in db.search_reflections(1, "running")] == [3]
+        assert db.search_reflections(1, '"운동" OR') == []
+        assert db.search_reflections(3, "운동을") == [] and db.search_reflections(1, "  ") == []
+
+        # 수정/삭제는 트리거로 색인에 반영
+        conn = db.pool.connection()
+        conn.execute("UPDATE reflections SET content = '수영장에 다녀왔다' WHERE id = 1")
+        conn.execute("DELETE FROM reflections WHERE id = 2")
+        conn.commit()
+        assert db.search_reflections(1, "운동을") == [] and db.search_reflections(1, "모임에서") == []
+        assert [r['id'] for r in db.search_reflections(1, "수영장")] == [1]
+
+        # 색인 추가 전부터 있던 회고도 마이그레이션에서 색인
+        conn.executescript("""
+            DROP TRIGGER reflections_fts_insert; DROP TRIGGER reflections_fts_delete; DROP TRIGGER reflections_fts_update;
+            DROP TABLE reflections_fts; DROP TABLE reflection_search_users;
+            DELETE FROM schema_version WHERE version >= 12;
+        """)
+        db.close()
+        db = Database(path)
+        assert [r['id'] for r in db.search_reflections(2, "운동을")] == [4]
+        assert [r['id'] for r in db.search_reflections(1, "수영장")] == [1]
+        db.close()
+    print("✅ 회고 검색 테스트 완료!")
+
+def test_keyset_pagination():
+    """회고/일정 키셋 페이지 조회와 인라인 버튼 이동 테스트"""
+    print("\n🧪 목록 페이지 테스트 시작...")
+    from bot import ScheduleBot
+
+    class FakeMessage:
+        def __init__(self):
+            self.replies = []
+
+        async def reply_text(self, text, reply_markup=None, **kwargs):
+            self.replies.append((text, reply_markup))
+
+    class FakeQuery:
+        def __init__(self, data):
+            self.data = data
+            self.from_user = SimpleNamespace(id=1)
+            self.edited = None
+
+        async def answer(self):
+            pass
+
+        async def edit_message_text(self, text, reply_markup=None, **kwargs):
+            self.edited = (text, reply_markup)
+
+    def buttons(markup):
+        return {button.text: button.callback_data for button in markup.inline_keyboard[0]} if markup else {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'pages.db'))
+        conn = db.pool.connection()
+        # 같은 날짜/같은 작성 시각이 섞인 회고 12개, 시간 없는 일정이 섞인 일정 11개
+        conn.executemany("INSERT INTO reflections (user_id, type, content, date, created_at) VALUES (1, 'daily', ?, ?, ?)",
+                         [(f"회고 {i}", f"2024-01-0{i % 4 + 1}", f"2024-01-0{i % 4 + 1} 21:00:0{i % 2}") for i in range(12)])
+        conn.executemany("INSERT INTO schedules (user_id, title, description, date, time) VALUES (1, ?, '', ?, ?)",
+                         [(f"일정 {i}", f"2024-02-0{i % 3 + 1}", None if i % 4 == 0 else f"0{i % 3 + 7}:00") for i in range(11)])
+        conn.commit()
+        expected = [row[0] for row in conn.execute("SELECT id FROM reflections ORDER BY date DESC, created_at DESC, id DESC")]
+
+        # 끝까지 넘긴 뒤 다시 처음으로: 빠지거나 겹치는 회고 없음
+        page, pages = db.get_reflections_page(1, limit=5), []
+        while True:
+            pages.append([r['id'] for r in page['items']])
+            if not page['has_older']:
+                break
+            last = page['items'][-1]
+            page = db.get_reflections_page(1, (last['date'], last['created_at'], last['id']), 'older', 5)
+        assert sum(pages, []) == expected and [len(p) for p in pages] == [5, 5, 2]
+        first = page['items'][0]
+        page = db.get_reflections_page(1, (first['date'], first['created_at'], first['id']), 'newer', 5)
+        assert [r['id'] for r in page['items']] == pages[1] and page['has_newer'] and page['has_older']
+
+        expected = [row[0] for row in conn.execute("SELECT id FROM schedules ORDER BY date, time, id")]
+        start = db.get_schedules_page(1, ("2024-02-02", None, 0), 'next', 4)
+        assert start['has_prev'] and start['items'][0]['date'] == "2024-02-02"
+        walked, page = [], start
+        while True:
+            walked += [s['id'] for s in page['items']]
+            if not page['has_next']:
+                break
+            last = page['items'][-1]
+            page = db.get_schedules_page(1, (last['date'], last['time'], last['id']), 'next', 4)
+        page = start
+        while page['has_prev']:
+            first = page['items'][0]
+            page = db.get_schedules_page(1, (first['date'], first['time'], first['id']), 'prev', 4)
+            walked = [s['id'] for s in page['items']] + walked
+        assert walked == expected
+
+        # 봇: /view_reflections 후 버튼으로 이동
+        async def navigate():
+            bot = ScheduleBot.__new__(ScheduleBot)
+            bot.db = AsyncDatabase(db)
+            message = FakeMessage()
+            await bot.view_reflections(SimpleNamespace(effective_user=SimpleNamespace(id=1), message=message), None)
+            text, markup = message.replies[0]
+            assert text.count("📅") == 5 and list(buttons(markup)) == ["이전 회고 ▶"]
+            query = FakeQuery(buttons(markup)["이전 회고 ▶"])
+            assert len(query.data.encode('utf-8')) <= 64
+            await bot.page_callback(SimpleNamespace(callback_query=query), None)
+            assert list(buttons(query.edited[1])) == ["◀ 최근 회고", "이전 회고 ▶"]
+            query = FakeQuery(buttons(query.edited[1])["◀ 최근 회고"])
+            await bot.page_callback(SimpleNamespace(callback_query=query), None)
+            assert query.edited[0] == text
+
+            message = FakeMessage()
+            await bot.view_schedule(SimpleNamespace(effective_user=SimpleNamespace(id=1), message=message),
+                                    SimpleNamespace(args=["2024-02-01"]))
+            assert message.replies[0][0].count("2024-02-01") == 5  # 제목 + 일정 4개
+            bot.db.close()
+
+        asyncio.run(navigate())
+    print("✅ 목록 페이지 테스트 완료!")
+
+def test_embedding_index():
+    """회고 임베딩 색인 (덧붙이기/재시작, 중단된 꼬리, 사용자 분리, 토큰 예산, OpenAI 임베딩) 테스트"""
+    print("\n🧪 회고 임베딩 색인 테스트 시작...")
+    import numpy as np
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'vectors')
+        embedder = HashingEmbedder(dim=64)
+        index = EmbeddingIndex(path, 64, embedder.name)
+        vectors = asyncio.run(embedder.embed(["아침 운동", "저녁 운동", "독서 모임"]))
+        index.append([1, 2, 5], [10, 20, 10], vectors)
+        assert len(index) == 3 and index.last_id == 5
+        assert [hit[0] for hit in index.search(vectors[0], 2)] == [1, 2]
+        assert [hit[0] for hit in index.search(vectors[0], 5, user_id=10, exclude_ids=[1])] == [5]
+        try:
+            index.append([4], [10], vectors[:1])
+            assert False, "이미 색인된 id 이후만 추가 가능"
+        except ValueError:
+            pass
+
+        # 다시 열면 그대로, 쓰다 중단된 꼬리(id 없는 벡터)는 잘라냄
+        with open(os.path.join(path, 'vectors.f32'), 'ab') as f:
+            f.write(b'\0' * 100)
+        reopened = EmbeddingIndex(path, 64, embedder.name)
+        assert len(reopened) == 3 and np.allclose(reopened.vectors_for([2, 5]), vectors[1:])
+        # 임베딩 종류가 바뀌면 비우고 새로 색인
+        assert len(EmbeddingIndex(path, 64, "other")) == 0
+
+        async def run():
+            db = AsyncDatabase(Database(os.path.join(tmp, 'memory.db')))
+            for day in range(1, 21):
+                await db.add_reflection(1, 'daily', f"운동 기록 {day}일차: 달리기와 스트레칭" * 3, f"2024-01-{day:02d}")
+                await db.add_reflection(1, 'daily', f"독서 기록 {day}일차", f"2024-01-{day:02d}")
+                await db.add_reflection(2, 'daily', f"운동 기록 {day}일차: 달리기와 스트레칭", f"2024-01-{day:02d}")
+            memory = ReflectionMemory(db, EmbeddingIndex(os.path.join(tmp, 'memory'), 64, embedder.name),
+                                      embedder, batch_size=16)
+            assert await memory.sync() == 60 and await memory.sync() == 0
+            await db.add_reflection(1, 'daily', "새 회고", '2024-01-21')
+            memory.notify()
+            await memory._task
+            assert memory.index.last_id == 61
+
+            # 수정한 회고는 다시 임베딩 (색인 안의 자리는 그대로, 같은 내용이면 같은 벡터)
+            assert await db.update_reflection(61, 1, "독서 기록 1일차")
+            assert not await db.update_reflection(61, 2, "남의 회고")
+            memory.notify()
+            await memory._task
+            assert len(memory.index) == 61 and await db.get_reindex_reflections(10) == []
+            assert np.allclose(memory.index.vectors_for([61]), memory.index.vectors_for([2]))
+
+            recent = await db.get_reflections(1)
+            recent = [r for r in recent if r['content'].startswith("운동")][:2]
+            related = await memory.related(1, recent, k=10, token_budget=200)
+            assert related and all(r['user_id'] == 1 for r in related)
+            assert not {r['id'] for r in related} & {r['id'] for r in recent}
+            assert all(r['content'].startswith("운동") for r in related)  # 비슷한 주제 우선
+            assert sum(estimate_tokens([{'content': format_reflection_line(r)}], 0) for r in related) <= 200
+            assert [r['date'] for r in related] == sorted(r['date'] for r in related)
+            messages = reflection_pattern_messages(recent, related)
+            assert "관련 있는 과거 회고" in messages[1]['content']
+            db.close()
+
+        asyncio.run(run())
+
+        # OpenAI 임베딩 API (차원 지정, base64 응답)
+        with FakeOpenAIServer() as server:
+            client = openai.AsyncOpenAI(api_key="test", base_url=server.base_url)
+            openai_embedder = OpenAIEmbedder(client, dim=16, executor=AIRequestExecutor())
+            result = asyncio.run(openai_embedder.embed(["가", "나"]))
+            assert result.shape == (2, 16) and np.allclose(np.linalg.norm(result, axis=1), 1.0)
+            assert server.requests[-1]['body']['dimensions'] == 16
+    print("✅ 회고 임베딩 색인 테스트 완료!")
+
+def test_prompt_builder():
+    """토큰 예산 프롬프트 구성 (짧은 대화는 더 많이, 긴 대화는 예산 안에서 + 요약, 관련 자료, 지표) 테스트"""
+    print("\n🧪 프롬프트 구성 테스트 시작...")
+    assert count_tokens("") == 0 and count_tokens("안녕하세요") >= count_tokens("안녕")
+    builder = PromptBuilder({'chat_with_gpt': 600}, summary_tokens=150, context_share=0.3)
+
+    # 짧은 턴은 10개 제한 없이 예산 안에서 모두 사용, 요약 자리도 비워두지 않음
+    short = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f"짧은 말 {i}"} for i in range(30)]
+    built = builder.build('chat_with_gpt', "시스템", "지금 질문", short)
+    assert built['history_turns'] == 30 and built['evicted_turns'] == 0
+    assert built['prompt_tokens'] == count_prompt_tokens(built['messages']) <= 600
+
+    # 긴 턴은 최근 것부터 예산만큼, 밀려난 턴은 요약으로
+    long = [{'role': 'user', 'content': f"긴 이야기 {i} " + "가나다라마바사" * 20} for i in range(10)]
+    built = builder.build('chat_with_gpt', "시스템", "지금 질문", long, summary="사용자: 예전 이야기")
+    assert 0 < built['history_turns'] < 10 and built['prompt_tokens'] <= 600
+    assert built['messages'][-2] == long[-1] and built['messages'][-1]['content'] == "지금 질문"
+    summary = next(m['content'] for m in built['messages'] if m['content'].startswith("이전 대화 요약"))
+    assert f"긴 이야기 {9 - built['history_turns']}" in summary
+
+    # 관련 자료는 남은 예산의 일부만 사용
+    context = [f"[2024-01-{day:02d}] daily: " + "회고 내용 " * 10 for day in range(1, 29)]
+    built = builder.build('chat_with_gpt', "시스템", "지금 질문", context=context)
+    assert 0 < built['context_items'] < len(context) and built['prompt_tokens'] <= 600 * 0.3 + 50
+    # 시스템 프롬프트와 현재 메시지는 예산을 넘어도 포함
+    built = builder.build('chat_with_gpt', "시스템", "아" * 1000, long)
+    assert built['history_turns'] == 0 and built['messages'][-1]['content'] == "아" * 1000
+
+    async def run(tmp: str):
+        # 보관 턴 수를 넘어 밀려난 턴은 요약으로 저장되고 재시작 후에도 유지
+        db = AsyncDatabase(Database(os.path.join(tmp, 'prompt.db')))
+        store = ConversationStore(db, max_turns=2)
+        for i in range(4):
+            await store.append(1, "user", f"질문 {i}")
+        assert await store.get_summary(1) == "사용자: 질문 0\n사용자: 질문 1"
+        await store.close()
+        restarted = ConversationStore(db, max_turns=2)
+        assert await restarted.get_summary(1) == "사용자: 질문 0\n사용자: 질문 1"
+        await restarted.clear(1)
+        assert await ConversationStore(db).get_summary(1) == ""
+        db.close()
+
+        # 요청마다 프롬프트 토큰 수를 지표로 기록
+        with FakeOpenAIServer(tokens=["안녕하세요"]) as server:
+            helper = AIHelper(client=openai.AsyncOpenAI(api_key="test", base_url=server.base_url, max_retries=0),
+                              prompts=PromptBuilder({'chat_with_gpt': 300}))
+            await helper.chat_with_gpt("안녕", long, summary="사용자: 예전 이야기")
+            await helper.chat_with_gpt("안녕")
+            stats = helper.prompt_stats()['chat_with_gpt']
+            assert stats['calls'] == 2 and 0 < stats['max_prompt_tokens'] <= 300
+            assert stats['evicted_turns'] > 0 and stats['usage_calls'] == 2
+            sent = server.requests[0]['body']['messages']
+            assert count_prompt_tokens(sent) == stats['max_prompt_tokens']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(tmp))
+    print("✅ 프롬프트 구성 테스트 완료!")
+
+def _text_update(update_id: int, user_id: int, text: str) -> dict:
+    """텔레그램 텍스트 메시지 업데이트 (명령어면 bot_command 엔티티 포함)"""
+    message = {'message_id': update_id, 'date': int(time.time()), 'text': text,
+               'chat': {'id': user_id, 'type': 'private'},
+               'from': {'id': user_id, 'is_bot': False, 'first_name': 'tester'}}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+def test_persistence():
+    """대화 흐름 상태 보관 (재시작 후 이어서 입력, 모아서 저장, 사용자별 지연 로딩, 오래된 흐름 만료) 테스트"""
+    print("\n🧪 대화 흐름 상태 보관 테스트 시작...")
+    import bot as bot_module
+    from bot import ScheduleBot, register_handlers
+    from telegram.ext import Application
+
+    async def run(server: FakeTelegramServer, path: str):
+        db = AsyncDatabase(Database(path))
+        bot = ScheduleBot.__new__(ScheduleBot)
+        bot.db = db
+        bot.ai_conversations = ConversationStore(db)
+        bot.ai_helper = SimpleNamespace(is_available=lambda: False)  # AI 흐름은 비활성 응답으로 확인
+        bot.memory = None
+
+        async def start_app(persistence: SQLitePersistence) -> Application:
+            app = Application.builder().token(server.token).base_url(server.base_url).persistence(persistence).build()
+            register_handlers(app, bot)
+            await app.initialize()
+            return app
+
+        async def send(app: Application, update_id: int, user_id: int, text: str):
+            await app.process_update(Update.de_json(_text_update(update_id, user_id, text), app.bot))
+
+        first = SQLitePersistence(db, update_interval=60)
+        app = await start_app(first)
+        for i, text in enumerate(["/add_routine", "물 마시기", "하루 8잔"]):
+            await send(app, i + 1, 1, text)
+        await send(app, 10, 2, "/daily_reflection")
+        await send(app, 11, 3, "/help")  # 흐름 밖 명령은 상태가 바뀌지 않음
+        await send(app, 12, 4, "/chatgpt")
+        await send(app, 13, 5, "/ai_reflection")
+        assert first.writes == 0  # 업데이트마다 저장하지 않음
+        await app.update_persistence()
+        await first.flush()
+        assert first.writes == 1  # 바뀐 사용자/대화를 한 트랜잭션으로
+        assert await first.get_conversations('chatgpt') == {(4, 4): bot_module.WAITING_CHATGPT}
+        assert await first.get_conversations('ai_reflection') == {(5, 5): bot_module.WAITING_AI_REFLECTION}
+        await app.update_persistence()
+        await first.flush()
+        assert first.writes == 1 and first.skipped >= 1  # 변경 없으면 다시 쓰지 않음
+        await app.shutdown()  # 배포 등으로 재시작
+
+        second = SQLitePersistence(db, update_interval=60)
+        app = await start_app(second)
+        assert second.stats()['loaded_users'] == 0  # user_data는 해당 사용자 업데이트가 올 때 불러옴
+        for i, text in enumerate(["daily", "2024-01-01", "2024-12-31"]):
+            await send(app, 20 + i, 1, text)
+        routines = await db.get_routines(1)
+        assert [(r['title'], r['description'], r['frequency']) for r in routines] == [("물 마시기", "하루 8잔", "daily")]
+        assert second.stats()['loaded_users'] == 1
+        await send(app, 30, 2, "오늘 산책을 했다")  # 사용자 2의 회고 흐름도 이어짐
+        assert app.user_data[2]['reflection'] == {'fact': "오늘 산책을 했다"}
+        # 대화/묵상 흐름도 재시작 뒤 입력을 이어서 받음
+        await send(app, 31, 4, "안녕")
+        assert [turn['content'] for turn in await bot.ai_conversations.get(4)] == ["안녕", "AI 대화 기능이 비활성화되어 있습니다."]
+        await send(app, 32, 5, "요즘 고민이 많다")
+        sent = [(int(params['chat_id']), params['text']) for method, params, _ in server.calls if method == 'sendMessage']
+        assert (5, "AI 묵상 기능이 비활성화되어 있습니다.") in sent
+        await app.update_persistence()
+        await second.flush()
+        await app.shutdown()
+
+        # 끝난 흐름은 지워지고, ttl보다 오래 멈춘 흐름은 시작할 때 버림
+        assert await second.get_conversations('add_routine') == {}
+        assert await second.get_conversations('chatgpt') == {} and await second.get_conversations('ai_reflection') == {}
+        assert list(await second.get_conversations('daily_reflection')) == [(2, 2)]
+        expired = SQLitePersistence(db, ttl=-1)
+        assert await expired.get_user_data() == {} and await db.get_persisted_user_data(2) is None
+        assert await expired.get_conversations('daily_reflection') == {}
+        db.close()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegramServer() as server:
+        asyncio.run(run(server, os.path.join(tmp, 'persistence.db')))
+    print("✅ 대화 흐름 상태 보관 테스트 완료!")
+
+def _scale_out_app(base_url: str, db_path: str, primary: bool):
+    """확장 실행 테스트용 워커 Application (실제 봇 핸들러, 백그라운드 작업 없음)"""
+    from bot import ScheduleBot, register_handlers
+    from telegram.ext import Application
+    db = AsyncDatabase(Database(db_path))
+    bot = ScheduleBot.__new__(ScheduleBot)
+    bot.db = db
+    bot.ai_conversations = ConversationStore(db)
+    persistence = SQLitePersistence(db, update_interval=0.5)
+    app = Application.builder().token("123:TEST").base_url(base_url).updater(None).persistence(persistence).build()
+    register_handlers(app, bot)
+    return app
+
+def test_scale_out():
+    """확장 실행 (리더 임대, 사용자별 워커 분배, 리더 교체 후 흐름 이어서 처리) 테스트"""
+    print("\n🧪 확장 실행 테스트 시작...")
+    import functools
+    import scale_out as scale_out_module
+    from scale_out import LEASE_NAME, ScaleOutRunner, worker_for
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'lease.db'))
+        assert db.acquire_lease('updates', 'a', 100.0, 30) == 0
+        assert db.acquire_lease('updates', 'b', 110.0, 30) is None  # a가 임대 중
+        assert db.acquire_lease('updates', 'a', 120.0, 30, update_offset=7) == 7  # 연장하며 offset 저장
+        assert db.acquire_lease('updates', 'b', 151.0, 30) == 7  # 만료 후 b가 이어받음
+        assert not db.release_lease('updates', 'a')
+        assert db.release_lease('updates', 'b', 9) and db.acquire_lease('updates', 'a', 152.0, 30) == 9
+        db.close()
+
+    routine = ["/add_routine", "루틴 {}", "설명 {}", "daily", "2024-01-01", "2024-12-31"]
+    users = [1, 2, 3, 4]
+    assert {worker_for(Update.de_json(_text_update(1, user_id, "hi"), None), 2) for user_id in users} == {0, 1}
+
+    async def wait_for(predicate, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        while not await predicate():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.1)
+
+    async def has_routines(db, user_ids):
+        return all([await db.get_routines(user_id) for user_id in user_ids])
+
+    async def run(server: FakeTelegramServer, path: str):
+        db = AsyncDatabase(Database(path))
+        factory = functools.partial(_scale_out_app, server.base_url, path)
+        options = dict(workers=2, token=server.token, base_url=server.base_url, lease_ttl=3.0, poll_timeout=0.5)
+        leader, standby = ScaleOutRunner(factory, db, holder='a', **options), ScaleOutRunner(factory, db, holder='b', **options)
+        leader_stop, standby_stop = asyncio.Event(), asyncio.Event()
+        leader_task = asyncio.create_task(leader.serve(leader_stop))
+        await wait_for(lambda: asyncio.sleep(0, leader.is_leader))
+        standby_task = asyncio.create_task(standby.serve(standby_stop))
+
+        # 사용자들의 입력이 섞여 들어와도 사용자별 순서대로 처리됨
+        update_id = 0
+        for step in routine:
+            for user_id in users:
+                update_id += 1
+                server.add_update(_text_update(update_id, user_id, step.format(user_id)))
+        for step in routine[:3]:  # 사용자 5는 흐름 중간에 리더가 바뀜
+            update_id += 1
+            server.add_update(_text_update(update_id, 5, step.format(5)))
+        await wait_for(lambda: has_routines(db, users))
+        assert not standby.is_leader and sum(leader.dispatched) >= 27 and all(leader.dispatched)
+        for user_id in users:
+            routines = await db.get_routines(user_id)
+            assert [(r['title'], r['description']) for r in routines] == [(f"루틴 {user_id}", f"설명 {user_id}")]
+
+        leader_stop.set()  # 리더 종료 (남은 업데이트 처리 후 임대 반납)
+        await leader_task
+        await wait_for(lambda: asyncio.sleep(0, standby.is_leader))
+        for step in routine[3:]:
+            update_id += 1
+            server.add_update(_text_update(update_id, 5, step.format(5)))
+        await wait_for(lambda: has_routines(db, [5]))
+        standby_stop.set()
+        await standby_task
+        assert [r['title'] for r in await db.get_routines(5)] == ["루틴 5"]
+        assert server.updates == [] and leader.restarts == standby.restarts == 0  # 받은 업데이트는 모두 확인됨
+        db.close()
+
+    async def lease_while_blocked(path: str):
+        # 워커 큐가 가득 차 분배가 멈춰 있어도 임대는 연장되고, 임대를 잃으면 분배를 포기함
+        import queue
+        db = AsyncDatabase(Database(path))
+        runner = ScaleOutRunner(None, db, workers=1, holder='a', lease_ttl=0.6)
+        assert await db.acquire_lease(LEASE_NAME, 'a', time.time(), 0.6) == 0
+        runner._queues = [queue.Queue(1)]
+        runner._queues[0].put("가득 참")
+        runner._offset, runner._lease_valid_until = 5, time.monotonic() + 0.6
+        lost = asyncio.Event()
+        heartbeat = asyncio.create_task(runner._heartbeat(lost))
+        dispatch = asyncio.create_task(runner._dispatch(Update.de_json(_text_update(5, 1, "hi"), None), lost))
+        await asyncio.sleep(1.5)  # 임대 시간보다 오래 막혀 있음
+        assert not dispatch.done() and not lost.is_set()
+        assert await db.acquire_lease(LEASE_NAME, 'b', time.time(), 0.6) is None
+        # 임대를 빼앗기면 (다른 인스턴스가 offset 5부터 받음) 막혀 있던 분배는 넣지 않고 끝남
+        assert await db.release_lease(LEASE_NAME, 'a')
+        assert await db.acquire_lease(LEASE_NAME, 'b', time.time(), 30) == 5
+        assert await asyncio.wait_for(dispatch, 2.0) is False
+        assert lost.is_set() and runner._queues[0].qsize() == 1 and runner.dispatched == [0]
+        await heartbeat
+        db.close()
+
+    original_timeout = scale_out_module.DISPATCH_PUT_TIMEOUT
+    scale_out_module.DISPATCH_PUT_TIMEOUT = 0.1
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(lease_while_blocked(os.path.join(tmp, 'lease_blocked.db')))
+    finally:
+        scale_out_module.DISPATCH_PUT_TIMEOUT = original_timeout
+
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegramServer() as server:
+        asyncio.run(run(server, os.path.join(tmp, 'scale_out.db')))
+    print("✅ 확장 실행 테스트 완료!")
+
+def test_webhook_ingress():
+    """webhook 수신 (secret_token 확인, 바로 응답, 사용자별 순서 처리, 대기열이 차면 503) 테스트"""
+    print("\n🧪 webhook 수신 테스트 시작...")
+    import httpx
+    from telegram.ext import Application, MessageHandler, filters
+    from bot import ScheduleBot
+    from outbox import MessageOutbox
+    from webhook_server import WebhookIngress, SECRET_HEADER
+
+    async def run(server: FakeTelegramServer):
+        gate = asyncio.Event()
+        seen: dict = {}
+
+        async def record(update, context):
+            await gate.wait()
+            seen.setdefault(update.effective_user.id, []).append(update.message.text)
+
+        processor = PerUserUpdateProcessor(concurrency=4)
+        app = (Application.builder().token(server.token).base_url(server.base_url).updater(None)
+               .concurrent_updates(processor).build())
+        app.add_handler(MessageHandler(filters.TEXT, record))
+        await app.initialize()
+        bot = ScheduleBot.__new__(ScheduleBot)
+        bot.ai_helper = AIHelper(client=openai.AsyncOpenAI(api_key="test", base_url="http://127.0.0.1:9"))
+        bot.ai_helper._build_prompt('chat_with_gpt', "시스템", "안녕")
+        bot.outbox = MessageOutbox()
+        bot.notifier = NotificationDispatcher(None)
+        ingress = WebhookIngress(app, "secret", queue_size=3, extra_metrics=bot.metrics, metrics_token="metrics")
+        assert WebhookIngress(app, "secret").authorize_metrics("Bearer ") == 404  # 토큰이 없으면 /metrics를 열지 않음
+        await ingress.start("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{ingress.port}/telegram"
+        headers = {SECRET_HEADER: "secret"}
+        async with httpx.AsyncClient() as client:
+            async def post(update_id: int, user_id: int, text: str, **kwargs) -> httpx.Response:
+                return await client.post(url, json=_text_update(update_id, user_id, text), **kwargs)
+
+            assert (await post(1, 1, "a", headers={SECRET_HEADER: "wrong"})).status_code == 403
+            assert (await post(1, 1, "a")).status_code == 403  # 헤더 없음
+            assert (await client.post(url, content=b"not json", headers=headers)).status_code == 400
+            assert (await client.get(f"http://127.0.0.1:{ingress.port}/")).status_code == 200
+
+            # 처리가 막혀 있어도 바로 응답하고, 처리를 기다리는 업데이트가 3개면 503
+            responses = [await post(1, 2, "u2-1", headers=headers), await post(2, 2, "u2-2", headers=headers),
+                         await post(3, 3, "u3-3", headers=headers), await post(4, 2, "u2-4", headers=headers)]
+            assert [response.status_code for response in responses] == [200, 200, 200, 503]
+            assert responses[-1].headers['Retry-After'] == "5"
+            # 사용자/채팅 id가 담긴 /metrics는 토큰이 있어야 조회
+            metrics_url = f"http://127.0.0.1:{ingress.port}/metrics"
+            assert (await client.get(metrics_url)).status_code == 403
+            assert (await client.get(metrics_url, headers={'Authorization': "Bearer wrong"})).status_code == 403
+            assert (await client.get(metrics_url, headers=headers)).status_code == 403  # webhook 비밀값으로는 안 됨
+            metrics = (await client.get(metrics_url, headers={'Authorization': "Bearer metrics"})).json()
+            assert metrics['unauthorized'] == 2 and metrics['invalid'] == 1 and metrics['shed'] == 1
+            assert metrics['metrics_unauthorized'] == 3
+            assert metrics['processed'] == 0 and metrics['queued'] == 3 and metrics['queue_capacity'] == 3
+            prompt = metrics['prompts']['chat_with_gpt']  # 봇 지표도 함께 (AI 호출별 프롬프트 토큰 수)
+            assert prompt['calls'] == 1 and prompt['last_prompt_tokens'] > 0
+            assert metrics['update_processor']['concurrency'] == 4  # 사용자별 밀림 등 처리 지표도 함께
+            assert metrics['outbox']['pending'] == 0 and 'send_p99_ms' in metrics['outbox']  # 응답 전송 지표
+            assert processor.stats()['active'] == 2 and processor.backlog(2) == 2  # 사용자 2의 두 번째는 차례 대기
+
+            gate.set()
+            while ingress.stats()['queued']:
+                await asyncio.sleep(0.01)
+            for i in (5, 6):
+                assert (await post(i, 3, f"u3-{i}", headers=headers)).status_code == 200
+        await ingress.stop()  # 받은 업데이트를 처리한 뒤 종료
+        assert seen == {2: ["u2-1", "u2-2"], 3: ["u3-3", "u3-5", "u3-6"]}  # 사용자별 받은 순서대로
+        stats = ingress.stats()
+        assert stats['processed'] == stats['received'] == 5 and stats['queued'] == 0
+        await app.shutdown()
+
+    with FakeTelegramServer() as server:
+        asyncio.run(run(server))
+    print("✅ webhook 수신 테스트 완료!")
+
+def test_per_user_update_processor():
+    """사용자별 순서를 지키는 동시 처리 (느린 사용자가 다른 사용자를 막지 않음, 동시 부하에서 입력 흐름 상태 유지) 테스트"""
+    print("\n🧪 사용자별 동시 처리 테스트 시작...")
+    import random
+    from bot import ScheduleBot, register_handlers
+    from telegram.ext import Application, MessageHandler, filters
+
+    async def idle(app: Application, processor: PerUserUpdateProcessor, total: int):
+        deadline = time.monotonic() + 60
+        while processor.processed < total or app.update_queue.qsize():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+
+    async def blocking(server: FakeTelegramServer):
+        gate = asyncio.Event()
+        seen = []
+
+        async def handle(update, context):
+            if update.message.text == "slow":
+                await gate.wait()  # 오래 걸리는 AI 분석 흉내
+            seen.append((update.effective_user.id, update.message.text))
+
+        processor = PerUserUpdateProcessor(concurrency=4)
+        app = (Application.builder().token(server.token).base_url(server.base_url).updater(None)
+               .concurrent_updates(processor).build())
+        app.add_handler(MessageHandler(filters.TEXT, handle))
+        async with app:
+            await app.start()
+            for update_id, (user_id, text) in enumerate([(1, "slow"), (1, "next"), (2, "view")], 1):
+                await app.update_queue.put(Update.de_json(_text_update(update_id, user_id, text), app.bot))
+            while (2, "view") not in seen:
+                await asyncio.sleep(0.01)
+            assert seen == [(2, "view")]  # 사용자 1이 막혀 있어도 사용자 2는 처리됨
+            assert processor.backlog(1) == 2 and processor.stats()['top_backlogs'] == [(1, 2)]
+            gate.set()
+            await idle(app, processor, 3)
+            assert seen == [(2, "view"), (1, "slow"), (1, "next")]  # 사용자 1은 받은 순서대로
+            assert processor.stats()['users'] == 0 and processor.backlog(1) == 0
+            await app.stop()
+
+    async def conversations(server: FakeTelegramServer, path: str):
+        db = AsyncDatabase(Database(path))
+        bot = ScheduleBot.__new__(ScheduleBot)
+        bot.db = db
+        bot.ai_conversations = ConversationStore(db)
+        processor = PerUserUpdateProcessor(concurrency=16)
+        app = (Application.builder().token(server.token).base_url(server.base_url).updater(None)
+               .concurrent_updates(processor).build())
+        register_handlers(app, bot)
+        server.latency = 0.005  # 응답을 기다리는 동안 다른 사용자의 처리가 끼어들도록
+
+        # 사용자 40명의 루틴 추가 흐름(6단계)을 무작위로 섞되 사용자별 순서는 유지해서 보냄
+        steps = {user_id: ["/add_routine", f"루틴 {user_id}", f"설명 {user_id}", "daily", "2024-01-01", "2024-12-31"]
+                 for user_id in range(1, 41)}
+        order = [user_id for user_id, texts in steps.items() for _ in texts]
+        random.Random(7).shuffle(order)
+        async with app:
+            await app.start()
+            for update_id, user_id in enumerate(order, 1):
+                text = steps[user_id].pop(0)
+                await app.update_queue.put(Update.de_json(_text_update(update_id, user_id, text), app.bot))
+            await idle(app, processor, len(order))
+            await app.stop()
+        for user_id in range(1, 41):
+            routines = await db.get_routines(user_id)
+            assert [(r['title'], r['description'], r['frequency']) for r in routines] == \
+                [(f"루틴 {user_id}", f"설명 {user_id}", "daily")]
+        stats = processor.stats()
+        assert stats['peak_active'] > 1 and stats['max_backlog'] > 1 and stats['processed'] == len(order)
+        db.close()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegramServer() as server:
+        asyncio.run(blocking(server))
+        asyncio.run(conversations(server, os.path.join(tmp, 'processor.db')))
+    print("✅ 사용자별 동시 처리 테스트 완료!")
+
+def test_message_outbox():
+    """응답 전송 대기열 (이어서 보내는 메시지 합치기, 4096자 나누기, 429 재시도, 채팅별 순서/한도) 테스트"""
+    print("\n🧪 응답 전송 대기열 테스트 시작...")
+    from bot import ScheduleBot
+    from outbox import MessageOutbox, message_length, split_message
+
+    # 나누기: 줄바꿈에서 자르고, 이모지는 2글자로 셈
+    lines = [f"{i:04d} " + "가" * 95 for i in range(100)]
+    chunks = split_message("\n".join(lines), 4096)
+    assert len(chunks) == 3 and all(message_length(chunk) <= 4096 for chunk in chunks)
+    assert "\n".join(chunks) == "\n".join(lines)
+    assert [message_length(chunk) for chunk in split_message("😀" * 3000, 4096)] == [4096, 1904]
+    assert split_message("짧은 메시지") == ["짧은 메시지"]
+
+    # 확장 실행 워커 몫(봇 전체 한도 / 워커 수)이 1보다 작아도 초당 그 몫까지만 전송
+    async def worker_share():
+        bucket = MessageOutbox(rate=30 / 64).bucket
+        assert bucket.capacity == 1.0 and bucket.rate == 30 / 64
+    asyncio.run(worker_share())
+
+    def sent(server: FakeTelegramServer, chat_id: int):
+        return [params['text'] for method, params, _ in server.calls
+                if method == 'sendMessage' and int(params['chat_id']) == chat_id]
+
+    async def run(server: FakeTelegramServer, path: str):
+        async with Bot(server.token, base_url=server.base_url) as tgbot:
+            outbox = MessageOutbox(window=0.05, per_chat_rate=100, per_chat_burst=100)
+            # 같은 채팅으로 이어서 보낸 세 메시지는 한 번에, parse_mode 메시지는 따로
+            await outbox.send(tgbot, 1, "첫째", wait=False)
+            await outbox.send(tgbot, 1, "둘째", wait=False)
+            assert await outbox.send(tgbot, 1, "셋째")
+            assert await outbox.send(tgbot, 1, "<b>굵게</b>", parse_mode='HTML')
+            assert sent(server, 1) == ["첫째\n\n둘째\n\n셋째", "<b>굵게</b>"]
+
+            # 합쳐서 길이를 넘으면 따로, 한 메시지가 길면 나눠서
+            await outbox.send(tgbot, 2, "가" * 3000, wait=False)
+            assert await outbox.send(tgbot, 2, "나" * 5000)
+            assert [len(text) for text in sent(server, 2)] == [3000, 4096, 904]
+
+            # 429: retry_after만큼 기다린 뒤 다시 보냄, 봇을 차단한 채팅은 실패
+            server.failures = [(429, 1)]
+            server.blocked_chats = {4}
+            began = time.monotonic()
+            assert await outbox.send(tgbot, 3, "재시도")
+            assert time.monotonic() - began >= 1.0 and sent(server, 3) == ["재시도", "재시도"]
+            assert not await outbox.send(tgbot, 4, "차단됨")
+
+            # 여러 채팅에 동시에 보내도 채팅별 순서 유지
+            for i in range(30):
+                await outbox.send(tgbot, 10 + i % 3, f"메시지 {i}", parse_mode='HTML', wait=False)
+            assert outbox.stats()['pending'] > 0
+            await outbox.close()
+            for chat_id in (10, 11, 12):
+                assert sent(server, chat_id) == [f"메시지 {i}" for i in range(30) if 10 + i % 3 == chat_id]
+            stats = outbox.stats()
+            assert (stats['queued'], stats['delivered'], stats['requests']) == (38, 37, 36)
+            assert (stats['coalesced'], stats['splits'], stats['retries']) == (2, 1, 1)
+            assert (stats['failed'], stats['blocked'], stats['pending'], stats['chats']) == (1, 1, 0, 0)
+            assert stats['latency_p99_ms'] >= stats['latency_p50_ms'] > 0
+
+            # 채팅별 한도: 초당 2건, 한 번에 1건
+            limited = MessageOutbox(window=0, per_chat_rate=2, per_chat_burst=1)
+            began = time.monotonic()
+            for i in range(3):
+                await limited.send(tgbot, 20, f"한도 {i}", parse_mode='HTML', wait=False)
+            await limited.close()
+            assert time.monotonic() - began >= 0.9 and len(sent(server, 20)) == 3
+
+            # 봇: 일정 삭제 확인 응답 두 개가 한 메시지로
+            bot = ScheduleBot.__new__(ScheduleBot)
+            bot.db = AsyncDatabase(Database(path))
+            bot.outbox = outbox
+            await bot.db.add_schedule(30, "회의", "", "2024-06-01", "10:00")
+            selected = (await bot.db.get_schedules(30))[0]
+            update = Update.de_json(_text_update(1, 30, "yes"), tgbot)
+            await bot.delete_confirm(update, SimpleNamespace(user_data={'delete_selected': selected}))
+            assert sent(server, 30) == ["✅ 일정이 성공적으로 삭제되었습니다!\n\n🔔 '회의' 일정이 삭제되었습니다."]
+            assert await bot.db.get_schedules(30) == []
+            bot.db.close()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegramServer() as server:
+        asyncio.run(run(server, os.path.join(tmp, 'outbox.db')))
+    print("✅ 응답 전송 대기열 테스트 완료!")
+
 def test_config():
     """설정 파일 테스트"""
     print("\n🧪 설정 파일 테스트 시작...")
@@ -0,0 +1,31 @@
+import datetime
+from typing import Optional
+import pytz
+from config import DEFAULT_TIMEZONE
+
+# 대소문자 구분 없이 입력받기 위한 시간대 이름 목록
+_TIMEZONE_NAMES = {name.lower(): name for name in pytz.all_timezones}
+
+# 자주 쓰는 별칭
+TIMEZONE_ALIASES = {
+    '한국': 'Asia/Seoul', '서울': 'Asia/Seoul', 'kst': 'Asia/Seoul',
+    '일본': 'Asia/Tokyo', '도쿄': 'Asia/Tokyo', 'jst': 'Asia/Tokyo',
+    '뉴욕': 'America/New_York', '런던': 'Europe/London', 'utc': 'UTC',
+}
+
+def normalize_timezone(name: Optional[str]) -> Optional[str]:
+    """'asia/seoul', '서울' 같은 입력을 pytz 시간대 이름으로 변환 (알 수 없으면 None)"""
+    key = (name or '').strip().lower()
+    return TIMEZONE_ALIASES.get(key) or _TIMEZONE_NAMES.get(key)
+
+def local_now(timezone: Optional[str] = None) -> datetime.datetime:
+    """시간대 기준 현재 시각 (잘못된 이름이면 기본 시간대)"""
+    try:
+        tz = pytz.timezone(timezone or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        tz = pytz.timezone(DEFAULT_TIMEZONE)
+    return datetime.datetime.now(tz)
+
+def local_today(timezone: Optional[str] = None) -> str:
+    """시간대 기준 오늘 날짜 ('YYYY-MM-DD')"""
+    return local_now(timezone).strftime('%Y-%m-%d')
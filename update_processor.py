@@ -0,0 +1,109 @@
+"""
+사용자별 순서를 지키는 동시 업데이트 처리 (python-telegram-bot BaseUpdateProcessor)
+서로 다른 사용자의 업데이트는 동시에 처리하고, 같은 사용자의 업데이트는 받은 순서대로 하나씩 처리합니다.
+(concurrent_updates=True만 켜면 같은 사용자의 ConversationHandler 상태 전환이 섞일 수 있음)
+"""
+
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import UPDATE_CONCURRENCY, UPDATE_MAX_PENDING
+from task_queue import _percentile_ms
+
+def user_key(update: object) -> Optional[int]:
+    """순서를 지킬 단위 (사용자 → 채팅, 둘 다 없으면 None = 순서 상관없이 처리)"""
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+class _UserBacklog:
+    """사용자 한 명의 대기열 (asyncio.Lock은 기다린 순서대로 넘겨줌)"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.count = 0  # 처리 중 + 기다리는 업데이트 수
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """사용자별 대기열 + 전체 동시 처리 한도 (Application.builder().concurrent_updates(...)에 전달)
+
+    사용자 차례를 기다리는 동안에는 동시 처리 자리를 차지하지 않으므로,
+    한 사용자가 메시지를 몰아 보내도 다른 사용자의 처리가 막히지 않습니다.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING):
+        # 기반 클래스의 한도는 처리 중 + 차례를 기다리는 업데이트 수, 실제 동시 실행 수는 concurrency
+        super().__init__(max(concurrency, max_pending))
+        self.concurrency = concurrency
+        self._running = asyncio.BoundedSemaphore(concurrency)
+        self._users: Dict[int, _UserBacklog] = {}
+
+        # 지표
+        self.active = 0  # 지금 처리 중인 업데이트 수
+        self.peak_active = 0
+        self.processed = 0
+        self.max_backlog = 0  # 한 사용자에게 쌓였던 최대 업데이트 수
+        self.wait_times: deque = deque(maxlen=1000)  # 처리 시작까지 기다린 시간(초)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def _run(self, coroutine: Awaitable[Any], queued_at: float):
+        async with self._running:
+            self.wait_times.append(time.monotonic() - queued_at)
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        queued_at = time.monotonic()
+        key = user_key(update)
+        if key is None:
+            await self._run(coroutine, queued_at)
+            return
+        backlog = self._users.get(key)
+        if backlog is None:
+            backlog = self._users[key] = _UserBacklog()
+        backlog.count += 1
+        self.max_backlog = max(self.max_backlog, backlog.count)
+        try:
+            async with backlog.lock:
+                await self._run(coroutine, queued_at)
+        finally:
+            backlog.count -= 1
+            if backlog.count == 0:
+                del self._users[key]
+
+    def backlog(self, user_id: int) -> int:
+        """사용자의 처리 중 + 기다리는 업데이트 수"""
+        backlog = self._users.get(user_id)
+        return backlog.count if backlog is not None else 0
+
+    def stats(self, top: int = 5) -> Dict[str, Any]:
+        """동시 처리 수, 대기 중인 사용자/업데이트 수, 가장 밀린 사용자, 대기 시간"""
+        backlogs: List[Tuple[int, int]] = sorted(((key, backlog.count) for key, backlog in self._users.items()),
+                                                 key=lambda item: -item[1])
+        return {
+            'active': self.active,
+            'peak_active': self.peak_active,
+            'concurrency': self.concurrency,
+            'users': len(backlogs),
+            'pending': sum(count for _, count in backlogs),
+            'top_backlogs': backlogs[:top],
+            'max_backlog': self.max_backlog,
+            'processed': self.processed,
+            'wait_p50_ms': _percentile_ms(list(self.wait_times), 50),
+            'wait_p99_ms': _percentile_ms(list(self.wait_times), 99),
+        }
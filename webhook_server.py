@@ -0,0 +1,218 @@
+"""
+텔레그램 webhook 수신 서버 (tornado)
+secret_token 헤더를 확인하고 업데이트를 처리 대기열에 넣은 뒤 바로 200으로 응답하며,
+처리는 Application의 update_processor가 맡습니다 (PerUserUpdateProcessor면 사용자별 순서를 지키며 동시 처리).
+
+- 처리를 기다리는 업데이트가 WEBHOOK_QUEUE_SIZE개면 503으로 거절해 텔레그램이 나중에 다시 보내게 함
+  (부하 차단, 업데이트는 잃지 않음)
+- GET /metrics: 수신/처리/거절 수, 큐 길이, 대기/처리 시간
+  + update_processor(사용자별 밀림, 동시 처리 수) + extra_metrics가 돌려주는 항목 (봇의 AI 프롬프트 토큰 등)
+  사용자/채팅 id가 담겨 있으므로 Authorization: Bearer <metrics_token> 헤더가 맞을 때만 응답 (토큰이 없으면 404)
+"""
+
+import hmac
+import json
+import time
+import signal
+import asyncio
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Set
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from telegram import Update
+from telegram.ext import Application
+from config import WEBHOOK_PATH, WEBHOOK_QUEUE_SIZE, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_RETRY_AFTER
+from task_queue import _percentile_ms
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# /metrics에 함께 내보낼 항목을 돌려주는 함수 (항목 이름 -> 지표)
+MetricsSource = Callable[[], Dict[str, Any]]
+
+class _UpdateHandler(tornado.web.RequestHandler):
+    def initialize(self, ingress: "WebhookIngress"):
+        self.ingress = ingress
+
+    def check_xsrf_cookie(self):
+        pass
+
+    def post(self):
+        status = self.ingress.accept(self.request.headers.get(SECRET_HEADER, ''), self.request.body)
+        self.set_status(status)
+        if status == 503:
+            self.set_header('Retry-After', str(WEBHOOK_RETRY_AFTER))
+
+class _MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, ingress: "WebhookIngress"):
+        self.ingress = ingress
+
+    def get(self):
+        status = self.ingress.authorize_metrics(self.request.headers.get('Authorization', ''))
+        if status != 200:
+            self.set_status(status)
+            return
+        self.write(self.ingress.metrics())
+
+class _HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("ok")
+
+class WebhookIngress:
+    """webhook 요청을 바로 응답하고 Application의 update_processor로 처리"""
+
+    def __init__(self, application: Application, secret_token: str, path: str = WEBHOOK_PATH,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, extra_metrics: Optional[MetricsSource] = None,
+                 metrics_token: Optional[str] = None):
+        self.application = application
+        self.secret_token = secret_token
+        self.metrics_token = metrics_token  # 없으면 /metrics를 열지 않음
+        self.path = path
+        self.queue_size = max(1, queue_size)
+        self.extra_metrics = extra_metrics
+        self._tasks: Set[asyncio.Task] = set()  # 받았지만 아직 처리가 끝나지 않은 업데이트
+        self._server: Optional[HTTPServer] = None
+        self.port = 0
+
+        # 지표
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.shed = 0  # 큐가 가득 차 503으로 거절
+        self.unauthorized = 0  # secret_token 불일치
+        self.metrics_unauthorized = 0  # /metrics 토큰 불일치
+        self.invalid = 0  # JSON이 아닌 요청
+        self.wait_times: deque = deque(maxlen=1000)  # 수신부터 처리 시작까지(초)
+        self.run_times: deque = deque(maxlen=1000)  # 처리 시간(초)
+
+    def accept(self, secret: str, body: bytes) -> int:
+        """요청 하나를 확인해 큐에 넣고 HTTP 상태 코드 반환 (이벤트 루프에서 바로 처리, await 없음)"""
+        if not hmac.compare_digest(secret.encode('utf-8'), self.secret_token.encode('utf-8')):
+            self.unauthorized += 1
+            return 403
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            print(f"webhook 업데이트 형식 오류: {e}")
+            self.invalid += 1
+            return 400
+        if len(self._tasks) >= self.queue_size:
+            self.shed += 1
+            return 503
+        self.received += 1
+        # 받은 순서대로 작업을 만들어 update_processor에 넘김 (사용자별 순서는 processor가 지킴)
+        task = asyncio.create_task(self.application.update_processor.process_update(
+            update, self._process(update, time.monotonic())))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return 200
+
+    def authorize_metrics(self, authorization: str) -> int:
+        """/metrics 요청의 Authorization 헤더를 확인해 HTTP 상태 코드 반환"""
+        if not self.metrics_token:
+            return 404
+        expected = f"Bearer {self.metrics_token}"
+        if not hmac.compare_digest(authorization.encode('utf-8'), expected.encode('utf-8')):
+            self.metrics_unauthorized += 1
+            return 403
+        return 200
+
+    async def _process(self, update: Update, received_at: float):
+        began = time.monotonic()
+        self.wait_times.append(began - received_at)
+        try:
+            await self.application.process_update(update)
+            self.processed += 1
+        except Exception as e:  # 핸들러 오류는 Application 오류 처리기에서 처리되고, 여기는 그 밖의 오류
+            print(f"webhook 업데이트 처리 오류: {e}")
+            self.failed += 1
+        finally:
+            self.run_times.append(time.monotonic() - began)
+
+    async def start(self, listen: str = "0.0.0.0", port: int = 8080):
+        """HTTP 서버 시작 (Application은 initialize/start된 상태여야 함)"""
+        app = tornado.web.Application([
+            (self.path, _UpdateHandler, {'ingress': self}),
+            (r"/metrics", _MetricsHandler, {'ingress': self}),
+            (r"/", _HealthHandler),
+        ], log_function=lambda handler: None)  # 요청마다 로그를 남기지 않음 (수신/거절 수는 /metrics)
+        sockets = bind_sockets(port, listen)
+        self.port = sockets[0].getsockname()[1]  # port=0이면 비어 있는 포트
+        self._server = HTTPServer(app, xheaders=True)
+        self._server.add_sockets(sockets)
+
+    async def stop(self, timeout: float = 10.0):
+        """새 요청을 받지 않고, 받은 업데이트를 처리한 뒤 종료 (시간 초과 시 남은 처리 취소)"""
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            print(f"⚠️ webhook으로 받은 업데이트 {len(pending)}건을 처리하지 못했습니다.")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """수신/처리/거절 수와 큐 대기/처리 시간"""
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'shed': self.shed,
+            'unauthorized': self.unauthorized,
+            'metrics_unauthorized': self.metrics_unauthorized,
+            'invalid': self.invalid,
+            'queued': len(self._tasks),
+            'queue_capacity': self.queue_size,
+            'wait_p50_ms': _percentile_ms(list(self.wait_times), 50),
+            'wait_p99_ms': _percentile_ms(list(self.wait_times), 99),
+            'run_p50_ms': _percentile_ms(list(self.run_times), 50),
+            'run_p99_ms': _percentile_ms(list(self.run_times), 99),
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        """/metrics 응답 (수신 지표 + update_processor 지표 + extra_metrics 항목)"""
+        metrics = self.stats()
+        processor_stats = getattr(self.application.update_processor, 'stats', None)
+        if processor_stats is not None:
+            metrics['update_processor'] = processor_stats()
+        if self.extra_metrics is not None:
+            try:
+                metrics.update(self.extra_metrics())
+            except Exception as e:
+                print(f"지표 수집 오류: {e}")
+        return metrics
+
+def run_webhook(application: Application, webhook_url: str, secret_token: str,
+                listen: str = "0.0.0.0", port: int = 8080, extra_metrics: Optional[MetricsSource] = None,
+                metrics_token: Optional[str] = None):
+    """webhook 등록 후 SIGINT/SIGTERM을 받을 때까지 실행 (Application.run_webhook 대신 사용)"""
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:  # Windows
+                pass
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        ingress = WebhookIngress(application, secret_token, extra_metrics=extra_metrics, metrics_token=metrics_token)
+        await ingress.start(listen, port)
+        await application.bot.set_webhook(webhook_url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES,
+                                          max_connections=WEBHOOK_MAX_CONNECTIONS)
+        try:
+            await stop.wait()
+        finally:
+            await ingress.stop()
+            await application.stop()
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+    asyncio.run(main())